@@ -269,6 +269,10 @@ class SessionLog(db.Model):
 
     request = db.relationship('SupportRequest', backref=db.backref('session_logs', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_assist_session_logs_request', 'request_id', 'timestamp'),
+    )
+
     def to_dict(self):
         meta = None
         try:
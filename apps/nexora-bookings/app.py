@@ -1,12 +1,30 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from functools import wraps
 import os
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, date, time, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import uuid
 import json
 import sys
+import base64
+import binascii
+import hashlib
+import heapq
+import math
+import re
+import smtplib
+from email.message import EmailMessage
+from time import sleep
+import click
+import threading
+from collections import OrderedDict
+import numpy as np
 
 # Add parent directory to path for imports
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -29,6 +47,25 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///app
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET', 'dev-secret-key-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+app.config['AVAILABILITY_MAX_DAYS'] = int(os.getenv('AVAILABILITY_MAX_DAYS', '90'))
+app.config['BOOKING_SUGGESTIONS'] = 5
+app.config['BOOKING_SUGGESTION_DAYS'] = 14
+app.config['FREE_SLOT_RESOLUTION'] = 5  # minutes per bitmap bin
+app.config['FREE_SLOT_MAX_CALENDARS'] = 100
+app.config['FREE_SLOT_CACHE_CALENDARS'] = 5000
+app.config['SYNC_PAGE_SIZE'] = 500
+app.config['ICS_PAST_DAYS'] = 90
+app.config['ICS_BATCH_SIZE'] = 200
+app.config['ICS_CACHE_BYTES'] = 64 * 1024 * 1024
+app.config['ICS_CACHE_MAX_FEED_BYTES'] = 2 * 1024 * 1024
+app.config['REMINDER_OFFSETS'] = [int(m) for m in os.getenv('REMINDER_OFFSETS', '1440,60').split(',')]  # minutes before start
+app.config['REMINDER_TRANSPORT'] = os.getenv('REMINDER_TRANSPORT', 'file:reminders.jsonl')
+app.config['REMINDER_SENDER'] = os.getenv('REMINDER_SENDER', 'bookings@nexora.local')
+app.config['REMINDER_HORIZON_SECONDS'] = 3600
+app.config['REMINDER_REFRESH_SECONDS'] = 60
+app.config['REMINDER_GRACE_SECONDS'] = 900
+app.config['REMINDER_PAGE_SIZE'] = 5000
+app.config['REMINDER_BATCH_SIZE'] = 500
 
 # Initialize extensions
 db = SQLAlchemy(app)
@@ -340,6 +377,11 @@ class Calendar(db.Model):
     description = db.Column(db.Text)
     timezone = db.Column(db.String(50), default='UTC')
     created_at = db.Column(db.DateTime, default=db.func.now())
+    # Rotated whenever the calendar's time slots or appointments change; keys cached bitmaps
+    availability_token = db.Column(db.String(32), nullable=False, default=lambda: uuid.uuid4().hex,
+                                   server_default='')
+    # Last change sequence handed to one of its appointments; versions the ICS feed
+    change_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     owner = db.relationship('User', backref=db.backref('calendars', lazy=True))
 
@@ -392,9 +434,21 @@ class Appointment(db.Model):
     location = db.Column(db.String(255))
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+    # Per-calendar sequence assigned at flush; sync tokens page through it
+    change_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     calendar = db.relationship('Calendar', backref=db.backref('appointments', lazy=True))
 
+    __table_args__ = (
+        # availability and overlap checks: equality on calendar, range on start, end read from the index
+        db.Index('ix_booking_appointments_calendar_start', 'calendar_id', 'start_time', 'end_time'),
+        db.Index('ix_booking_appointments_changes', 'calendar_id', 'change_seq'),
+        # reminder dispatcher: horizon loads by start time, reschedules by change time
+        db.Index('ix_booking_appointments_start', 'start_time'),
+        db.Index('ix_booking_appointments_updated_at', 'updated_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -410,10 +464,111 @@ class Appointment(db.Model):
             'status': self.status,
             'location': self.location,
             'notes': self.notes,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
 
+class AppointmentTombstone(db.Model):
+    """Left behind by a deleted appointment so sync-token deltas can report the deletion"""
+    __tablename__ = 'booking_appointment_tombstones'
+    id = db.Column(db.Integer, primary_key=True)
+    calendar_id = db.Column(db.Integer, db.ForeignKey('booking_calendars.id'), nullable=False)
+    appointment_id = db.Column(db.String(64), nullable=False)
+    change_seq = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=db.func.now())
+
+    __table_args__ = (
+        db.Index('ix_booking_appointment_tombstones_changes', 'calendar_id', 'change_seq'),
+    )
+
+
+class ReminderDelivery(db.Model):
+    """One reminder per appointment and offset; the unique key makes delivery idempotent"""
+    __tablename__ = 'booking_reminder_deliveries'
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('booking_appointments.id', ondelete='CASCADE'), nullable=False)
+    offset_minutes = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='sending')  # sending, sent, failed, skipped
+    claim_token = db.Column(db.String(32), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=1)
+    error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.UniqueConstraint('appointment_id', 'offset_minutes', name='uq_booking_reminder_deliveries'),
+        db.Index('ix_booking_reminder_deliveries_claim', 'claim_token'),
+    )
+
+
+# Postgres backstop for the double-booking guard: live appointments on one
+# calendar may not overlap. gist needs btree_gist for the calendar_id equality.
+event.listen(Appointment.__table__, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS btree_gist'
+).execute_if(dialect='postgresql'))
+OVERLAP_CONSTRAINT = 'ex_booking_appointments_overlap'
+event.listen(Appointment.__table__, 'after_create', DDL(
+    f"ALTER TABLE booking_appointments ADD CONSTRAINT {OVERLAP_CONSTRAINT} "
+    "EXCLUDE USING gist (calendar_id WITH =, tsrange(start_time, end_time) WITH &&) "
+    "WHERE (status <> 'cancelled')"
+).execute_if(dialect='postgresql'))
+
+
+def is_overlap_violation(error):
+    """True if an IntegrityError came from the overlap constraint, not some other integrity check."""
+    diag = getattr(error.orig, 'diag', None)
+    if getattr(diag, 'constraint_name', None):
+        return diag.constraint_name == OVERLAP_CONSTRAINT
+    return OVERLAP_CONSTRAINT in str(error.orig)
+
+
+def backfill_columns(added):
+    """
+    Fill columns that scripts/migrate_indexes.py just added to an existing database.
+
+    ``added`` holds the (table, column) names it added.
+    """
+    calendars = Calendar.__table__
+    if ('booking_calendars', 'availability_token') in added:
+        cal_ids = db.session.execute(
+            db.select(calendars.c.id).where(calendars.c.availability_token == '')
+        ).scalars().all()
+        if cal_ids:
+            db.session.execute(
+                calendars.update().where(calendars.c.id == db.bindparam('cal_id'))
+                .values(availability_token=db.bindparam('token')),
+                [{'cal_id': cal_id, 'token': uuid.uuid4().hex} for cal_id in cal_ids]
+            )
+
+    appointments = Appointment.__table__
+    if ('booking_appointments', 'updated_at') in added:
+        db.session.execute(appointments.update().where(appointments.c.updated_at.is_(None))
+                           .values(updated_at=appointments.c.created_at))
+    if ('booking_appointments', 'change_seq') in added:
+        # Number each calendar's appointments 1..n so sync tokens can page through them
+        rows = db.session.execute(
+            db.select(appointments.c.id, appointments.c.calendar_id)
+            .order_by(appointments.c.calendar_id, appointments.c.id)
+        ).all()
+        seqs, last_cal, seq = [], None, 0
+        for apt_id, cal_id in rows:
+            seq = seq + 1 if cal_id == last_cal else 1
+            last_cal = cal_id
+            seqs.append({'apt_id': apt_id, 'seq': seq})
+        if seqs:
+            db.session.execute(
+                appointments.update().where(appointments.c.id == db.bindparam('apt_id'))
+                .values(change_seq=db.bindparam('seq'), updated_at=appointments.c.updated_at),
+                seqs
+            )
+    if {('booking_appointments', 'change_seq'), ('booking_calendars', 'change_seq')} & added:
+        db.session.execute(calendars.update().values(change_seq=db.func.coalesce(
+            db.select(db.func.max(appointments.c.change_seq))
+            .where(appointments.c.calendar_id == calendars.c.id).scalar_subquery(), 0
+        )))
+    db.session.commit()
+
+
 with app.app_context():
     db.create_all()
     # Seed demo user and example data when running in demo mode
@@ -485,6 +640,13 @@ def create_time_slot(cal_id):
     data = request.get_json() or {}
     if 'day_of_week' not in data or not data.get('start_time') or not data.get('end_time'):
         return jsonify({'error': 'day_of_week, start_time, end_time required'}), 400
+    if type(data['day_of_week']) is not int or not 0 <= data['day_of_week'] <= 6:
+        return jsonify({'error': 'day_of_week must be 0-6 (Mon-Sun)'}), 400
+    start_clock, end_clock = parse_clock(data['start_time']), parse_clock(data['end_time'])
+    if start_clock is None or end_clock is None:
+        return jsonify({'error': 'start_time and end_time must be HH:MM'}), 400
+    if start_clock >= end_clock:
+        return jsonify({'error': 'end_time must be after start_time'}), 400
     slot = TimeSlot(
         calendar_id=cal_id,
         day_of_week=data['day_of_week'],
@@ -522,10 +684,18 @@ def create_appointment():
         return jsonify({'error': 'calendar_id, title, start_time, end_time required'}), 400
     cal = Calendar.query.get_or_404(data['calendar_id'])
     try:
-        start = datetime.fromisoformat(data['start_time'])
-        end = datetime.fromisoformat(data['end_time'])
+        start = to_utc(datetime.fromisoformat(data['start_time']), timezone.utc)
+        end = to_utc(datetime.fromisoformat(data['end_time']), timezone.utc)
     except Exception:
         return jsonify({'error': 'invalid datetime format'}), 400
+    if end <= start:
+        return jsonify({'error': 'end_time must be after start_time'}), 400
+    status = data.get('status', 'pending')
+    if status != 'cancelled':
+        try:
+            guard_booking(cal.id, start, end)
+        except BookingConflict as conflict:
+            return booking_conflict_response(cal, start, end, conflict.conflicts)
     apt = Appointment(
         calendar_id=data['calendar_id'],
         client_name=data.get('client_name'),
@@ -535,12 +705,19 @@ def create_appointment():
         description=data.get('description'),
         start_time=start,
         end_time=end,
-        status=data.get('status', 'pending'),
+        status=status,
         location=data.get('location'),
         notes=data.get('notes')
     )
     db.session.add(apt)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        if not is_overlap_violation(error):
+            raise
+        # Postgres exclusion constraint: a booking raced past the guard
+        return booking_conflict_response(cal, start, end, [])
     return jsonify(apt.to_dict()), 201
 
 
@@ -574,19 +751,35 @@ def update_appointment(apt_id):
     apt.description = data.get('description', apt.description)
     apt.location = data.get('location', apt.location)
     apt.notes = data.get('notes', apt.notes)
-    if 'status' in data:
-        apt.status = data.get('status')
+    status = data.get('status') if 'status' in data else apt.status
+    start, end = apt.start_time, apt.end_time
     if data.get('start_time'):
         try:
-            apt.start_time = datetime.fromisoformat(data['start_time'])
+            start = to_utc(datetime.fromisoformat(data['start_time']), timezone.utc)
         except Exception:
             pass
     if data.get('end_time'):
         try:
-            apt.end_time = datetime.fromisoformat(data['end_time'])
+            end = to_utc(datetime.fromisoformat(data['end_time']), timezone.utc)
         except Exception:
             pass
-    db.session.commit()
+    if end <= start:
+        return jsonify({'error': 'end_time must be after start_time'}), 400
+    reactivated = apt.status == 'cancelled' and status != 'cancelled'
+    if status != 'cancelled' and (reactivated or (start, end) != (apt.start_time, apt.end_time)):
+        try:
+            guard_booking(apt.calendar_id, start, end, exclude_id=apt.id)
+        except BookingConflict as conflict:
+            return booking_conflict_response(apt.calendar, start, end, conflict.conflicts, exclude_id=apt.id)
+    apt.status = status
+    apt.start_time, apt.end_time = start, end
+    try:
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        if not is_overlap_violation(error):
+            raise
+        return booking_conflict_response(apt.calendar, start, end, [], exclude_id=apt.id)
     return jsonify(apt.to_dict()), 200
 
 
@@ -600,13 +793,998 @@ def delete_appointment(apt_id):
     return jsonify({'message': 'appointment deleted'}), 200
 
 
-# Availability check endpoint
+# ==================== Availability Engine ====================
+# Appointment times are stored as naive UTC; TimeSlot templates are wall-clock
+# times in the calendar's timezone.
+
+def calendar_zone(cal):
+    try:
+        return ZoneInfo(cal.timezone or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+
+def to_utc(value, tz):
+    """Naive values are wall-clock in ``tz``; returns a naive UTC datetime."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tz)
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_local_iso(value, tz):
+    return value.replace(tzinfo=timezone.utc).astimezone(tz).isoformat()
+
+
+def parse_window_bound(value, tz, is_end):
+    """Parse a from/to query value; a bare date covers that whole local day."""
+    if len(value) == 10:
+        day = date.fromisoformat(value)
+        return to_utc(datetime.combine(day + timedelta(days=1) if is_end else day, time()), tz)
+    return to_utc(datetime.fromisoformat(value), tz)
+
+
+CLOCK = re.compile(r'([01]\d|2[0-3]):([0-5]\d)')
+
+
+def parse_clock(value):
+    """The time of an HH:MM string, or None when it is not one."""
+    match = CLOCK.fullmatch(value) if isinstance(value, str) else None
+    return time(int(match[1]), int(match[2])) if match else None
+
+
+def expand_time_slots(slots, window_start, window_end, tz):
+    """
+    Expand weekly TimeSlot templates into concrete UTC intervals.
+
+    Returns:
+        list: Sorted, merged (start, end) naive UTC pairs clipped to the window
+    """
+    by_weekday = {}
+    for slot in slots:
+        start_clock, end_clock = parse_clock(slot.start_time), parse_clock(slot.end_time)
+        if start_clock is not None and end_clock is not None:  # rows stored before slots were validated
+            by_weekday.setdefault(slot.day_of_week, []).append((start_clock, end_clock))
+
+    intervals = []
+    # A local day can start up to a day before window_start once the offset is applied
+    day = (window_start.replace(tzinfo=timezone.utc).astimezone(tz).date()) - timedelta(days=1)
+    last_day = window_end.replace(tzinfo=timezone.utc).astimezone(tz).date()
+    while day <= last_day:
+        for start_clock, end_clock in by_weekday.get(day.weekday(), ()):
+            start = to_utc(datetime.combine(day, start_clock), tz)
+            end_day = day if end_clock > start_clock else day + timedelta(days=1)
+            end = to_utc(datetime.combine(end_day, end_clock), tz)
+            start, end = max(start, window_start), min(end, window_end)
+            if start < end:
+                intervals.append((start, end))
+        day += timedelta(days=1)
+
+    intervals.sort()
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(free, busy):
+    """
+    Sweep sorted busy intervals out of sorted, disjoint free intervals.
+
+    Both lists are walked once, so the cost is O(len(free) + len(busy)) plus
+    the overlap of long appointments spanning several free intervals.
+    """
+    result = []
+    first = 0
+    for start, end in free:
+        while first < len(busy) and busy[first][1] <= start:
+            first += 1
+        cursor = start
+        i = first
+        while i < len(busy) and busy[i][0] < end:
+            if busy[i][0] > cursor:
+                result.append((cursor, busy[i][0]))
+            cursor = max(cursor, busy[i][1])
+            i += 1
+        if cursor < end:
+            result.append((cursor, end))
+    return result
+
+
+def round_up_to_grid(value, origin, step):
+    """The first ``origin + n * step`` (n >= 0) at or after ``value``."""
+    if value <= origin:
+        return origin
+    return origin - ((origin - value) // step) * step
+
+
+def drop_past(free, now, step):
+    """Clip free intervals to ``now``, keeping each interval's starts on its ``step`` grid."""
+    clipped = [(round_up_to_grid(now, start, step), end) for start, end in free]
+    return [(start, end) for start, end in clipped if start < end]
+
+
+def bookable_starts(free, duration, step):
+    """Start times at ``step`` increments from each free interval's start that fit ``duration``."""
+    for start, end in free:
+        cursor = start
+        while cursor + duration <= end:
+            yield cursor
+            cursor += step
+
+
+def overlapping_appointments(cal_id, window_start, window_end, exclude_id=None):
+    """Non-cancelled appointments overlapping the window, in one range query ordered by start."""
+    query = db.session.query(Appointment.id, Appointment.start_time, Appointment.end_time).filter(
+        Appointment.calendar_id == cal_id,
+        Appointment.start_time < window_end,
+        Appointment.end_time > window_start,
+        Appointment.status != 'cancelled',
+    )
+    if exclude_id is not None:
+        query = query.filter(Appointment.id != exclude_id)
+    return query.order_by(Appointment.start_time).all()
+
+
+def busy_intervals(cal_id, window_start, window_end, exclude_id=None):
+    return [(row.start_time, row.end_time)
+            for row in overlapping_appointments(cal_id, window_start, window_end, exclude_id)]
+
+
 @app.route('/api/bookings/calendars/<int:cal_id>/availability', methods=['GET'])
 def check_availability(cal_id):
+    """
+    Bookable start times for a calendar.
+
+    Query params: from/to (dates or datetimes in the calendar's timezone;
+    default today plus 7 days), duration and step in minutes (default 30 and
+    the duration). Times are returned in the calendar's timezone.
+    """
     cal = Calendar.query.get_or_404(cal_id)
-    # Simple check: return available time slots for the calendar
+    tz = calendar_zone(cal)
+    duration_minutes = request.args.get('duration', 30, type=int)
+    step_minutes = request.args.get('step', duration_minutes, type=int)
+    if duration_minutes <= 0 or step_minutes <= 0:
+        return jsonify({'error': 'duration and step must be positive'}), 400
+
+    now = datetime.utcnow()
+    try:
+        today = now.replace(tzinfo=timezone.utc).astimezone(tz).date().isoformat()
+        window_start = parse_window_bound(request.args.get('from', today), tz, is_end=False)
+        if request.args.get('to'):
+            window_end = parse_window_bound(request.args['to'], tz, is_end=True)
+        else:
+            window_end = window_start + timedelta(days=7)
+    except ValueError:
+        return jsonify({'error': 'invalid from/to, use YYYY-MM-DD or ISO datetime'}), 400
+    if window_end <= window_start:
+        return jsonify({'error': 'to must be after from'}), 400
+    if window_end - window_start > timedelta(days=app.config['AVAILABILITY_MAX_DAYS']):
+        return jsonify({'error': f"window exceeds {app.config['AVAILABILITY_MAX_DAYS']} days"}), 400
+
     slots = TimeSlot.query.filter(TimeSlot.calendar_id == cal_id, TimeSlot.is_available == True).all()
-    return jsonify({'calendar_id': cal_id, 'available_slots': [s.to_dict() for s in slots]}), 200
+    step = timedelta(minutes=step_minutes)
+    # Expand from the window start so a template already under way keeps its grid
+    free = drop_past(expand_time_slots(slots, window_start, window_end, tz), now, step)
+    if free:
+        free = subtract_intervals(free, busy_intervals(cal_id, free[0][0], free[-1][1]))
+
+    duration = timedelta(minutes=duration_minutes)
+    return jsonify({
+        'calendar_id': cal_id,
+        'timezone': str(tz),
+        'from': to_local_iso(window_start, tz),
+        'to': to_local_iso(window_end, tz),
+        'duration': duration_minutes,
+        'available_slots': [
+            {'start': to_local_iso(start, tz), 'end': to_local_iso(start + duration, tz)}
+            for start in bookable_starts(free, duration, step)
+        ],
+    }), 200
+
+
+# ==================== Double-booking Guard ====================
+
+class BookingConflict(Exception):
+    """The requested interval overlaps a booked appointment"""
+
+    def __init__(self, conflicts):
+        super().__init__('time slot already booked')
+        self.conflicts = conflicts
+
+
+def lock_calendar(cal_id):
+    """
+    Serialize bookings on a calendar until the transaction ends.
+
+    Postgres takes the calendar's row lock. SQLite has no row locks, so a
+    no-op UPDATE takes the database write lock instead; pysqlite only opens
+    the transaction at that first write, so earlier reads hold no lock.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(
+            db.update(Calendar.__table__).where(Calendar.id == cal_id).values(id=Calendar.id)
+        )
+    else:
+        db.session.execute(db.select(Calendar.id).where(Calendar.id == cal_id).with_for_update())
+
+
+def guard_booking(cal_id, start, end, exclude_id=None):
+    """
+    Lock the calendar and check [start, end) against its booked appointments.
+
+    The check runs in the caller's transaction after the lock, so a concurrent
+    booking either committed before it (and is seen) or waits for our commit.
+    Raises ``BookingConflict``; the caller owns the transaction.
+    """
+    lock_calendar(cal_id)
+    conflicts = overlapping_appointments(cal_id, start, end, exclude_id)
+    if conflicts:
+        raise BookingConflict(conflicts)
+
+
+def next_free_slots(cal, start, duration, exclude_id=None):
+    """The first free starts able to hold ``duration`` at or after ``start``, in the calendar's timezone."""
+    tz = calendar_zone(cal)
+    # A start in the past moves forward whole durations, so suggestions keep its grid
+    start = round_up_to_grid(datetime.utcnow(), start, duration)
+    search_end = start + timedelta(days=app.config['BOOKING_SUGGESTION_DAYS'])
+    slots = TimeSlot.query.filter(TimeSlot.calendar_id == cal.id, TimeSlot.is_available == True).all()
+    # As in availability, a calendar without weekly templates has no free time to suggest
+    free = expand_time_slots(slots, start, search_end, tz)
+    if free:
+        free = subtract_intervals(free, busy_intervals(cal.id, free[0][0], free[-1][1], exclude_id))
+    suggestions = []
+    for slot_start in bookable_starts(free, duration, duration):
+        suggestions.append({'start': to_local_iso(slot_start, tz), 'end': to_local_iso(slot_start + duration, tz)})
+        if len(suggestions) == app.config['BOOKING_SUGGESTIONS']:
+            break
+    return suggestions
+
+
+def booking_conflict_response(cal, start, end, conflicts, exclude_id=None):
+    db.session.rollback()
+    return jsonify({
+        'error': 'time slot already booked',
+        'conflicts': [row.id for row in conflicts],
+        'next_available': next_free_slots(cal, start, end - start, exclude_id),
+    }), 409
+
+
+# ==================== Free-slot Search ====================
+
+@event.listens_for(db.session, 'after_flush')
+def rotate_availability_tokens(session, flush_context):
+    """Rotate the token of every calendar whose slots, appointments or timezone changed in this flush."""
+    cal_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (TimeSlot, Appointment)) and obj.calendar_id is not None:
+            cal_ids.add(obj.calendar_id)
+            history = db.inspect(obj).attrs.calendar_id.history
+            cal_ids.update(c for c in history.deleted if c is not None)
+        elif isinstance(obj, Calendar) and obj not in session.new \
+                and db.inspect(obj).attrs.timezone.history.has_changes():
+            cal_ids.add(obj.id)
+    if cal_ids:
+        session.connection().execute(
+            db.update(Calendar.__table__).where(Calendar.id.in_(cal_ids))
+            .values(availability_token=uuid.uuid4().hex)
+        )
+
+
+class AvailabilityBitmaps:
+    """
+    Per-worker cache of calendar availability as one boolean array per UTC day,
+    a bin per FREE_SLOT_RESOLUTION minutes. An entry belongs to the calendar's
+    availability_token, so changes made by any worker invalidate it on the
+    next search. The least recently searched calendars are evicted first.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()  # cal_id -> (token, {day ordinal: bool array})
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def window(self, calendars, first_day, days):
+        """Return a (len(calendars), days * bins_per_day) matrix of free bins."""
+        ordinals = range(first_day.toordinal(), first_day.toordinal() + days)
+        with self.lock:
+            stale = []
+            for cal in calendars:
+                token, day_bits = self.entries.get(cal.id, (None, {}))
+                if token != cal.availability_token or any(o not in day_bits for o in ordinals):
+                    stale.append(cal)
+        if stale:
+            built = build_day_bitmaps(stale, first_day, days)
+            with self.lock:
+                for cal in stale:
+                    token, day_bits = self.entries.get(cal.id, (None, {}))
+                    if token != cal.availability_token:
+                        day_bits = {}
+                    day_bits.update(built[cal.id])
+                    self.entries[cal.id] = (cal.availability_token, day_bits)
+        with self.lock:
+            rows = []
+            for cal in calendars:
+                self.entries.move_to_end(cal.id)
+                day_bits = self.entries[cal.id][1]
+                rows.append(np.concatenate([day_bits[o] for o in ordinals]))
+            while len(self.entries) > app.config['FREE_SLOT_CACHE_CALENDARS']:
+                self.entries.popitem(last=False)
+        return np.vstack(rows)
+
+
+availability_bitmaps = AvailabilityBitmaps()
+
+
+def build_day_bitmaps(calendars, first_day, days):
+    """
+    Rasterise time slots minus live appointments for several calendars.
+
+    One query for the time slots and one range query for the appointments
+    cover every calendar. Slot bins must lie wholly inside a template interval
+    and any bin an appointment touches is busy.
+
+    Returns:
+        dict: cal_id -> {day ordinal: bool array}
+    """
+    resolution = timedelta(minutes=app.config['FREE_SLOT_RESOLUTION'])
+    bins_per_day = timedelta(days=1) // resolution
+    window_start = datetime.combine(first_day, time())
+    window_end = window_start + timedelta(days=days)
+    cal_ids = [cal.id for cal in calendars]
+
+    slots = {}
+    for slot in TimeSlot.query.filter(TimeSlot.calendar_id.in_(cal_ids), TimeSlot.is_available == True):
+        slots.setdefault(slot.calendar_id, []).append(slot)
+    busy = {}
+    for row in db.session.query(Appointment.calendar_id, Appointment.start_time, Appointment.end_time).filter(
+        Appointment.calendar_id.in_(cal_ids),
+        Appointment.start_time < window_end,
+        Appointment.end_time > window_start,
+        Appointment.status != 'cancelled',
+    ):
+        busy.setdefault(row.calendar_id, []).append((row.start_time, row.end_time))
+
+    built = {}
+    for cal in calendars:
+        # As in availability, a calendar without weekly templates is never free
+        bits = np.zeros(days * bins_per_day, dtype=bool)
+        for start, end in expand_time_slots(slots.get(cal.id, ()), window_start, window_end, calendar_zone(cal)):
+            bits[-((window_start - start) // resolution):(end - window_start) // resolution] = True
+        for start, end in busy.get(cal.id, ()):
+            first = max(start, window_start)
+            last = min(end, window_end)
+            bits[(first - window_start) // resolution:-((window_start - last) // resolution)] = False
+        built[cal.id] = {
+            first_day.toordinal() + n: day for n, day in enumerate(bits.reshape(days, bins_per_day))
+        }
+    return built
+
+
+def common_free_runs(calendars, window_start, window_end, duration, limit):
+    """
+    The first ``limit`` runs of at least ``duration`` where every calendar is free.
+
+    Returns:
+        list: (start, end) naive UTC pairs of maximal common free runs
+    """
+    resolution = timedelta(minutes=app.config['FREE_SLOT_RESOLUTION'])
+    first_day = window_start.date()
+    days = (window_end - datetime.combine(first_day, time()) - timedelta(microseconds=1)).days + 1
+    origin = datetime.combine(first_day, time())
+    matrix = availability_bitmaps.window(calendars, first_day, days)
+
+    lo = -((origin - window_start) // resolution)
+    hi = (window_end - origin) // resolution
+    free = np.logical_and.reduce(matrix[:, lo:hi], axis=0)
+    edges = np.diff(np.concatenate(([False], free, [False])).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    needed = -(-duration // resolution)
+    fits = np.flatnonzero(ends - starts >= needed)[:limit]
+    window_origin = origin + resolution * lo
+    return [(window_origin + resolution * int(starts[i]), window_origin + resolution * int(ends[i])) for i in fits]
+
+
+@app.route('/api/bookings/free-slots', methods=['GET'])
+def search_free_slots():
+    """
+    Common free time across several calendars.
+
+    Query params: calendar_ids (comma separated), from/to (dates or datetimes
+    in ``tz``, default UTC; default today plus 7 days), duration in minutes
+    (default 30) and limit (default 5). Returns maximal runs where every
+    calendar is free that are at least ``duration`` long.
+    """
+    try:
+        cal_ids = sorted({int(v) for v in request.args.get('calendar_ids', '').split(',') if v.strip()})
+        tz = ZoneInfo(request.args.get('tz', 'UTC'))
+    except (ValueError, ZoneInfoNotFoundError):
+        return jsonify({'error': 'calendar_ids must be integers and tz a valid timezone'}), 400
+    if not cal_ids:
+        return jsonify({'error': 'calendar_ids required'}), 400
+    if len(cal_ids) > app.config['FREE_SLOT_MAX_CALENDARS']:
+        return jsonify({'error': f"at most {app.config['FREE_SLOT_MAX_CALENDARS']} calendars"}), 400
+    duration = request.args.get('duration', 30, type=int)
+    limit = request.args.get('limit', 5, type=int)
+    if duration <= 0 or limit <= 0:
+        return jsonify({'error': 'duration and limit must be positive'}), 400
+
+    now = datetime.utcnow()
+    try:
+        today = to_local_iso(now, tz)[:10]
+        window_start = parse_window_bound(request.args.get('from', today), tz, is_end=False)
+        if request.args.get('to'):
+            window_end = parse_window_bound(request.args['to'], tz, is_end=True)
+        else:
+            window_end = window_start + timedelta(days=7)
+    except ValueError:
+        return jsonify({'error': 'invalid from/to, use YYYY-MM-DD or ISO datetime'}), 400
+    if window_end <= window_start:
+        return jsonify({'error': 'to must be after from'}), 400
+    if window_end - window_start > timedelta(days=app.config['AVAILABILITY_MAX_DAYS']):
+        return jsonify({'error': f"window exceeds {app.config['AVAILABILITY_MAX_DAYS']} days"}), 400
+
+    calendars = db.session.query(Calendar.id, Calendar.timezone, Calendar.availability_token) \
+        .filter(Calendar.id.in_(cal_ids)).all()
+    missing = sorted(set(cal_ids) - {cal.id for cal in calendars})
+    if missing:
+        return jsonify({'error': 'calendars not found', 'missing': missing}), 404
+
+    # Runs still open now start at the next whole duration from the window start
+    search_start = round_up_to_grid(now, window_start, timedelta(minutes=duration))
+    runs = []
+    if search_start < window_end:
+        runs = common_free_runs(calendars, search_start, window_end, timedelta(minutes=duration), limit)
+    return jsonify({
+        'calendar_ids': cal_ids,
+        'duration': duration,
+        'resolution': app.config['FREE_SLOT_RESOLUTION'],
+        'slots': [{'start': to_local_iso(start, tz), 'end': to_local_iso(end, tz)} for start, end in runs],
+    }), 200
+
+
+# ==================== ICS Feed & Sync Tokens ====================
+
+@event.listens_for(db.session, 'before_flush')
+def sequence_appointment_changes(session, flush_context, instances):
+    """
+    Give every appointment written or deleted in this flush the next change
+    sequence of its calendar. The counter is bumped with an UPDATE on the
+    calendar row, which holds that row until commit, so sequences commit in
+    order and a reader paging by sequence never skips a late commit.
+    """
+    changed = {}
+    for obj in session.new:
+        if isinstance(obj, Appointment) and obj.calendar_id is not None:
+            changed.setdefault(obj.calendar_id, []).append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Appointment) and obj.calendar_id is not None \
+                and session.is_modified(obj, include_collections=False):
+            changed.setdefault(obj.calendar_id, []).append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Appointment) and obj.calendar_id is not None:
+            tombstone = AppointmentTombstone(calendar_id=obj.calendar_id, appointment_id=obj.appointment_id)
+            session.add(tombstone)
+            changed.setdefault(obj.calendar_id, []).append(tombstone)
+
+    connection = session.connection()
+    for cal_id, objs in changed.items():
+        connection.execute(
+            db.update(Calendar.__table__).where(Calendar.id == cal_id)
+            .values(change_seq=Calendar.change_seq + len(objs))
+        )
+        last = connection.execute(db.select(Calendar.change_seq).where(Calendar.id == cal_id)).scalar()
+        for offset, obj in enumerate(objs, start=last - len(objs) + 1):
+            obj.change_seq = offset
+
+
+def encode_sync_token(cal_id, seq):
+    return base64.urlsafe_b64encode(f'{cal_id}:{seq}'.encode()).decode().rstrip('=')
+
+
+def decode_sync_token(token):
+    """Returns (calendar id, sequence); raises ValueError for anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        cal_id, seq = raw.split(':')
+        return int(cal_id), int(seq)
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError(str(exc))
+
+
+@app.route('/api/bookings/calendars/<int:cal_id>/changes', methods=['GET'])
+def appointment_changes(cal_id):
+    """
+    Appointments created, changed, cancelled or deleted since a sync token.
+
+    Without a token this is the initial sync of every appointment. Pages hold
+    at most ``limit`` changes in sequence order; keep passing the returned
+    sync_token while has_more is true. Deleted appointments come back as
+    {'appointment_id', 'deleted': true}.
+    """
+    cal = Calendar.query.get_or_404(cal_id)
+    since = -1
+    if request.args.get('sync_token'):
+        try:
+            token_cal, since = decode_sync_token(request.args['sync_token'])
+        except ValueError:
+            return jsonify({'error': 'invalid sync token'}), 400
+        if token_cal != cal_id:
+            return jsonify({'error': 'sync token belongs to another calendar'}), 400
+        if since > cal.change_seq:
+            return jsonify({'error': 'sync token is no longer valid, start a full sync'}), 410
+    limit = min(request.args.get('limit', app.config['SYNC_PAGE_SIZE'], type=int), app.config['SYNC_PAGE_SIZE'])
+    if limit <= 0:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    appointments = Appointment.query.filter(
+        Appointment.calendar_id == cal_id, Appointment.change_seq > since
+    ).order_by(Appointment.change_seq).limit(limit + 1).all()
+    tombstones = []
+    if since >= 0:
+        tombstones = AppointmentTombstone.query.filter(
+            AppointmentTombstone.calendar_id == cal_id, AppointmentTombstone.change_seq > since
+        ).order_by(AppointmentTombstone.change_seq).limit(limit + 1).all()
+    changes = sorted(appointments + tombstones, key=lambda change: change.change_seq)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    if changes:
+        next_seq = changes[-1].change_seq
+    else:
+        next_seq = cal.change_seq if since < 0 else since
+    return jsonify({
+        'calendar_id': cal_id,
+        'changes': [
+            {'appointment_id': c.appointment_id, 'deleted': True, 'deleted_at': c.deleted_at.isoformat() if c.deleted_at else None}
+            if isinstance(c, AppointmentTombstone) else c.to_dict()
+            for c in changes
+        ],
+        'sync_token': encode_sync_token(cal_id, next_seq),
+        'has_more': has_more,
+    }), 200
+
+
+ICS_STATUS = {'pending': 'TENTATIVE', 'confirmed': 'CONFIRMED', 'completed': 'CONFIRMED', 'cancelled': 'CANCELLED'}
+
+
+def ics_text(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def ics_line(name, value):
+    """One content line, folded at 75 octets as RFC 5545 requires."""
+    line = f'{name}:{value}'.encode('utf-8')
+    parts = []
+    limit = 75
+    while len(line) > limit:
+        cut = limit
+        while (line[cut] & 0xC0) == 0x80:  # never split a UTF-8 sequence
+            cut -= 1
+        parts.append(line[:cut])
+        line = line[cut:]
+        limit = 74  # continuation lines start with a space
+    parts.append(line)
+    return b'\r\n '.join(parts) + b'\r\n'
+
+
+def ics_time(value):
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def ics_event(apt):
+    lines = [
+        ics_line('BEGIN', 'VEVENT'),
+        ics_line('UID', f'{apt.appointment_id}@nexora-bookings'),
+        ics_line('DTSTAMP', ics_time(apt.updated_at or apt.created_at or datetime.utcnow())),
+        ics_line('DTSTART', ics_time(apt.start_time)),
+        ics_line('DTEND', ics_time(apt.end_time)),
+        ics_line('SEQUENCE', str(apt.change_seq)),
+        ics_line('STATUS', ICS_STATUS.get(apt.status, 'TENTATIVE')),
+        ics_line('SUMMARY', ics_text(apt.title)),
+    ]
+    if apt.location:
+        lines.append(ics_line('LOCATION', ics_text(apt.location)))
+    if apt.description:
+        lines.append(ics_line('DESCRIPTION', ics_text(apt.description)))
+    lines.append(ics_line('END', 'VEVENT'))
+    return b''.join(lines)
+
+
+class IcsFeedCache:
+    """Rendered feeds per calendar, valid for one ETag, bounded by total size (LRU)."""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # cal_id -> (etag, body)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, cal_id, etag):
+        with self.lock:
+            entry = self.entries.get(cal_id)
+            if entry and entry[0] == etag:
+                self.entries.move_to_end(cal_id)
+                return entry[1]
+        return None
+
+    def put(self, cal_id, etag, body):
+        if len(body) > app.config['ICS_CACHE_MAX_FEED_BYTES']:
+            return
+        with self.lock:
+            old = self.entries.pop(cal_id, None)
+            if old:
+                self.size -= len(old[1])
+            self.entries[cal_id] = (etag, body)
+            self.size += len(body)
+            while self.size > app.config['ICS_CACHE_BYTES']:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+ics_feed_cache = IcsFeedCache()
+
+
+@app.route('/api/bookings/calendars/<int:cal_id>/ics', methods=['GET'])
+def calendar_ics(cal_id):
+    """
+    iCalendar feed of a calendar's appointments from ICS_PAST_DAYS ago onwards.
+
+    The ETag is the calendar's change sequence, a digest of the calendar
+    fields the feed header shows and the feed's start date, so polling clients
+    get a 304 without any appointment being read. Feeds are streamed from an
+    index range scan and kept per worker for the same ETag.
+    """
+    cal = Calendar.query.get_or_404(cal_id)
+    since = datetime.combine(datetime.utcnow().date() - timedelta(days=app.config['ICS_PAST_DAYS']), time())
+    header_digest = hashlib.sha1(f'{cal.name}\0{cal.timezone}'.encode()).hexdigest()[:12]
+    etag = f'{cal.id}-{cal.change_seq}-{header_digest}-{since:%Y%m%d}'
+    headers = {'Cache-Control': 'private, no-cache', 'ETag': f'"{etag}"'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    mimetype = 'text/calendar'
+    cached = ics_feed_cache.get(cal.id, etag)
+    if cached is not None:
+        return Response(cached, mimetype=mimetype, headers=headers)
+
+    header = b''.join([
+        ics_line('BEGIN', 'VCALENDAR'),
+        ics_line('VERSION', '2.0'),
+        ics_line('PRODID', '-//Nexora//Bookings//EN'),
+        ics_line('X-WR-CALNAME', ics_text(cal.name)),
+        ics_line('X-WR-TIMEZONE', cal.timezone or 'UTC'),
+    ])
+    footer = ics_line('END', 'VCALENDAR')
+    appointments = Appointment.query.filter(
+        Appointment.calendar_id == cal.id, Appointment.start_time >= since
+    ).order_by(Appointment.start_time).yield_per(app.config['ICS_BATCH_SIZE'])
+
+    def generate():
+        chunks = [header]
+        size = len(header)
+        yield header
+        batch = []
+        for apt in appointments:
+            batch.append(ics_event(apt))
+            if len(batch) == app.config['ICS_BATCH_SIZE']:
+                chunk = b''.join(batch)
+                batch = []
+                size += len(chunk)
+                if chunks is not None:
+                    chunks.append(chunk)
+                    if size > app.config['ICS_CACHE_MAX_FEED_BYTES']:
+                        chunks = None
+                yield chunk
+        chunk = b''.join(batch) + footer
+        if chunks is not None:
+            chunks.append(chunk)
+            ics_feed_cache.put(cal.id, etag, b''.join(chunks))
+        yield chunk
+
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
+# ==================== Reminder Dispatcher ====================
+
+def utc_seconds(value):
+    return int(value.replace(tzinfo=timezone.utc).timestamp())
+
+
+def utc_naive(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel over integer ticks.
+
+    Level 0 has a slot per tick and every higher level a slot per full turn of
+    the level below, so with sizes (60, 60, 24) and one-second ticks it spans
+    a day. An entry sits at the lowest level whose current turn contains its
+    tick and cascades down as the wheel reaches its slot; entries beyond the
+    top level wait in a heap. Adding and expiring an entry is O(1) amortised.
+    """
+
+    def __init__(self, now, sizes=(60, 60, 24)):
+        self.now = now
+        self.sizes = sizes
+        self.spans = [math.prod(sizes[:level]) for level in range(len(sizes))]
+        self.levels = [[[] for _ in range(size)] for size in sizes]
+        self.overflow = []
+        self.count = 0
+
+    def add(self, tick, item):
+        """Schedule ``item`` for ``tick``; past ticks fire on the next advance."""
+        self.count += 1
+        self._place(max(tick, self.now + 1), item)
+
+    def _place(self, tick, item):
+        for level, (span, size) in enumerate(zip(self.spans, self.sizes)):
+            if tick // span - self.now // span < size:
+                self.levels[level][(tick // span) % size].append((tick, item))
+                return
+        heapq.heappush(self.overflow, (tick, id(item), item))
+
+    def advance(self, to_tick):
+        """Turn the wheel to ``to_tick`` and return the (tick, item) pairs that came due, in order."""
+        due = []
+        while self.now < to_tick:
+            self.now += 1
+            top = self.spans[-1] * self.sizes[-1]
+            while self.overflow and self.overflow[0][0] // top - self.now // top < 1:
+                tick, _, item = heapq.heappop(self.overflow)
+                self._place(tick, item)
+            for level in range(len(self.sizes) - 1, 0, -1):
+                span = self.spans[level]
+                if self.now % span == 0:
+                    slot = (self.now // span) % self.sizes[level]
+                    entries, self.levels[level][slot] = self.levels[level][slot], []
+                    for tick, item in entries:
+                        self._place(tick, item)
+            slot = self.now % self.sizes[0]
+            if self.levels[0][slot]:
+                entries, self.levels[0][slot] = self.levels[0][slot], []
+                due.extend(entries)
+        self.count -= len(due)
+        return due
+
+
+class FileReminderTransport:
+    """Appends reminders as JSON lines; the local sink for development and tests"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, reminders):
+        with open(self.path, 'a') as sink:
+            for reminder in reminders:
+                sink.write(json.dumps(reminder) + '\n')
+        return {}
+
+
+class SmtpReminderTransport:
+    """Sends each batch over one SMTP connection, e.g. to a local `python -m aiosmtpd -n` sink"""
+
+    def __init__(self, host, port, sender):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def send(self, reminders):
+        failed = {}
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            for reminder in reminders:
+                message = EmailMessage()
+                message['From'] = self.sender
+                message['To'] = reminder['client_email']
+                message['Subject'] = f"Reminder: {reminder['title']}"
+                message.set_content(
+                    f"Hi {reminder['client_name'] or 'there'},\n\n"
+                    f"this is a reminder of {reminder['title']} at {reminder['start_time']} UTC"
+                    + (f" ({reminder['location']})" if reminder['location'] else '') + '.\n'
+                )
+                try:
+                    smtp.send_message(message)
+                except smtplib.SMTPException as exc:
+                    failed[(reminder['appointment_id'], reminder['offset_minutes'])] = str(exc)
+        return failed
+
+
+def reminder_transport():
+    """Transport from REMINDER_TRANSPORT: smtp://host:port or file:path (the default)"""
+    target = app.config['REMINDER_TRANSPORT']
+    if target.startswith('smtp://'):
+        host, _, port = target[len('smtp://'):].partition(':')
+        return SmtpReminderTransport(host, int(port or 25), app.config['REMINDER_SENDER'])
+    return FileReminderTransport(target[len('file:'):] if target.startswith('file:') else target)
+
+
+class ReminderDispatcher:
+    """
+    Fires appointment reminders REMINDER_OFFSETS minutes before start.
+
+    Only reminders due within the next REMINDER_HORIZON_SECONDS are held in
+    the wheel; refresh() extends the loaded range through
+    ix_booking_appointments_start and reschedules appointments changed since
+    the last refresh through ix_booking_appointments_updated_at, so memory is
+    bounded by the horizon rather than by the number of appointments.
+
+    Due reminders are re-read in batches (moved or cancelled appointments are
+    dropped), claimed by inserting their (appointment, offset) delivery row,
+    and only the rows this dispatcher claimed are handed to the transport.
+    A crash between claim and send loses that reminder rather than sending
+    it twice.
+    """
+
+    def __init__(self, transport, clock=None):
+        self.transport = transport
+        self.clock = clock or (lambda: datetime.now(timezone.utc).timestamp())
+        self.offsets = app.config['REMINDER_OFFSETS']
+        self.wheel = None
+        self.scheduled = {}  # (appointment id, offset) -> start seconds
+        self.loaded_until = None
+        self.changed_since = None
+        self.stats = {'delivered': 0, 'failed': 0, 'skipped': 0, 'stale': 0, 'peak_scheduled': 0}
+
+    def schedule(self, apt_id, start, offset):
+        key = (apt_id, offset)
+        start_seconds = utc_seconds(start)
+        if self.scheduled.get(key) == start_seconds:
+            return
+        self.scheduled[key] = start_seconds
+        self.wheel.add(start_seconds - offset * 60, (apt_id, offset, start_seconds))
+
+    def refresh(self):
+        """Load reminders that entered the horizon and reschedule changed appointments."""
+        now = int(self.clock())
+        if self.wheel is None:
+            self.wheel = TimingWheel(now)
+            self.loaded_until = now - app.config['REMINDER_GRACE_SECONDS']
+            self.changed_since = utc_naive(now)
+        horizon = now + app.config['REMINDER_HORIZON_SECONDS']
+        page_size = app.config['REMINDER_PAGE_SIZE']
+
+        for offset in self.offsets:
+            lower = utc_naive(self.loaded_until + offset * 60)
+            upper = utc_naive(horizon + offset * 60)
+            last_id = 0
+            while True:
+                rows = db.session.query(Appointment.id, Appointment.start_time).filter(
+                    Appointment.status != 'cancelled',
+                    db.or_(Appointment.start_time > lower,
+                           db.and_(Appointment.start_time == lower, Appointment.id > last_id)),
+                    Appointment.start_time <= upper,
+                ).order_by(Appointment.start_time, Appointment.id).limit(page_size).all()
+                for row in rows:
+                    self.schedule(row.id, row.start_time, offset)
+                if len(rows) < page_size:
+                    break
+                lower, last_id = rows[-1].start_time, rows[-1].id
+        self.loaded_until = horizon
+
+        # Appointments moved into (or within) the already loaded range since the last refresh
+        changed = db.session.query(Appointment.id, Appointment.start_time, Appointment.status, Appointment.updated_at) \
+            .filter(Appointment.updated_at >= self.changed_since).order_by(Appointment.updated_at).yield_per(page_size)
+        for row in changed:
+            self.changed_since = max(self.changed_since, row.updated_at)
+            if row.status == 'cancelled':
+                continue
+            for offset in self.offsets:
+                fire = utc_seconds(row.start_time) - offset * 60
+                if now - app.config['REMINDER_GRACE_SECONDS'] <= fire <= self.loaded_until:
+                    self.schedule(row.id, row.start_time, offset)
+        db.session.rollback()
+        self.stats['peak_scheduled'] = max(self.stats['peak_scheduled'], len(self.scheduled))
+
+    def dispatch(self):
+        """Deliver every reminder due by now, in batches. Returns how many were delivered."""
+        due = self.wheel.advance(int(self.clock()))
+        delivered = 0
+        batch_size = app.config['REMINDER_BATCH_SIZE']
+        for index in range(0, len(due), batch_size):
+            delivered += self.deliver_batch([item for _, item in due[index:index + batch_size]])
+        return delivered
+
+    def deliver_batch(self, entries):
+        for apt_id, offset, start_seconds in entries:
+            if self.scheduled.get((apt_id, offset)) == start_seconds:
+                del self.scheduled[(apt_id, offset)]
+        # Plain rows rather than entities: the claim commit below would expire them
+        current = {
+            apt.id: apt for apt in db.session.query(
+                Appointment.id, Appointment.status, Appointment.start_time, Appointment.title, Appointment.location,
+                Appointment.client_name, Appointment.client_email, Appointment.client_phone,
+            ).filter(Appointment.id.in_(sorted({apt_id for apt_id, _, _ in entries})))
+        }
+        wanted = []
+        for apt_id, offset, start_seconds in entries:
+            apt = current.get(apt_id)
+            if apt is None or apt.status == 'cancelled' or utc_seconds(apt.start_time) != start_seconds:
+                self.stats['stale'] += 1
+                continue
+            wanted.append((apt, offset))
+        if not wanted:
+            db.session.rollback()
+            return 0
+
+        token = uuid.uuid4().hex
+        insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+        db.session.execute(
+            insert(ReminderDelivery.__table__).on_conflict_do_nothing(index_elements=['appointment_id', 'offset_minutes']),
+            [{'appointment_id': apt.id, 'offset_minutes': offset, 'status': 'sending', 'claim_token': token, 'attempts': 1}
+             for apt, offset in wanted],
+        )
+        claimed = set(db.session.query(ReminderDelivery.appointment_id, ReminderDelivery.offset_minutes)
+                      .filter(ReminderDelivery.claim_token == token).all())
+        db.session.commit()
+
+        reminders, skipped = [], []
+        for apt, offset in wanted:
+            if (apt.id, offset) not in claimed:
+                continue
+            if not apt.client_email and not apt.client_phone:
+                skipped.append((apt.id, offset))
+                continue
+            reminders.append({
+                'appointment_id': apt.id, 'offset_minutes': offset, 'title': apt.title,
+                'start_time': apt.start_time.isoformat(), 'location': apt.location,
+                'client_name': apt.client_name, 'client_email': apt.client_email, 'client_phone': apt.client_phone,
+            })
+        try:
+            failed = self.transport.send(reminders) if reminders else {}
+        except Exception as exc:
+            failed = {(r['appointment_id'], r['offset_minutes']): str(exc) for r in reminders}
+
+        sent_at = datetime.utcnow()
+        updates = [{'b_apt': r['appointment_id'], 'b_offset': r['offset_minutes'], 'b_status': 'sent', 'b_error': None}
+                   for r in reminders if (r['appointment_id'], r['offset_minutes']) not in failed]
+        updates += [{'b_apt': apt_id, 'b_offset': offset, 'b_status': 'failed', 'b_error': error}
+                    for (apt_id, offset), error in failed.items()]
+        updates += [{'b_apt': apt_id, 'b_offset': offset, 'b_status': 'skipped', 'b_error': 'no contact'}
+                    for apt_id, offset in skipped]
+        if updates:
+            table = ReminderDelivery.__table__
+            db.session.execute(
+                table.update().where(
+                    table.c.appointment_id == db.bindparam('b_apt'),
+                    table.c.offset_minutes == db.bindparam('b_offset'),
+                    table.c.claim_token == token,
+                ).values(status=db.bindparam('b_status'), error=db.bindparam('b_error'), sent_at=sent_at),
+                updates,
+            )
+        db.session.commit()
+        delivered = len(reminders) - len(failed)
+        self.stats['delivered'] += delivered
+        self.stats['failed'] += len(failed)
+        self.stats['skipped'] += len(skipped)
+        return delivered
+
+
+@app.cli.command('run-reminders')
+@click.option('--once', is_flag=True, help='Deliver what is due now and exit (for cron)')
+def run_reminders_command(once):
+    """Deliver appointment reminders until interrupted"""
+    dispatcher = ReminderDispatcher(reminder_transport())
+    next_refresh = 0
+    while True:
+        now = dispatcher.clock()
+        if now >= next_refresh:
+            dispatcher.refresh()
+            next_refresh = now + app.config['REMINDER_REFRESH_SECONDS']
+        dispatcher.dispatch()
+        if once:
+            break
+        sleep(1)
+    print(f"Delivered {dispatcher.stats['delivered']} reminders, {dispatcher.stats['failed']} failed, "
+          f"{dispatcher.stats['skipped']} without contact details")
 
 
 # ==================== Health Check ====================
@@ -1,6 +1,9 @@
+import time
+import multiprocessing
 import pytest
 from app import app, db, User, Module, Calendar, TimeSlot, Appointment
-from datetime import datetime, timedelta
+import json
+from datetime import datetime, timedelta, timezone
 
 @pytest.fixture
 def client():
@@ -192,6 +195,33 @@ def test_update_time_slot(client):
     assert response.status_code == 200
     assert response.json['is_available'] == False
 
+def test_create_time_slot_validates_clock_and_weekday(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Test Calendar'}).json['id']
+    url = f'/api/bookings/calendars/{cal_id}/time-slots'
+    for slot in ({'day_of_week': 1, 'start_time': '9am', 'end_time': '17:00'},
+                 {'day_of_week': 1, 'start_time': '09:00', 'end_time': '24:00'},
+                 {'day_of_week': 7, 'start_time': '09:00', 'end_time': '17:00'},
+                 {'day_of_week': '1', 'start_time': '09:00', 'end_time': '17:00'},
+                 {'day_of_week': 1, 'start_time': '17:00', 'end_time': '09:00'}):
+        assert client.post(url, json=slot).status_code == 400
+    assert TimeSlot.query.count() == 0
+
+def test_malformed_stored_time_slots_are_skipped(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Test Calendar'}).json['id']
+    client.post(f'/api/bookings/calendars/{cal_id}/time-slots', json={
+        'day_of_week': 0, 'start_time': '09:00', 'end_time': '10:00'})
+    db.session.add(TimeSlot(calendar_id=cal_id, day_of_week=0, start_time='9am', end_time='17:00'))
+    db.session.commit()
+
+    response = client.get(f'/api/bookings/calendars/{cal_id}/availability?from=2030-01-07&to=2030-01-07&duration=30')
+    assert response.status_code == 200
+    assert [s['start'] for s in response.json['available_slots']] == ['2030-01-07T09:00:00+00:00', '2030-01-07T09:30:00+00:00']
+    booking = {'calendar_id': cal_id, 'title': 'A', 'start_time': '2030-01-07T09:00:00', 'end_time': '2030-01-07T09:30:00'}
+    assert client.post('/api/bookings/appointments', json=booking).status_code == 201
+    response = client.post('/api/bookings/appointments', json=booking)
+    assert response.status_code == 409
+    assert response.json['next_available'][0]['start'] == '2030-01-07T09:30:00+00:00'
+
 # ==================== Appointment Tests ====================
 
 def test_create_appointment(client):
@@ -378,3 +408,366 @@ def test_delete_blocked_in_demo_mode(client):
     finally:
         app_module.DEMO_MODE = original
 
+
+def test_appointment_list_query_is_indexed(client):
+    from utils.index_advisor import QueryShapeRecorder
+
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Indexed'}).json['id']
+    recorder = QueryShapeRecorder()
+    recorder.install(db.engine)
+    try:
+        response = client.get(f'/api/bookings/appointments?calendar_id={cal_id}')
+    finally:
+        recorder.uninstall(db.engine)
+    assert response.status_code == 200
+
+    proposals = recorder.to_dict(db.metadata)['proposals']
+    listing = [p for p in proposals if p['table'] == 'booking_appointments']
+    assert listing[0]['columns'] == ['calendar_id', 'start_time']
+    assert listing[0]['covered_by'] == 'ix_booking_appointments_calendar_start'
+
+def test_availability_subtracts_appointments_in_calendar_timezone(client):
+    cal_id = client.post('/api/bookings/calendars', json={
+        'name': 'Clinic', 'timezone': 'America/New_York'
+    }).json['id']
+    client.post(f'/api/bookings/calendars/{cal_id}/time-slots', json={
+        'day_of_week': 0, 'start_time': '09:00', 'end_time': '12:00'
+    })
+    # 10:00-11:00 New York is 15:00-16:00 UTC in January
+    client.post('/api/bookings/appointments', json={
+        'calendar_id': cal_id, 'title': 'Booked',
+        'start_time': '2030-01-07T15:00:00', 'end_time': '2030-01-07T16:00:00'
+    })
+    client.post('/api/bookings/appointments', json={
+        'calendar_id': cal_id, 'title': 'Cancelled', 'status': 'cancelled',
+        'start_time': '2030-01-07T14:00:00', 'end_time': '2030-01-07T14:30:00'
+    })
+
+    response = client.get(f'/api/bookings/calendars/{cal_id}/availability?from=2030-01-07&to=2030-01-13&duration=30')
+    assert response.status_code == 200
+    assert response.json['timezone'] == 'America/New_York'
+    assert [s['start'] for s in response.json['available_slots']] == [
+        '2030-01-07T09:00:00-05:00',
+        '2030-01-07T09:30:00-05:00',
+        '2030-01-07T11:00:00-05:00',
+        '2030-01-07T11:30:00-05:00',
+    ]
+
+    response = client.get(f'/api/bookings/calendars/{cal_id}/availability?from=2030-01-07&to=2030-01-07&duration=90&step=15')
+    assert [s['start'] for s in response.json['available_slots']] == []
+
+def test_availability_today_starts_on_the_template_grid(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Walk-in'}).json['id']
+    for day in range(7):
+        client.post(f'/api/bookings/calendars/{cal_id}/time-slots', json={
+            'day_of_week': day, 'start_time': '00:10', 'end_time': '23:50'
+        })
+    now = datetime.now(timezone.utc)
+
+    starts = [datetime.fromisoformat(s['start']) for s in client.get(
+        f'/api/bookings/calendars/{cal_id}/availability?duration=25').json['available_slots']]
+    assert starts and starts[0] >= now
+    assert all((start - start.replace(hour=0, minute=10, second=0)).total_seconds() % (25 * 60) == 0
+               for start in starts)
+
+    # A calendar open all day: the search still starts on a whole duration
+    open_id = client.post('/api/bookings/calendars', json={'name': 'Open'}).json['id']
+    for day in range(7):
+        client.post(f'/api/bookings/calendars/{open_id}/time-slots', json={
+            'day_of_week': day, 'start_time': '00:00', 'end_time': '23:59'
+        })
+    slots = client.get(f'/api/bookings/free-slots?calendar_ids={open_id}&duration=30').json['slots']
+    first = datetime.fromisoformat(slots[0]['start'])
+    assert first >= now and (first.minute % 30, first.second, first.microsecond) == (0, 0, 0)
+
+def test_availability_rejects_bad_windows(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Windows'}).json['id']
+    url = f'/api/bookings/calendars/{cal_id}/availability'
+    assert client.get(f'{url}?from=2030-01-01&to=2030-06-01').status_code == 400
+    assert client.get(f'{url}?from=2030-01-07&to=2030-01-01').status_code == 400
+    assert client.get(f'{url}?from=soon').status_code == 400
+    assert client.get(f'{url}?duration=0').status_code == 400
+
+def test_calendar_without_templates_is_closed_everywhere(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Empty'}).json['id']
+    availability = client.get(f'/api/bookings/calendars/{cal_id}/availability?from=2030-01-07&to=2030-01-13').json
+    assert availability['available_slots'] == []
+    assert client.get(f'/api/bookings/free-slots?calendar_ids={cal_id}&from=2030-01-07&to=2030-01-13').json['slots'] == []
+    booking = {'calendar_id': cal_id, 'title': 'A', 'start_time': '2030-01-07T10:00:00', 'end_time': '2030-01-07T11:00:00'}
+    assert client.post('/api/bookings/appointments', json=booking).status_code == 201
+    response = client.post('/api/bookings/appointments', json=booking)
+    assert response.status_code == 409 and response.json['next_available'] == []
+
+def test_overlapping_booking_is_rejected_with_next_free_slots(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Guarded'}).json['id']
+    client.post(f'/api/bookings/calendars/{cal_id}/time-slots', json={
+        'day_of_week': 0, 'start_time': '09:00', 'end_time': '17:00'
+    })
+    booked = client.post('/api/bookings/appointments', json={
+        'calendar_id': cal_id, 'title': 'First',
+        'start_time': '2030-01-07T10:00:00', 'end_time': '2030-01-07T11:00:00'
+    })
+    assert booked.status_code == 201
+
+    response = client.post('/api/bookings/appointments', json={
+        'calendar_id': cal_id, 'title': 'Clash',
+        'start_time': '2030-01-07T10:30:00', 'end_time': '2030-01-07T11:30:00'
+    })
+    assert response.status_code == 409
+    assert response.json['conflicts'] == [booked.json['id']]
+    assert response.json['next_available'][0] == {
+        'start': '2030-01-07T11:00:00+00:00', 'end': '2030-01-07T12:00:00+00:00'
+    }
+
+    # Back-to-back and cancelled bookings do not conflict
+    assert client.post('/api/bookings/appointments', json={
+        'calendar_id': cal_id, 'title': 'Next',
+        'start_time': '2030-01-07T11:00:00', 'end_time': '2030-01-07T12:00:00'
+    }).status_code == 201
+    assert client.post('/api/bookings/appointments', json={
+        'calendar_id': cal_id, 'title': 'Dropped', 'status': 'cancelled',
+        'start_time': '2030-01-07T10:00:00', 'end_time': '2030-01-07T11:00:00'
+    }).status_code == 201
+
+def test_only_the_overlap_constraint_counts_as_a_booking_conflict(client):
+    from types import SimpleNamespace
+    from sqlalchemy.exc import IntegrityError
+    from app import is_overlap_violation
+
+    class Violation(Exception):
+        diag = SimpleNamespace(constraint_name='ex_booking_appointments_overlap')
+
+    assert is_overlap_violation(IntegrityError('INSERT', {}, Violation('conflicting key value')))
+    assert not is_overlap_violation(IntegrityError('INSERT', {}, Exception(
+        'UNIQUE constraint failed: booking_appointments.appointment_id')))
+
+def test_update_cannot_move_into_a_booked_slot(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Moves'}).json['id']
+    first = client.post('/api/bookings/appointments', json={
+        'calendar_id': cal_id, 'title': 'First',
+        'start_time': '2030-01-07T10:00:00', 'end_time': '2030-01-07T11:00:00'
+    }).json['id']
+    second = client.post('/api/bookings/appointments', json={
+        'calendar_id': cal_id, 'title': 'Second',
+        'start_time': '2030-01-07T12:00:00', 'end_time': '2030-01-07T13:00:00'
+    }).json['id']
+
+    assert client.put(f'/api/bookings/appointments/{second}', json={'title': 'Renamed'}).status_code == 200
+    response = client.put(f'/api/bookings/appointments/{second}', json={
+        'start_time': '2030-01-07T10:30:00', 'end_time': '2030-01-07T11:30:00'
+    })
+    assert response.status_code == 409
+    assert response.json['conflicts'] == [first]
+    assert client.get(f'/api/bookings/appointments/{second}').json['start_time'] == '2030-01-07T12:00:00'
+
+    client.put(f'/api/bookings/appointments/{first}', json={'status': 'cancelled'})
+    assert client.put(f'/api/bookings/appointments/{second}', json={
+        'start_time': '2030-01-07T10:30:00', 'end_time': '2030-01-07T11:30:00'
+    }).status_code == 200
+
+def booking_worker(cal_id, starts, results):
+    db.engine.dispose(close=False)
+    worker = app.test_client()
+    booked = 0
+    for start in starts:
+        response = worker.post('/api/bookings/appointments', json={
+            'calendar_id': cal_id, 'title': 'Storm',
+            'start_time': start.isoformat(), 'end_time': (start + timedelta(minutes=30)).isoformat()
+        })
+        booked += response.status_code == 201
+    results.put(booked)
+
+def test_concurrent_bookings_never_double_book(client):
+    if db.engine.url.database in (None, '', ':memory:'):
+        pytest.skip('needs a file-backed database shared across processes')
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Storm'}).json['id']
+    base = datetime(2030, 1, 7, 9)
+    # Half-hour bookings every 15 minutes, so neighbouring requests overlap too
+    starts = [base + timedelta(minutes=15 * n) for n in range(40)]
+    db.session.remove()
+
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    workers = [ctx.Process(target=booking_worker, args=(cal_id, starts if n % 2 == 0 else starts[::-1], results))
+               for n in range(4)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    booked = sum(results.get(timeout=60) for _ in workers)
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+
+    appointments = Appointment.query.filter_by(calendar_id=cal_id).order_by(Appointment.start_time).all()
+    assert len(appointments) == booked
+    assert all(a.end_time <= b.start_time for a, b in zip(appointments, appointments[1:]))
+    assert booked >= 20
+    print(f'{len(workers) * len(starts) / elapsed:.0f} booking requests/sec across {len(workers)} processes')
+
+def test_free_slot_search_intersects_calendars_and_sees_new_bookings(client):
+    alice = client.post('/api/bookings/calendars', json={'name': 'Alice'}).json['id']
+    bob = client.post('/api/bookings/calendars', json={'name': 'Bob'}).json['id']
+    client.post(f'/api/bookings/calendars/{alice}/time-slots', json={
+        'day_of_week': 0, 'start_time': '09:00', 'end_time': '12:00'
+    })
+    client.post(f'/api/bookings/calendars/{bob}/time-slots', json={
+        'day_of_week': 0, 'start_time': '10:00', 'end_time': '13:00'
+    })
+    client.post('/api/bookings/appointments', json={
+        'calendar_id': bob, 'title': 'Busy',
+        'start_time': '2030-01-07T10:30:00', 'end_time': '2030-01-07T10:50:00'
+    })
+
+    url = f'/api/bookings/free-slots?calendar_ids={alice},{bob}&from=2030-01-07&to=2030-01-13'
+    response = client.get(f'{url}&duration=30')
+    assert response.status_code == 200
+    assert response.json['slots'] == [
+        {'start': '2030-01-07T10:00:00+00:00', 'end': '2030-01-07T10:30:00+00:00'},
+        {'start': '2030-01-07T10:50:00+00:00', 'end': '2030-01-07T12:00:00+00:00'},
+    ]
+    assert [s['start'] for s in client.get(f'{url}&duration=45').json['slots']] == ['2030-01-07T10:50:00+00:00']
+
+    # A new booking rotates the calendar's token, so the cached bitmap is rebuilt
+    client.post('/api/bookings/appointments', json={
+        'calendar_id': alice, 'title': 'Later',
+        'start_time': '2030-01-07T11:00:00', 'end_time': '2030-01-07T11:30:00'
+    })
+    assert client.get(f'{url}&duration=30').json['slots'] == [
+        {'start': '2030-01-07T10:00:00+00:00', 'end': '2030-01-07T10:30:00+00:00'},
+        {'start': '2030-01-07T11:30:00+00:00', 'end': '2030-01-07T12:00:00+00:00'},
+    ]
+
+def test_free_slot_search_validates_calendars(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Solo'}).json['id']
+    response = client.get(f'/api/bookings/free-slots?calendar_ids={cal_id},999')
+    assert response.status_code == 404
+    assert response.json['missing'] == [999]
+    assert client.get('/api/bookings/free-slots').status_code == 400
+    assert client.get('/api/bookings/free-slots?calendar_ids=a').status_code == 400
+
+def create_timed_appointment(client, cal_id, title, start, **extra):
+    return client.post('/api/bookings/appointments', json={
+        'calendar_id': cal_id, 'title': title,
+        'start_time': start.isoformat(), 'end_time': (start + timedelta(hours=1)).isoformat(), **extra
+    }).json['id']
+
+def test_ics_feed_is_etagged_per_calendar_version(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Feed'}).json['id']
+    start = datetime.utcnow().replace(microsecond=0) + timedelta(days=1)
+    apt_id = create_timed_appointment(client, cal_id, 'Checkup, room 2', start,
+                                      description='Bring forms; ask about résumé ' * 5)
+    create_timed_appointment(client, cal_id, 'Follow-up', start + timedelta(hours=2))
+
+    response = client.get(f'/api/bookings/calendars/{cal_id}/ics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/calendar'
+    body = response.data
+    assert body.count(b'BEGIN:VEVENT') == 2
+    assert b'SUMMARY:Checkup\\, room 2' in body
+    assert b'DTSTART:' + start.strftime('%Y%m%dT%H%M%SZ').encode() in body
+    assert all(len(line) <= 75 for line in body.split(b'\r\n'))
+    etag = response.headers['ETag']
+
+    assert client.get(f'/api/bookings/calendars/{cal_id}/ics', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(f'/api/bookings/calendars/{cal_id}/ics').data == body
+
+    client.put(f'/api/bookings/appointments/{apt_id}', json={'status': 'cancelled'})
+    response = client.get(f'/api/bookings/calendars/{cal_id}/ics', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert b'STATUS:CANCELLED' in response.data
+
+    # A timezone change alters the feed header, so the ETag moves too
+    etag = response.headers['ETag']
+    db.session.get(Calendar, cal_id).timezone = 'Europe/Berlin'
+    db.session.commit()
+    response = client.get(f'/api/bookings/calendars/{cal_id}/ics', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'X-WR-TIMEZONE:Europe/Berlin' in response.data
+
+def test_sync_token_returns_only_changes(client):
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Sync'}).json['id']
+    other_id = client.post('/api/bookings/calendars', json={'name': 'Other'}).json['id']
+    start = datetime(2030, 1, 7, 9)
+    first = create_timed_appointment(client, cal_id, 'First', start)
+    second = create_timed_appointment(client, cal_id, 'Second', start + timedelta(hours=2))
+    create_timed_appointment(client, other_id, 'Elsewhere', start)
+
+    url = f'/api/bookings/calendars/{cal_id}/changes'
+    initial = client.get(url).json
+    assert [c['title'] for c in initial['changes']] == ['First', 'Second']
+    assert initial['has_more'] is False
+
+    second_uid = client.get(f'/api/bookings/appointments/{second}').json['appointment_id']
+    client.put(f'/api/bookings/appointments/{first}', json={'status': 'cancelled'})
+    client.delete(f'/api/bookings/appointments/{second}')
+    create_timed_appointment(client, cal_id, 'Third', start + timedelta(hours=4))
+
+    page = client.get(f"{url}?sync_token={initial['sync_token']}&limit=2").json
+    assert page['has_more'] is True
+    assert [(c.get('title'), c.get('status')) for c in page['changes']] == [('First', 'cancelled'), (None, None)]
+    assert page['changes'][1] == {'appointment_id': second_uid, 'deleted': True,
+                                  'deleted_at': page['changes'][1]['deleted_at']}
+    page = client.get(f"{url}?sync_token={page['sync_token']}&limit=2").json
+    assert [c['title'] for c in page['changes']] == ['Third']
+    assert page['has_more'] is False
+    done = client.get(f"{url}?sync_token={page['sync_token']}").json
+    assert done['changes'] == [] and done['sync_token'] == page['sync_token']
+
+    assert client.get(f'{url}?sync_token=%%%').status_code == 400
+    other_token = client.get(f'/api/bookings/calendars/{other_id}/changes').json['sync_token']
+    assert client.get(f'{url}?sync_token={other_token}').status_code == 400
+
+def test_timing_wheel_fires_each_entry_on_its_tick():
+    from app import TimingWheel
+    wheel = TimingWheel(now=1000)
+    ticks = [1001, 1059, 1060, 1061, 1000 + 3599, 1000 + 3600, 1000 + 7200, 1000 + 90000, 1000 + 200000]
+    wheel.add(10, 'late')
+    for tick in reversed(ticks):
+        wheel.add(tick, f'at-{tick}')
+
+    fired = []
+    for step in range(0, 200001, 97):
+        fired += [(tick, wheel.now, item) for tick, item in wheel.advance(1000 + step)]
+    fired += [(tick, wheel.now, item) for tick, item in wheel.advance(1000 + 200001)]
+    assert [item for _, _, item in fired] == ['late'] + [f'at-{t}' for t in ticks]
+    assert all(tick <= now < tick + 97 for tick, now, _ in fired)
+    assert wheel.count == 0
+
+def test_reminder_dispatcher_delivers_once_per_offset(client, tmp_path, monkeypatch):
+    from app import ReminderDispatcher, FileReminderTransport, ReminderDelivery
+    monkeypatch.setitem(app.config, 'REMINDER_OFFSETS', [60, 15])
+    cal_id = client.post('/api/bookings/calendars', json={'name': 'Reminders'}).json['id']
+    base = datetime.utcnow().replace(microsecond=0)
+    soon = create_timed_appointment(client, cal_id, 'Soon', base + timedelta(minutes=80), client_email='a@example.com')
+    create_timed_appointment(client, cal_id, 'Now-ish', base + timedelta(minutes=20), client_phone='555-0100')
+    create_timed_appointment(client, cal_id, 'Dropped', base + timedelta(minutes=65), status='cancelled',
+                             client_email='c@example.com')
+
+    sink = tmp_path / 'reminders.jsonl'
+    clock = {'now': base.replace(tzinfo=timezone.utc).timestamp()}
+    dispatcher = ReminderDispatcher(FileReminderTransport(str(sink)), clock=lambda: clock['now'])
+    dispatcher.refresh()
+    assert dispatcher.dispatch() == 0
+
+    clock['now'] += 21 * 60
+    assert dispatcher.dispatch() == 2
+    sent = [json.loads(line) for line in sink.read_text().splitlines()]
+    assert sorted((r['title'], r['offset_minutes']) for r in sent) == [('Now-ish', 15), ('Soon', 60)]
+
+    # A restarted dispatcher reloads the grace window but the claims stop a second send
+    restarted = ReminderDispatcher(FileReminderTransport(str(sink)), clock=lambda: clock['now'])
+    restarted.refresh()
+    assert restarted.dispatch() == 0
+    assert len(sink.read_text().splitlines()) == 2
+
+    # Moving the appointment drops its pending reminder and schedules the new one
+    client.put(f'/api/bookings/appointments/{soon}', json={
+        'start_time': (base + timedelta(minutes=85)).isoformat(),
+        'end_time': (base + timedelta(minutes=145)).isoformat(),
+    })
+    dispatcher.refresh()
+    clock['now'] += 50 * 60
+    assert dispatcher.dispatch() == 1
+    assert json.loads(sink.read_text().splitlines()[-1])['offset_minutes'] == 15
+    assert ReminderDelivery.query.filter_by(status='sent').count() == 3
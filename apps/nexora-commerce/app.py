@@ -1,11 +1,41 @@
-from flask import Flask, jsonify, request, abort
+from flask import Flask, Response, jsonify, request, abort
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import MetaData, Table, create_engine, event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.exc import StaleDataError
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from abc import ABC, abstractmethod
+from collections import Counter
 from functools import wraps
+import fcntl
+import gzip
+import hashlib
+import json
+import math
 import os
-from datetime import timedelta, datetime
+import re
+import secrets
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from datetime import timedelta
 from decimal import Decimal
 
+# Add parent directory to path for imports
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APPS_DIR = os.path.abspath(os.path.join(BASE_DIR, '..'))
+COMMON_DIR = os.path.abspath(os.path.join(APPS_DIR, '..', 'common'))
+sys.path.insert(0, COMMON_DIR)
+
+from utils.sequences import SequenceAllocator, format_number, sequence_table
+
+try:
+    import redis
+except Exception:
+    redis = None
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -14,6 +44,22 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///app
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET', 'dev-secret-key-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+# Order numbers each worker reserves per database round trip
+app.config['ORDER_NUMBER_BLOCK_SIZE'] = int(os.getenv('ORDER_NUMBER_BLOCK_SIZE', '100'))
+# Catalog search: backend name (default: the database dialect), candidates ranked per query, term statistics lifetime
+app.config['PRODUCT_SEARCH_BACKEND'] = os.getenv('PRODUCT_SEARCH_BACKEND')
+app.config['PRODUCT_SEARCH_WINDOW'] = int(os.getenv('PRODUCT_SEARCH_WINDOW', '200'))
+app.config['PRODUCT_SEARCH_STATS_TTL'] = int(os.getenv('PRODUCT_SEARCH_STATS_TTL', '3600'))
+# Rendered storefront pages shared by all workers (point it at /dev/shm to keep them in memory),
+# the Cache-Control they are served with, and whether a gzip copy is kept next to each
+app.config['STOREFRONT_CACHE_DIR'] = os.getenv('STOREFRONT_CACHE_DIR', os.path.join(app.instance_path, 'storefront-cache'))
+app.config['STOREFRONT_CACHE_CONTROL'] = os.getenv('STOREFRONT_CACHE_CONTROL', 'public, max-age=60')
+app.config['STOREFRONT_GZIP'] = os.getenv('STOREFRONT_GZIP', '').lower() in ('1', 'true', 'yes')
+# Carts live outside the app database: memory:// (one process, tests), a SQLAlchemy URL or redis://.
+# A cart untouched for CART_TTL seconds expires; expired carts are swept at most every CART_SWEEP_INTERVAL.
+app.config['CART_STORE_URL'] = os.getenv('CART_STORE_URL', 'sqlite:///' + os.path.join(app.instance_path, 'carts.db'))
+app.config['CART_TTL'] = int(os.getenv('CART_TTL', 7 * 24 * 3600))
+app.config['CART_SWEEP_INTERVAL'] = int(os.getenv('CART_SWEEP_INTERVAL', 600))
 
 # Initialize extensions
 db = SQLAlchemy(app)
@@ -83,9 +129,15 @@ class StorefrontTemplate(db.Model):
     slug = db.Column(db.String(150), unique=True, nullable=False)
     html = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+    # Bumped by every UPDATE, which fails if another writer bumped it first; versions the cached page
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     def to_dict(self):
-        return { 'id': self.id, 'name': self.name, 'slug': self.slug, 'html': self.html, 'created_at': self.created_at }
+        return { 'id': self.id, 'name': self.name, 'slug': self.slug, 'html': self.html, 'version': self.version,
+                 'created_at': self.created_at, 'updated_at': self.updated_at }
 
 class Order(db.Model):
     __tablename__ = 'orders'
@@ -108,6 +160,10 @@ class OrderItem(db.Model):
     order = db.relationship('Order', backref=db.backref('items', lazy=True))
     product = db.relationship('Product')
 
+number_sequences = sequence_table(db.metadata)
+order_numbers = SequenceAllocator(lambda: db.engine, number_sequences,
+                                  block_size=app.config['ORDER_NUMBER_BLOCK_SIZE'])
+
 # ==================== Role-based decorator ====================
 
 def role_required(roles):
@@ -279,6 +335,33 @@ def create_product():
     return jsonify(p.to_dict()), 201
 
 
+def cart_quantities(items):
+    """{product_id: quantity} of checkout lines, merging repeated products; raises ValueError"""
+    quantities = {}
+    for it in items:
+        pid, qty = int(it['product_id']), int(it.get('quantity', 0))
+        if qty <= 0:
+            raise ValueError(f'quantity of product {pid} must be positive')
+        quantities[pid] = quantities.get(pid, 0) + qty
+    return quantities
+
+
+def reserve_stock(quantities):
+    """
+    Take ``quantities`` out of stock in one conditional UPDATE. Every product
+    is decremented or none is: the row count is short when any of them no
+    longer has enough stock, and the caller must roll back.
+    """
+    wanted = db.case(quantities, value=Product.id)
+    result = db.session.execute(
+        db.update(Product)
+        .where(Product.id.in_(quantities), Product.quantity >= wanted)
+        .values(quantity=Product.quantity - wanted)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == len(quantities)
+
+
 @app.route('/api/checkout', methods=['POST'])
 def checkout():
     data = request.get_json() or {}
@@ -287,40 +370,632 @@ def checkout():
     items = data.get('items', [])
     if not customer_name or not customer_email or not items:
         return jsonify({'error': 'customer_name, customer_email and items are required'}), 400
+    try:
+        quantities = cart_quantities(items)
+    except (KeyError, TypeError, ValueError) as exc:
+        return jsonify({'error': f'invalid items: {exc}'}), 400
 
-    total = Decimal('0.00')
-    for it in items:
-        pid = it.get('product_id')
-        qty = int(it.get('quantity', 0))
-        product = Product.query.get(pid)
+    # One query for the whole cart; priced in memory
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(quantities))}
+    for pid, qty in quantities.items():
+        product = products.get(pid)
         if not product:
             return jsonify({'error': f'product {pid} not found'}), 400
-        if product.quantity < qty:
+        if (product.quantity or 0) < qty:
             return jsonify({'error': f'not enough stock for product {product.name}'}), 400
-        total += Decimal(str(product.price)) * qty
 
+    order = place_order(customer_name, customer_email, quantities, {pid: p.price for pid, p in products.items()})
+    if order is None:
+        return jsonify({'error': f'not enough stock for product {short_product_name(quantities)}'}), 409
+    return jsonify({'order_id': order.id, 'order_number': order.order_number, 'total': str(order.total_amount)}), 201
+
+
+def place_order(customer_name, customer_email, quantities, prices):
+    """
+    Write and commit an order for ``quantities`` at ``prices`` (both keyed by
+    product id), taking its stock in the same transaction. Returns None, with
+    nothing written, when another checkout took the stock first.
+    """
+    # Taken before the order is written: the block reservation commits on its own connection
+    order_number = format_number('ORD', order_numbers.allocate('ORD'))
+    if not reserve_stock(quantities):
+        # Another checkout took the stock since it was read; nothing was decremented
+        db.session.rollback()
+        return None
     order = Order(
-        order_number=f"ORD-{int(datetime.utcnow().timestamp())}",
+        order_number=order_number,
         customer_name=customer_name,
         customer_email=customer_email,
-        total_amount=total,
+        total_amount=sum((Decimal(str(prices[pid])) * qty for pid, qty in quantities.items()), Decimal('0.00')),
         status='pending'
     )
     db.session.add(order)
     db.session.flush()
+    db.session.execute(db.insert(OrderItem), [
+        {'order_id': order.id, 'product_id': pid, 'quantity': qty, 'unit_price': prices[pid]}
+        for pid, qty in quantities.items()
+    ])
+    db.session.commit()
+    return order
 
-    for it in items:
-        pid = it.get('product_id')
-        qty = int(it.get('quantity', 0))
-        product = Product.query.get(pid)
-        oi = OrderItem(order_id=order.id, product_id=product.id, quantity=qty, unit_price=product.price)
-        product.quantity = product.quantity - qty
-        db.session.add(oi)
 
-    db.session.commit()
+def short_product_name(quantities):
+    """Name of a product that has less stock than ``quantities`` asks for"""
+    short = Product.query.filter(Product.id.in_(quantities)).all()
+    return next((p.name for p in short if (p.quantity or 0) < quantities[p.id]), 'an item')
+
+
+# ==================== Carts ====================
+#
+# A cart is a JSON document keyed by an opaque cart id (the client's cart
+# session), kept in a cart store rather than the app database:
+#   {'lines': {'<product_id>': {'product_id', 'name', 'quantity', 'unit_price'}}, 'version': n}
+# Prices are snapshotted when a product is first added. Checkout revalidates
+# every line's price and stock in one query: if a price moved the snapshot is
+# refreshed and the buyer is asked to confirm (409), otherwise the order is
+# written exactly as the cart shows it.
+
+class CartBusy(Exception):
+    """The cart is held by a checkout, or changed since it was read"""
+
+
+class CartStore(ABC):
+    """
+    Where carts are kept. Every write pushes the cart's expiry CART_TTL
+    seconds ahead; expired carts read as missing and are deleted by sweep(),
+    which create() runs at most every ``sweep_interval`` seconds.
+
+    A checkout claim()s its cart before placing the order, so a second
+    checkout of the same cart, or a change to its lines, is refused until the
+    claim is released or the cart deleted. A claim left behind by a crashed
+    worker lapses after ``claim_timeout`` seconds.
+    """
+
+    claim_timeout = 120
+
+    def __init__(self, ttl, sweep_interval):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+
+    def create(self):
+        """Id of a new, empty cart"""
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            self.sweep()
+        cart_id = secrets.token_urlsafe(18)
+        self.save(cart_id, {'lines': {}, 'version': 0})
+        return cart_id
+
+    def is_claimed(self, cart):
+        """True while a checkout holds ``cart``"""
+        return cart.get('checking_out', 0) > time.time() - self.claim_timeout
+
+    def claim(self, cart_id, version):
+        """
+        Mark the cart as checking out if it is still at ``version`` and no
+        other checkout holds it. Returns the claimed cart, or None when the
+        cart is gone, has changed or is already claimed.
+        """
+        def mark(cart):
+            if cart['version'] != version or self.is_claimed(cart):
+                raise CartBusy
+            cart['checking_out'] = time.time()
+
+        try:
+            return self.update(cart_id, mark)
+        except CartBusy:
+            return None
+
+    def release(self, cart_id):
+        """Let go of a checkout's claim on the cart"""
+        return self.update(cart_id, lambda cart: cart.pop('checking_out', None))
+
+    @abstractmethod
+    def load(self, cart_id):
+        """The cart, or None when it does not exist or has expired"""
+
+    @abstractmethod
+    def save(self, cart_id, cart):
+        """Store ``cart`` as it is, renewing its expiry"""
+
+    @abstractmethod
+    def update(self, cart_id, change):
+        """
+        Apply ``change(cart)`` to the stored cart atomically against other
+        writers and return the new cart, or None when there is no such cart.
+        An exception raised by ``change`` leaves the cart as it was.
+        """
+
+    @abstractmethod
+    def delete(self, cart_id):
+        """Delete the cart, if it exists"""
+
+    @abstractmethod
+    def sweep(self):
+        """Delete expired carts; returns how many"""
+
+
+class MemoryCartStore(CartStore):
+    """Carts in a dict of this process: the stand-in for tests and single-process runs"""
+
+    def __init__(self, url, ttl, sweep_interval):
+        super().__init__(ttl, sweep_interval)
+        self.carts = {}  # cart_id -> (expires_at, JSON)
+        self.lock = threading.Lock()
+
+    def load(self, cart_id):
+        entry = self.carts.get(cart_id)
+        return json.loads(entry[1]) if entry and entry[0] > time.time() else None
+
+    def save(self, cart_id, cart):
+        self.carts[cart_id] = (time.time() + self.ttl, json.dumps(cart))
+
+    def update(self, cart_id, change):
+        with self.lock:
+            cart = self.load(cart_id)
+            if cart is not None:
+                change(cart)
+                cart['version'] += 1
+                self.save(cart_id, cart)
+            return cart
+
+    def delete(self, cart_id):
+        self.carts.pop(cart_id, None)
+
+    def sweep(self):
+        now = time.time()
+        with self.lock:
+            expired = [cart_id for cart_id, (expires_at, _) in self.carts.items() if expires_at <= now]
+            for cart_id in expired:
+                del self.carts[cart_id]
+        return len(expired)
+
+
+class SqlCartStore(CartStore):
+    """
+    Carts in a carts table of their own database (by default a SQLite file
+    next to the app's), so cart traffic never touches the order tables.
+    Updates are optimistic: the write only lands if the version read is
+    still current, and is retried otherwise.
+    """
+
+    def __init__(self, url, ttl, sweep_interval):
+        super().__init__(ttl, sweep_interval)
+        metadata = MetaData()
+        self.table = Table(
+            'carts', metadata,
+            db.Column('id', db.String(32), primary_key=True),
+            db.Column('data', db.Text, nullable=False),
+            db.Column('version', db.Integer, nullable=False),
+            db.Column('expires_at', db.Float, nullable=False, index=True),
+        )
+        if url.startswith('sqlite:///'):
+            os.makedirs(os.path.dirname(os.path.abspath(url[len('sqlite:///'):])) or '.', exist_ok=True)
+        self.engine = create_engine(url)
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine, 'connect', self._sqlite_pragmas)
+        metadata.create_all(self.engine)
+
+    @staticmethod
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # Readers never wait for a writer, and commits skip the fsync a lost cart is not worth
+        dbapi_connection.execute('PRAGMA journal_mode = WAL')
+        dbapi_connection.execute('PRAGMA synchronous = NORMAL')
+
+    def load(self, cart_id):
+        table = self.table
+        with self.engine.connect() as connection:
+            data = connection.execute(
+                db.select(table.c.data).where(table.c.id == cart_id, table.c.expires_at > time.time())
+            ).scalar()
+        return json.loads(data) if data is not None else None
+
+    def save(self, cart_id, cart):
+        values = {'data': json.dumps(cart), 'version': cart['version'], 'expires_at': time.time() + self.ttl}
+        with self.engine.begin() as connection:
+            if not connection.execute(db.update(self.table).where(self.table.c.id == cart_id).values(**values)).rowcount:
+                connection.execute(db.insert(self.table).values(id=cart_id, **values))
+
+    def update(self, cart_id, change):
+        table = self.table
+        while True:
+            cart = self.load(cart_id)
+            if cart is None:
+                return None
+            version = cart['version']
+            change(cart)
+            cart['version'] = version + 1
+            with self.engine.begin() as connection:
+                written = connection.execute(
+                    db.update(table).where(table.c.id == cart_id, table.c.version == version).values(
+                        data=json.dumps(cart), version=version + 1, expires_at=time.time() + self.ttl)
+                ).rowcount
+            if written:
+                return cart
+
+    def delete(self, cart_id):
+        with self.engine.begin() as connection:
+            connection.execute(db.delete(self.table).where(self.table.c.id == cart_id))
+
+    def sweep(self):
+        with self.engine.begin() as connection:
+            return connection.execute(db.delete(self.table).where(self.table.c.expires_at <= time.time())).rowcount
+
+
+class RedisCartStore(CartStore):
+    """
+    Carts as Redis keys cart:<id> (any Redis-protocol server). Redis expires
+    them itself, so sweep() has nothing to do; updates use WATCH/MULTI.
+    """
+
+    def __init__(self, url, ttl, sweep_interval):
+        super().__init__(ttl, sweep_interval)
+        if redis is None:
+            raise RuntimeError('CART_STORE_URL is a Redis URL but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+
+    @staticmethod
+    def key(cart_id):
+        return f'cart:{cart_id}'
+
+    def load(self, cart_id):
+        data = self.client.get(self.key(cart_id))
+        return json.loads(data) if data is not None else None
+
+    def save(self, cart_id, cart):
+        self.client.set(self.key(cart_id), json.dumps(cart), ex=self.ttl)
+
+    def update(self, cart_id, change):
+        key = self.key(cart_id)
+
+        def apply(pipe):
+            data = pipe.get(key)
+            if data is None:
+                return None
+            cart = json.loads(data)
+            change(cart)
+            cart['version'] += 1
+            pipe.multi()
+            pipe.set(key, json.dumps(cart), ex=self.ttl)
+            return cart
+
+        return self.client.transaction(apply, key, value_from_callable=True)
+
+    def delete(self, cart_id):
+        self.client.delete(self.key(cart_id))
+
+    def sweep(self):
+        return 0
+
+
+CART_STORES = {
+    'memory': MemoryCartStore,
+    'sqlite': SqlCartStore,
+    'postgresql': SqlCartStore,
+    'mysql': SqlCartStore,
+    'redis': RedisCartStore,
+    'rediss': RedisCartStore,
+}
+cart_stores = {}
+
+
+def cart_store():
+    """The cart store of the configured CART_STORE_URL"""
+    url = app.config['CART_STORE_URL']
+    if url not in cart_stores:
+        scheme = url.split(':', 1)[0].split('+', 1)[0]
+        if scheme not in CART_STORES:
+            raise RuntimeError(f'no cart store for {scheme} URLs')
+        cart_stores[url] = CART_STORES[scheme](url, app.config['CART_TTL'], app.config['CART_SWEEP_INTERVAL'])
+    return cart_stores[url]
+
+
+def current_products(product_ids):
+    """{product_id: (name, price, stock)} of the given products, in one query"""
+    rows = db.session.execute(
+        db.select(Product.id, Product.name, Product.price, Product.quantity).where(Product.id.in_(product_ids))
+    )
+    return {pid: (name, price, quantity or 0) for pid, name, price, quantity in rows}
+
+
+def cart_dict(cart_id, cart):
+    lines = list(cart['lines'].values())
+    subtotal = sum((Decimal(line['unit_price']) * line['quantity'] for line in lines), Decimal('0.00'))
+    return {'cart_id': cart_id, 'lines': lines, 'item_count': sum(line['quantity'] for line in lines),
+            'subtotal': str(subtotal), 'version': cart['version']}
+
+
+def cart_not_found():
+    return jsonify({'error': 'cart not found or expired'}), 404
+
+
+def cart_checking_out():
+    return jsonify({'error': 'cart is being checked out or changed meanwhile'}), 409
+
+
+def change_cart_lines(cart_id, quantities, replace):
+    """
+    Add ``quantities`` to a cart's lines (or set them, with ``replace``; 0
+    removes a line). All products are priced in one query; a product new to
+    the cart is added at today's price, which the cart then keeps.
+    """
+    products = current_products(quantities)
+    missing = [pid for pid, qty in quantities.items() if pid not in products and qty > 0]
+    if missing:
+        return jsonify({'error': f'product {missing[0]} not found'}), 400
+    short = []
+    store = cart_store()
+
+    def change(cart):
+        if store.is_claimed(cart):
+            raise CartBusy
+        short.clear()
+        lines = cart['lines']
+        for pid, qty in quantities.items():
+            line = lines.get(str(pid))
+            quantity = qty if replace else qty + (line['quantity'] if line else 0)
+            if quantity <= 0:
+                lines.pop(str(pid), None)
+            elif quantity > products[pid][2]:
+                short.append(products[pid][0])
+            elif line:
+                line['quantity'] = quantity
+            else:
+                name, price, _ = products[pid]
+                lines[str(pid)] = {'product_id': pid, 'name': name, 'quantity': quantity, 'unit_price': str(price)}
+        if short:
+            raise ValueError(short)
+
+    try:
+        cart = store.update(cart_id, change)
+    except ValueError:
+        return jsonify({'error': f'not enough stock for product {short[0]}'}), 409
+    except CartBusy:
+        return cart_checking_out()
+    if cart is None:
+        return cart_not_found()
+    return jsonify(cart_dict(cart_id, cart)), 200
+
+
+@app.route('/api/carts', methods=['POST'])
+def create_cart():
+    store = cart_store()
+    cart_id = store.create()
+    return jsonify(cart_dict(cart_id, store.load(cart_id))), 201
+
+
+@app.route('/api/carts/<cart_id>', methods=['GET'])
+def get_cart(cart_id):
+    cart = cart_store().load(cart_id)
+    if cart is None:
+        return cart_not_found()
+    return jsonify(cart_dict(cart_id, cart)), 200
+
+
+@app.route('/api/carts/<cart_id>', methods=['DELETE'])
+def delete_cart(cart_id):
+    cart_store().delete(cart_id)
+    return jsonify({'message': 'cart deleted'}), 200
+
+
+@app.route('/api/carts/<cart_id>/items', methods=['POST'])
+def add_cart_items(cart_id):
+    """Add one line ({product_id, quantity}) or several ({items: [...]}), priced in one query."""
+    data = request.get_json() or {}
+    items = data['items'] if isinstance(data.get('items'), list) else [data]
+    try:
+        quantities = cart_quantities(items)
+    except (KeyError, TypeError, ValueError) as exc:
+        return jsonify({'error': f'invalid items: {exc}'}), 400
+    if not quantities:
+        return jsonify({'error': 'items are required'}), 400
+    return change_cart_lines(cart_id, quantities, replace=False)
+
+
+@app.route('/api/carts/<cart_id>/items/<int:product_id>', methods=['PUT'])
+def set_cart_item(cart_id, product_id):
+    try:
+        quantity = int((request.get_json() or {})['quantity'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'quantity is required'}), 400
+    if quantity < 0:
+        return jsonify({'error': 'quantity must not be negative'}), 400
+    return change_cart_lines(cart_id, {product_id: quantity}, replace=True)
+
+
+@app.route('/api/carts/<cart_id>/items/<int:product_id>', methods=['DELETE'])
+def remove_cart_item(cart_id, product_id):
+    return change_cart_lines(cart_id, {product_id: 0}, replace=True)
+
+
+@app.route('/api/carts/<cart_id>/checkout', methods=['POST'])
+def checkout_cart(cart_id):
+    """
+    Order a cart at its snapshot prices. Prices and stock of every line are
+    checked in one query; a moved price refreshes the cart and returns 409 so
+    the buyer can confirm the new total. The cart is claimed before the order
+    is placed, so checking it out twice at once places one order.
+    """
+    data = request.get_json() or {}
+    customer_name = data.get('customer_name')
+    customer_email = data.get('customer_email')
+    if not customer_name or not customer_email:
+        return jsonify({'error': 'customer_name and customer_email are required'}), 400
+    store = cart_store()
+    cart = store.load(cart_id)
+    if cart is None:
+        return cart_not_found()
+    if store.is_claimed(cart):
+        return cart_checking_out()
+    lines = cart['lines']
+    if not lines:
+        return jsonify({'error': 'cart is empty'}), 400
+    quantities = {line['product_id']: line['quantity'] for line in lines.values()}
+    products = current_products(quantities)
+
+    missing = [line['name'] for line in lines.values() if line['product_id'] not in products]
+    if missing:
+        return jsonify({'error': f'product {missing[0]} is no longer available'}), 409
+    changed = {pid: products[pid][1] for pid in quantities
+               if Decimal(lines[str(pid)]['unit_price']) != Decimal(str(products[pid][1]))}
+    if changed:
+        def reprice(cart):
+            for pid, price in changed.items():
+                if str(pid) in cart['lines']:
+                    cart['lines'][str(pid)]['unit_price'] = str(price)
+
+        cart = store.update(cart_id, reprice) or cart
+        return jsonify({'error': 'prices changed since the items were added',
+                        'changed': [{'product_id': pid, 'unit_price': str(price)} for pid, price in changed.items()],
+                        'cart': cart_dict(cart_id, cart)}), 409
+    short = [products[pid][0] for pid, qty in quantities.items() if products[pid][2] < qty]
+    if short:
+        return jsonify({'error': f'not enough stock for product {short[0]}'}), 409
+
+    if store.claim(cart_id, cart['version']) is None:
+        return cart_checking_out()
+    try:
+        order = place_order(customer_name, customer_email, quantities, {pid: products[pid][1] for pid in quantities})
+    except Exception:
+        store.release(cart_id)
+        raise
+    if order is None:
+        store.release(cart_id)
+        return jsonify({'error': f'not enough stock for product {short_product_name(quantities)}'}), 409
+    store.delete(cart_id)
     return jsonify({'order_id': order.id, 'order_number': order.order_number, 'total': str(order.total_amount)}), 201
 
 
+@app.cli.command('sweep-carts')
+def sweep_carts_command():
+    """Delete expired carts from the cart store"""
+    print(f'Deleted {cart_store().sweep()} expired carts')
+
+
+# ==================== Storefronts ====================
+
+class StorefrontCache:
+    """
+    Rendered storefront pages, one file per slug under ``root``, shared by
+    every worker using the directory. A file is a JSON header line (template
+    id and version, ETag, HTML length) followed by the HTML and, when
+    STOREFRONT_GZIP was on, its gzip encoding.
+
+    Writers hold a lock file and never replace a page with an older version
+    of the same template, so a page rendered before an update committed
+    cannot overwrite the one written by that update.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, slug):
+        return os.path.join(self.root, hashlib.sha1(slug.encode()).hexdigest())
+
+    def get(self, slug):
+        """(etag, html, gzipped html or None) of ``slug``, or None on a miss"""
+        header, body = self._read(self.path(slug))
+        if not header or 'etag' not in header:
+            return None
+        size = header['size']
+        return header['etag'], body[:size], body[size:] or None
+
+    def put(self, slug, template_id, version, page):
+        """Store ``page`` as version ``version`` of template ``template_id``; None leaves a tombstone."""
+        path = self.path(slug)
+        header = {'id': template_id, 'version': version}
+        body = b''
+        if page is not None:
+            etag, html, gzipped = page
+            header.update(etag=etag, size=len(html))
+            body = html + (gzipped or b'')
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            current, _ = self._read(path, header_only=True)
+            if current and current['id'] == template_id and current['version'] > version:
+                return
+            # Write-then-rename so readers in other workers never see a partial page
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as out:
+                out.write(json.dumps(header).encode() + b'\n' + body)
+            os.replace(tmp, path)
+
+    def clear(self):
+        if os.path.isdir(self.root):
+            for entry in os.scandir(self.root):
+                if entry.is_file() and entry.name != '.lock':
+                    os.unlink(entry.path)
+
+    @staticmethod
+    def _read(path, header_only=False):
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                return header, None if header_only else f.read()
+        except (FileNotFoundError, ValueError):
+            return None, None
+
+
+storefront_caches = {}
+
+
+def storefront_cache():
+    """The page cache of the configured STOREFRONT_CACHE_DIR"""
+    root = app.config['STOREFRONT_CACHE_DIR']
+    if root not in storefront_caches:
+        storefront_caches[root] = StorefrontCache(root)
+    return storefront_caches[root]
+
+
+def render_storefront_page(template):
+    """(etag, html, gzipped html or None) of a storefront; the ETag is a hash of the HTML"""
+    html = (template.html or ('<h1>' + template.name + '</h1>')).encode()
+    gzipped = gzip.compress(html, mtime=0) if app.config['STOREFRONT_GZIP'] else None
+    return hashlib.sha256(html).hexdigest()[:32], html, gzipped
+
+
+def store_storefront_page(slug, template_id, version, page):
+    try:
+        storefront_cache().put(slug, template_id, version, page)
+    except OSError as exc:  # a full or read-only cache must not fail the page view
+        app.logger.warning('storefront cache write failed: %s', exc)
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_storefront_pages(session, flush_context):
+    """Render the storefronts written in this flush; their cached pages are replaced on commit."""
+    pages = session.info.setdefault('storefront_pages', {})  # slug -> (template id, version, page or None)
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, StorefrontTemplate):
+            pages[obj.slug] = (obj.id, obj.version, render_storefront_page(obj))
+            for slug in db.inspect(obj).attrs.slug.history.deleted:
+                if slug != obj.slug:
+                    pages[slug] = (obj.id, obj.version, None)
+    for obj in session.deleted:
+        if isinstance(obj, StorefrontTemplate):
+            pages[obj.slug] = (obj.id, obj.version + 1, None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def store_storefront_pages(session):
+    for slug, (template_id, version, page) in session.info.pop('storefront_pages', {}).items():
+        store_storefront_page(slug, template_id, version, page)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_storefront_pages(session):
+    session.info.pop('storefront_pages', None)
+
+
+@event.listens_for(StorefrontTemplate.__table__, 'after_create')
+@event.listens_for(StorefrontTemplate.__table__, 'before_drop')
+def clear_storefront_cache(target, connection, **kw):
+    # Only a fresh template table restarts versions at 1; create_all on an existing schema keeps the cache
+    storefront_cache().clear()
+
+
 @app.route('/api/storefronts', methods=['GET'])
 def list_storefronts():
     t = StorefrontTemplate.query.order_by(StorefrontTemplate.created_at.desc()).all()
@@ -342,13 +1017,54 @@ def create_storefront():
     return jsonify(s.to_dict()), 201
 
 
-@app.route('/store/<slug>', methods=['GET'])
-def render_storefront(slug):
-    s = StorefrontTemplate.query.filter_by(slug=slug).first()
+@app.route('/api/storefronts/<int:storefront_id>', methods=['PUT'])
+@role_required(['admin','manager'])
+def update_storefront(storefront_id):
+    s = StorefrontTemplate.query.get(storefront_id)
     if not s:
         return jsonify({'error': 'storefront not found'}), 404
-    # For simple template rendering we return HTML content stored in template
-    return s.html or ('<h1>' + s.name + '</h1>'), 200
+    data = request.get_json() or {}
+    s.name = data.get('name', s.name)
+    s.slug = data.get('slug', s.slug)
+    s.html = data.get('html', s.html)
+    if not s.name or not s.slug:
+        db.session.rollback()
+        return jsonify({'error': 'name and slug required'}), 400
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'storefront was changed by another request, reload and retry'}), 409
+    return jsonify(s.to_dict()), 200
+
+
+@app.route('/store/<slug>', methods=['GET'])
+def render_storefront(slug):
+    """
+    A storefront's public page. Once rendered it is served from the shared
+    page cache without touching the database until the template changes.
+    Responses carry a strong ETag (304 on a match) and
+    STOREFRONT_CACHE_CONTROL so nginx or a CDN can keep them too.
+    """
+    page = storefront_cache().get(slug)
+    if page is None:
+        s = StorefrontTemplate.query.filter_by(slug=slug).first()
+        if not s:
+            return jsonify({'error': 'storefront not found'}), 404
+        page = render_storefront_page(s)
+        store_storefront_page(slug, s.id, s.version, page)
+    etag, html, gzipped = page
+    headers = {'Cache-Control': app.config['STOREFRONT_CACHE_CONTROL']}
+    if app.config['STOREFRONT_GZIP']:
+        headers['Vary'] = 'Accept-Encoding'
+        if gzipped is not None and request.accept_encodings['gzip']:
+            # Each encoding is a representation of its own and needs its own strong ETag
+            etag, html = etag + '-gzip', gzipped
+            headers['Content-Encoding'] = 'gzip'
+    headers['ETag'] = f'"{etag}"'
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(html, mimetype='text/html', headers=headers)
 
 @app.route('/api/items/<int:item_id>', methods=['GET'])
 def get_item(item_id):
@@ -427,6 +1143,491 @@ def delete_item(item_id):
     
     return jsonify({'message': 'Item deleted successfully'}), 200
 
+# ==================== Product Search ====================
+#
+# Products are indexed by a pluggable backend chosen by PRODUCT_SEARCH_BACKEND
+# or the database dialect: SQLite FTS5 or a Postgres tsvector side table. The
+# index is created and dropped with the tables and kept in step with product
+# writes in the flush that makes them. An index created on an existing database
+# is filled from the products already there; `flask rebuild-product-search`
+# reindexes rows written around the ORM.
+#
+# Ranking every match of a broad term ("mug", or the typeahead prefix "mu*")
+# costs time proportional to the catalog, so each query ranks at most
+# PRODUCT_SEARCH_WINDOW candidates: name/SKU matches first, then the rest,
+# newest first. When every match fits in the window, ranking, total and facet
+# counts are exact; otherwise total and facets are estimates and say so, and
+# pages past the window are refused rather than returned empty.
+
+SEARCH_WORD = re.compile(r'[^\W_]+')
+SEARCH_SEPARATORS = str.maketrans({code: ' ' for code in range(128) if not chr(code).isalnum()})
+SEARCH_MAX_TERMS = 8
+
+
+def search_tokens(text):
+    """Lowercased, accent-stripped words of ``text``, split as FTS5's unicode61 tokenizer splits them"""
+    if not text:
+        return []
+    text = text.lower()
+    if text.isascii():
+        return text.translate(SEARCH_SEPARATORS).split()
+    text = ''.join(ch for ch in unicodedata.normalize('NFKD', text) if not unicodedata.combining(ch))
+    return SEARCH_WORD.findall(text)
+
+
+def parse_search_query(q, prefix=True):
+    """[(term, is_prefix)] of a query; the last word is a prefix while it is still being typed"""
+    terms = []
+    for token in search_tokens(q)[:SEARCH_MAX_TERMS]:
+        if (token, False) not in terms:
+            terms.append((token, False))
+    if terms and prefix and not q[-1:].isspace() and len(terms[-1][0]) >= 2:
+        terms[-1] = (terms[-1][0], True)
+    return terms
+
+
+def id_chunks(ids, size=500):
+    ids = sorted(ids)
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+class ProductSearch(ABC):
+    """
+    A catalog search backend. candidates() returns
+    ([(product_id, category_id, score)], exact, total) for products matching
+    every term, at most ``window`` of them.
+    """
+
+    def __init__(self, window, stats_ttl):
+        self.window = window
+        self.stats_ttl = stats_ttl
+
+    @abstractmethod
+    def create(self, connection):
+        """Create the index structures, if missing; True if they were missing"""
+
+    @abstractmethod
+    def drop(self, connection):
+        """Drop the index structures"""
+
+    @abstractmethod
+    def index(self, connection, product_ids):
+        """(Re)index the current rows of ``product_ids``"""
+
+    @abstractmethod
+    def remove(self, connection, product_ids):
+        """Remove ``product_ids`` from the index"""
+
+    @abstractmethod
+    def rebuild(self, connection):
+        """Reindex every product"""
+
+    @abstractmethod
+    def candidates(self, connection, terms, category_id=None):
+        """([(product_id, category_id, score)], exact, total) of the products matching every term"""
+
+
+class SqliteProductSearch(ProductSearch):
+    """
+    FTS5 table products_fts. Candidates are scored with FTS5's BM25 formula in
+    Python: the bm25() SQL function counts every document of every query term
+    to weigh it, which for a common term or short prefix is a scan of most of
+    the index.
+
+    products_fts_vocabulary holds the number of documents of each term, kept
+    in step by index() and remove() (fts5vocab counts them by reading the
+    term's whole doclist). It weighs terms, cached for
+    PRODUCT_SEARCH_STATS_TTL seconds, and expands a prefix longer than the
+    prefix indexes into an OR of the terms it stands for: FTS5 merges every
+    doclist of an unindexed prefix before applying LIMIT.
+    """
+
+    COLUMNS = ('name', 'description', 'sku', 'category_id')
+    WEIGHTS = (10.0, 1.0, 5.0, 0.0)
+    K1, B = 1.2, 0.75
+    PREFIX_INDEXES = (2, 3)
+    MAX_EXPANSION = 500
+
+    def __init__(self, window, stats_ttl):
+        super().__init__(window, stats_ttl)
+        self._document_counts = {}
+        self._totals = None
+
+    def create(self, connection):
+        created = not db.inspect(connection).has_table('products_fts')
+        connection.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+            "name, description, sku, category_id, tokenize = 'unicode61 remove_diacritics 2', "
+            f"prefix = '{' '.join(map(str, self.PREFIX_INDEXES))}')"
+        )
+        connection.exec_driver_sql("CREATE VIRTUAL TABLE IF NOT EXISTS products_fts_terms USING fts5vocab(products_fts, 'row')")
+        connection.exec_driver_sql('CREATE TABLE IF NOT EXISTS products_fts_vocabulary ('
+                                   'term TEXT PRIMARY KEY, documents INTEGER NOT NULL) WITHOUT ROWID')
+        return created
+
+    def drop(self, connection):
+        connection.exec_driver_sql('DROP TABLE IF EXISTS products_fts_vocabulary')
+        connection.exec_driver_sql('DROP TABLE IF EXISTS products_fts_terms')
+        connection.exec_driver_sql('DROP TABLE IF EXISTS products_fts')
+        self.forget_statistics()
+
+    def forget_statistics(self):
+        self._document_counts.clear()
+        self._totals = None
+
+    @staticmethod
+    def term_documents(rows):
+        """Counter of term -> number of the given (name, description, sku, category_id) rows containing it"""
+        documents = Counter()
+        for row in rows:
+            documents.update({token for value in row if value is not None for token in search_tokens(str(value))})
+        return documents
+
+    def remove(self, connection, product_ids):
+        select = db.text('SELECT name, description, sku, category_id FROM products_fts WHERE rowid IN :ids'
+                         ).bindparams(db.bindparam('ids', expanding=True))
+        delete = db.text('DELETE FROM products_fts WHERE rowid IN :ids').bindparams(db.bindparam('ids', expanding=True))
+        for chunk in id_chunks(product_ids):
+            documents = self.term_documents(connection.execute(select, {'ids': chunk}))
+            connection.execute(delete, {'ids': chunk})
+            if documents:
+                connection.execute(db.text('UPDATE products_fts_vocabulary SET documents = documents - :count '
+                                           'WHERE term = :term'),
+                                   [{'term': term, 'count': count} for term, count in documents.items()])
+                connection.execute(db.text('DELETE FROM products_fts_vocabulary WHERE term IN :terms AND documents <= 0')
+                                   .bindparams(db.bindparam('terms', expanding=True)), {'terms': list(documents)})
+
+    def index(self, connection, product_ids):
+        self.remove(connection, product_ids)
+        statement = db.text(
+            'INSERT INTO products_fts (rowid, name, description, sku, category_id) '
+            'SELECT id, name, description, sku, category_id FROM products WHERE id IN :ids'
+        ).bindparams(db.bindparam('ids', expanding=True))
+        select = db.text('SELECT name, description, sku, category_id FROM products WHERE id IN :ids'
+                         ).bindparams(db.bindparam('ids', expanding=True))
+        for chunk in id_chunks(product_ids):
+            connection.execute(statement, {'ids': chunk})
+            documents = self.term_documents(connection.execute(select, {'ids': chunk}))
+            if documents:
+                connection.execute(db.text(
+                    'INSERT INTO products_fts_vocabulary (term, documents) VALUES (:term, :count) '
+                    'ON CONFLICT (term) DO UPDATE SET documents = documents + excluded.documents'
+                ), [{'term': term, 'count': count} for term, count in documents.items()])
+
+    def rebuild(self, connection):
+        connection.exec_driver_sql('DELETE FROM products_fts')
+        connection.exec_driver_sql('INSERT INTO products_fts (rowid, name, description, sku, category_id) '
+                                   'SELECT id, name, description, sku, category_id FROM products')
+        connection.exec_driver_sql("INSERT INTO products_fts (products_fts) VALUES ('optimize')")
+        connection.exec_driver_sql('DELETE FROM products_fts_vocabulary')
+        connection.exec_driver_sql('INSERT INTO products_fts_vocabulary (term, documents) '
+                                   'SELECT term, doc FROM products_fts_terms')
+        self.forget_statistics()
+
+    def totals(self, connection):
+        """
+        (documents, average tokens per document), cached for PRODUCT_SEARCH_STATS_TTL.
+
+        Read from FTS5's averages record, row 1 of its products_fts_data shadow
+        table: varints of the row count and then the token count of each
+        column. That record is an FTS5 internal rather than an API, so when it
+        is missing or does not decode to one count per column, the statistics
+        come from the products table and the vocabulary instead (one word per
+        distinct term of a document, which undercounts repeated words).
+        """
+        if self._totals is None or self._totals[0] < time.monotonic():
+            numbers = self.averages_record(connection)
+            if numbers == []:
+                documents, tokens = 0, 0
+            elif numbers is not None and len(numbers) == 1 + len(self.COLUMNS):
+                documents, tokens = numbers[0], sum(numbers[1:])
+            else:
+                app.logger.warning('products_fts averages record not readable; using vocabulary statistics')
+                documents = connection.exec_driver_sql('SELECT count(*) FROM products').scalar()
+                tokens = connection.exec_driver_sql('SELECT sum(documents) FROM products_fts_vocabulary').scalar() or 0
+            self._totals = (time.monotonic() + self.stats_ttl, documents, tokens / documents if documents else 1.0)
+        return self._totals[1:]
+
+    @staticmethod
+    def averages_record(connection):
+        """The varints of FTS5's averages record, [] for an empty index, or None when it cannot be read"""
+        try:
+            block = connection.exec_driver_sql('SELECT block FROM products_fts_data WHERE id = 1').scalar()
+        except DBAPIError:
+            return None
+        if not block:
+            return []
+        if not isinstance(block, bytes) or block[-1:] >= b'\x80':
+            return None
+        numbers, value = [], 0
+        for byte in block:  # SQLite varints, 7 bits a byte, high bit set on all but the last
+            value = (value << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                numbers.append(value)
+                value = 0
+        return numbers
+
+    def document_count(self, connection, term, prefix):
+        """Documents containing ``term`` (any word starting with it when ``prefix``; then an upper bound)"""
+        key = (term, prefix)
+        cached = self._document_counts.get(key)
+        if cached is None or cached[0] < time.monotonic():
+            if prefix:
+                upper = term[:-1] + chr(ord(term[-1]) + 1)
+                count = connection.exec_driver_sql(
+                    'SELECT sum(documents) FROM products_fts_vocabulary WHERE term >= ? AND term < ?', (term, upper)
+                ).scalar()
+            else:
+                count = connection.exec_driver_sql('SELECT documents FROM products_fts_vocabulary WHERE term = ?',
+                                                   (term,)).scalar()
+            if len(self._document_counts) > 50000:
+                self._document_counts.clear()
+            cached = self._document_counts[key] = (time.monotonic() + self.stats_ttl, count or 0)
+        return cached[1]
+
+    def phrase(self, connection, term, prefix):
+        """FTS5 query for one term; None when it is a prefix of no indexed word"""
+        if not prefix:
+            return f'"{term}"'
+        if len(term) <= max(self.PREFIX_INDEXES):
+            return f'"{term}"*'
+        upper = term[:-1] + chr(ord(term[-1]) + 1)
+        words = connection.exec_driver_sql(
+            'SELECT term FROM products_fts_vocabulary WHERE term >= ? AND term < ? LIMIT ?',
+            (term, upper, self.MAX_EXPANSION + 1)).scalars().all()
+        if not words:
+            return None
+        if len(words) > self.MAX_EXPANSION:
+            return f'"{term}"*'
+        return '(' + ' OR '.join(f'"{word}"' for word in words) + ')'
+
+    def matching_ids(self, connection, columns, expression, category_id):
+        query = f'{{{columns}}} : ({expression})'
+        if category_id is not None:
+            query += f' AND category_id : "{int(category_id)}"'
+        return connection.exec_driver_sql(
+            'SELECT rowid FROM products_fts WHERE products_fts MATCH ? ORDER BY rowid DESC LIMIT ?',
+            (query, self.window + 1)).scalars().all()
+
+    def candidates(self, connection, terms, category_id=None):
+        phrases = [self.phrase(connection, term, prefix) for term, prefix in terms]
+        if None in phrases:
+            return [], True, 0
+        expression = ' AND '.join(phrases)
+        ids = self.matching_ids(connection, 'name sku', expression, category_id)
+        exact = False
+        if len(ids) <= self.window:
+            everywhere = self.matching_ids(connection, 'name description sku', expression, category_id)
+            exact = len(everywhere) <= self.window
+            seen = set(ids)
+            ids += [pid for pid in everywhere if pid not in seen][:self.window - len(ids)]
+        ids = ids[:self.window]
+        if not ids:
+            return [], True, 0
+
+        documents, average_length = self.totals(connection)
+        counts = [min(self.document_count(connection, term, prefix), documents) for term, prefix in terms]
+        idf = [max(math.log((documents - count + 0.5) / (count + 0.5)), 1e-6) for count in counts]
+        rows = connection.exec_driver_sql(
+            f'SELECT id, name, description, sku, category_id FROM products WHERE id IN ({",".join("?" * len(ids))})',
+            tuple(ids)).all()
+        scored = [(pid, category, self.bm25(
+            (search_tokens(name), search_tokens(description), search_tokens(sku), [str(category)] if category else []),
+            terms, idf, average_length)) for pid, name, description, sku, category in rows]
+        return scored, exact, len(scored) if exact else max(min(counts), len(scored))
+
+    def bm25(self, columns, terms, idf, average_length):
+        """FTS5's bm25() of one document whose columns are the given token lists (higher is better)"""
+        norm = self.K1 * (1 - self.B + self.B * sum(len(tokens) for tokens in columns) / average_length)
+        score = 0.0
+        for (term, prefix), weight_of_term in zip(terms, idf):
+            hits = 0.0
+            for weight, tokens in zip(self.WEIGHTS, columns):
+                if weight:
+                    # ' ' + term counts the words starting with term: the joined words are space separated
+                    hits += weight * ((' ' + ' '.join(tokens)).count(' ' + term) if prefix else tokens.count(term))
+            score += weight_of_term * hits * (self.K1 + 1) / (hits + norm)
+        return score
+
+
+class PostgresProductSearch(ProductSearch):
+    """
+    Side table product_search holding a weighted tsvector per product under a
+    GIN index. Postgres has no BM25; candidates are scored with ts_rank using
+    the same name > SKU > description weighting.
+    """
+
+    DOCUMENT = ("setweight(to_tsvector('simple', coalesce(p.name, '')), 'A') || "
+                "setweight(to_tsvector('simple', coalesce(p.sku, '')), 'B') || "
+                "setweight(to_tsvector('simple', coalesce(p.description, '')), 'C')")
+
+    def create(self, connection):
+        created = not db.inspect(connection).has_table('product_search')
+        connection.exec_driver_sql('CREATE TABLE IF NOT EXISTS product_search ('
+                                   'product_id integer PRIMARY KEY, category_id integer, document tsvector NOT NULL)')
+        connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_product_search_document ON product_search USING gin (document)')
+        return created
+
+    def drop(self, connection):
+        connection.exec_driver_sql('DROP TABLE IF EXISTS product_search')
+
+    def remove(self, connection, product_ids):
+        statement = db.text('DELETE FROM product_search WHERE product_id IN :ids').bindparams(db.bindparam('ids', expanding=True))
+        for chunk in id_chunks(product_ids):
+            connection.execute(statement, {'ids': chunk})
+
+    def index(self, connection, product_ids):
+        statement = db.text(
+            f'INSERT INTO product_search (product_id, category_id, document) '
+            f'SELECT p.id, p.category_id, {self.DOCUMENT} FROM products p WHERE p.id IN :ids '
+            f'ON CONFLICT (product_id) DO UPDATE SET category_id = excluded.category_id, document = excluded.document'
+        ).bindparams(db.bindparam('ids', expanding=True))
+        for chunk in id_chunks(product_ids):
+            connection.execute(statement, {'ids': chunk})
+
+    def rebuild(self, connection):
+        connection.exec_driver_sql('TRUNCATE product_search')
+        connection.exec_driver_sql(f'INSERT INTO product_search (product_id, category_id, document) '
+                                   f'SELECT p.id, p.category_id, {self.DOCUMENT} FROM products p')
+
+    def candidates(self, connection, terms, category_id=None):
+        query = ' & '.join(f'{term}:*' if prefix else term for term, prefix in terms)  # words only, nothing to escape
+        rows = connection.execute(db.text(
+            "SELECT product_id, category_id, ts_rank('{0, 0.2, 0.5, 1}', document, query) "
+            "FROM product_search, to_tsquery('simple', :query) query "
+            "WHERE document @@ query AND (CAST(:category_id AS integer) IS NULL OR category_id = :category_id) "
+            "LIMIT :limit"
+        ), {'query': query, 'category_id': category_id, 'limit': self.window + 1}).all()
+        exact = len(rows) <= self.window
+        rows = [tuple(row) for row in rows[:self.window]]
+        return rows, exact, len(rows) if exact else len(rows) + 1
+
+
+PRODUCT_SEARCH_BACKENDS = {
+    'sqlite': SqliteProductSearch,
+    'postgresql': PostgresProductSearch,
+}
+product_search_backends = {}
+
+
+def product_search(engine=None):
+    """The search backend of ``engine`` (the app's by default): PRODUCT_SEARCH_BACKEND, or one for its dialect"""
+    engine = engine or db.engine
+    name = app.config['PRODUCT_SEARCH_BACKEND'] or engine.dialect.name
+    key = (name, str(engine.url))
+    if key not in product_search_backends:
+        if name not in PRODUCT_SEARCH_BACKENDS:
+            raise RuntimeError(f'no product search backend for {name}')
+        product_search_backends[key] = PRODUCT_SEARCH_BACKENDS[name](
+            app.config['PRODUCT_SEARCH_WINDOW'], app.config['PRODUCT_SEARCH_STATS_TTL'])
+    return product_search_backends[key]
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_product_search(target, connection, **kw):
+    search = product_search(connection.engine)
+    # A database upgraded to catalog search already has products the new index has not seen
+    if search.create(connection):
+        search.rebuild(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_product_search(target, connection, **kw):
+    product_search(connection.engine).drop(connection)
+
+
+SEARCHED_FIELDS = ('name', 'description', 'sku', 'category_id', 'category')
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_product_search_changes(session, flush_context):
+    changes = session.info.setdefault('product_search_changes', {'index': set(), 'remove': set()})
+    for obj in session.new:
+        if isinstance(obj, Product):
+            changes['index'].add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Product) and any(db.inspect(obj).attrs[field].history.has_changes() for field in SEARCHED_FIELDS):
+            changes['index'].add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            changes['remove'].add(obj.id)
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def update_product_search(session, flush_context):
+    changes = session.info.pop('product_search_changes', None)
+    if changes and (changes['index'] or changes['remove']):
+        backend = product_search()
+        connection = session.connection()
+        if changes['remove']:
+            backend.remove(connection, changes['remove'])
+        if changes['index'] - changes['remove']:
+            backend.index(connection, changes['index'] - changes['remove'])
+
+
+def search_products(q, category_id=None, limit=20, offset=0, prefix=True):
+    """Ranked page, total and category facets of the products matching every word of ``q``"""
+    terms = parse_search_query(q, prefix)
+    if not terms:
+        return {'items': [], 'total': 0, 'total_is_estimate': False, 'facets': {'category': []},
+                'facets_are_estimates': False}
+    backend = product_search()
+    connection = db.session.connection()
+    rows, exact, total = backend.candidates(connection, terms)
+    scale = 1 if exact else total / len(rows)
+    facets = {category: max(1, round(count * scale)) for category, count in Counter(row[1] for row in rows).items()}
+    facets_are_estimates = not exact
+    if category_id is not None:
+        if exact:
+            rows = [row for row in rows if row[1] == category_id]
+            total = len(rows)
+        else:
+            rows, exact, total = backend.candidates(connection, terms, category_id)
+            if not exact:
+                total = max(facets.get(category_id, 0), len(rows))
+
+    rows.sort(key=lambda row: (-row[2], -row[0]))
+    page = rows[offset:offset + limit]
+    products = {p.id: p for p in Product.query.options(db.joinedload(Product.category))
+                .filter(Product.id.in_([row[0] for row in page]))}
+    names = dict(db.session.query(Category.id, Category.name).filter(Category.id.in_([c for c in facets if c])))
+    return {
+        'items': [{**products[pid].to_dict(), 'score': float(f'{score:.6g}')} for pid, _, score in page if pid in products],
+        'total': total,
+        'total_is_estimate': not exact,
+        'facets': {'category': sorted(
+            ({'id': category, 'name': names.get(category), 'count': count} for category, count in facets.items()),
+            key=lambda facet: (-facet['count'], facet['id'] or 0))},
+        'facets_are_estimates': facets_are_estimates,
+    }
+
+
+@app.route('/api/products/search', methods=['GET'])
+def product_search_endpoint():
+    """Products matching ?q= (last word as a prefix unless ?prefix=0), best first, with category facet counts"""
+    q = request.args.get('q', '')
+    if not search_tokens(q):
+        return jsonify({'error': 'q required'}), 400
+    category_id = request.args.get('category_id', type=int)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    window = product_search().window
+    if offset >= window:
+        # Only the first PRODUCT_SEARCH_WINDOW candidates are ranked; deeper pages would always be empty
+        return jsonify({'error': f'offset must be below {window}; narrow the query or the category instead'}), 400
+    prefix = request.args.get('prefix', '1') not in ('0', 'false', 'no')
+    result = search_products(q, category_id, limit, offset, prefix)
+    return jsonify({'query': q, 'limit': limit, 'offset': offset, **result}), 200
+
+
+@app.cli.command('rebuild-product-search')
+def rebuild_product_search_command():
+    """Reindex every product for catalog search"""
+    product_search().rebuild(db.session.connection())
+    db.session.commit()
+    print(f'Reindexed {Product.query.count()} products')
+
+
 # ==================== Health Check ====================
 
 @app.route('/api/health', methods=['GET'])
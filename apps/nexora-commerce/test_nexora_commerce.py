@@ -1,8 +1,15 @@
 import sys, os
 sys.path.insert(0, os.path.dirname(__file__))
 
+import gzip
+import threading
+import time
+
 import pytest
-from app import app, db, User, Module
+from sqlalchemy import event
+from app import (app, db, User, Module, Category, Product, Order, OrderItem, StorefrontTemplate, order_numbers,
+                 reserve_stock, product_search, storefront_cache, render_storefront_page, cart_stores,
+                 MemoryCartStore, SqlCartStore, SqliteProductSearch)
 
 @pytest.fixture
 def client():
@@ -41,3 +48,351 @@ def test_health_check(client):
     response = client.get('/api/health')
     assert response.status_code == 200
     assert response.json['status'] == 'healthy'
+
+def test_checkouts_in_the_same_second_get_distinct_order_numbers(client):
+    product = Product(sku='SKU-1', name='Widget', price=5, quantity=100)
+    db.session.add(product)
+    db.session.commit()
+
+    numbers = []
+    for n in range(5):
+        response = client.post('/api/checkout', json={
+            'customer_name': 'Ann', 'customer_email': 'ann@example.com',
+            'items': [{'product_id': product.id, 'quantity': 1}]
+        })
+        assert response.status_code == 201
+        numbers.append(response.json['order_number'])
+    assert len(set(numbers)) == 5
+    assert all(number.startswith('ORD-') for number in numbers)
+    assert numbers == sorted(numbers)
+
+def test_order_numbers_come_from_reserved_blocks(client):
+    order_numbers._blocks.clear()
+    reservations = order_numbers.reservations
+    first = order_numbers.allocate('BENCH')
+    values = [order_numbers.allocate('BENCH') for _ in range(order_numbers.block_size - 1)]
+    assert values == list(range(first + 1, first + order_numbers.block_size))
+    assert order_numbers.reservations == reservations + 1
+    assert order_numbers.allocate('BENCH') == first + order_numbers.block_size
+    assert order_numbers.reservations == reservations + 2
+
+def test_checkout_prices_cart_in_one_query_and_merges_lines(client):
+    widget = Product(sku='W', name='Widget', price=5, quantity=10)
+    gadget = Product(sku='G', name='Gadget', price='2.50', quantity=10)
+    db.session.add_all([widget, gadget])
+    db.session.commit()
+    response = client.post('/api/checkout', json={
+        'customer_name': 'Ann', 'customer_email': 'ann@example.com',
+        'items': [{'product_id': widget.id, 'quantity': 2}, {'product_id': gadget.id, 'quantity': 1},
+                  {'product_id': widget.id, 'quantity': 1}]
+    })
+    assert response.status_code == 201
+    assert response.json['total'] == '17.50'
+    db.session.expire_all()
+    assert (widget.quantity, gadget.quantity) == (7, 9)
+    lines = OrderItem.query.filter_by(order_id=response.json['order_id']).order_by(OrderItem.product_id).all()
+    assert [(line.product_id, line.quantity) for line in lines] == [(widget.id, 3), (gadget.id, 1)]
+
+    for items in ([{'product_id': widget.id, 'quantity': 8}], [{'product_id': widget.id, 'quantity': 0}],
+                  [{'product_id': 999, 'quantity': 1}], [{'quantity': 1}]):
+        response = client.post('/api/checkout', json={'customer_name': 'Ann', 'customer_email': 'a@e.com', 'items': items})
+        assert response.status_code == 400
+    db.session.expire_all()
+    assert widget.quantity == 7
+
+    # Stock is taken for every product of the cart or for none of them
+    assert not reserve_stock({widget.id: 1, gadget.id: 100})
+    db.session.rollback()
+    assert (widget.quantity, gadget.quantity) == (7, 9)
+
+def test_concurrent_checkouts_never_oversell(client):
+    scarce = Product(sku='S', name='Scarce', price=10, quantity=20)
+    plenty = Product(sku='P', name='Plenty', price=1, quantity=10000)
+    db.session.add_all([scarce, plenty])
+    db.session.commit()
+    cart = {'customer_name': 'Ann', 'customer_email': 'ann@example.com',
+            'items': [{'product_id': plenty.id, 'quantity': 1}, {'product_id': scarce.id, 'quantity': 1}]}
+    statuses = []
+
+    def buyer():
+        buyer_client = app.test_client()
+        for _ in range(6):
+            statuses.append(buyer_client.post('/api/checkout', json=cart).status_code)
+
+    threads = [threading.Thread(target=buyer) for _ in range(8)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(f'{len(statuses)} concurrent checkouts in {elapsed:.2f}s ({len(statuses) / elapsed:.0f} carts/sec)')
+
+    assert statuses.count(201) == 20
+    assert set(statuses) <= {201, 400, 409}
+    db.session.expire_all()
+    assert scarce.quantity == 0
+    assert plenty.quantity == 10000 - 20
+    assert Order.query.count() == 20
+    assert OrderItem.query.count() == 40
+
+def make_catalog():
+    kitchen, garden = Category(name='Kitchen'), Category(name='Garden')
+    db.session.add_all([kitchen, garden])
+    db.session.add_all([
+        Product(sku='MUG-01', name='Ceramic coffee mug', description='Holds 300ml', price=8, category=kitchen),
+        Product(sku='MUG-02', name='Travel mug', description='Insulated steel', price=15, category=kitchen),
+        Product(sku='KET-01', name='Kettle', description='Boils water for a mug of tea', price=30, category=kitchen),
+        Product(sku='POT-01', name='Flower pot', description='Terracotta, frost proof', price=12, category=garden),
+        Product(sku='CAF-01', name='Café crème cup', description='Espresso cup', price=6, category=kitchen),
+    ])
+    db.session.commit()
+    return kitchen, garden
+
+def test_product_search_ranks_by_bm25_with_facets(client):
+    kitchen, garden = make_catalog()
+    result = client.get('/api/products/search?q=mug').json
+    # The shorter name scores higher; a description match ranks below both
+    assert [item['sku'] for item in result['items']] == ['MUG-02', 'MUG-01', 'KET-01']
+    assert result['total'] == 3 and not result['total_is_estimate']
+    assert result['facets']['category'] == [{'id': kitchen.id, 'name': 'Kitchen', 'count': 3}]
+    scores = [item['score'] for item in result['items']]
+    assert scores == sorted(scores, reverse=True)
+
+    assert [item['sku'] for item in client.get('/api/products/search?q=flow').json['items']] == ['POT-01']
+    assert client.get('/api/products/search?q=flow&prefix=0').json['total'] == 0
+    assert [item['sku'] for item in client.get('/api/products/search?q=pot-01').json['items']] == ['POT-01']
+    assert [item['sku'] for item in client.get('/api/products/search?q=cafe creme').json['items']] == ['CAF-01']
+    assert client.get(f'/api/products/search?q=mug&category_id={garden.id}').json['total'] == 0
+    assert client.get('/api/products/search?q=').status_code == 400
+
+def test_product_search_statistics_survive_an_unreadable_averages_record(client, monkeypatch):
+    make_catalog()
+    backend = product_search()
+    connection = db.session.connection()
+    backend.forget_statistics()
+    documents, average_length = backend.totals(connection)
+    assert documents == 5 and average_length > 1
+    monkeypatch.setattr(SqliteProductSearch, 'averages_record', staticmethod(lambda connection: [5, 7]))
+    backend.forget_statistics()
+    assert backend.totals(connection)[0] == 5
+    assert [item['sku'] for item in client.get('/api/products/search?q=mug').json['items']] == ['MUG-02', 'MUG-01', 'KET-01']
+
+def test_product_search_follows_product_writes(client):
+    make_catalog()
+    pot = Product.query.filter_by(sku='POT-01').one()
+    pot.name = 'Herb planter'
+    db.session.commit()
+    assert client.get('/api/products/search?q=flower').json['total'] == 0
+    assert [item['sku'] for item in client.get('/api/products/search?q=planter').json['items']] == ['POT-01']
+    # A prefix longer than the FTS prefix indexes is expanded through the term vocabulary
+    assert [item['sku'] for item in client.get('/api/products/search?q=plan').json['items']] == ['POT-01']
+    vocabulary = dict(db.session.execute(db.text('SELECT term, documents FROM products_fts_vocabulary')).all())
+    assert vocabulary['mug'] == 3 and vocabulary['planter'] == 1 and 'flower' not in vocabulary
+    db.session.delete(pot)
+    db.session.commit()
+    assert client.get('/api/products/search?q=planter').json['total'] == 0
+    assert client.get('/api/products/search?q=plan').json['total'] == 0
+
+def test_product_search_index_created_on_an_existing_catalog_is_filled(client):
+    make_catalog()
+    product_search().drop(db.session.connection())
+    db.session.commit()
+    db.create_all()
+    assert [item['sku'] for item in client.get('/api/products/search?q=mug').json['items']] == ['MUG-02', 'MUG-01', 'KET-01']
+    db.create_all()
+    assert client.get('/api/products/search?q=mug').json['total'] == 3
+
+def test_product_search_estimates_beyond_the_ranking_window(client, monkeypatch):
+    kitchen, _ = make_catalog()
+    monkeypatch.setattr(product_search(), 'window', 2)
+    result = client.get('/api/products/search?q=mug').json
+    assert len(result['items']) == 2
+    assert {item['sku'] for item in result['items']} == {'MUG-01', 'MUG-02'}  # name matches are ranked first
+    assert result['total_is_estimate'] and result['facets_are_estimates']
+    assert result['total'] >= 2
+    assert client.get('/api/products/search?q=mug&offset=1').json['items'] != []
+    assert client.get('/api/products/search?q=mug&offset=2').status_code == 400
+
+@pytest.fixture
+def storefront_dir(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'STOREFRONT_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def statements(client):
+    seen = []
+    def record(conn, cursor, statement, *args):
+        seen.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+def test_storefront_is_served_from_the_page_cache(client, storefront_dir, statements):
+    store = StorefrontTemplate(name='Spring', slug='spring', html='<p>Sale</p>')
+    db.session.add(store)
+    db.session.commit()
+
+    statements.clear()
+    response = client.get('/store/spring')
+    assert response.status_code == 200 and response.data == b'<p>Sale</p>'
+    assert response.headers['Cache-Control'] == 'public, max-age=60'
+    assert statements == []  # written to the cache when the template was committed
+    etag = response.headers['ETag']
+    assert client.get('/store/spring', headers={'If-None-Match': etag}).status_code == 304
+
+    store.html = '<p>Summer</p>'
+    db.session.commit()
+    assert store.version == 2
+    statements.clear()
+    response = client.get('/store/spring', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.data == b'<p>Summer</p>'
+    assert response.headers['ETag'] != etag and statements == []
+
+    # A page rendered from version 1 before the update committed must not replace version 2
+    old = StorefrontTemplate(name='Spring', slug='spring', html='<p>Sale</p>')
+    storefront_cache().put('spring', store.id, 1, render_storefront_page(old))
+    assert client.get('/store/spring').data == b'<p>Summer</p>'
+
+    store.slug = 'summer'
+    db.session.commit()
+    assert client.get('/store/spring').status_code == 404
+    assert client.get('/store/summer').data == b'<p>Summer</p>'
+
+def test_storefront_cache_fills_on_first_view(client, storefront_dir, statements):
+    db.session.add(StorefrontTemplate(name='Outlet', slug='outlet'))
+    db.session.commit()
+    storefront_cache().clear()
+    assert client.get('/store/outlet').data == b'<h1>Outlet</h1>'
+    statements.clear()
+    assert client.get('/store/outlet').data == b'<h1>Outlet</h1>'
+    assert statements == []
+    assert client.get('/store/missing').status_code == 404
+
+def test_create_all_on_an_existing_schema_keeps_the_storefront_cache(client, storefront_dir, statements):
+    db.session.add(StorefrontTemplate(name='Outlet', slug='outlet'))
+    db.session.commit()
+    db.create_all()
+    statements.clear()
+    assert client.get('/store/outlet').data == b'<h1>Outlet</h1>'
+    assert statements == []
+
+def test_storefront_is_served_pre_gzipped(client, storefront_dir, monkeypatch):
+    monkeypatch.setitem(app.config, 'STOREFRONT_GZIP', True)
+    db.session.add(StorefrontTemplate(name='Big', slug='big', html='<p>catalog</p>' * 500))
+    db.session.commit()
+    plain = client.get('/store/big')
+    zipped = client.get('/store/big', headers={'Accept-Encoding': 'gzip, br'})
+    assert 'Content-Encoding' not in plain.headers and plain.headers['Vary'] == 'Accept-Encoding'
+    assert zipped.headers['Content-Encoding'] == 'gzip' and len(zipped.data) < len(plain.data) / 10
+    assert gzip.decompress(zipped.data) == plain.data
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+
+def test_storefront_update_replaces_the_cached_page(client, storefront_dir):
+    client.post('/api/auth/register', json={'username': 'boss', 'email': 'boss@example.com', 'password': 'secret123'})
+    User.query.filter_by(username='boss').update({'role': 'manager'})
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'username': 'boss', 'password': 'secret123'}).json['access_token']
+    auth = {'Authorization': f'Bearer {token}'}
+    created = client.post('/api/storefronts', json={'name': 'Home', 'slug': 'home', 'html': 'v1'}, headers=auth).json
+    assert client.get('/store/home').data == b'v1'
+    updated = client.put(f"/api/storefronts/{created['id']}", json={'html': 'v2'}, headers=auth)
+    assert updated.status_code == 200 and updated.json['version'] == created['version'] + 1
+    assert client.get('/store/home').data == b'v2'
+
+@pytest.fixture
+def cart(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'CART_STORE_URL', 'memory://')
+    cart_stores.pop('memory://', None)
+    mug = Product(sku='MUG-01', name='Mug', price=8, quantity=10)
+    kettle = Product(sku='KET-01', name='Kettle', price=30, quantity=2)
+    db.session.add_all([mug, kettle])
+    db.session.commit()
+    cart_id = client.post('/api/carts').json['cart_id']
+    return cart_id, mug, kettle
+
+def test_cart_snapshots_prices_and_checks_out(client, cart):
+    cart_id, mug, kettle = cart
+    response = client.post(f'/api/carts/{cart_id}/items', json={'items': [
+        {'product_id': mug.id, 'quantity': 2}, {'product_id': kettle.id, 'quantity': 1}, {'product_id': mug.id, 'quantity': 1},
+    ]})
+    assert response.status_code == 200
+    assert [(line['name'], line['quantity'], line['unit_price']) for line in response.json['lines']] == [
+        ('Mug', 3, '8.00'), ('Kettle', 1, '30.00')]
+    assert response.json['subtotal'] == '54.00'
+    assert client.put(f'/api/carts/{cart_id}/items/{kettle.id}', json={'quantity': 3}).status_code == 409  # 2 in stock
+    assert client.put(f'/api/carts/{cart_id}/items/{kettle.id}', json={'quantity': 2}).json['subtotal'] == '84.00'
+    assert client.delete(f'/api/carts/{cart_id}/items/{mug.id}').json['item_count'] == 2
+
+    response = client.post(f'/api/carts/{cart_id}/checkout', json={'customer_name': 'Ann', 'customer_email': 'ann@example.com'})
+    assert response.status_code == 201 and response.json['total'] == '60.00'
+    assert db.session.get(Product, kettle.id).quantity == 0
+    assert client.get(f'/api/carts/{cart_id}').status_code == 404
+
+def test_cart_checkout_revalidates_prices_and_stock(client, cart):
+    cart_id, mug, kettle = cart
+    client.post(f'/api/carts/{cart_id}/items', json={'product_id': mug.id, 'quantity': 2})
+    client.post(f'/api/carts/{cart_id}/items', json={'product_id': kettle.id, 'quantity': 2})
+    mug.price = 9
+    db.session.commit()
+    buyer = {'customer_name': 'Ann', 'customer_email': 'ann@example.com'}
+    response = client.post(f'/api/carts/{cart_id}/checkout', json=buyer)
+    assert response.status_code == 409
+    assert response.json['changed'] == [{'product_id': mug.id, 'unit_price': '9.00'}]
+    assert response.json['cart']['subtotal'] == '78.00'  # the cart now holds the new price
+
+    kettle.quantity = 1
+    db.session.commit()
+    assert client.post(f'/api/carts/{cart_id}/checkout', json=buyer).status_code == 409
+    assert Order.query.count() == 0
+    kettle.quantity = 5
+    db.session.commit()
+    response = client.post(f'/api/carts/{cart_id}/checkout', json=buyer)
+    assert response.status_code == 201 and response.json['total'] == '78.00'
+
+def test_cart_is_claimed_so_it_checks_out_once(client, cart):
+    cart_id, mug, _ = cart
+    version = client.post(f'/api/carts/{cart_id}/items', json={'product_id': mug.id, 'quantity': 2}).json['version']
+    store = cart_stores['memory://']
+    assert store.claim(cart_id, version - 1) is None  # changed since it was read
+    assert store.claim(cart_id, version) is not None  # another checkout got there first
+    buyer = {'customer_name': 'Ann', 'customer_email': 'ann@example.com'}
+    assert client.post(f'/api/carts/{cart_id}/checkout', json=buyer).status_code == 409
+    assert client.post(f'/api/carts/{cart_id}/items', json={'product_id': mug.id, 'quantity': 1}).status_code == 409
+    assert Order.query.count() == 0
+
+    store.release(cart_id)
+    assert client.post(f'/api/carts/{cart_id}/checkout', json=buyer).status_code == 201
+    assert client.post(f'/api/carts/{cart_id}/checkout', json=buyer).status_code == 404
+    assert Order.query.count() == 1 and db.session.get(Product, mug.id).quantity == 8
+
+@pytest.mark.parametrize('store_type', ['memory', 'sql'])
+def test_cart_stores_expire_and_sweep_carts(tmp_path, monkeypatch, store_type):
+    if store_type == 'memory':
+        store = MemoryCartStore('memory://', ttl=60, sweep_interval=0)
+    else:
+        store = SqlCartStore(f'sqlite:///{tmp_path}/carts.db', ttl=60, sweep_interval=0)
+    old, kept = store.create(), store.create()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 45)
+    store.update(kept, lambda cart: cart['lines'].update(x={'quantity': 1}))  # a write renews the expiry
+    monkeypatch.setattr(time, 'time', lambda: now + 90)
+    assert store.load(old) is None and store.update(old, lambda cart: None) is None
+    assert store.load(kept)['lines'] == {'x': {'quantity': 1}}
+    assert store.sweep() == 1
+
+def test_sql_cart_store_updates_do_not_lose_writes(tmp_path):
+    store = SqlCartStore(f'sqlite:///{tmp_path}/carts.db', ttl=60, sweep_interval=60)
+    cart_id = store.create()
+
+    def bump(cart):
+        cart['lines']['n'] = cart['lines'].get('n', 0) + 1
+        time.sleep(0.001)  # widen the read-modify-write window
+
+    threads = [threading.Thread(target=lambda: [store.update(cart_id, bump) for _ in range(10)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cart = store.load(cart_id)
+    assert cart['lines']['n'] == 40 and cart['version'] == 40
@@ -1,10 +1,31 @@
 from flask import Flask, jsonify, request
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from functools import wraps
+from functools import lru_cache, partial, wraps
 import os
 from datetime import timedelta, datetime
 from decimal import Decimal
+from collections import OrderedDict
+import click
+import hashlib
+import itertools
+import re
+import struct
+import sys
+import threading
+import time
+import unicodedata
+
+# Add parent directory to path for imports
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APPS_DIR = os.path.abspath(os.path.join(BASE_DIR, '..'))
+COMMON_DIR = os.path.abspath(os.path.join(APPS_DIR, '..', 'common'))
+sys.path.insert(0, COMMON_DIR)
+
+from utils.parallel import parallel_map
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -14,6 +35,16 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///app
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET', 'dev-secret-key-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+# Duplicate detection: pairs of leads (or contacts) scoring at least the
+# threshold are merge candidates. Blocks with more members than MAX_BLOCK
+# (a shared office number, a very common surname) are too unspecific to
+# compare within; the records still meet through their other keys.
+app.config['CRM_DEDUP_THRESHOLD'] = float(os.getenv('CRM_DEDUP_THRESHOLD', '0.55'))
+app.config['CRM_DEDUP_MAX_BLOCK'] = int(os.getenv('CRM_DEDUP_MAX_BLOCK', 100))
+app.config['CRM_DEDUP_WORKERS'] = int(os.getenv('CRM_DEDUP_WORKERS', os.cpu_count() or 1))
+app.config['CRM_DEDUP_CHUNK'] = int(os.getenv('CRM_DEDUP_CHUNK', 20000))  # records per worker task
+app.config['CRM_DEFAULT_COUNTRY_CODE'] = os.getenv('CRM_DEFAULT_COUNTRY_CODE', '1')  # for numbers without one
+app.config['CRM_ANALYTICS_CACHE_ENTRIES'] = int(os.getenv('CRM_ANALYTICS_CACHE_ENTRIES', 256))  # filter combinations per worker
 
 # Initialize extensions
 db = SQLAlchemy(app)
@@ -53,7 +84,7 @@ class Lead(db.Model):
     phone = db.Column(db.String(50))
     source = db.Column(db.String(100))
     status = db.Column(db.String(50), default='new')
-    created_at = db.Column(db.DateTime, default=db.func.now())
+    created_at = db.Column(db.DateTime, default=db.func.now(), index=True)
 
     def to_dict(self):
         return {
@@ -74,7 +105,7 @@ class Contact(db.Model):
     email = db.Column(db.String(255))
     phone = db.Column(db.String(50))
     company = db.Column(db.String(255))
-    created_at = db.Column(db.DateTime, default=db.func.now())
+    created_at = db.Column(db.DateTime, default=db.func.now(), index=True)
 
     lead = db.relationship('Lead', backref=db.backref('contacts', lazy=True))
 
@@ -91,9 +122,13 @@ class Contact(db.Model):
 
 class Deal(db.Model):
     __tablename__ = 'deals'
+    # Analytics groups by (status, stage) in index order, checks created_at and sums amount from the index alone
+    __table_args__ = (db.Index('ix_deals_status_stage_created', 'status', 'stage', 'created_at', 'amount'),
+                      db.Index('ix_deals_owner_created', 'owner_id', 'created_at'))
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     contact_id = db.Column(db.Integer, db.ForeignKey('contacts.id'), nullable=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     amount = db.Column(db.Numeric(12,2), default=0)
     stage = db.Column(db.String(100), default='prospect')
     status = db.Column(db.String(50), default='open')
@@ -106,6 +141,7 @@ class Deal(db.Model):
             'id': self.id,
             'title': self.title,
             'contact_id': self.contact_id,
+            'owner_id': self.owner_id,
             'amount': str(self.amount),
             'stage': self.stage,
             'status': self.status,
@@ -137,6 +173,47 @@ class Task(db.Model):
             'created_at': self.created_at
         }
 
+class TableVersion(db.Model):
+    """Write counter of a CRM table, bumped by every flush that changes it; keys cached analytics"""
+    __tablename__ = 'crm_table_versions'
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# ---------------- Deduplication Models ----------------
+# kind is 'leads' or 'contacts'; both share the tables but never meet.
+class DedupRecord(db.Model):
+    """A record's normalized identity as of its last indexing"""
+    __tablename__ = 'crm_dedup_records'
+    kind = db.Column(db.String(16), primary_key=True)
+    record_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    email = db.Column(db.String(255))
+    phone = db.Column(db.String(20))  # E.164
+    name = db.Column(db.String(255))
+
+class DedupBlock(db.Model):
+    """Block membership: only records sharing a block are compared"""
+    __tablename__ = 'crm_dedup_blocks'
+    __table_args__ = {'sqlite_with_rowid': False}
+    kind = db.Column(db.String(16), primary_key=True)
+    block = db.Column(db.BigInteger, primary_key=True, autoincrement=False)  # hash of the blocking key
+    record_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+class DedupPair(db.Model):
+    """A likely duplicate pair, record_id < other_id"""
+    __tablename__ = 'crm_dedup_pairs'
+    __table_args__ = (db.Index('ix_crm_dedup_pairs_other', 'kind', 'other_id'),)
+    kind = db.Column(db.String(16), primary_key=True)
+    record_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    other_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    score = db.Column(db.Float, nullable=False)
+
+class DedupQueue(db.Model):
+    """Records created, changed or deleted since the last incremental run"""
+    __tablename__ = 'crm_dedup_queue'
+    kind = db.Column(db.String(16), primary_key=True)
+    record_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
 # ==================== Role-based decorator ====================
 
 def role_required(roles):
@@ -450,14 +527,30 @@ def get_deal(deal_id):
     return jsonify(d.to_dict()), 200
 
 
+def owner_error(owner_id):
+    """Why ``owner_id`` cannot own a deal, or None; a deal may have no owner"""
+    if owner_id is None:
+        return None
+    if not isinstance(owner_id, int) or isinstance(owner_id, bool):
+        return 'owner_id must be an integer'
+    if db.session.get(User, owner_id) is None:
+        return 'owner_id is not a user'
+    return None
+
+
 @app.route('/api/deals', methods=['POST'])
 @role_required(['admin','manager'])
 def create_deal():
     data = request.get_json() or {}
     if not data.get('title'):
         return jsonify({'error': 'title required'}), 400
+    owner_id = data.get('owner_id', get_jwt_identity())
+    error = owner_error(owner_id)
+    if error:
+        return jsonify({'error': error}), 400
     amount = Decimal(str(data.get('amount', '0')))
-    d = Deal(title=data['title'], contact_id=data.get('contact_id'), amount=amount, stage=data.get('stage','prospect'))
+    d = Deal(title=data['title'], contact_id=data.get('contact_id'), amount=amount, stage=data.get('stage','prospect'),
+             owner_id=owner_id)
     db.session.add(d)
     db.session.commit()
     return jsonify(d.to_dict()), 201
@@ -468,10 +561,14 @@ def create_deal():
 def update_deal(deal_id):
     d = Deal.query.get_or_404(deal_id)
     data = request.get_json() or {}
+    error = owner_error(data.get('owner_id')) if 'owner_id' in data else None
+    if error:
+        return jsonify({'error': error}), 400
     d.title = data.get('title', d.title)
     d.amount = Decimal(str(data.get('amount', d.amount)))
     d.stage = data.get('stage', d.stage)
     d.status = data.get('status', d.status)
+    d.owner_id = data.get('owner_id', d.owner_id)
     db.session.commit()
     return jsonify(d.to_dict()), 200
 
@@ -546,26 +643,607 @@ def delete_task(task_id):
 
 
 # Analytics / Dashboard
+# Every transaction that writes leads, contacts or deals bumps that table's row
+# in crm_table_versions once it has committed, in a short transaction of its
+# own, so concurrent writers only queue on the counter row for that one
+# statement rather than for the whole of their transactions. Each worker
+# caches figures per filter combination for the versions they were computed
+# at, so a hit costs one primary-key read and a write through any worker
+# invalidates every worker's copy. Versions are read before figures are
+# computed, so figures cached between a commit and its bump are invalidated
+# by the bump.
+ANALYTICS_TABLES = {Lead: 'leads', Contact: 'contacts', Deal: 'deals'}
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_table_writes(session, flush_context):
+    names = session.info.setdefault('written_tables', set())
+    names.update(ANALYTICS_TABLES[type(obj)] for obj in itertools.chain(session.new, session.deleted)
+                 if type(obj) in ANALYTICS_TABLES)
+    names.update(ANALYTICS_TABLES[type(obj)] for obj in session.dirty
+                 if type(obj) in ANALYTICS_TABLES and session.is_modified(obj))
+
+
+@event.listens_for(db.session, 'after_commit')
+def bump_table_versions(session):
+    names = session.info.pop('written_tables', None)
+    if names:
+        with db.engine.begin() as connection:
+            increment_table_versions(connection, names)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_table_writes(session):
+    session.info.pop('written_tables', None)
+
+
+def increment_table_versions(connection, names):
+    table = TableVersion.__table__
+    dialect_insert = postgresql_insert if connection.dialect.name == 'postgresql' else sqlite_insert
+    statement = dialect_insert(table).on_conflict_do_update(index_elements=[table.c.name],
+                                                            set_={'version': table.c.version + 1})
+    connection.execute(statement, [{'name': name, 'version': 1} for name in sorted(names)])
+
+
+def table_versions():
+    versions = dict(db.session.execute(db.select(TableVersion.name, TableVersion.version)).all())
+    return tuple(versions.get(name, 0) for name in ANALYTICS_TABLES.values())
+
+
+class AnalyticsCache:
+    """Figures per key (a filter combination, a dedup kind), valid for one set of table versions (LRU)"""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # filters -> (versions, figures)
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get(self, filters, versions):
+        with self.lock:
+            entry = self.entries.get(filters)
+            if entry and entry[0] == versions:
+                self.entries.move_to_end(filters)
+                return entry[1]
+        return None
+
+    def put(self, filters, versions, figures):
+        with self.lock:
+            self.entries[filters] = (versions, figures)
+            self.entries.move_to_end(filters)
+            while len(self.entries) > app.config['CRM_ANALYTICS_CACHE_ENTRIES']:
+                self.entries.popitem(last=False)
+
+
+analytics_cache = AnalyticsCache()
+
+
+def money(value):
+    return str(Decimal(value or 0).quantize(Decimal('0.01')))
+
+
+def parse_analytics_date(value, end=False):
+    """datetime of an ISO date or datetime argument; a bare ``end`` date includes that whole day"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed + timedelta(days=1) if end and len(value) == 10 else parsed
+
+
+def crm_figures(start=None, end=None, owner_id=None):
+    """
+    Lead, contact and deal figures for records created in [start, end), deals
+    optionally of one owner, in one round trip.
+
+    The deal counts and amounts come grouped by (status, stage): walking
+    ix_deals_status_stage_created yields the groups in order and tests the
+    date range on index entries, and every status and stage total is a sum
+    of those groups.
+    """
+    def window(column):
+        conditions = []
+        if start is not None:
+            conditions.append(column >= start)
+        if end is not None:
+            conditions.append(column < end)
+        return conditions
+
+    deals = (db.select(db.literal('deals'), Deal.status, Deal.stage, db.func.count(),
+                       db.func.coalesce(db.func.sum(Deal.amount), 0))
+             .where(*window(Deal.created_at), *([Deal.owner_id == owner_id] if owner_id is not None else []))
+             .group_by(Deal.status, Deal.stage))
+    leads = db.select(db.literal('leads'), db.null(), db.null(), db.func.count(), db.null()).select_from(Lead) \
+        .where(*window(Lead.created_at))
+    contacts = db.select(db.literal('contacts'), db.null(), db.null(), db.func.count(), db.null()) \
+        .select_from(Contact).where(*window(Contact.created_at))
+
+    counts, statuses, stages = {}, {}, {}
+    for source, status, stage, count, amount in db.session.execute(db.union_all(deals, leads, contacts)):
+        if source != 'deals':
+            counts[source] = count
+            continue
+        for totals in (statuses.setdefault(status, {'count': 0, 'amount': 0}),
+                       stages.setdefault(stage, {'count': 0, 'amount': 0, 'by_status': {}})):
+            totals['count'] += count
+            totals['amount'] += amount
+        stages[stage]['by_status'][status] = {'count': count, 'amount': money(amount)}
+
+    open_deals, closed_deals = (statuses.get(status, {'count': 0, 'amount': 0}) for status in ('open', 'closed'))
+    return {
+        'total_leads': counts.get('leads', 0),
+        'total_contacts': counts.get('contacts', 0),
+        'total_deals': sum(totals['count'] for totals in statuses.values()),
+        'total_amount': money(sum(totals['amount'] for totals in statuses.values())),
+        'open_deals': open_deals['count'],
+        'open_amount': money(open_deals['amount']),
+        'closed_deals': closed_deals['count'],
+        'closed_amount': money(closed_deals['amount']),
+        'by_status': [{'status': status, 'count': totals['count'], 'amount': money(totals['amount'])}
+                      for status, totals in sorted(statuses.items(), key=lambda item: str(item[0]))],
+        'pipeline': [{'stage': stage, 'count': totals['count'], 'amount': money(totals['amount']),
+                      'by_status': totals['by_status']}
+                     for stage, totals in sorted(stages.items(), key=lambda item: str(item[0]))],
+        'filters': {'from': start.isoformat() if start else None, 'to': end.isoformat() if end else None,
+                    'owner_id': owner_id},
+    }
+
+
 @app.route('/api/crm/analytics', methods=['GET'])
 def crm_analytics():
-    total_leads = Lead.query.count()
-    total_contacts = Contact.query.count()
-    total_deals = Deal.query.count()
-    open_deals = Deal.query.filter(Deal.status=='open').count()
-    closed_deals = Deal.query.filter(Deal.status=='closed').count()
-    # pipeline breakdown
-    stages = db.session.query(Deal.stage, db.func.count(Deal.id)).group_by(Deal.stage).all()
-    pipeline = [{ 'stage': s, 'count': c } for s,c in stages]
+    try:
+        start = parse_analytics_date(request.args.get('from'))
+        end = parse_analytics_date(request.args.get('to'), end=True)
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates'}), 400
+    owner_id = request.args.get('owner_id', type=int)
+    if owner_id is None and request.args.get('owner_id', '') != '':
+        return jsonify({'error': 'owner_id must be an integer'}), 400
+    filters, versions = (start, end, owner_id), table_versions()
+    figures = analytics_cache.get(filters, versions)
+    if figures is None:
+        figures = crm_figures(start, end, owner_id)
+        analytics_cache.put(filters, versions, figures)
+    return jsonify(figures), 200
+
+
+# ==================== Duplicate Detection ====================
+# Leads and contacts are normalized (email, E.164 phone, name) and indexed
+# under a few blocking keys; a record is only ever compared with records it
+# shares a block with, so a pass costs the sum of the squared block sizes
+# rather than n squared. Pairs scoring CRM_DEDUP_THRESHOLD or more are kept
+# in crm_dedup_pairs and joined into merge candidate clusters, which each
+# worker caches until a run bumps the kind's dedup_pairs version in
+# crm_table_versions. Writes to leads and contacts queue the record for the
+# next incremental run; full passes are for `flask dedup <kind> --full`.
+
+DEDUP_KINDS = {'leads': Lead, 'contacts': Contact}
+DEDUP_FIELDS = ('name', 'email', 'phone')
+DEDUP_INCREMENTAL_BATCH = 500  # queued records reindexed per transaction
+NAME_WORD = re.compile(r'[^\W\d_]+')
+NAME_TITLES = frozenset({'mr', 'mrs', 'ms', 'miss', 'dr', 'prof', 'sir', 'jr', 'sr', 'ii', 'iii', 'iv'})
+PHONE_EXTENSION = re.compile(r'\s*(?:x|ext\.?|extension|#)\s*\d+\s*$', re.IGNORECASE)
+NON_DIGIT = re.compile(r'\D')
+SOUNDEX_DIGITS = {letter: digit for digit, letters in (('1', 'bfpv'), ('2', 'cgjkqsxz'), ('3', 'dt'), ('4', 'l'),
+                                                      ('5', 'mn'), ('6', 'r')) for letter in letters}
+# MinHash over name trigrams, in BANDS bands of ROWS hashes: two names whose
+# trigram sets have Jaccard similarity s share a band with probability
+# 1 - (1 - s ** ROWS) ** BANDS, 0.68 at s = 0.5 and 0.93 at s = 0.7. The
+# hash functions are the 32-bit words of one BLAKE2b digest per trigram, the
+# same in every process (unlike hash()).
+MINHASH_BANDS, MINHASH_ROWS = 4, 2
+MINHASH_WORDS = struct.Struct(f'<{MINHASH_BANDS * MINHASH_ROWS}I')
+
+
+def normalize_email(email):
+    """Comparable form of an email address, or None if it is not one.
+
+    Lowercased without a +tag; for Gmail also without dots in the local part.
+    """
+    email = (email or '').strip().lower()
+    local, _, domain = email.rpartition('@')
+    local = local.split('+', 1)[0]
+    if domain in ('gmail.com', 'googlemail.com'):
+        local, domain = local.replace('.', ''), 'gmail.com'
+    return f'{local}@{domain}' if local and '.' in domain else None
+
+
+def normalize_phone(phone, country_code):
+    """E.164 form of a phone number (+14155550100), or None if it cannot be one.
+
+    Extensions are dropped; national numbers (a trunk 0, or ten digits or
+    fewer) get ``country_code``.
+    """
+    phone = PHONE_EXTENSION.sub('', (phone or '').strip())
+    digits = NON_DIGIT.sub('', phone)
+    if phone.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith('0'):
+        digits = country_code + digits[1:]
+    elif len(digits) <= 10:
+        digits = country_code + digits
+    return '+' + digits if 8 <= len(digits) <= 15 else None
+
+
+def normalize_name(name):
+    """Words of a name, lowercased, unaccented and sorted, without titles ('Smith, Dr. José' -> 'jose smith')"""
+    name = unicodedata.normalize('NFKD', (name or '').lower())
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch))
+    return ' '.join(sorted(word for word in NAME_WORD.findall(name) if word not in NAME_TITLES))
+
+
+def soundex(word):
+    """American Soundex code of a word ('robert' -> 'R163'), '' if it has no ASCII letters"""
+    letters = [ch for ch in word if 'a' <= ch <= 'z']
+    if not letters:
+        return ''
+    code, last = letters[0].upper(), SOUNDEX_DIGITS.get(letters[0], '')
+    for ch in letters[1:]:
+        digit = SOUNDEX_DIGITS.get(ch, '')
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if ch not in 'hw':
+            last = digit
+    return code.ljust(4, '0')
+
+
+def name_trigrams(name):
+    """Character trigrams of a normalized name, padded so word starts weigh more"""
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@lru_cache(maxsize=65536)
+def trigram_hashes(trigram):
+    return MINHASH_WORDS.unpack(hashlib.blake2b(trigram.encode(), digest_size=MINHASH_WORDS.size).digest())
+
+
+def minhash_bands(trigrams):
+    signature = [min(column) for column in zip(*map(trigram_hashes, trigrams))]
+    return [signature[i:i + MINHASH_ROWS] for i in range(0, len(signature), MINHASH_ROWS)]
+
+
+def blocking_keys(email, phone, name):
+    """Block ids of a normalized record, as signed 64-bit hashes of its keys.
+
+    The keys are the exact email, the last 7 digits of the phone number, the
+    Soundex codes of the first and last word of the sorted name, and the
+    MinHash bands of the name's trigrams.
+    """
+    keys = []
+    if email:
+        keys.append('email:' + email)
+    if phone:
+        keys.append('phone:' + phone[-7:])
+    words = name.split()
+    if words:
+        code = soundex(words[0]) + soundex(words[-1])
+        if code:
+            keys.append('soundex:' + code)
+        keys.extend(f'trigrams{band}:' + ':'.join(map(str, values))
+                    for band, values in enumerate(minhash_bands(name_trigrams(name))))
+    return sorted({int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=True)
+                   for key in keys})
+
+
+def dedup_index(rows, country_code):
+    """Normalized records (id, email, phone, name) and (block, id) entries for (id, name, email, phone) rows"""
+    records, blocks = [], []
+    for record_id, name, email, phone in rows:
+        email, phone, name = normalize_email(email), normalize_phone(phone, country_code), normalize_name(name)
+        records.append((record_id, email, phone, name))
+        blocks.extend((block, record_id) for block in blocking_keys(email, phone, name))
+    return records, blocks
+
+
+def dedup_score(a, b, trigrams, threshold=0.0):
+    """Similarity of two normalized records, 0 to 1.
+
+    Name trigram overlap (Jaccard) is worth up to 0.5, the same email 0.45
+    (0.2 for the same mailbox name at another domain) and the same phone
+    0.35; an email or phone both have but that differs costs 0.15. A name
+    alone never reaches the default threshold: too many people share one.
+    Names are not compared when even identical ones could not lift the score
+    to ``threshold``.
+    """
+    score = 0.0
+    if a[1] and b[1]:
+        if a[1] == b[1]:
+            score += 0.45
+        elif a[1].partition('@')[0] == b[1].partition('@')[0]:
+            score += 0.2
+        else:
+            score -= 0.15
+    if a[2] and b[2]:
+        score += 0.35 if a[2] == b[2] else -0.15
+    if a[3] and b[3] and score + 0.5 >= threshold:
+        ta, tb = trigrams(a[3]), trigrams(b[3])
+        if score + 0.5 * min(len(ta), len(tb)) / max(len(ta), len(tb)) >= threshold:
+            score += 0.5 * len(ta & tb) / len(ta | tb)
+    return min(1.0, max(0.0, score))
+
+
+def dedup_match(blocks, threshold, changed=None):
+    """Pairs (record_id, other_id, score) within blocks of normalized records scoring ``threshold`` or more,
+    and the number of pairs compared. With ``changed``, only pairs involving one of those ids are compared."""
+    cache = {}
+
+    def trigrams(name):
+        found = cache.get(name)
+        if found is None:
+            found = cache[name] = name_trigrams(name)
+        return found
+
+    seen, matches = set(), []
+    for members in blocks:
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pair = (a[0], b[0]) if a[0] < b[0] else (b[0], a[0])
+                if pair in seen or (changed is not None and a[0] not in changed and b[0] not in changed):
+                    continue
+                seen.add(pair)
+                score = dedup_score(a, b, trigrams, threshold)
+                if score >= threshold:
+                    matches.append((*pair, round(score, 3)))
+    return matches, len(seen)
+
+
+def dedup_blocks(rows, max_block):
+    """Member lists of the blocks worth comparing, from (block, record...) rows in block order: blocks of one
+    record, and of more than ``max_block``, are skipped"""
+    for _, members in itertools.groupby(rows, key=lambda row: row[0]):
+        members = list(itertools.islice(members, max_block + 1))
+        if 1 < len(members) <= max_block:
+            yield [tuple(row[1:]) for row in members]
+
+
+def dedup_block_members(kind):
+    return (db.select(DedupBlock.block, DedupRecord.record_id, DedupRecord.email, DedupRecord.phone, DedupRecord.name)
+            .join(DedupRecord, (DedupRecord.kind == DedupBlock.kind) & (DedupRecord.record_id == DedupBlock.record_id))
+            .where(DedupBlock.kind == kind).order_by(DedupBlock.block))
+
+
+DEDUP_ENGINES = {}  # per worker process
+
+
+def dedup_match_range(bounds, kind, threshold, max_block, url=None):
+    """dedup_match over the blocks with ids in [low, high) (high None: unbounded). With ``url`` (in a worker
+    process) they are read on a connection of its own, so the parent never streams them."""
+    low, high = bounds
+    statement = dedup_block_members(kind).where(DedupBlock.block >= low)
+    if high is not None:
+        statement = statement.where(DedupBlock.block < high)
+    if url is None:
+        return dedup_match(dedup_blocks(db.session.connection().execute(statement), max_block), threshold)
+    engine = DEDUP_ENGINES.get(url) or DEDUP_ENGINES.setdefault(url, create_engine(url))
+    with engine.connect() as connection:
+        return dedup_match(dedup_blocks(connection.execute(statement), max_block), threshold)
+
+
+def dedup_insert(model, kind, rows, columns):
+    if rows:
+        db.session.execute(model.__table__.insert(), [dict(zip(columns, row), kind=kind) for row in rows])
+
+
+def dedup_unindex(kind, ids):
+    """Drop the blocks, normalized records and pairs of ``ids``"""
+    blocks = DedupBlock.__table__
+    indexed = db.session.execute(db.select(DedupRecord.record_id, DedupRecord.email, DedupRecord.phone, DedupRecord.name)
+                                 .where(DedupRecord.kind == kind, DedupRecord.record_id.in_(ids))).all()
+    entries = [{'old_block': block, 'old_record': row.record_id}
+               for row in indexed for block in blocking_keys(row.email, row.phone, row.name or '')]
+    if entries:
+        db.session.execute(blocks.delete().where(blocks.c.kind == kind, blocks.c.block == db.bindparam('old_block'),
+                                                 blocks.c.record_id == db.bindparam('old_record')), entries)
+    db.session.execute(db.delete(DedupRecord).where(DedupRecord.kind == kind, DedupRecord.record_id.in_(ids)))
+    db.session.execute(db.delete(DedupPair).where(
+        DedupPair.kind == kind, db.or_(DedupPair.record_id.in_(ids), DedupPair.other_id.in_(ids))))
+
+
+def dedup_full(kind):
+    """Reindex and compare every record of ``kind`` across CRM_DEDUP_WORKERS processes; returns run statistics.
+
+    The index is committed before matching so that worker processes can read
+    it; the previous pairs stay visible until the new ones replace them.
+    """
+    model, config = DEDUP_KINDS[kind], app.config
+    workers, chunk = config['CRM_DEDUP_WORKERS'], config['CRM_DEDUP_CHUNK']
+    started = time.perf_counter()
+    for table in (DedupBlock, DedupRecord, DedupQueue):
+        db.session.execute(db.delete(table).where(table.kind == kind))
+
+    # Core rows: ORM row loading would double the parent's share of the work
+    source = db.session.connection().execute(db.select(model.id, model.name, model.email, model.phone)
+                                             .execution_options(yield_per=chunk))
+    index = partial(dedup_index, country_code=config['CRM_DEFAULT_COUNTRY_CODE'])
+    records = 0
+    for _, (normalized, blocks), _ in parallel_map(index, ([tuple(row) for row in part] for part in source.partitions()),
+                                                   workers):
+        dedup_insert(DedupRecord, kind, normalized, ('record_id', 'email', 'phone', 'name'))
+        dedup_insert(DedupBlock, kind, blocks, ('block', 'record_id'))
+        records += len(normalized)
+    db.session.commit()
+    indexed = time.perf_counter()
+
+    # Block ids are uniform hashes, so equal slices of the id space hold about
+    # equally many blocks; a pair sharing blocks in two slices is found twice.
+    slices = max(workers * 4, records // chunk, 1)
+    edges = [-2 ** 63 + (2 ** 64 * i) // slices for i in range(slices)] + [None]
+    match = partial(dedup_match_range, kind=kind, threshold=config['CRM_DEDUP_THRESHOLD'],
+                    max_block=config['CRM_DEDUP_MAX_BLOCK'],
+                    url=db.engine.url.render_as_string(hide_password=False) if workers > 1 else None)
+    pairs, compared = {}, 0
+    for _, (matches, count), _ in parallel_map(match, zip(edges, edges[1:]), workers):
+        compared += count
+        pairs.update(((record_id, other_id), score) for record_id, other_id, score in matches)
+    db.session.execute(db.delete(DedupPair).where(DedupPair.kind == kind))
+    dedup_insert(DedupPair, kind, [(*pair, score) for pair, score in pairs.items()], ('record_id', 'other_id', 'score'))
+    increment_table_versions(db.session.connection(), [dedup_pairs_version(kind)])
+    db.session.commit()
+    return {'records': records, 'compared': compared, 'pairs': len(pairs),
+            'index_seconds': round(indexed - started, 2), 'match_seconds': round(time.perf_counter() - indexed, 2)}
+
+
+def dedup_incremental(kind):
+    """Reindex the queued records of ``kind`` and compare them with their blocks; returns run statistics"""
+    model, config = DEDUP_KINDS[kind], app.config
+    max_block = config['CRM_DEDUP_MAX_BLOCK']
+    started = time.perf_counter()
+    queued = db.session.execute(db.select(DedupQueue.record_id).where(DedupQueue.kind == kind)).scalars().all()
+    records = compared = pairs = 0
+    for start in range(0, len(queued), DEDUP_INCREMENTAL_BATCH):
+        ids = queued[start:start + DEDUP_INCREMENTAL_BATCH]
+        dedup_unindex(kind, ids)
+        rows = db.session.execute(db.select(model.id, model.name, model.email, model.phone).where(model.id.in_(ids)))
+        normalized, blocks = dedup_index([tuple(row) for row in rows], config['CRM_DEFAULT_COUNTRY_CODE'])
+        dedup_insert(DedupRecord, kind, normalized, ('record_id', 'email', 'phone', 'name'))
+        dedup_insert(DedupBlock, kind, blocks, ('block', 'record_id'))
+
+        small = (db.select(DedupBlock.block)
+                 .where(DedupBlock.kind == kind, DedupBlock.block.in_({block for block, _ in blocks}))
+                 .group_by(DedupBlock.block).having(db.func.count().between(2, max_block)))
+        members = db.session.execute(dedup_block_members(kind).where(DedupBlock.block.in_(small)))
+        matches, count = dedup_match(dedup_blocks(members, max_block), config['CRM_DEDUP_THRESHOLD'], changed=set(ids))
+        dedup_insert(DedupPair, kind, matches, ('record_id', 'other_id', 'score'))
+        db.session.execute(db.delete(DedupQueue).where(DedupQueue.kind == kind, DedupQueue.record_id.in_(ids)))
+        increment_table_versions(db.session.connection(), [dedup_pairs_version(kind)])
+        db.session.commit()
+        records, compared, pairs = records + len(normalized), compared + count, pairs + len(matches)
+    return {'records': records, 'compared': compared, 'pairs': pairs,
+            'seconds': round(time.perf_counter() - started, 2)}
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_dedup_changes(session, flush_context):
+    changes = session.info.setdefault('dedup_changes', set())
+    kinds = {model: kind for kind, model in DEDUP_KINDS.items()}
+    for obj in itertools.chain(session.new, session.deleted):
+        if type(obj) in kinds:
+            changes.add((kinds[type(obj)], obj.id))
+    for obj in session.dirty:
+        if type(obj) in kinds and any(db.inspect(obj).attrs[field].history.has_changes() for field in DEDUP_FIELDS):
+            changes.add((kinds[type(obj)], obj.id))
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def queue_dedup_changes(session, flush_context):
+    changes = session.info.pop('dedup_changes', None)
+    if changes:
+        connection = session.connection()
+        dialect_insert = postgresql_insert if connection.dialect.name == 'postgresql' else sqlite_insert
+        connection.execute(dialect_insert(DedupQueue.__table__).on_conflict_do_nothing(),
+                           [{'kind': kind, 'record_id': record_id} for kind, record_id in changes])
+
+
+class UnionFind:
+    """Disjoint sets of hashable items, with union by size and path halving"""
+
+    def __init__(self):
+        self.parent, self.size = {}, {}
+
+    def find(self, item):
+        parent = self.parent
+        if item not in parent:
+            parent[item], self.size[item] = item, 1
+            return item
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            if self.size[a] < self.size[b]:
+                a, b = b, a
+            self.parent[b] = a
+            self.size[a] += self.size[b]
+        return a
+
+    def groups(self):
+        """{root: [items]} of every set"""
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return groups
+
+
+def dedup_pairs_version(kind):
+    """crm_table_versions name bumped whenever the pairs of ``kind`` change"""
+    return f'dedup_pairs:{kind}'
+
+
+def dedup_cluster_list(kind):
+    """[(sorted member ids, best score)] of ``kind``, largest first, cached per worker until the pairs change"""
+    versions = tuple(db.session.execute(db.select(TableVersion.version)
+                                        .where(TableVersion.name == dedup_pairs_version(kind))).scalars())
+    clusters = dedup_cluster_cache.get(kind, versions)
+    if clusters is None:
+        pairs = db.session.execute(db.select(DedupPair.record_id, DedupPair.other_id, DedupPair.score)
+                                   .where(DedupPair.kind == kind)).all()
+        sets = UnionFind()
+        for record_id, other_id, _ in pairs:
+            sets.union(record_id, other_id)
+        best = {}
+        for record_id, _, score in pairs:
+            root = sets.find(record_id)
+            best[root] = max(best.get(root, 0), score)
+        clusters = sorted(((sorted(members), best[root]) for root, members in sets.groups().items()),
+                          key=lambda cluster: (-len(cluster[0]), -cluster[1], cluster[0][0]))
+        dedup_cluster_cache.put(kind, versions, clusters)
+    return clusters
+
+
+dedup_cluster_cache = AnalyticsCache()
+
+
+@app.route('/api/crm/dedup/<kind>/run', methods=['POST'])
+@role_required(['admin', 'manager'])
+def run_dedup(kind):
+    """Incremental run over the queued records; a full pass is too long for a request and runs from the CLI"""
+    if kind not in DEDUP_KINDS:
+        return jsonify({'error': 'kind must be leads or contacts'}), 404
+    mode = (request.get_json(silent=True) or {}).get('mode', 'incremental')
+    if mode != 'incremental':
+        return jsonify({'error': f'mode must be incremental; run full passes with `flask dedup {kind} --full`'}), 400
+    stats = dedup_incremental(kind)
+    return jsonify({'kind': kind, 'mode': mode, **stats}), 200
+
+
+@app.route('/api/crm/dedup/<kind>/clusters', methods=['GET'])
+@role_required(['admin', 'manager'])
+def dedup_clusters(kind):
+    model = DEDUP_KINDS.get(kind)
+    if model is None:
+        return jsonify({'error': 'kind must be leads or contacts'}), 404
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    clusters = dedup_cluster_list(kind)
+    shown = clusters[(page - 1) * per_page:page * per_page]
+    found = {r.id: r for r in model.query.filter(model.id.in_([i for members, _ in shown for i in members]))}
     return jsonify({
-        'total_leads': total_leads,
-        'total_contacts': total_contacts,
-        'total_deals': total_deals,
-        'open_deals': open_deals,
-        'closed_deals': closed_deals,
-        'pipeline': pipeline
+        'clusters': [{'size': len(members), 'score': score,
+                      'records': [found[i].to_dict() for i in members if i in found]} for members, score in shown],
+        'current_page': page,
+        'pages': -(-len(clusters) // per_page),
+        'total': len(clusters)
     }), 200
 
 
+@app.cli.command('dedup')
+@click.argument('kind', type=click.Choice(sorted(DEDUP_KINDS)))
+@click.option('--full', is_flag=True, help='Reindex every record rather than the queued ones')
+def dedup_command(kind, full):
+    """Find likely duplicate leads or contacts"""
+    stats = dedup_full(kind) if full else dedup_incremental(kind)
+    print(', '.join(f'{name}={value}' for name, value in stats.items()))
+
+
 # ==================== Health Check ====================
 
 @app.route('/api/health', methods=['GET'])
@@ -2,7 +2,9 @@ import sys, os
 sys.path.insert(0, os.path.dirname(__file__))
 
 import pytest
-from app import app, db, User, Module
+from datetime import datetime
+from sqlalchemy import event
+from app import app, db, User, Module, Deal, Lead, analytics_cache, dedup_cluster_cache, table_versions, dedup_full, normalize_email, normalize_name, normalize_phone, soundex
 
 @pytest.fixture
 def client():
@@ -11,6 +13,7 @@ def client():
     
     with app.app_context():
         db.create_all()
+        dedup_cluster_cache.clear()
         yield app.test_client()
         db.session.remove()
         db.drop_all()
@@ -41,3 +44,149 @@ def test_health_check(client):
     response = client.get('/api/health')
     assert response.status_code == 200
     assert response.json['status'] == 'healthy'
+
+def auth_headers(client, role='admin'):
+    response = client.post('/api/auth/register', json={
+        'username': f'{role}user',
+        'email': f'{role}@example.com',
+        'password': 'password123',
+        'role': role
+    })
+    return {'Authorization': f"Bearer {response.json['access_token']}"}
+
+def test_dedup_normalization():
+    assert normalize_email(' J.Doe+news@GoogleMail.com ') == 'jdoe@gmail.com'
+    assert normalize_email('jane.doe+x@example.com') == 'jane.doe@example.com'
+    assert normalize_email('not an address') is None
+    assert normalize_phone('(415) 555-0100 ext. 12', '1') == '+14155550100'
+    assert normalize_phone('+44 20 7946 0958', '1') == normalize_phone('0044 20 7946 0958', '1') == '+442079460958'
+    assert normalize_phone('020 7946 0958', '44') == '+442079460958'
+    assert normalize_phone('12', '1') is None
+    assert normalize_name('Smith, Dr. José') == normalize_name('jose SMITH') == 'jose smith'
+    assert soundex('robert') == soundex('rupert') == 'R163'
+    assert soundex('ashcraft') == 'A261'
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_dedup_full_run_clusters_duplicates(client, monkeypatch, workers):
+    monkeypatch.setitem(app.config, 'CRM_DEDUP_WORKERS', workers)
+    headers = auth_headers(client)
+    db.session.add_all([
+        Lead(name='John Smith', email='john.smith@example.com', phone='415-555-0100'),
+        Lead(name='Smith, John', email='John.Smith+web@Example.com'),
+        Lead(name='Jon Smith', phone='+1 (415) 555 0100'),
+        Lead(name='Maria Garcia', email='maria@example.org', phone='212 555 0199'),
+        Lead(name='Maria Garcia', email='mgarcia@other.org', phone='305 555 0142'),
+        Lead(name='Wei Chen', email='wei@example.net'),
+    ])
+    db.session.commit()
+
+    # Full passes are too long for a request: the CLI runs them
+    assert client.post('/api/crm/dedup/leads/run', headers=headers, json={'mode': 'full'}).status_code == 400
+    assert dedup_full('leads')['records'] == 6
+
+    response = client.get('/api/crm/dedup/leads/clusters', headers=headers)
+    assert response.status_code == 200
+    assert response.json['total'] == 1
+    cluster = response.json['clusters'][0]
+    assert sorted(r['name'] for r in cluster['records']) == ['John Smith', 'Jon Smith', 'Smith, John']
+
+def test_dedup_incremental_run_checks_changed_records(client, statements):
+    headers = auth_headers(client)
+    db.session.add_all([Lead(name='Ada Lovelace', email='ada@example.com'), Lead(name='Alan Turing')])
+    db.session.commit()
+    dedup_full('leads')
+    assert client.get('/api/crm/dedup/leads/clusters', headers=headers).json['total'] == 0
+
+    created = client.post('/api/leads', headers=headers, json={'name': 'Ada Lovelace', 'email': 'ADA@example.com'})
+    response = client.post('/api/crm/dedup/leads/run', headers=headers)
+    assert response.json['mode'] == 'incremental'
+    assert response.json['records'] == 1
+    assert response.json['pairs'] == 1
+    assert client.get('/api/crm/dedup/leads/clusters', headers=headers).json['total'] == 1
+    statements.clear()
+    assert client.get('/api/crm/dedup/leads/clusters', headers=headers).json['total'] == 1
+    assert not any('crm_dedup_pairs' in statement for statement in statements)  # clusters cached until the next run
+
+    client.put(f"/api/leads/{created.json['id']}", headers=headers, json={'name': 'Grace Hopper', 'email': 'grace@example.com'})
+    assert client.post('/api/crm/dedup/leads/run', headers=headers).json['pairs'] == 0
+    assert client.get('/api/crm/dedup/leads/clusters', headers=headers).json['total'] == 0
+    assert client.post('/api/crm/dedup/leads/run', headers=headers).json['records'] == 0
+
+@pytest.fixture
+def statements(client):
+    seen = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+def test_crm_analytics_amounts_and_filters(client):
+    analytics_cache.clear()
+    headers = auth_headers(client)
+    db.session.add(User(username='seller', email='seller@example.com', password='x', role='user'))
+    db.session.commit()
+    for title, amount, stage, owner in (('A', '100.50', 'prospect', 1), ('B', '200', 'prospect', 2),
+                                        ('C', '300', 'proposal', 1), ('D', '50', 'proposal', 2)):
+        client.post('/api/deals', headers=headers, json={'title': title, 'amount': amount, 'stage': stage, 'owner_id': owner})
+    client.put('/api/deals/3', headers=headers, json={'status': 'closed'})
+    client.put('/api/deals/4', headers=headers, json={'status': 'lost'})
+    client.post('/api/leads', headers=headers, json={'name': 'Lead'})
+    db.session.get(Deal, 1).created_at = datetime(2024, 3, 15, 12)
+    db.session.commit()
+
+    body = client.get('/api/crm/analytics').json
+    assert (body['total_leads'], body['total_contacts'], body['total_deals']) == (1, 0, 4)
+    assert (body['total_amount'], body['open_amount'], body['closed_amount']) == ('650.50', '300.50', '300.00')
+    assert (body['open_deals'], body['closed_deals']) == (2, 1)
+    assert body['by_status'] == [{'status': 'closed', 'count': 1, 'amount': '300.00'},
+                                 {'status': 'lost', 'count': 1, 'amount': '50.00'},
+                                 {'status': 'open', 'count': 2, 'amount': '300.50'}]
+    assert body['pipeline'][0] == {'stage': 'proposal', 'count': 2, 'amount': '350.00',
+                                   'by_status': {'closed': {'count': 1, 'amount': '300.00'},
+                                                 'lost': {'count': 1, 'amount': '50.00'}}}
+
+    body = client.get('/api/crm/analytics?from=2024-03-01&to=2024-03-15').json
+    assert (body['total_deals'], body['total_amount'], body['total_leads']) == (1, '100.50', 0)
+    assert client.get('/api/crm/analytics?from=2024-03-16').json['total_deals'] == 3
+    body = client.get('/api/crm/analytics?owner_id=2').json
+    assert (body['total_deals'], body['total_amount']) == (2, '250.00')
+    assert client.get('/api/crm/analytics?from=March').status_code == 400
+    assert client.get('/api/crm/analytics?owner_id=me').status_code == 400
+
+def test_deal_owner_must_be_a_user(client):
+    headers = auth_headers(client)
+    for owner in ('1', 99, True):
+        response = client.post('/api/deals', headers=headers, json={'title': 'A', 'owner_id': owner})
+        assert response.status_code == 400
+    deal = client.post('/api/deals', headers=headers, json={'title': 'A'}).json
+    assert deal['owner_id'] == 1
+    assert client.put(f"/api/deals/{deal['id']}", headers=headers, json={'owner_id': 99}).status_code == 400
+    assert client.put(f"/api/deals/{deal['id']}", headers=headers, json={'owner_id': 'me'}).status_code == 400
+    assert client.put(f"/api/deals/{deal['id']}", headers=headers, json={'owner_id': None}).json['owner_id'] is None
+
+def test_crm_analytics_cached_until_a_write(client, statements):
+    analytics_cache.clear()
+    headers = auth_headers(client)
+    client.post('/api/deals', headers=headers, json={'title': 'A', 'amount': '10'})
+
+    statements.clear()
+    assert client.get('/api/crm/analytics').json['total_deals'] == 1
+    assert len(statements) == 2  # table versions, then every figure in one query
+    statements.clear()
+    assert client.get('/api/crm/analytics').json['total_deals'] == 1
+    assert len(statements) == 1
+
+    client.post('/api/leads', headers=headers, json={'name': 'Lead'})
+    assert client.get('/api/crm/analytics').json['total_leads'] == 1
+    client.put('/api/deals/1', headers=headers, json={'amount': '25'})
+    assert client.get('/api/crm/analytics').json['total_amount'] == '25.00'
+    client.delete('/api/deals/1', headers=headers)
+    assert client.get('/api/crm/analytics').json['total_deals'] == 0
+
+    # Versions are bumped after the write commits, and a rolled back write bumps nothing
+    versions = table_versions()
+    db.session.add(Lead(name='Never'))
+    db.session.flush()
+    db.session.rollback()
+    assert table_versions() == versions
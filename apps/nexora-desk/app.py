@@ -247,6 +247,10 @@ class SupportTicket(db.Model):
 
     category = db.relationship('TicketCategory')
 
+    __table_args__ = (
+        db.Index('ix_support_tickets_queue', 'status', 'category_id', 'assigned_to', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -70,6 +70,10 @@ class ExpenseReport(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.now())
     attachments = db.relationship('Attachment', backref='expense', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_expense_reports_status_category', 'status', 'category_id'),
+    )
+
 
 class Attachment(db.Model):
     __tablename__ = 'expense_attachments'
@@ -1,10 +1,32 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from functools import wraps
+from functools import wraps, partial
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import os
-from datetime import timedelta, datetime
-from decimal import Decimal
+import io
+import csv
+import json
+import sys
+import time
+import threading
+from datetime import timedelta, datetime, date
+from decimal import Decimal, InvalidOperation
+from concurrent.futures import ProcessPoolExecutor
+import math
+import click
+import numpy as np
+
+# Add parent directory to path for imports
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APPS_DIR = os.path.abspath(os.path.join(BASE_DIR, '..'))
+COMMON_DIR = os.path.abspath(os.path.join(APPS_DIR, '..', 'common'))
+sys.path.insert(0, COMMON_DIR)
+
+from utils.pricing_guard import pricing_guard
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -14,6 +36,12 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///app
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET', 'dev-secret-key-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+app.config['BULK_CHUNK_SIZE'] = int(os.getenv('BULK_CHUNK_SIZE', '1000'))
+app.config['FULFILL_BATCH_LIMIT'] = int(os.getenv('FULFILL_BATCH_LIMIT', '1000'))
+app.config['FEFO_PAGE_SIZE'] = int(os.getenv('FEFO_PAGE_SIZE', '50'))
+app.config['SKU_INDEX_POLL_SECONDS'] = float(os.getenv('SKU_INDEX_POLL_SECONDS', '1'))
+app.config['SKU_INDEX_RELOAD_SECONDS'] = float(os.getenv('SKU_INDEX_RELOAD_SECONDS', '300'))
+app.config['SKU_LOOKUP_LIMIT'] = int(os.getenv('SKU_LOOKUP_LIMIT', '500'))
 
 # Initialize extensions
 db = SQLAlchemy(app)
@@ -64,7 +92,7 @@ class Item(db.Model):
     sku = db.Column(db.String(50), unique=True, nullable=False)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
-    category = db.Column(db.String(100))
+    category = db.Column(db.String(100), index=True)
     unit_price = db.Column(db.Numeric(12, 2), nullable=False)
     reorder_level = db.Column(db.Integer, default=10)
     reorder_quantity = db.Column(db.Integer, default=50)
@@ -75,6 +103,11 @@ class Item(db.Model):
     batches = db.relationship('StockBatch', backref='item', lazy=True, cascade='all, delete-orphan')
     alerts = db.relationship('StockAlert', backref='item', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # SKU index refresh polls for rows changed since its watermark
+        db.Index('ix_inventory_items_updated_at', 'updated_at'),
+    )
+
 
 class StockBatch(db.Model):
     __tablename__ = 'stock_batches'
@@ -91,6 +124,90 @@ class StockBatch(db.Model):
     received_date = db.Column(db.DateTime, default=db.func.now())
     created_at = db.Column(db.DateTime, default=db.func.now())
 
+    __table_args__ = (
+        # FEFO allocation: equality on item/warehouse/status, range scan on expiry
+        db.Index('ix_stock_batches_fefo', 'item_id', 'warehouse_id', 'status', 'expiry_date'),
+    )
+
+
+class BatchAllocation(db.Model):
+    __tablename__ = 'batch_allocations'
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('stock_batches.id'), nullable=False, index=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id'), nullable=False)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=False)
+    sale_order_id = db.Column(db.Integer, db.ForeignKey('sale_orders.id'), index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    batch = db.relationship('StockBatch')
+
+
+class MovementRollup(db.Model):
+    """Daily received/fulfilled totals per item and warehouse, kept current at commit time"""
+    __tablename__ = 'inventory_movement_rollups'
+    id = db.Column(db.Integer, primary_key=True)
+    bucket_date = db.Column(db.Date, nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id'), nullable=False)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=False)
+    category = db.Column(db.String(100))
+    received_orders = db.Column(db.Integer, nullable=False, default=0)
+    received_quantity = db.Column(db.Integer, nullable=False, default=0)
+    received_cost = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    fulfilled_orders = db.Column(db.Integer, nullable=False, default=0)
+    fulfilled_quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('bucket_date', 'item_id', 'warehouse_id', name='uq_movement_rollups_bucket'),
+    )
+
+
+class StockMovement(db.Model):
+    """Append-only ledger of every change to Item.current_stock"""
+    __tablename__ = 'stock_movements'
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id'), nullable=False)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'))
+    quantity = db.Column(db.Integer, nullable=False)  # signed delta
+    movement_type = db.Column(db.String(20), nullable=False)  # opening, batch, fulfill, adjust, allocate, release
+    reference = db.Column(db.String(100))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+
+    __table_args__ = (
+        db.Index('ix_stock_movements_item', 'item_id', 'id'),
+    )
+
+
+class StockSnapshot(db.Model):
+    """Ledger balance of an item up to and including last_movement_id"""
+    __tablename__ = 'stock_snapshots'
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    last_movement_id = db.Column(db.Integer, nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+
+    __table_args__ = (
+        db.Index('ix_stock_snapshots_item', 'item_id', 'taken_at'),
+    )
+
+
+class ReorderSuggestion(db.Model):
+    """Latest forecast-driven reorder point for an item, pending staff review"""
+    __tablename__ = 'reorder_suggestions'
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('inventory_items.id'), nullable=False, unique=True)
+    method = db.Column(db.String(20), nullable=False)  # ses, croston
+    daily_demand = db.Column(db.Float, nullable=False)
+    reorder_level = db.Column(db.Integer, nullable=False)
+    reorder_quantity = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+
+
+MOVEMENT_MEASURES = ('received_orders', 'received_quantity', 'received_cost',
+                     'fulfilled_orders', 'fulfilled_quantity', 'revenue')
+
 
 class PurchaseOrder(db.Model):
     __tablename__ = 'purchase_orders'
@@ -101,7 +218,7 @@ class PurchaseOrder(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     unit_cost = db.Column(db.Numeric(12, 2), nullable=False)
     total_cost = db.Column(db.Numeric(12, 2), nullable=False)
-    status = db.Column(db.String(50), default='pending')  # pending, received, cancelled
+    status = db.Column(db.String(50), default='pending')  # draft, pending, received, cancelled
     warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'))
     order_date = db.Column(db.DateTime, default=db.func.now())
     expected_delivery = db.Column(db.DateTime)
@@ -143,6 +260,11 @@ class StockAlert(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.now())
     resolved_at = db.Column(db.DateTime)
 
+    __table_args__ = (
+        # check_alerts looks for an open alert of a type per item
+        db.Index('ix_stock_alerts_item_type', 'item_id', 'alert_type', 'is_resolved'),
+    )
+
 # ==================== Role-based decorator ====================
 
 def role_required(roles):
@@ -398,6 +520,143 @@ def update_item(item_id):
         'unit_price': float(item.unit_price)
     }), 200
 
+# ==================== SKU Lookup Index ====================
+
+class SkuIndex:
+    """Per-worker map of sku -> (id, name, unit_price, current_stock, warehouse_id).
+
+    Loaded in one query on first use. Commits from this worker that write
+    inventory_items mark it stale through session events, so the next lookup
+    re-reads changed rows. Commits from other workers are picked up by polling
+    updated_at every SKU_INDEX_POLL_SECONDS, and a full reload every
+    SKU_INDEX_RELOAD_SECONDS bounds any drift.
+    """
+    
+    # Poll window overlap, so rows committed late with an older updated_at are still seen
+    LAG = timedelta(seconds=5)
+    
+    def __init__(self):
+        self.entries = {}
+        self.watermark = None
+        self.loaded_at = 0
+        self.polled_at = 0
+        self.stale = True
+        self.lock = threading.Lock()
+    
+    def columns(self):
+        return db.session.query(
+            Item.sku, Item.id, Item.name, Item.unit_price, Item.current_stock,
+            Item.warehouse_id, Item.updated_at
+        )
+    
+    def apply(self, rows):
+        for sku, item_id, name, unit_price, current_stock, warehouse_id, updated_at in rows:
+            self.entries[sku] = (item_id, name, float(unit_price), current_stock, warehouse_id)
+            if updated_at and (self.watermark is None or updated_at > self.watermark):
+                self.watermark = updated_at
+    
+    def reload(self):
+        self.entries = {}
+        self.watermark = None
+        self.apply(self.columns())
+        self.loaded_at = self.polled_at = time.monotonic()
+    
+    def poll(self):
+        query = self.columns()
+        if self.watermark is not None:
+            query = query.filter(Item.updated_at >= self.watermark - self.LAG)
+        self.apply(query)
+        self.polled_at = time.monotonic()
+    
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if not self.loaded_at or now - self.loaded_at >= app.config['SKU_INDEX_RELOAD_SECONDS']:
+            self.reload()
+        elif self.stale or now - self.polled_at >= app.config['SKU_INDEX_POLL_SECONDS']:
+            self.poll()
+        self.stale = False
+    
+    def lookup(self, skus):
+        with self.lock:
+            self.ensure_fresh()
+            return {sku: self.entries[sku] for sku in skus if sku in self.entries}
+    
+    def invalidate(self):
+        self.stale = True
+    
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.watermark = None
+            self.loaded_at = 0
+
+
+sku_index = SkuIndex()
+
+@event.listens_for(db.session, 'after_flush')
+def track_item_flush(session, flush_context):
+    if any(isinstance(obj, Item) for obj in list(session.new) + list(session.dirty)):
+        session.info['items_changed'] = True
+
+@event.listens_for(db.session, 'do_orm_execute')
+def track_item_statements(execute_state):
+    statement = execute_state.statement
+    table = getattr(statement, 'table', None)
+    if (execute_state.is_insert or execute_state.is_update) and getattr(table, 'name', None) == Item.__tablename__:
+        execute_state.session.info['items_changed'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def publish_item_changes(session):
+    if session.info.pop('items_changed', False):
+        sku_index.invalidate()
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_item_changes(session):
+    session.info.pop('items_changed', None)
+
+def sku_entry(sku, entry):
+    item_id, name, unit_price, current_stock, warehouse_id = entry
+    return {
+        'id': item_id,
+        'sku': sku,
+        'name': name,
+        'unit_price': unit_price,
+        'current_stock': current_stock,
+        'warehouse_id': warehouse_id
+    }
+
+@app.route('/api/items/lookup', methods=['GET'])
+@jwt_required()
+def lookup_item():
+    """Resolve a scanned SKU from the worker's in-memory index"""
+    sku = request.args.get('sku')
+    if not sku:
+        return jsonify({'error': 'sku is required'}), 400
+    
+    entry = sku_index.lookup([sku]).get(sku)
+    if not entry:
+        return jsonify({'error': 'Item not found'}), 404
+    
+    return jsonify(sku_entry(sku, entry)), 200
+
+@app.route('/api/items/lookup', methods=['POST'])
+@jwt_required()
+def lookup_items():
+    """Resolve many SKUs in one call"""
+    data = request.get_json() or {}
+    skus = data.get('skus')
+    
+    if not isinstance(skus, list) or not all(isinstance(sku, str) for sku in skus):
+        return jsonify({'error': 'skus must be a list of strings'}), 400
+    if len(skus) > app.config['SKU_LOOKUP_LIMIT']:
+        return jsonify({'error': f"At most {app.config['SKU_LOOKUP_LIMIT']} SKUs per lookup"}), 400
+    
+    found = sku_index.lookup(skus)
+    return jsonify({
+        'items': [sku_entry(sku, found[sku]) for sku in skus if sku in found],
+        'missing': [sku for sku in skus if sku not in found]
+    }), 200
+
 # ==================== Stock Batch Endpoints ====================
 
 @app.route('/api/batches', methods=['GET'])
@@ -456,12 +715,18 @@ def create_batch():
         location_rack=data.get('location_rack')
     )
     
+    db.session.add(batch)
+    
     # Update item's current stock
-    item = Item.query.get(data['item_id'])
-    if item:
-        item.current_stock += data['quantity']
+    if increment_stock(data['item_id'], data['quantity']):
+        record_stock_movements([{
+            'item_id': data['item_id'],
+            'warehouse_id': data['warehouse_id'],
+            'quantity': data['quantity'],
+            'movement_type': 'batch',
+            'reference': data['batch_number']
+        }])
     
-    db.session.add(batch)
     db.session.commit()
     
     return jsonify({
@@ -470,6 +735,229 @@ def create_batch():
         'quantity': batch.quantity
     }), 201
 
+# ==================== Bulk Import Endpoints ====================
+
+def iter_bulk_rows():
+    """Yield (row_number, row) pairs from a CSV or NDJSON request body without buffering it"""
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    if request.mimetype == 'text/csv':
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, row
+        return
+
+    row_number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row_number, row
+
+def iter_chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def bulk_field(row, field, cast=str, required=False):
+    """Read a field from an import row, treating blank CSV cells as missing"""
+    value = row.get(field)
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == '':
+        if required:
+            raise ValueError(f'{field} is required')
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError, InvalidOperation):
+        raise ValueError(f'Invalid value for {field}')
+
+def bulk_date(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+def parse_item_row(row):
+    if not isinstance(row, dict):
+        raise ValueError('Malformed row')
+    values = {
+        'sku': bulk_field(row, 'sku', required=True),
+        'name': bulk_field(row, 'name', required=True),
+        'unit_price': bulk_field(row, 'unit_price', Decimal, required=True),
+    }
+    for field, cast in (('description', str), ('category', str), ('reorder_level', int),
+                        ('reorder_quantity', int), ('warehouse_id', int)):
+        value = bulk_field(row, field, cast)
+        if value is not None:
+            values[field] = value
+    return values
+
+def parse_batch_row(row):
+    if not isinstance(row, dict):
+        raise ValueError('Malformed row')
+    values = {
+        'batch_number': bulk_field(row, 'batch_number', required=True),
+        'item_id': bulk_field(row, 'item_id', int),
+        'sku': bulk_field(row, 'sku'),
+        'warehouse_id': bulk_field(row, 'warehouse_id', int, required=True),
+        'quantity': bulk_field(row, 'quantity', int, required=True),
+        'unit_cost': bulk_field(row, 'unit_cost', Decimal, required=True),
+    }
+    if values['item_id'] is None and values['sku'] is None:
+        raise ValueError('item_id or sku is required')
+    if values['quantity'] < 0:
+        raise ValueError('quantity must not be negative')
+    for field, cast in (('manufacture_date', bulk_date), ('expiry_date', bulk_date),
+                        ('location_rack', str)):
+        value = bulk_field(row, field, cast)
+        if value is not None:
+            values[field] = value
+    return values
+
+def validate_chunk(chunk, parse, key, report):
+    """Parse a chunk of rows, recording errors and dropping duplicate keys within the chunk"""
+    valid = []
+    seen = set()
+    for row_number, row in chunk:
+        try:
+            values = parse(row)
+        except ValueError as e:
+            report['errors'].append({'row': row_number, 'error': str(e)})
+            continue
+        if values[key] in seen:
+            report['errors'].append({'row': row_number, 'error': f'Duplicate {key} in upload'})
+            continue
+        seen.add(values[key])
+        valid.append((row_number, values))
+    return valid
+
+def upsert_item_chunk(valid, report):
+    skus = [values['sku'] for _, values in valid]
+    existing = dict(db.session.query(Item.sku, Item.id).filter(Item.sku.in_(skus)).all())
+
+    inserts = [values for _, values in valid if values['sku'] not in existing]
+    updates = [dict(values, id=existing[values['sku']]) for _, values in valid if values['sku'] in existing]
+    if inserts:
+        db.session.execute(db.insert(Item), inserts)
+    if updates:
+        db.session.execute(db.update(Item), updates)
+
+    report['created'] += len(inserts)
+    report['updated'] += len(updates)
+
+def upsert_batch_chunk(valid, report):
+    batch_numbers = [values['batch_number'] for _, values in valid]
+    existing = {
+        b.batch_number: b for b in db.session.query(
+            StockBatch.batch_number, StockBatch.id, StockBatch.item_id, StockBatch.quantity
+        ).filter(StockBatch.batch_number.in_(batch_numbers))
+    }
+    item_ids = {values['item_id'] for _, values in valid if values['item_id'] is not None}
+    skus = {values['sku'] for _, values in valid if values['sku'] is not None}
+    known_ids = set()
+    ids_by_sku = {}
+    for item_id, sku in db.session.query(Item.id, Item.sku).filter(
+        db.or_(Item.id.in_(item_ids), Item.sku.in_(skus))
+    ):
+        known_ids.add(item_id)
+        ids_by_sku[sku] = item_id
+
+    inserts = []
+    updates = []
+    stock_deltas = {}
+    movements = []
+    for row_number, values in valid:
+        sku = values.pop('sku')
+        item_id = values['item_id'] if values['item_id'] is not None else ids_by_sku.get(sku)
+        if item_id not in known_ids:
+            report['errors'].append({'row': row_number, 'error': 'Item not found'})
+            continue
+        values['item_id'] = item_id
+
+        current = existing.get(values['batch_number'])
+        if current is None:
+            inserts.append(values)
+            delta = values['quantity']
+        elif current.item_id != item_id:
+            report['errors'].append({'row': row_number, 'error': 'Batch number belongs to a different item'})
+            continue
+        else:
+            updates.append(dict(values, id=current.id))
+            delta = values['quantity'] - current.quantity
+        if delta:
+            stock_deltas[item_id] = stock_deltas.get(item_id, 0) + delta
+            movements.append({
+                'item_id': item_id,
+                'warehouse_id': values['warehouse_id'],
+                'quantity': delta,
+                'movement_type': 'batch',
+                'reference': values['batch_number']
+            })
+
+    if inserts:
+        db.session.execute(db.insert(StockBatch), inserts)
+    if updates:
+        db.session.execute(db.update(StockBatch), updates)
+    if stock_deltas:
+        items = Item.__table__
+        db.session.execute(
+            items.update()
+            .where(items.c.id == db.bindparam('b_item_id'))
+            .values(current_stock=items.c.current_stock + db.bindparam('b_delta')),
+            [{'b_item_id': item_id, 'b_delta': delta} for item_id, delta in stock_deltas.items()]
+        )
+        record_stock_movements(movements)
+
+    report['created'] += len(inserts)
+    report['updated'] += len(updates)
+
+def run_bulk_import(parse, key, upsert):
+    if request.mimetype not in ('text/csv', 'application/x-ndjson', 'application/jsonl'):
+        return jsonify({'error': 'Body must be text/csv or application/x-ndjson'}), 415
+
+    report = {'processed': 0, 'created': 0, 'updated': 0, 'errors': []}
+    for chunk in iter_chunks(iter_bulk_rows(), app.config['BULK_CHUNK_SIZE']):
+        report['processed'] += len(chunk)
+        valid = validate_chunk(chunk, parse, key, report)
+        if not valid:
+            continue
+        snapshot = (report['created'], report['updated'], len(report['errors']))
+        try:
+            upsert(valid, report)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            report['created'], report['updated'] = snapshot[:2]
+            del report['errors'][snapshot[2]:]
+            report['errors'].extend(
+                {'row': row_number, 'error': 'Conflicting write, row not imported'}
+                for row_number, _ in valid
+            )
+
+    report['errors'].sort(key=lambda e: e['row'])
+    report['failed'] = len(report['errors'])
+    return jsonify(report), 200
+
+@app.route('/api/items/bulk', methods=['POST'])
+@role_required(['admin', 'manager'])
+@pricing_guard(feature='bulk_operations')
+def bulk_import_items():
+    """Upsert items by SKU from a streamed CSV or NDJSON body"""
+    return run_bulk_import(parse_item_row, 'sku', upsert_item_chunk)
+
+@app.route('/api/batches/bulk', methods=['POST'])
+@role_required(['admin', 'manager'])
+@pricing_guard(feature='bulk_operations')
+def bulk_import_batches():
+    """Upsert stock batches by batch number from a streamed CSV or NDJSON body"""
+    return run_bulk_import(parse_batch_row, 'batch_number', upsert_batch_chunk)
+
 # ==================== Purchase Order Endpoints ====================
 
 @app.route('/api/purchase-orders', methods=['GET'])
@@ -548,9 +1036,23 @@ def receive_purchase_order(po_id):
     if not po:
         return jsonify({'error': 'Purchase order not found'}), 404
     
+    if po.status == 'received':
+        return jsonify({'error': 'Purchase order already received'}), 400
+    
     po.status = 'received'
     po.received_date = datetime.now()
     
+    # Received goods are booked into stock when their batch is created
+    upsert_movement_rollups([{
+        'bucket_date': po.received_date.date(),
+        'item_id': po.item_id,
+        'warehouse_id': po.warehouse_id,
+        'category': po.item.category if po.item else None,
+        'received_orders': 1,
+        'received_quantity': po.quantity,
+        'received_cost': po.total_cost
+    }])
+    
     db.session.commit()
     
     return jsonify({'message': 'Purchase order received'}), 200
@@ -624,6 +1126,41 @@ def create_sale_order():
         'total_price': float(total_price)
     }), 201
 
+def decrement_stock(item_id, quantity):
+    """Take stock off an item in one conditional UPDATE; False if it would go negative"""
+    result = db.session.execute(
+        db.update(Item)
+        .where(Item.id == item_id, Item.current_stock >= quantity)
+        .values(current_stock=Item.current_stock - quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def increment_stock(item_id, quantity):
+    result = db.session.execute(
+        db.update(Item)
+        .where(Item.id == item_id)
+        .values(current_stock=Item.current_stock + quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def allocated_quantities(so_ids):
+    """Stock already reserved per sale order; allocation took it off current_stock"""
+    return dict(db.session.query(
+        BatchAllocation.sale_order_id, db.func.sum(BatchAllocation.quantity)
+    ).filter(BatchAllocation.sale_order_id.in_(so_ids)).group_by(BatchAllocation.sale_order_id).all())
+
+def claim_sale_orders(so_ids, fulfillment_date):
+    """Mark pending sale orders fulfilled; returns how many were still pending"""
+    result = db.session.execute(
+        db.update(SaleOrder)
+        .where(SaleOrder.id.in_(so_ids), SaleOrder.status == 'pending')
+        .values(status='fulfilled', fulfillment_date=fulfillment_date)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
 @app.route('/api/sale-orders/<int:so_id>/fulfill', methods=['PUT'])
 @role_required(['admin', 'manager'])
 def fulfill_sale_order(so_id):
@@ -632,20 +1169,840 @@ def fulfill_sale_order(so_id):
     if not so:
         return jsonify({'error': 'Sale order not found'}), 404
     
-    # Check if stock is available
-    item = so.item
-    if item.current_stock < so.quantity:
-        return jsonify({'error': 'Insufficient stock'}), 400
+    if so.status != 'pending':
+        return jsonify({'error': 'Sale order is not pending'}), 400
     
-    # Update stock
-    item.current_stock -= so.quantity
-    so.status = 'fulfilled'
-    so.fulfillment_date = datetime.now()
+    # Item row first, then the order row: the same lock order as the batch path
+    unreserved = max(so.quantity - allocated_quantities([so.id]).get(so.id, 0), 0)
+    if unreserved and not decrement_stock(so.item_id, unreserved):
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient stock'}), 400
+    # Stock nobody reserved ships from the batches too, so they stay in step with the item
+    try:
+        if unreserved:
+            consume_fefo_batches(so.item_id, so.warehouse_id, unreserved)
+    except AllocationConflict:
+        db.session.rollback()
+        return jsonify({'error': 'Batches changed concurrently, retry the fulfillment'}), 409
+    
+    fulfillment_date = datetime.now()
+    if not claim_sale_orders([so.id], fulfillment_date):
+        db.session.rollback()
+        return jsonify({'error': 'Sale order is not pending'}), 400
+    
+    if unreserved:
+        record_stock_movements([{
+            'item_id': so.item_id,
+            'warehouse_id': so.warehouse_id,
+            'quantity': -unreserved,
+            'movement_type': 'fulfill',
+            'reference': so.so_number
+        }])
+    upsert_movement_rollups([{
+        'bucket_date': fulfillment_date.date(),
+        'item_id': so.item_id,
+        'warehouse_id': so.warehouse_id,
+        'category': so.item.category if so.item else None,
+        'fulfilled_orders': 1,
+        'fulfilled_quantity': so.quantity,
+        'revenue': so.total_price
+    }])
     
     db.session.commit()
     
     return jsonify({'message': 'Sale order fulfilled'}), 200
 
+@app.route('/api/sale-orders/fulfill-batch', methods=['POST'])
+@role_required(['admin', 'manager'])
+def fulfill_sale_orders_batch():
+    """Fulfill many sale orders in one transaction, skipping those that cannot be filled"""
+    data = request.get_json() or {}
+    so_ids = data.get('sale_order_ids')
+    
+    if not isinstance(so_ids, list) or not so_ids:
+        return jsonify({'error': 'sale_order_ids must be a non-empty list'}), 400
+    if not all(isinstance(so_id, int) and not isinstance(so_id, bool) for so_id in so_ids):
+        return jsonify({'error': 'sale_order_ids must be integers'}), 400
+    if len(so_ids) > app.config['FULFILL_BATCH_LIMIT']:
+        return jsonify({'error': f"At most {app.config['FULFILL_BATCH_LIMIT']} sale orders per batch"}), 400
+    
+    orders = db.session.query(
+        SaleOrder.id, SaleOrder.so_number, SaleOrder.item_id, SaleOrder.warehouse_id,
+        SaleOrder.quantity, SaleOrder.total_price, SaleOrder.status
+    ).filter(SaleOrder.id.in_(so_ids)).order_by(SaleOrder.id).all()
+    
+    found = {o.id for o in orders}
+    failed = [{'id': so_id, 'error': 'Sale order not found'} for so_id in so_ids if so_id not in found]
+    failed.extend({'id': o.id, 'error': 'Sale order is not pending'} for o in orders if o.status != 'pending')
+    pending = [o for o in orders if o.status == 'pending']
+    
+    # Lock item rows in ascending id order so concurrent batches cannot deadlock
+    item_ids = sorted({o.item_id for o in pending})
+    locked = db.session.query(Item.id, Item.current_stock, Item.category).filter(
+        Item.id.in_(item_ids)
+    ).order_by(Item.id).with_for_update().all()
+    stock = {i.id: i.current_stock for i in locked}
+    categories = {i.id: i.category for i in locked}
+    reserved = allocated_quantities([o.id for o in pending]) if pending else {}
+    
+    taken = {}
+    shipped = {}
+    fulfilled = []
+    ledger = []
+    movements = {}
+    fulfillment_date = datetime.now()
+    for o in pending:
+        unreserved = max(o.quantity - reserved.get(o.id, 0), 0)
+        if unreserved > (stock.get(o.item_id) or 0) - taken.get(o.item_id, 0):
+            failed.append({'id': o.id, 'error': 'Insufficient stock'})
+            continue
+        fulfilled.append(o.id)
+        if unreserved:
+            taken[o.item_id] = taken.get(o.item_id, 0) + unreserved
+            shipped[(o.item_id, o.warehouse_id)] = shipped.get((o.item_id, o.warehouse_id), 0) + unreserved
+            ledger.append({
+                'item_id': o.item_id,
+                'warehouse_id': o.warehouse_id,
+                'quantity': -unreserved,
+                'movement_type': 'fulfill',
+                'reference': o.so_number
+            })
+        movement = movements.setdefault((o.item_id, o.warehouse_id), {
+            'bucket_date': fulfillment_date.date(),
+            'item_id': o.item_id,
+            'warehouse_id': o.warehouse_id,
+            'category': categories.get(o.item_id),
+            'fulfilled_orders': 0,
+            'fulfilled_quantity': 0,
+            'revenue': Decimal(0)
+        })
+        movement['fulfilled_orders'] += 1
+        movement['fulfilled_quantity'] += o.quantity
+        movement['revenue'] += Decimal(o.total_price)
+    
+    for item_id in sorted(taken):
+        if not decrement_stock(item_id, taken[item_id]):
+            db.session.rollback()
+            return jsonify({'error': 'Stock changed concurrently, retry the batch'}), 409
+    try:
+        for item_id, warehouse_id in sorted(shipped):
+            consume_fefo_batches(item_id, warehouse_id, shipped[(item_id, warehouse_id)])
+    except AllocationConflict:
+        db.session.rollback()
+        return jsonify({'error': 'Batches changed concurrently, retry the batch'}), 409
+    
+    if fulfilled and claim_sale_orders(fulfilled, fulfillment_date) != len(fulfilled):
+        db.session.rollback()
+        return jsonify({'error': 'Sale orders changed concurrently, retry the batch'}), 409
+    
+    record_stock_movements(ledger)
+    upsert_movement_rollups(list(movements.values()))
+    db.session.commit()
+    
+    return jsonify({
+        'fulfilled': fulfilled,
+        'failed': sorted(failed, key=lambda f: f['id'])
+    }), 200
+
+# ==================== Batch Allocation (FEFO) ====================
+
+class AllocationConflict(Exception):
+    """A batch was changed by a concurrent transaction during allocation"""
+
+def iter_fefo_batches(item_id, warehouse_id):
+    """Yield (id, batch_number, quantity, expiry_date) for available batches, soonest expiry first.
+
+    Pages through ix_stock_batches_fefo with a keyset on (expiry_date, id), so the
+    cost of an allocation depends on how many batches it touches, not on how many
+    batches the item has. Expired batches are skipped; undated batches come last.
+    """
+    page_size = app.config['FEFO_PAGE_SIZE']
+    base = db.session.query(
+        StockBatch.id, StockBatch.batch_number, StockBatch.quantity, StockBatch.expiry_date
+    ).filter(
+        StockBatch.item_id == item_id,
+        StockBatch.warehouse_id == warehouse_id,
+        StockBatch.status == 'available',
+        StockBatch.quantity > 0
+    )
+    
+    last = None
+    while True:
+        query = base.filter(StockBatch.expiry_date >= datetime.now())
+        if last:
+            query = query.filter(db.or_(
+                StockBatch.expiry_date > last.expiry_date,
+                db.and_(StockBatch.expiry_date == last.expiry_date, StockBatch.id > last.id)
+            ))
+        page = query.order_by(StockBatch.expiry_date, StockBatch.id).limit(page_size).with_for_update().all()
+        yield from page
+        if len(page) < page_size:
+            break
+        last = page[-1]
+    
+    last_id = 0
+    while True:
+        page = base.filter(StockBatch.expiry_date.is_(None), StockBatch.id > last_id).order_by(
+            StockBatch.id
+        ).limit(page_size).with_for_update().all()
+        yield from page
+        if len(page) < page_size:
+            break
+        last_id = page[-1].id
+
+def consume_fefo_batches(item_id, warehouse_id, quantity):
+    """Take shipped stock off an item's available batches, soonest expiry first.
+
+    Covers as much of ``quantity`` as the batches hold; the rest is stock the item
+    carries outside any batch. Raises ``AllocationConflict`` if a batch changed
+    underneath us; the caller owns the transaction.
+    """
+    taken = {}
+    for batch in iter_fefo_batches(item_id, warehouse_id):
+        if quantity <= 0:
+            break
+        taken[batch.id] = min(quantity, batch.quantity)
+        quantity -= taken[batch.id]
+    
+    if taken:
+        batches = StockBatch.__table__
+        result = db.session.execute(
+            batches.update()
+            .where(batches.c.id == db.bindparam('b_id'),
+                   batches.c.status == 'available',
+                   batches.c.quantity >= db.bindparam('b_quantity'))
+            .values(quantity=batches.c.quantity - db.bindparam('b_quantity')),
+            [{'b_id': batch_id, 'b_quantity': q} for batch_id, q in taken.items()]
+        )
+        if db.engine.dialect.supports_sane_multi_rowcount and result.rowcount != len(taken):
+            raise AllocationConflict()
+
+def allocate_fefo(lines, allow_partial=False):
+    """Reserve batch stock first-expiry-first-out for many order lines at once.
+
+    ``lines`` are dicts with item_id, warehouse_id, quantity and an optional
+    sale_order_id and ledger reference. Lines for the same item and warehouse
+    share one batch cursor. Returns one result per line; a line that cannot be
+    covered in full reserves nothing unless ``allow_partial`` is set. Reserved
+    stock comes off the batches and the item's current_stock alike. Raises
+    ``AllocationConflict`` if a batch or item changed underneath us; the caller
+    owns the transaction.
+    """
+    cursors = {}
+    remaining = {}
+    taken = {}
+    allocations = []
+    results = []
+    
+    for index, line in enumerate(lines):
+        key = (line['item_id'], line['warehouse_id'])
+        if key not in cursors:
+            cursors[key] = {'batches': iter_fefo_batches(*key), 'seen': []}
+        cursor = cursors[key]
+        
+        need = line['quantity']
+        picks = []
+        position = 0
+        while need > 0:
+            if position == len(cursor['seen']):
+                batch = next(cursor['batches'], None)
+                if batch is None:
+                    break
+                cursor['seen'].append(batch)
+                remaining[batch.id] = batch.quantity
+            batch = cursor['seen'][position]
+            position += 1
+            quantity = min(need, remaining[batch.id])
+            if quantity > 0:
+                picks.append((batch, quantity))
+                need -= quantity
+        
+        if need > 0 and not allow_partial:
+            picks = []
+        
+        for batch, quantity in picks:
+            remaining[batch.id] -= quantity
+            taken[batch.id] = taken.get(batch.id, 0) + quantity
+            allocations.append({
+                'batch_id': batch.id,
+                'item_id': line['item_id'],
+                'warehouse_id': line['warehouse_id'],
+                'sale_order_id': line.get('sale_order_id'),
+                'quantity': quantity
+            })
+        results.append({
+            'line': index,
+            'item_id': line['item_id'],
+            'warehouse_id': line['warehouse_id'],
+            'sale_order_id': line.get('sale_order_id'),
+            'requested': line['quantity'],
+            'allocated': sum(q for _, q in picks),
+            'batches': [{
+                'batch_id': batch.id,
+                'batch_number': batch.batch_number,
+                'expiry_date': batch.expiry_date,
+                'quantity': quantity
+            } for batch, quantity in picks]
+        })
+    
+    if taken:
+        batches = StockBatch.__table__
+        result = db.session.execute(
+            batches.update()
+            .where(batches.c.id == db.bindparam('b_id'),
+                   batches.c.status == 'available',
+                   batches.c.quantity >= db.bindparam('b_quantity'))
+            .values(
+                quantity=batches.c.quantity - db.bindparam('b_quantity'),
+                status=db.case((batches.c.quantity == db.bindparam('b_quantity'), 'reserved'),
+                               else_=batches.c.status)
+            ),
+            [{'b_id': batch_id, 'b_quantity': quantity} for batch_id, quantity in taken.items()]
+        )
+        if db.engine.dialect.supports_sane_multi_rowcount and result.rowcount != len(taken):
+            raise AllocationConflict()
+        db.session.execute(db.insert(BatchAllocation), allocations)
+        
+        # Reserved stock leaves the batch and the item together, so the two stay in step
+        reserved = {}
+        for allocation in allocations:
+            reserved[allocation['item_id']] = reserved.get(allocation['item_id'], 0) + allocation['quantity']
+        for item_id in sorted(reserved):
+            if not decrement_stock(item_id, reserved[item_id]):
+                raise AllocationConflict('Item stock is below its batch stock, reconcile the item first')
+        record_stock_movements([{
+            'item_id': line['item_id'],
+            'warehouse_id': line['warehouse_id'],
+            'quantity': -result['allocated'],
+            'movement_type': 'allocate',
+            'reference': line.get('reference')
+        } for line, result in zip(lines, results) if result['allocated']])
+    
+    return results
+
+@app.route('/api/allocations', methods=['POST'])
+@role_required(['admin', 'manager'])
+def create_allocations():
+    """Reserve batch stock FEFO for a list of order lines or sale orders"""
+    data = request.get_json() or {}
+    raw_lines = data.get('lines')
+    
+    if not isinstance(raw_lines, list) or not raw_lines:
+        return jsonify({'error': 'lines must be a non-empty list'}), 400
+    
+    so_ids = [l['sale_order_id'] for l in raw_lines if isinstance(l, dict) and l.get('sale_order_id')]
+    if len(set(so_ids)) != len(so_ids):
+        return jsonify({'error': 'Each sale order can appear on one line only'}), 400
+    # Lock the orders so two requests cannot both see them unallocated
+    orders = {o.id: o for o in db.session.query(
+        SaleOrder.id, SaleOrder.so_number, SaleOrder.item_id, SaleOrder.warehouse_id,
+        SaleOrder.quantity, SaleOrder.status
+    ).filter(SaleOrder.id.in_(so_ids)).order_by(SaleOrder.id).with_for_update()} if so_ids else {}
+    allocated = {so_id for so_id, in db.session.query(BatchAllocation.sale_order_id).filter(
+        BatchAllocation.sale_order_id.in_(so_ids)
+    ).distinct()} if so_ids else set()
+    
+    lines = []
+    for index, raw in enumerate(raw_lines):
+        if not isinstance(raw, dict):
+            return jsonify({'error': f'Line {index} is malformed'}), 400
+        order = orders.get(raw.get('sale_order_id'))
+        if raw.get('sale_order_id') and not order:
+            return jsonify({'error': f'Line {index}: sale order not found'}), 400
+        if order and order.status != 'pending':
+            db.session.rollback()
+            return jsonify({'error': f'Line {index}: sale order is not pending'}), 400
+        if order and order.id in allocated:
+            db.session.rollback()
+            return jsonify({'error': f'Line {index}: sale order is already allocated'}), 409
+        line = {
+            'item_id': raw.get('item_id', order.item_id if order else None),
+            'warehouse_id': raw.get('warehouse_id', order.warehouse_id if order else None),
+            'quantity': raw.get('quantity', order.quantity if order else None),
+            'sale_order_id': order.id if order else None,
+            'reference': order.so_number if order else None
+        }
+        if not all(isinstance(line[f], int) for f in ('item_id', 'warehouse_id', 'quantity')) or line['quantity'] <= 0:
+            db.session.rollback()
+            return jsonify({'error': f'Line {index} needs item_id, warehouse_id and a positive quantity'}), 400
+        lines.append(line)
+    
+    try:
+        results = allocate_fefo(lines, allow_partial=bool(data.get('allow_partial')))
+        db.session.commit()
+    except AllocationConflict as conflict:
+        db.session.rollback()
+        return jsonify({'error': str(conflict) or 'Batches changed concurrently, retry the allocation'}), 409
+    
+    return jsonify({
+        'lines': results,
+        'fully_allocated': all(r['allocated'] == r['requested'] for r in results)
+    }), 200
+
+@app.route('/api/allocations', methods=['GET'])
+@jwt_required()
+def get_allocations():
+    sale_order_id = request.args.get('sale_order_id', type=int)
+    item_id = request.args.get('item_id', type=int)
+    
+    query = BatchAllocation.query
+    if sale_order_id:
+        query = query.filter_by(sale_order_id=sale_order_id)
+    if item_id:
+        query = query.filter_by(item_id=item_id)
+    
+    return jsonify([{
+        'id': a.id,
+        'batch_id': a.batch_id,
+        'batch_number': a.batch.batch_number if a.batch else None,
+        'item_id': a.item_id,
+        'warehouse_id': a.warehouse_id,
+        'sale_order_id': a.sale_order_id,
+        'quantity': a.quantity,
+        'created_at': a.created_at
+    } for a in query.order_by(BatchAllocation.id).all()]), 200
+
+@app.route('/api/allocations/<int:allocation_id>', methods=['DELETE'])
+@role_required(['admin', 'manager'])
+def release_allocation(allocation_id):
+    allocation = BatchAllocation.query.get(allocation_id)
+    
+    if not allocation:
+        return jsonify({'error': 'Allocation not found'}), 404
+    
+    order = SaleOrder.query.get(allocation.sale_order_id) if allocation.sale_order_id else None
+    if order and order.status == 'fulfilled':
+        return jsonify({'error': 'Sale order is already fulfilled'}), 400
+    
+    db.session.execute(
+        db.update(StockBatch)
+        .where(StockBatch.id == allocation.batch_id)
+        .values(
+            quantity=StockBatch.quantity + allocation.quantity,
+            status=db.case((StockBatch.status == 'reserved', 'available'), else_=StockBatch.status)
+        )
+        .execution_options(synchronize_session=False)
+    )
+    increment_stock(allocation.item_id, allocation.quantity)
+    record_stock_movements([{
+        'item_id': allocation.item_id,
+        'warehouse_id': allocation.warehouse_id,
+        'quantity': allocation.quantity,
+        'movement_type': 'release',
+        'reference': order.so_number if order else None
+    }])
+    db.session.delete(allocation)
+    db.session.commit()
+    
+    return jsonify({'message': 'Allocation released'}), 200
+
+# ==================== Stock Ledger ====================
+
+def record_stock_movements(rows):
+    """Append signed stock deltas to the ledger in the caller's transaction"""
+    if not rows:
+        return
+    user_id = get_jwt_identity() if has_request_context() else None
+    db.session.execute(db.insert(StockMovement), [
+        dict({'warehouse_id': None, 'reference': None, 'created_by': user_id}, **row) for row in rows
+    ])
+
+def latest_snapshots():
+    """Subquery of the newest snapshot per item"""
+    newest = db.session.query(
+        db.func.max(StockSnapshot.id).label('id')
+    ).group_by(StockSnapshot.item_id).subquery()
+    return db.session.query(StockSnapshot).join(newest, newest.c.id == StockSnapshot.id).subquery()
+
+def stock_at(item_id, at):
+    """Stock on hand for an item at a point in time: nearest snapshot plus the movements after it.
+
+    The scan is bounded by the next snapshot, so it covers at most one snapshot
+    interval however far back ``at`` is.
+    """
+    snapshot = StockSnapshot.query.filter(
+        StockSnapshot.item_id == item_id,
+        StockSnapshot.taken_at <= at
+    ).order_by(StockSnapshot.taken_at.desc(), StockSnapshot.id.desc()).first()
+    following = db.session.query(StockSnapshot.last_movement_id).filter(
+        StockSnapshot.item_id == item_id,
+        StockSnapshot.taken_at > at
+    ).order_by(StockSnapshot.taken_at, StockSnapshot.id).limit(1).scalar()
+    
+    after_id = snapshot.last_movement_id if snapshot else 0
+    query = db.session.query(
+        db.func.coalesce(db.func.sum(StockMovement.quantity), 0),
+        db.func.count(StockMovement.id)
+    ).filter(
+        StockMovement.item_id == item_id,
+        StockMovement.id > after_id,
+        StockMovement.created_at <= at
+    )
+    if following is not None:
+        query = query.filter(StockMovement.id <= following)
+    delta, scanned = query.one()
+    
+    return {
+        'quantity': (snapshot.quantity if snapshot else 0) + delta,
+        'snapshot_id': snapshot.id if snapshot else None,
+        'movements_scanned': scanned
+    }
+
+def take_stock_snapshots(chunk_size=500):
+    """Snapshot every item whose ledger moved since its last snapshot.
+
+    Items that have stock but no ledger history yet get an 'opening' movement
+    first, so stock that predates the ledger reconciles. Moved items are then
+    locked a chunk at a time before their movements are summed; every ledger
+    write also updates its item row, so no movement for a locked item is still
+    uncommitted, and each snapshot ends at that item's own last movement id.
+    """
+    has_movements = db.session.query(StockMovement.id).filter(StockMovement.item_id == Item.id).exists()
+    openings = db.session.query(Item.id, Item.warehouse_id, Item.current_stock).filter(
+        Item.current_stock != 0, ~has_movements
+    ).order_by(Item.id).with_for_update().all()
+    record_stock_movements([{
+        'item_id': item_id,
+        'warehouse_id': warehouse_id,
+        'quantity': quantity,
+        'movement_type': 'opening'
+    } for item_id, warehouse_id, quantity in openings])
+    db.session.commit()
+    
+    latest = latest_snapshots()
+    moved = [item_id for item_id, in db.session.query(StockMovement.item_id).outerjoin(
+        latest, latest.c.item_id == StockMovement.item_id
+    ).filter(
+        StockMovement.id > db.func.coalesce(latest.c.last_movement_id, 0)
+    ).distinct().order_by(StockMovement.item_id)]
+    db.session.commit()
+    
+    taken = 0
+    for chunk in iter_chunks(moved, chunk_size):
+        db.session.query(Item.id).filter(Item.id.in_(chunk)).order_by(Item.id).with_for_update().all()
+        latest = latest_snapshots()
+        deltas = db.session.query(
+            StockMovement.item_id,
+            db.func.coalesce(latest.c.quantity, 0),
+            db.func.sum(StockMovement.quantity),
+            db.func.max(StockMovement.id)
+        ).outerjoin(latest, latest.c.item_id == StockMovement.item_id).filter(
+            StockMovement.item_id.in_(chunk),
+            StockMovement.id > db.func.coalesce(latest.c.last_movement_id, 0)
+        ).group_by(StockMovement.item_id, latest.c.quantity).all()
+        
+        if deltas:
+            db.session.execute(db.insert(StockSnapshot), [{
+                'item_id': item_id,
+                'quantity': base + delta,
+                'last_movement_id': last_id
+            } for item_id, base, delta, last_id in deltas])
+        db.session.commit()
+        taken += len(deltas)
+    return taken
+
+def reconcile_stock():
+    """Items whose current_stock disagrees with the ledger, found in one aggregated query"""
+    latest = latest_snapshots()
+    ledger = (db.func.coalesce(latest.c.quantity, 0)
+              + db.func.coalesce(db.func.sum(StockMovement.quantity), 0)).label('ledger_stock')
+    rows = db.session.query(Item.id, Item.sku, Item.current_stock, ledger).outerjoin(
+        latest, latest.c.item_id == Item.id
+    ).outerjoin(StockMovement, db.and_(
+        StockMovement.item_id == Item.id,
+        StockMovement.id > db.func.coalesce(latest.c.last_movement_id, 0)
+    )).group_by(Item.id, Item.sku, Item.current_stock, latest.c.quantity).having(
+        Item.current_stock != ledger
+    ).all()
+    
+    return [{
+        'item_id': item_id,
+        'sku': sku,
+        'current_stock': current_stock,
+        'ledger_stock': ledger_stock,
+        'drift': current_stock - ledger_stock
+    } for item_id, sku, current_stock, ledger_stock in rows]
+
+@app.cli.command('snapshot-stock')
+def snapshot_stock_command():
+    """Write stock ledger snapshots for items that moved since the last run"""
+    print(f'Snapshotted {take_stock_snapshots()} items')
+
+@app.cli.command('reconcile-stock')
+def reconcile_stock_command():
+    """Report items whose current_stock drifted from the stock ledger"""
+    drift = reconcile_stock()
+    for row in drift:
+        print(f"{row['sku']}: current_stock={row['current_stock']} ledger={row['ledger_stock']}")
+    print(f'{len(drift)} items out of balance')
+
+@app.route('/api/items/<int:item_id>/adjust', methods=['POST'])
+@role_required(['admin', 'manager'])
+def adjust_stock(item_id):
+    """Manually correct an item's stock by a signed quantity"""
+    data = request.get_json() or {}
+    quantity = data.get('quantity')
+    
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity == 0:
+        return jsonify({'error': 'quantity must be a non-zero integer'}), 400
+    
+    item = Item.query.get(item_id)
+    if not item:
+        return jsonify({'error': 'Item not found'}), 404
+    
+    applied = increment_stock(item_id, quantity) if quantity > 0 else decrement_stock(item_id, -quantity)
+    if not applied:
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient stock'}), 400
+    
+    record_stock_movements([{
+        'item_id': item_id,
+        'warehouse_id': data.get('warehouse_id', item.warehouse_id),
+        'quantity': quantity,
+        'movement_type': 'adjust',
+        'reference': data.get('reason')
+    }])
+    db.session.commit()
+    
+    return jsonify({'id': item_id, 'current_stock': item.current_stock}), 200
+
+@app.route('/api/items/<int:item_id>/movements', methods=['GET'])
+@jwt_required()
+def get_stock_movements(item_id):
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    
+    movements = StockMovement.query.filter_by(item_id=item_id).order_by(
+        StockMovement.id.desc()
+    ).paginate(page=page, per_page=per_page)
+    
+    return jsonify({
+        'total': movements.total,
+        'pages': movements.pages,
+        'current_page': page,
+        'movements': [{
+            'id': m.id,
+            'warehouse_id': m.warehouse_id,
+            'quantity': m.quantity,
+            'movement_type': m.movement_type,
+            'reference': m.reference,
+            'created_by': m.created_by,
+            'created_at': m.created_at
+        } for m in movements.items]
+    }), 200
+
+@app.route('/api/items/<int:item_id>/stock-at', methods=['GET'])
+@jwt_required()
+def get_stock_at(item_id):
+    """Get an item's stock on hand as of ?at=<ISO datetime>"""
+    try:
+        at = datetime.fromisoformat(request.args['at'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'at must be an ISO 8601 datetime'}), 400
+    
+    return jsonify(dict(stock_at(item_id, at), item_id=item_id, at=at.isoformat())), 200
+
+@app.route('/api/analytics/stock-reconciliation', methods=['GET'])
+@role_required(['admin', 'manager'])
+def get_stock_reconciliation():
+    drift = reconcile_stock()
+    return jsonify({'items_out_of_balance': len(drift), 'items': drift}), 200
+
+# ==================== Reorder Planning ====================
+
+def load_demand_matrix(start, end, period_days):
+    """Fulfilled quantity per item and period as (item_ids, items x periods array), in one query"""
+    day = db.func.date(SaleOrder.fulfillment_date)
+    rows = db.session.query(SaleOrder.item_id, day, db.func.sum(SaleOrder.quantity)).filter(
+        SaleOrder.status == 'fulfilled',
+        SaleOrder.fulfillment_date >= start,
+        SaleOrder.fulfillment_date < end
+    ).group_by(SaleOrder.item_id, day).all()
+    
+    periods = max(1, math.ceil((end - start).days / period_days))
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, periods))
+    
+    item_col, day_col, qty_col = zip(*rows)
+    days = np.array([str(d) for d in day_col], dtype='datetime64[D]')
+    period = (days - np.datetime64(start.date(), 'D')).astype(np.int64) // period_days
+    item_ids, row = np.unique(np.array(item_col, dtype=np.int64), return_inverse=True)
+    demand = np.bincount(
+        row * periods + np.clip(period, 0, periods - 1),
+        weights=np.array(qty_col, dtype=np.float64),
+        minlength=len(item_ids) * periods
+    ).reshape(len(item_ids), periods)
+    return item_ids, demand
+
+def forecast_demand(demand, alpha=0.2, intermittent_adi=1.32):
+    """Forecast next-period demand for every row of an items x periods matrix at once.
+
+    Runs simple exponential smoothing and Croston's method (SBA-corrected) side by
+    side, looping over periods only, and picks Croston for rows whose average
+    demand interval exceeds ``intermittent_adi``. Returns (forecast, sigma, is_croston).
+    """
+    n, periods = demand.shape
+    level = demand[:, 0].copy() if periods else np.zeros(n)
+    size = np.zeros(n)
+    interval = np.zeros(n)
+    since = np.ones(n)
+    seen = np.zeros(n, dtype=bool)
+    
+    for t in range(periods):
+        y = demand[:, t]
+        if t:
+            level += alpha * (y - level)
+        hit = y > 0
+        first = hit & ~seen
+        update = hit & seen
+        size[first] = y[first]
+        interval[first] = since[first]
+        size[update] += alpha * (y[update] - size[update])
+        interval[update] += alpha * (since[update] - interval[update])
+        seen |= hit
+        since = np.where(hit, 1, since + 1)
+    
+    croston = np.where(seen, (1 - alpha / 2) * size / np.maximum(interval, 1), 0)
+    adi = periods / np.maximum(np.count_nonzero(demand, axis=1), 1)
+    is_croston = adi > intermittent_adi
+    return np.where(is_croston, croston, level), demand.std(axis=1), is_croston
+
+def forecast_sharded(demand, workers=1, **params):
+    """Split the matrix by SKU rows across processes and stitch the forecasts back together"""
+    if workers <= 1 or len(demand) < workers * 1000:
+        return forecast_demand(demand, **params)
+    shards = np.array_split(demand, workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(partial(forecast_demand, **params), shards))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+def plan_reorders(history_days=730, period_days=7, lead_time_days=14, cover_days=30,
+                  service_z=1.65, alpha=0.2, workers=1, draft_orders=True):
+    """Rewrite reorder suggestions from sales history and draft POs for items at or below them"""
+    end = datetime.now()
+    item_ids, demand = load_demand_matrix(end - timedelta(days=history_days), end, period_days)
+    forecast, sigma, is_croston = forecast_sharded(demand, workers, alpha=alpha)
+    
+    daily = forecast / period_days
+    levels = np.ceil(daily * lead_time_days + service_z * sigma * np.sqrt(lead_time_days / period_days))
+    quantities = np.maximum(np.ceil(daily * cover_days), 1)
+    
+    ReorderSuggestion.query.delete()
+    if len(item_ids):
+        db.session.execute(db.insert(ReorderSuggestion), [{
+            'item_id': item_id,
+            'method': 'croston' if croston else 'ses',
+            'daily_demand': round(rate, 4),
+            'reorder_level': level,
+            'reorder_quantity': quantity
+        } for item_id, croston, rate, level, quantity in zip(
+            item_ids.tolist(), is_croston.tolist(), daily.tolist(),
+            levels.astype(int).tolist(), quantities.astype(int).tolist()
+        )])
+    
+    drafts = create_draft_purchase_orders() if draft_orders else 0
+    db.session.commit()
+    return {'items_forecast': len(item_ids), 'draft_purchase_orders': drafts}
+
+def create_draft_purchase_orders():
+    """Draft a PO for every item at or below its suggested reorder level with no open PO"""
+    open_po = db.session.query(PurchaseOrder.id).filter(
+        PurchaseOrder.item_id == Item.id,
+        PurchaseOrder.status.in_(['draft', 'pending'])
+    ).exists()
+    last_po = db.session.query(
+        PurchaseOrder.item_id, db.func.max(PurchaseOrder.id).label('id')
+    ).group_by(PurchaseOrder.item_id).subquery()
+    previous = db.aliased(PurchaseOrder)
+    
+    candidates = db.session.query(
+        Item.id, Item.warehouse_id, ReorderSuggestion.reorder_quantity,
+        previous.supplier_name, previous.unit_cost
+    ).join(ReorderSuggestion, ReorderSuggestion.item_id == Item.id).outerjoin(
+        last_po, last_po.c.item_id == Item.id
+    ).outerjoin(previous, previous.id == last_po.c.id).filter(
+        Item.current_stock <= ReorderSuggestion.reorder_level, ~open_po
+    ).all()
+    
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    if candidates:
+        db.session.execute(db.insert(PurchaseOrder), [{
+            'po_number': f'DRAFT-{stamp}-{item_id}',
+            'supplier_name': supplier_name or 'Unassigned',
+            'item_id': item_id,
+            'quantity': quantity,
+            'unit_cost': unit_cost or 0,
+            'total_cost': Decimal(quantity) * Decimal(unit_cost or 0),
+            'status': 'draft',
+            'warehouse_id': warehouse_id,
+            'notes': 'Drafted by reorder planning'
+        } for item_id, warehouse_id, quantity, supplier_name, unit_cost in candidates])
+    return len(candidates)
+
+@app.cli.command('plan-reorders')
+@click.option('--workers', default=1, help='Processes to shard the forecast across')
+@click.option('--history-days', default=730)
+@click.option('--lead-time-days', default=14)
+@click.option('--no-drafts', is_flag=True, help='Only write suggestions')
+def plan_reorders_command(workers, history_days, lead_time_days, no_drafts):
+    """Forecast demand for every SKU and refresh reorder suggestions"""
+    started = time.perf_counter()
+    summary = plan_reorders(history_days=history_days, lead_time_days=lead_time_days,
+                            workers=workers, draft_orders=not no_drafts)
+    print(f"Forecast {summary['items_forecast']} items, drafted {summary['draft_purchase_orders']} "
+          f"purchase orders in {time.perf_counter() - started:.1f}s")
+
+@app.route('/api/reorder-suggestions', methods=['GET'])
+@jwt_required()
+def get_reorder_suggestions():
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    
+    suggestions = db.session.query(ReorderSuggestion, Item).join(
+        Item, Item.id == ReorderSuggestion.item_id
+    ).order_by(ReorderSuggestion.item_id).paginate(page=page, per_page=per_page)
+    
+    return jsonify({
+        'total': suggestions.total,
+        'pages': suggestions.pages,
+        'current_page': page,
+        'suggestions': [{
+            'item_id': item.id,
+            'sku': item.sku,
+            'method': suggestion.method,
+            'daily_demand': suggestion.daily_demand,
+            'current_stock': item.current_stock,
+            'reorder_level': item.reorder_level,
+            'reorder_quantity': item.reorder_quantity,
+            'suggested_reorder_level': suggestion.reorder_level,
+            'suggested_reorder_quantity': suggestion.reorder_quantity,
+            'created_at': suggestion.created_at
+        } for suggestion, item in suggestions.items]
+    }), 200
+
+@app.route('/api/reorder-suggestions/apply', methods=['POST'])
+@role_required(['admin', 'manager'])
+def apply_reorder_suggestions():
+    """Copy suggestions onto Item.reorder_level/reorder_quantity for the given items, or all"""
+    data = request.get_json() or {}
+    item_ids = data.get('item_ids')
+    
+    suggestions = db.session.query(
+        ReorderSuggestion.item_id, ReorderSuggestion.reorder_level, ReorderSuggestion.reorder_quantity
+    )
+    if item_ids is not None:
+        if not isinstance(item_ids, list):
+            return jsonify({'error': 'item_ids must be a list'}), 400
+        suggestions = suggestions.filter(ReorderSuggestion.item_id.in_(item_ids))
+    
+    updates = [{'id': item_id, 'reorder_level': level, 'reorder_quantity': quantity}
+               for item_id, level, quantity in suggestions]
+    if updates:
+        db.session.execute(db.update(Item), updates)
+    db.session.commit()
+    
+    return jsonify({'updated': len(updates)}), 200
+
 # ==================== Stock Alert Endpoints ====================
 
 @app.route('/api/alerts', methods=['GET'])
@@ -853,6 +2210,129 @@ def get_inventory_movement():
         }
     }), 200
 
+def upsert_movement_rollups(rows):
+    """Add movement deltas into their daily buckets with one INSERT ... ON CONFLICT statement"""
+    if not rows:
+        return
+    
+    table = MovementRollup.__table__
+    insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['bucket_date', 'item_id', 'warehouse_id'],
+        set_={measure: table.c[measure] + stmt.excluded[measure] for measure in MOVEMENT_MEASURES}
+    )
+    db.session.execute(stmt, [dict({m: 0 for m in MOVEMENT_MEASURES}, **row) for row in rows])
+
+def rebuild_movement_rollups():
+    """Recompute every rollup bucket from purchase and sale order history"""
+    MovementRollup.query.delete()
+    
+    received = db.session.query(
+        db.func.date(PurchaseOrder.received_date), PurchaseOrder.item_id, PurchaseOrder.warehouse_id,
+        Item.category, db.func.count(PurchaseOrder.id), db.func.sum(PurchaseOrder.quantity),
+        db.func.sum(PurchaseOrder.total_cost)
+    ).join(Item, Item.id == PurchaseOrder.item_id).filter(
+        PurchaseOrder.status == 'received', PurchaseOrder.received_date.isnot(None)
+    ).group_by(db.func.date(PurchaseOrder.received_date), PurchaseOrder.item_id,
+               PurchaseOrder.warehouse_id, Item.category)
+    upsert_movement_rollups([{
+        'bucket_date': day if isinstance(day, date) else date.fromisoformat(day),
+        'item_id': item_id, 'warehouse_id': warehouse_id, 'category': category,
+        'received_orders': count, 'received_quantity': quantity, 'received_cost': cost
+    } for day, item_id, warehouse_id, category, count, quantity, cost in received])
+    
+    fulfilled = db.session.query(
+        db.func.date(SaleOrder.fulfillment_date), SaleOrder.item_id, SaleOrder.warehouse_id,
+        Item.category, db.func.count(SaleOrder.id), db.func.sum(SaleOrder.quantity),
+        db.func.sum(SaleOrder.total_price)
+    ).join(Item, Item.id == SaleOrder.item_id).filter(
+        SaleOrder.status == 'fulfilled', SaleOrder.fulfillment_date.isnot(None)
+    ).group_by(db.func.date(SaleOrder.fulfillment_date), SaleOrder.item_id,
+               SaleOrder.warehouse_id, Item.category)
+    upsert_movement_rollups([{
+        'bucket_date': day if isinstance(day, date) else date.fromisoformat(day),
+        'item_id': item_id, 'warehouse_id': warehouse_id, 'category': category,
+        'fulfilled_orders': count, 'fulfilled_quantity': quantity, 'revenue': revenue
+    } for day, item_id, warehouse_id, category, count, quantity, revenue in fulfilled])
+    
+    db.session.commit()
+
+@app.cli.command('rebuild-movement-rollups')
+def rebuild_movement_rollups_command():
+    """Backfill inventory movement rollups from order history"""
+    rebuild_movement_rollups()
+    print(f'Rebuilt {MovementRollup.query.count()} movement rollup buckets')
+
+MOVEMENT_GROUPS = {
+    'item': MovementRollup.item_id,
+    'warehouse': MovementRollup.warehouse_id,
+    'category': MovementRollup.category,
+}
+
+def movement_period(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+@app.route('/api/analytics/movement/trend', methods=['GET'])
+@jwt_required()
+def get_inventory_movement_trend():
+    """Get received and fulfilled totals per day, week or month from the rollup buckets"""
+    granularity = request.args.get('granularity', 'day')
+    group_by = request.args.get('group_by')
+    
+    if granularity not in ('day', 'week', 'month'):
+        return jsonify({'error': 'granularity must be day, week or month'}), 400
+    if group_by and group_by not in MOVEMENT_GROUPS:
+        return jsonify({'error': 'group_by must be item, warehouse or category'}), 400
+    
+    try:
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'from and to must be YYYY-MM-DD dates'}), 400
+    if start > end:
+        return jsonify({'error': 'from must not be after to'}), 400
+    
+    columns = [MovementRollup.bucket_date]
+    if group_by:
+        columns.append(MOVEMENT_GROUPS[group_by])
+    query = db.session.query(
+        *columns, *[db.func.sum(getattr(MovementRollup, m)) for m in MOVEMENT_MEASURES]
+    ).filter(MovementRollup.bucket_date.between(start, end))
+    
+    for field in ('item_id', 'warehouse_id'):
+        value = request.args.get(field, type=int)
+        if value:
+            query = query.filter(getattr(MovementRollup, field) == value)
+    if request.args.get('category'):
+        query = query.filter(MovementRollup.category == request.args['category'])
+    
+    buckets = {}
+    for row in query.group_by(*columns):
+        key = (movement_period(row[0], granularity), row[1] if group_by else None)
+        bucket = buckets.setdefault(key, dict.fromkeys(MOVEMENT_MEASURES, 0))
+        for measure, value in zip(MOVEMENT_MEASURES, row[len(columns):]):
+            bucket[measure] += value or 0
+    
+    results = []
+    for (period, group), totals in sorted(buckets.items(), key=lambda b: (b[0][0], str(b[0][1]))):
+        entry = {'period': period.isoformat()}
+        if group_by:
+            entry[group_by] = group
+        entry.update({m: float(v) if m in ('received_cost', 'revenue') else v for m, v in totals.items()})
+        results.append(entry)
+    
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'granularity': granularity,
+        'buckets': results
+    }), 200
+
 # ==================== Health Check ====================
 
 @app.route('/api/health', methods=['GET'])
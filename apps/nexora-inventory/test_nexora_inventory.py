@@ -1,8 +1,18 @@
 import sys, os
 sys.path.insert(0, os.path.dirname(__file__))
 
+import sys
+import json
+import time
+import multiprocessing
 import pytest
-from app import app, db, User, Module
+import numpy as np
+from datetime import date, datetime, timedelta
+from app import (
+    app, db, User, Module, Item, PurchaseOrder, SaleOrder, StockBatch, MovementRollup,
+    forecast_demand, forecast_sharded, plan_reorders,
+    rebuild_movement_rollups, take_stock_snapshots, reconcile_stock, sku_index
+)
 
 @pytest.fixture
 def client():
@@ -41,3 +51,399 @@ def test_health_check(client):
     response = client.get('/api/health')
     assert response.status_code == 200
     assert response.json['status'] == 'healthy'
+
+@pytest.fixture
+def premium(monkeypatch):
+    monkeypatch.setattr(sys.modules['utils.pricing_guard'], 'is_free_tier_active', lambda: True)
+
+def auth_headers(client, role='admin'):
+    response = client.post('/api/auth/register', json={
+        'username': f'{role}user',
+        'email': f'{role}@example.com',
+        'password': 'password123',
+        'role': role
+    })
+    return {'Authorization': f"Bearer {response.json['access_token']}"}
+
+def test_bulk_import_items_csv_upserts_by_sku(client, premium):
+    headers = auth_headers(client)
+    client.post('/api/items', headers=headers, json={'sku': 'SKU-1', 'name': 'Old', 'unit_price': 1})
+
+    body = 'sku,name,unit_price,category\nSKU-1,Widget,2.50,tools\nSKU-2,Gadget,4,\nSKU-2,Dup,4,\nSKU-3,,1,\n'
+    response = client.post('/api/items/bulk', headers=headers, data=body, content_type='text/csv')
+    assert response.status_code == 200
+    assert response.json['processed'] == 4
+    assert response.json['created'] == 1
+    assert response.json['updated'] == 1
+    assert [e['row'] for e in response.json['errors']] == [3, 4]
+
+    items = client.get('/api/items', headers=headers).json['items']
+    assert {i['sku']: i['name'] for i in items} == {'SKU-1': 'Widget', 'SKU-2': 'Gadget'}
+
+def test_bulk_import_batches_ndjson_adjusts_stock(client, premium):
+    headers = auth_headers(client)
+    item_id = client.post('/api/items', headers=headers, json={'sku': 'SKU-1', 'name': 'Widget', 'unit_price': 1}).json['id']
+
+    rows = [
+        {'batch_number': 'B-1', 'sku': 'SKU-1', 'warehouse_id': 1, 'quantity': 10, 'unit_cost': 1},
+        {'batch_number': 'B-2', 'item_id': item_id, 'warehouse_id': 1, 'quantity': 5, 'unit_cost': 1},
+        {'batch_number': 'B-3', 'sku': 'MISSING', 'warehouse_id': 1, 'quantity': 5, 'unit_cost': 1},
+    ]
+    body = '\n'.join(json.dumps(r) for r in rows) + '\nnot json\n'
+    response = client.post('/api/batches/bulk', headers=headers, data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.json['created'] == 2
+    assert response.json['failed'] == 2
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['current_stock'] == 15
+
+    body = json.dumps({'batch_number': 'B-1', 'sku': 'SKU-1', 'warehouse_id': 1, 'quantity': 4, 'unit_cost': 1})
+    response = client.post('/api/batches/bulk', headers=headers, data=body, content_type='application/x-ndjson')
+    assert response.json['updated'] == 1
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['current_stock'] == 9
+
+def test_bulk_import_rejects_unknown_content_type(client, premium):
+    headers = auth_headers(client)
+    response = client.post('/api/items/bulk', headers=headers, json=[])
+    assert response.status_code == 415
+
+def test_bulk_import_requires_bulk_operations_feature(client, monkeypatch):
+    monkeypatch.setattr(sys.modules['utils.pricing_guard'], 'is_free_tier_active', lambda: False)
+    headers = auth_headers(client)
+    response = client.post('/api/items/bulk', headers=headers, data='sku,name,unit_price\n', content_type='text/csv')
+    assert response.status_code == 402
+
+def create_sale_orders(client, headers, stock, count, quantity=1):
+    item_id = client.post('/api/items', headers=headers, json={'sku': 'SKU-SO', 'name': 'Widget', 'unit_price': 1}).json['id']
+    client.post('/api/batches', headers=headers, json={
+        'batch_number': 'B-SO', 'item_id': item_id, 'warehouse_id': 1, 'quantity': stock, 'unit_cost': 1
+    })
+    so_ids = [client.post('/api/sale-orders', headers=headers, json={
+        'so_number': f'SO-{n}', 'customer_name': 'Acme', 'item_id': item_id,
+        'quantity': quantity, 'unit_price': 1, 'warehouse_id': 1
+    }).json['id'] for n in range(count)]
+    return item_id, so_ids
+
+def test_fulfill_sale_order_is_conditional(client):
+    headers = auth_headers(client)
+    item_id, so_ids = create_sale_orders(client, headers, stock=3, count=2, quantity=2)
+
+    assert client.put(f'/api/sale-orders/{so_ids[0]}/fulfill', headers=headers).status_code == 200
+    assert client.put(f'/api/sale-orders/{so_ids[0]}/fulfill', headers=headers).status_code == 400
+    response = client.put(f'/api/sale-orders/{so_ids[1]}/fulfill', headers=headers)
+    assert response.status_code == 400
+    assert response.json['error'] == 'Insufficient stock'
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['current_stock'] == 1
+
+def test_fulfill_batch_reports_partial_results(client):
+    headers = auth_headers(client)
+    item_id, so_ids = create_sale_orders(client, headers, stock=5, count=4, quantity=2)
+    client.put(f'/api/sale-orders/{so_ids[0]}/fulfill', headers=headers)
+
+    response = client.post('/api/sale-orders/fulfill-batch', headers=headers, json={'sale_order_ids': so_ids + [9999]})
+    assert response.status_code == 200
+    assert response.json['fulfilled'] == so_ids[1:2]
+    assert {f['id']: f['error'] for f in response.json['failed']} == {
+        so_ids[0]: 'Sale order is not pending',
+        so_ids[2]: 'Insufficient stock',
+        so_ids[3]: 'Insufficient stock',
+        9999: 'Sale order not found',
+    }
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['current_stock'] == 1
+
+    for bad in ([so_ids[1], 'x'], [True], [1.5]):
+        response = client.post('/api/sale-orders/fulfill-batch', headers=headers, json={'sale_order_ids': bad})
+        assert response.status_code == 400
+
+def fulfill_worker(headers, so_ids, results):
+    db.engine.dispose(close=False)
+    worker = app.test_client()
+    fulfilled = 0
+    for so_id in so_ids:
+        if worker.put(f'/api/sale-orders/{so_id}/fulfill', headers=headers).status_code == 200:
+            fulfilled += 1
+    results.put(fulfilled)
+
+def test_concurrent_fulfillment_never_oversells(client):
+    if db.engine.url.database in (None, '', ':memory:'):
+        pytest.skip('needs a file-backed database shared across processes')
+    headers = auth_headers(client)
+    item_id, so_ids = create_sale_orders(client, headers, stock=40, count=120)
+    db.session.remove()
+
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    # Every worker races for every order, in a different order
+    workers = [ctx.Process(target=fulfill_worker, args=(headers, so_ids if n % 2 == 0 else so_ids[::-1], results))
+               for n in range(4)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    fulfilled = sum(results.get(timeout=60) for _ in workers)
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+
+    assert fulfilled == 40
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['current_stock'] == 0
+    assert SaleOrder.query.filter_by(status='fulfilled').count() == 40
+    print(f'{len(workers) * len(so_ids) / elapsed:.0f} fulfill requests/sec, {fulfilled / elapsed:.0f} orders/sec '
+          f'across {len(workers)} processes')
+
+def test_allocate_fefo_spans_batches_in_expiry_order(client):
+    headers = auth_headers(client)
+    item_id = client.post('/api/items', headers=headers, json={'sku': 'SKU-F', 'name': 'Milk', 'unit_price': 1}).json['id']
+    soon = datetime.now() + timedelta(days=2)
+    for number, quantity, expiry in (('LATE', 10, soon + timedelta(days=10)), ('NODATE', 10, None),
+                                     ('SOON', 4, soon), ('GONE', 10, datetime.now() - timedelta(days=1))):
+        db.session.add(StockBatch(batch_number=number, item_id=item_id, warehouse_id=1,
+                                  quantity=quantity, unit_cost=1, expiry_date=expiry))
+    db.session.get(Item, item_id).current_stock = 34
+    db.session.commit()
+
+    response = client.post('/api/allocations', headers=headers, json={'lines': [
+        {'item_id': item_id, 'warehouse_id': 1, 'quantity': 6},
+        {'item_id': item_id, 'warehouse_id': 1, 'quantity': 100},
+        {'item_id': item_id, 'warehouse_id': 1, 'quantity': 10},
+    ]})
+    assert response.status_code == 200
+    first, second, third = response.json['lines']
+    assert [(b['batch_number'], b['quantity']) for b in first['batches']] == [('SOON', 4), ('LATE', 2)]
+    assert second['allocated'] == 0
+    assert [(b['batch_number'], b['quantity']) for b in third['batches']] == [('LATE', 8), ('NODATE', 2)]
+
+    statuses = {b['batch_number']: (b['quantity'], b['status']) for b in client.get('/api/batches', headers=headers).json}
+    assert statuses['SOON'] == (0, 'reserved')
+    assert statuses['NODATE'] == (8, 'available')
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['current_stock'] == 34 - 16
+
+    allocation = client.get(f'/api/allocations?item_id={item_id}', headers=headers).json[0]
+    assert client.delete(f"/api/allocations/{allocation['id']}", headers=headers).status_code == 200
+    statuses = {b['batch_number']: (b['quantity'], b['status']) for b in client.get('/api/batches', headers=headers).json}
+    assert statuses['SOON'] == (4, 'available')
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['current_stock'] == 34 - 12
+
+def test_allocate_fefo_pages_through_many_batches(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'FEFO_PAGE_SIZE', 3)
+    headers = auth_headers(client)
+    item_id = client.post('/api/items', headers=headers, json={'sku': 'SKU-P', 'name': 'Milk', 'unit_price': 1}).json['id']
+    start = datetime.now() + timedelta(days=1)
+    db.session.add_all([StockBatch(batch_number=f'P-{n}', item_id=item_id, warehouse_id=1, quantity=1,
+                                   unit_cost=1, expiry_date=start + timedelta(hours=n % 4))
+                        for n in range(10)])
+    db.session.get(Item, item_id).current_stock = 10
+    db.session.commit()
+
+    response = client.post('/api/allocations', headers=headers, json={
+        'lines': [{'item_id': item_id, 'warehouse_id': 1, 'quantity': 8}]
+    })
+    batches = response.json['lines'][0]['batches']
+    assert len(batches) == 8
+    assert [b['expiry_date'] for b in batches] == sorted(b['expiry_date'] for b in batches)
+
+def test_allocating_a_sale_order_reserves_its_stock_once(client):
+    headers = auth_headers(client)
+    item_id, so_ids = create_sale_orders(client, headers, stock=10, count=3, quantity=4)
+
+    lines = {'lines': [{'sale_order_id': so_ids[0]}]}
+    assert client.post('/api/allocations', headers=headers, json=lines).json['fully_allocated']
+    assert client.post('/api/allocations', headers=headers, json=lines).status_code == 409
+    duplicate = {'lines': [{'sale_order_id': so_ids[1]}, {'sale_order_id': so_ids[1]}]}
+    assert client.post('/api/allocations', headers=headers, json=duplicate).status_code == 400
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['current_stock'] == 6
+    assert client.get('/api/batches', headers=headers).json[0]['quantity'] == 6
+
+    # The reserved order ships without taking its stock a second time
+    assert client.put(f'/api/sale-orders/{so_ids[0]}/fulfill', headers=headers).status_code == 200
+    assert client.post('/api/allocations', headers=headers, json=lines).status_code == 400
+    allocation = client.get(f'/api/allocations?sale_order_id={so_ids[0]}', headers=headers).json[0]
+    assert client.delete(f"/api/allocations/{allocation['id']}", headers=headers).status_code == 400
+
+    response = client.post('/api/sale-orders/fulfill-batch', headers=headers, json={'sale_order_ids': so_ids[1:]})
+    assert [f['id'] for f in response.json['failed']] == [so_ids[2]]
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['current_stock'] == 2
+    assert reconcile_stock() == []
+
+def test_fulfilling_unallocated_orders_ships_from_batches_fefo(client):
+    headers = auth_headers(client)
+    item_id = client.post('/api/items', headers=headers, json={'sku': 'SKU-U', 'name': 'Milk', 'unit_price': 1}).json['id']
+    soon = datetime.now() + timedelta(days=2)
+    for number, quantity, expiry in (('LATE', 5, soon + timedelta(days=10)), ('SOON', 3, soon)):
+        db.session.add(StockBatch(batch_number=number, item_id=item_id, warehouse_id=1,
+                                  quantity=quantity, unit_cost=1, expiry_date=expiry))
+    db.session.get(Item, item_id).current_stock = 8
+    db.session.commit()
+    so_ids = [client.post('/api/sale-orders', headers=headers, json={
+        'so_number': f'SO-U{n}', 'customer_name': 'Acme', 'item_id': item_id,
+        'quantity': quantity, 'unit_price': 1, 'warehouse_id': 1
+    }).json['id'] for n, quantity in enumerate((4, 2))]
+
+    assert client.put(f'/api/sale-orders/{so_ids[0]}/fulfill', headers=headers).status_code == 200
+    batches = {b['batch_number']: b['quantity'] for b in client.get('/api/batches', headers=headers).json}
+    assert batches == {'SOON': 0, 'LATE': 4}
+    response = client.post('/api/sale-orders/fulfill-batch', headers=headers, json={'sale_order_ids': so_ids[1:]})
+    assert response.json['fulfilled'] == so_ids[1:]
+
+    batches = client.get('/api/batches', headers=headers).json
+    current_stock = client.get(f'/api/items/{item_id}', headers=headers).json['current_stock']
+    assert sum(b['quantity'] for b in batches) == current_stock == 2
+
+def test_movement_rollups_follow_receive_and_fulfill(client):
+    headers = auth_headers(client)
+    item_id, so_ids = create_sale_orders(client, headers, stock=10, count=3, quantity=2)
+    client.put(f'/api/items/{item_id}', headers=headers, json={'category': 'tools'})
+    po_id = client.post('/api/purchase-orders', headers=headers, json={
+        'po_number': 'PO-1', 'supplier_name': 'Supplier', 'item_id': item_id,
+        'quantity': 5, 'unit_cost': 3, 'warehouse_id': 1
+    }).json['id']
+
+    assert client.put(f'/api/purchase-orders/{po_id}/receive', headers=headers).status_code == 200
+    assert client.put(f'/api/purchase-orders/{po_id}/receive', headers=headers).status_code == 400
+    client.put(f'/api/sale-orders/{so_ids[0]}/fulfill', headers=headers)
+    client.post('/api/sale-orders/fulfill-batch', headers=headers, json={'sale_order_ids': so_ids[1:]})
+
+    response = client.get('/api/analytics/movement/trend?granularity=month&group_by=category', headers=headers)
+    assert response.status_code == 200
+    [bucket] = response.json['buckets']
+    assert bucket['period'] == date.today().replace(day=1).isoformat()
+    assert bucket['category'] == 'tools'
+    assert (bucket['received_orders'], bucket['received_quantity'], bucket['received_cost']) == (1, 5, 15.0)
+    assert (bucket['fulfilled_orders'], bucket['fulfilled_quantity'], bucket['revenue']) == (3, 6, 6.0)
+
+    rollups = [(r.received_quantity, r.fulfilled_quantity) for r in MovementRollup.query.all()]
+    rebuild_movement_rollups()
+    assert [(r.received_quantity, r.fulfilled_quantity) for r in MovementRollup.query.all()] == rollups
+
+def test_movement_trend_validates_range(client):
+    headers = auth_headers(client)
+    assert client.get('/api/analytics/movement/trend?granularity=year', headers=headers).status_code == 400
+    assert client.get('/api/analytics/movement/trend?from=2026-02-01&to=2026-01-01', headers=headers).status_code == 400
+    response = client.get('/api/analytics/movement/trend?from=2026-01-01&to=2026-01-31', headers=headers)
+    assert response.json['buckets'] == []
+
+def test_stock_ledger_records_every_stock_change(client):
+    headers = auth_headers(client)
+    item_id, so_ids = create_sale_orders(client, headers, stock=10, count=2, quantity=3)
+    po_id = client.post('/api/purchase-orders', headers=headers, json={
+        'po_number': 'PO-L', 'supplier_name': 'Supplier', 'item_id': item_id,
+        'quantity': 5, 'unit_cost': 1, 'warehouse_id': 1
+    }).json['id']
+    client.put(f'/api/purchase-orders/{po_id}/receive', headers=headers)
+    client.put(f'/api/sale-orders/{so_ids[0]}/fulfill', headers=headers)
+    client.post('/api/sale-orders/fulfill-batch', headers=headers, json={'sale_order_ids': so_ids[1:]})
+    assert client.post(f'/api/items/{item_id}/adjust', headers=headers, json={'quantity': -100}).status_code == 400
+    response = client.post(f'/api/items/{item_id}/adjust', headers=headers, json={'quantity': -2, 'reason': 'damaged'})
+    assert response.json['current_stock'] == 2
+
+    movements = client.get(f'/api/items/{item_id}/movements', headers=headers).json['movements']
+    assert [(m['movement_type'], m['quantity']) for m in reversed(movements)] == [
+        ('batch', 10), ('fulfill', -3), ('fulfill', -3), ('adjust', -2)
+    ]
+    assert reconcile_stock() == []
+
+def test_stock_at_uses_snapshot_plus_delta(client):
+    headers = auth_headers(client)
+    item_id, _ = create_sale_orders(client, headers, stock=10, count=0)
+    assert take_stock_snapshots() == 1
+    client.post(f'/api/items/{item_id}/adjust', headers=headers, json={'quantity': 4})
+
+    at = (datetime.utcnow() + timedelta(minutes=1)).isoformat()
+    response = client.get(f'/api/items/{item_id}/stock-at?at={at}', headers=headers)
+    assert response.json['quantity'] == 14
+    assert response.json['snapshot_id'] is not None
+    assert response.json['movements_scanned'] == 1
+
+    # Before the first snapshot the scan stops at the movements that snapshot covers
+    before = (datetime.utcnow() - timedelta(days=1)).isoformat()
+    response = client.get(f'/api/items/{item_id}/stock-at?at={before}', headers=headers)
+    assert (response.json['quantity'], response.json['movements_scanned']) == (0, 0)
+    assert client.get(f'/api/items/{item_id}/stock-at', headers=headers).status_code == 400
+
+def test_reconciliation_reports_drift_and_opening_balances(client):
+    headers = auth_headers(client)
+    item_id, _ = create_sale_orders(client, headers, stock=10, count=0)
+    legacy = Item(sku='LEGACY', name='Old stock', unit_price=1, current_stock=7)
+    db.session.add(legacy)
+    db.session.commit()
+    assert [row['sku'] for row in reconcile_stock()] == ['LEGACY']
+
+    take_stock_snapshots()
+    assert reconcile_stock() == []
+
+    db.session.execute(db.update(Item).where(Item.id == item_id).values(current_stock=12))
+    db.session.commit()
+    response = client.get('/api/analytics/stock-reconciliation', headers=headers)
+    assert response.json['items'] == [
+        {'item_id': item_id, 'sku': 'SKU-SO', 'current_stock': 12, 'ledger_stock': 10, 'drift': 2}
+    ]
+
+def test_sku_lookup_serves_from_index_and_sees_commits(client):
+    sku_index.clear()
+    headers = auth_headers(client)
+    item_id, so_ids = create_sale_orders(client, headers, stock=10, count=1, quantity=4)
+
+    response = client.get('/api/items/lookup?sku=SKU-SO', headers=headers)
+    assert response.status_code == 200
+    assert (response.json['id'], response.json['current_stock']) == (item_id, 10)
+    assert client.get('/api/items/lookup?sku=NOPE', headers=headers).status_code == 404
+
+    # Core UPDATEs on the stock path invalidate the index at commit time
+    client.put(f'/api/sale-orders/{so_ids[0]}/fulfill', headers=headers)
+    assert client.get('/api/items/lookup?sku=SKU-SO', headers=headers).json['current_stock'] == 6
+
+    client.post('/api/items', headers=headers, json={'sku': 'SKU-NEW', 'name': 'New', 'unit_price': 2})
+    response = client.post('/api/items/lookup', headers=headers, json={'skus': ['SKU-NEW', 'SKU-SO', 'NOPE']})
+    assert [i['sku'] for i in response.json['items']] == ['SKU-NEW', 'SKU-SO']
+    assert response.json['missing'] == ['NOPE']
+
+def test_sku_index_polls_for_other_workers(client, monkeypatch):
+    sku_index.clear()
+    headers = auth_headers(client)
+    client.post('/api/items', headers=headers, json={'sku': 'SKU-W', 'name': 'Widget', 'unit_price': 1})
+    assert client.get('/api/items/lookup?sku=SKU-W', headers=headers).json['name'] == 'Widget'
+
+    # A write from another process is only seen once the poll interval lapses
+    with db.engine.begin() as conn:
+        conn.execute(db.update(Item).where(Item.sku == 'SKU-W').values(name='Renamed'))
+    monkeypatch.setitem(app.config, 'SKU_INDEX_POLL_SECONDS', 3600)
+    assert client.get('/api/items/lookup?sku=SKU-W', headers=headers).json['name'] == 'Widget'
+    monkeypatch.setitem(app.config, 'SKU_INDEX_POLL_SECONDS', 0)
+    assert client.get('/api/items/lookup?sku=SKU-W', headers=headers).json['name'] == 'Renamed'
+
+def test_forecast_demand_picks_croston_for_intermittent_rows():
+    demand = np.array([
+        [10, 10, 10, 10, 10, 10],
+        [0, 0, 12, 0, 0, 12],
+        [0, 0, 0, 0, 0, 0],
+    ], dtype=float)
+    forecast, sigma, is_croston = forecast_demand(demand, alpha=0.5)
+    assert is_croston.tolist() == [False, True, True]
+    assert forecast[0] == pytest.approx(10)
+    assert forecast[1] == pytest.approx(0.75 * 12 / 3)
+    assert forecast[2] == 0
+    assert sigma[0] == 0
+
+def test_forecast_sharded_matches_single_process():
+    demand = np.random.default_rng(7).poisson(0.6, size=(2400, 30)).astype(float)
+    single = forecast_demand(demand)
+    sharded = forecast_sharded(demand, workers=2)
+    for a, b in zip(single, sharded):
+        assert np.allclose(a, b)
+
+def test_plan_reorders_writes_suggestions_and_drafts(client):
+    headers = auth_headers(client)
+    item_id, so_ids = create_sale_orders(client, headers, stock=40, count=8, quantity=5)
+    client.post('/api/sale-orders/fulfill-batch', headers=headers, json={'sale_order_ids': so_ids})
+
+    summary = plan_reorders(history_days=28, lead_time_days=14)
+    assert summary == {'items_forecast': 1, 'draft_purchase_orders': 1}
+    suggestion = client.get('/api/reorder-suggestions', headers=headers).json['suggestions'][0]
+    assert suggestion['sku'] == 'SKU-SO'
+    assert suggestion['suggested_reorder_level'] > 0
+    assert PurchaseOrder.query.filter_by(item_id=item_id, status='draft').count() == 1
+
+    # An open draft suppresses a second one
+    assert plan_reorders(history_days=28)['draft_purchase_orders'] == 0
+
+    response = client.post('/api/reorder-suggestions/apply', headers=headers, json={'item_ids': [item_id]})
+    assert response.json['updated'] == 1
+    assert client.get(f'/api/items/{item_id}', headers=headers).json['reorder_level'] == suggestion['suggested_reorder_level']
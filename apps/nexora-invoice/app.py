@@ -1,16 +1,35 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from functools import wraps
+from functools import lru_cache, wraps
 import os
 from datetime import timedelta, datetime
 from decimal import Decimal
+import hashlib
 import io
+import json
+import tempfile
+import sys
+import threading
+import zipfile
 
 # PDF generation
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
+from reportlab.lib.rl_accel import escapePDF
+from reportlab import rl_config
+
+# Add parent directory to path for imports
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APPS_DIR = os.path.abspath(os.path.join(BASE_DIR, '..'))
+COMMON_DIR = os.path.abspath(os.path.join(APPS_DIR, '..', 'common'))
+sys.path.insert(0, COMMON_DIR)
+
+from utils.parallel import parallel_map
+from utils.sequences import SequenceAllocator, format_number, sequence_table
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -20,6 +39,20 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///app
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET', 'dev-secret-key-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+app.config['INVOICE_PDF_CACHE_DIR'] = os.getenv('INVOICE_PDF_CACHE_DIR', os.path.join(app.instance_path, 'pdf-cache'))
+app.config['INVOICE_PDF_CACHE_MAX_BYTES'] = int(os.getenv('INVOICE_PDF_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+app.config['INVOICE_PDF_PRERENDER'] = os.getenv('INVOICE_PDF_PRERENDER', '').lower() in ('1', 'true', 'yes')
+app.config['INVOICE_EXPORT_WORKERS'] = int(os.getenv('INVOICE_EXPORT_WORKERS', os.cpu_count() or 1))
+app.config['INVOICE_EXPORT_SYNC_MAX'] = int(os.getenv('INVOICE_EXPORT_SYNC_MAX', 5000))  # larger exports must use a job
+# Invoices created without an invoice_number are numbered PREFIX-000001, ...:
+# 'gapless' takes the number in the invoice's own transaction (no holes, one
+# writer at a time); 'block' reserves numbers per worker (faster, may skip).
+app.config['INVOICE_NUMBER_PREFIX'] = os.getenv('INVOICE_NUMBER_PREFIX', 'INV')
+app.config['INVOICE_NUMBER_MODE'] = os.getenv('INVOICE_NUMBER_MODE', 'gapless')
+app.config['INVOICE_PAYMENT_TERMS_DAYS'] = int(os.getenv('INVOICE_PAYMENT_TERMS_DAYS', 30))  # due date when none is given
+app.config['INVOICE_EXPORT_DIR'] = os.getenv('INVOICE_EXPORT_DIR', os.path.join(app.instance_path, 'exports'))
+# An export whose worker has not reported progress for this long is marked failed
+app.config['INVOICE_EXPORT_STALE_SECONDS'] = int(os.getenv('INVOICE_EXPORT_STALE_SECONDS', 600))
 
 # Initialize extensions
 db = SQLAlchemy(app)
@@ -267,40 +300,70 @@ class Item(db.Model):
         }
 
 
+def default_due_date(context):
+    """Invoice date (or now) plus INVOICE_PAYMENT_TERMS_DAYS, for invoices inserted without a due_date"""
+    issued = context.get_current_parameters().get('date')
+    if not isinstance(issued, datetime):
+        issued = datetime.utcnow()
+    return issued + timedelta(days=app.config['INVOICE_PAYMENT_TERMS_DAYS'])
+
+
 class Invoice(db.Model):
     __tablename__ = 'invoices'
+    __table_args__ = (
+        db.Index('ix_invoices_customer_date', 'customer_id', 'date'),
+        # Invoices that still have a balance; AR aging reads nothing but this index
+        db.Index('ix_invoices_open', 'customer_id', 'due_date', 'balance_due',
+                 sqlite_where=db.text('balance_due <> 0'), postgresql_where=db.text('balance_due <> 0')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     invoice_number = db.Column(db.String(80), unique=True, nullable=False)
     customer_id = db.Column(db.Integer, db.ForeignKey('invoice_customers.id'))
     date = db.Column(db.DateTime, default=db.func.now())
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=db.func.now())
+    # Maintained from the invoice's lines by refresh_invoice_totals() in the flush that changes them
+    subtotal = db.Column(db.Numeric(12,2), default=0, server_default='0', nullable=False)
+    tax_total = db.Column(db.Numeric(12,2), default=0, server_default='0', nullable=False)
+    grand_total = db.Column(db.Numeric(12,2), default=0, server_default='0', nullable=False, index=True)
+    line_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    due_date = db.Column(db.DateTime, default=default_due_date)
+    # Maintained with the totals, from the invoice's payments
+    amount_paid = db.Column(db.Numeric(12,2), default=0, server_default='0', nullable=False)
+    balance_due = db.Column(db.Numeric(12,2), default=0, server_default='0', nullable=False)
 
     customer = db.relationship('Customer', backref=db.backref('invoices', lazy=True))
 
-    def to_dict(self):
-        items = [ii.to_dict() for ii in self.items]
-        subtotal = sum(Decimal(ii['total']) for ii in items) if items else Decimal('0')
-        return {
+    def to_dict(self, include_items=True):
+        data = {
             'id': self.id,
             'invoice_number': self.invoice_number,
             'customer_id': self.customer_id,
             'date': self.date.isoformat() if self.date else None,
             'notes': self.notes,
-            'items': items,
-            'subtotal': str(subtotal),
+            'subtotal': str(self.subtotal),
+            'tax_total': str(self.tax_total),
+            'grand_total': str(self.grand_total),
+            'line_count': self.line_count,
+            'due_date': self.due_date.isoformat() if self.due_date else None,
+            'amount_paid': str(self.amount_paid),
+            'balance_due': str(self.balance_due),
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+        if include_items:
+            data['items'] = [ii.to_dict() for ii in self.items]
+        return data
 
 
 class InvoiceItem(db.Model):
     __tablename__ = 'invoice_invoice_items'
     id = db.Column(db.Integer, primary_key=True)
-    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'))
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), index=True)
     item_id = db.Column(db.Integer, db.ForeignKey('invoice_items.id'))
     description = db.Column(db.Text)
     quantity = db.Column(db.Integer, default=1)
     unit_price = db.Column(db.Numeric(12,2), default=0)
+    tax_rate = db.Column(db.Numeric(5,2), default=0, server_default='0')  # percent
 
     invoice = db.relationship('Invoice', backref=db.backref('items', lazy=True))
     item = db.relationship('Item')
@@ -314,7 +377,85 @@ class InvoiceItem(db.Model):
             'description': self.description,
             'quantity': self.quantity,
             'unit_price': str(self.unit_price),
-            'total': str(total)
+            'tax_rate': str(self.tax_rate or 0),
+            'total': str(total),
+            'tax': str((total * Decimal(str(self.tax_rate or 0)) / 100).quantize(Decimal('0.01'))),
+        }
+
+
+class InvoicePayment(db.Model):
+    __tablename__ = 'invoice_payments'
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False, index=True)
+    amount = db.Column(db.Numeric(12,2), nullable=False)
+    paid_at = db.Column(db.DateTime, default=db.func.now(), nullable=False)
+    reference = db.Column(db.String(120))
+    created_at = db.Column(db.DateTime, default=db.func.now())
+
+    invoice = db.relationship('Invoice', backref=db.backref('payments', lazy=True))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'invoice_id': self.invoice_id,
+            'amount': str(self.amount),
+            'paid_at': self.paid_at.isoformat() if self.paid_at else None,
+            'reference': self.reference,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+def first_free_invoice_number(connection, tenant, prefix):
+    """One past the highest PREFIX-<digits> invoice number already issued, so a new sequence never collides"""
+    numbers = connection.execute(db.select(Invoice.invoice_number)
+                                 .where(Invoice.invoice_number.like(f'{prefix}-%'))).scalars()
+    return max((int(number[len(prefix) + 1:]) for number in numbers if number[len(prefix) + 1:].isdigit()),
+               default=0) + 1
+
+
+number_sequences = sequence_table(db.metadata)
+invoice_numbers = SequenceAllocator(lambda: db.engine, number_sequences, block_size=20,
+                                    start=first_free_invoice_number)
+
+
+def next_invoice_number():
+    """Allocate the next invoice number in the configured INVOICE_NUMBER_MODE, skipping numbers supplied by clients"""
+    prefix = app.config['INVOICE_NUMBER_PREFIX']
+    while True:
+        if app.config['INVOICE_NUMBER_MODE'] == 'block':
+            number = format_number(prefix, invoice_numbers.allocate(prefix))
+        else:
+            number = format_number(prefix, invoice_numbers.allocate_gapless(db.session.connection(), prefix))
+        if not db.session.query(Invoice.query.filter_by(invoice_number=number).exists()).scalar():
+            return number
+
+
+class InvoiceExport(db.Model):
+    """A bulk PDF export job; the ZIP is written to INVOICE_EXPORT_DIR by a background thread"""
+    __tablename__ = 'invoice_exports'
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed
+    filters = db.Column(db.Text)  # JSON, as returned by parse_invoice_filter()
+    total = db.Column(db.Integer, default=0)
+    completed = db.Column(db.Integer, default=0)
+    path = db.Column(db.String(500))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    heartbeat_at = db.Column(db.DateTime)  # last progress report from the export thread
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'filters': json.loads(self.filters or '{}'),
+            'total': self.total,
+            'completed': self.completed,
+            'progress': round(self.completed / self.total, 4) if self.total else (1.0 if self.status == 'done' else 0.0),
+            'error': self.error,
+            'download_url': f'/api/invoice/exports/{self.id}/download' if self.status == 'done' else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
         }
 
 
@@ -417,11 +558,228 @@ def delete_invoice_item(item_id):
     return jsonify({'message': 'item deleted'}), 200
 
 
+# Invoice totals
+#
+# subtotal, tax_total, grand_total and line_count are kept on the invoice row
+# so lists, filters and sums never read line items. Every flush that adds,
+# changes or removes an InvoiceItem recomputes its invoices' totals from their
+# lines in SQL, inside the same transaction. amount_paid and balance_due are
+# recomputed the same way from InvoicePayment rows.
+
+INVOICE_TOTAL_FIELDS = ('subtotal', 'tax_total', 'grand_total', 'line_count', 'amount_paid', 'balance_due')
+
+
+def line_amounts(lines):
+    """(subtotal, tax, line count) aggregate expressions over invoice line rows ``lines``"""
+    amount = lines.c.quantity * lines.c.unit_price
+    tax = db.func.round(amount * db.func.coalesce(lines.c.tax_rate, 0) / 100, 2)
+    return (db.func.round(db.func.coalesce(db.func.sum(amount), 0), 2),
+            db.func.coalesce(db.func.sum(tax), 0),
+            db.func.count(lines.c.id))
+
+
+def refresh_invoice_totals(connection, invoice_ids=None):
+    """Recompute the stored totals of ``invoice_ids`` (all invoices when None) from their lines and payments."""
+    invoices, lines, payments = Invoice.__table__, InvoiceItem.__table__, InvoicePayment.__table__
+    if invoice_ids is not None:
+        # Lock first: on Postgres the UPDATE's subqueries then see lines committed by whoever held the lock
+        connection.execute(db.select(invoices.c.id).where(invoices.c.id.in_(sorted(invoice_ids)))
+                           .order_by(invoices.c.id).with_for_update())
+    subtotal, tax, count = (
+        db.select(expr).where(lines.c.invoice_id == invoices.c.id).scalar_subquery()
+        for expr in line_amounts(lines)
+    )
+    paid = db.select(db.func.round(db.func.coalesce(db.func.sum(payments.c.amount), 0), 2)) \
+        .where(payments.c.invoice_id == invoices.c.id).scalar_subquery()
+    statement = db.update(invoices).values(subtotal=subtotal, tax_total=tax, grand_total=subtotal + tax, line_count=count,
+                                           amount_paid=paid, balance_due=subtotal + tax - paid)
+    if invoice_ids is not None:
+        statement = statement.where(invoices.c.id.in_(invoice_ids))
+    return connection.execute(statement).rowcount
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_invoice_total_changes(session, flush_context):
+    invoice_ids = session.info.setdefault('invoice_totals_stale', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (InvoiceItem, InvoicePayment)) and (obj not in session.dirty or session.is_modified(obj)):
+            invoice_ids.add(obj.invoice_id)
+            invoice_ids.update(db.inspect(obj).attrs.invoice_id.history.deleted)
+    invoice_ids.discard(None)
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def refresh_changed_invoice_totals(session, flush_context):
+    invoice_ids = session.info.pop('invoice_totals_stale', None)
+    if invoice_ids:
+        refresh_invoice_totals(session.connection(), invoice_ids)
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, Invoice) and obj.id in invoice_ids:
+                session.expire(obj, INVOICE_TOTAL_FIELDS)
+
+
+def reconcile_invoice_totals():
+    """Invoices whose stored totals disagree with their lines, found in one aggregated query"""
+    lines = InvoiceItem.__table__
+    subtotal, tax, count = line_amounts(lines)
+    computed = db.select(lines.c.invoice_id, subtotal.label('subtotal'), tax.label('tax_total'),
+                         count.label('line_count')).group_by(lines.c.invoice_id).subquery()
+    expected_subtotal = db.func.coalesce(computed.c.subtotal, 0)
+    expected_tax = db.func.coalesce(computed.c.tax_total, 0)
+    expected_count = db.func.coalesce(computed.c.line_count, 0)
+    rows = db.session.query(
+        Invoice.id, Invoice.invoice_number, Invoice.subtotal, Invoice.tax_total, Invoice.line_count,
+        expected_subtotal, expected_tax, expected_count
+    ).outerjoin(computed, computed.c.invoice_id == Invoice.id).filter(db.or_(
+        db.func.abs(Invoice.subtotal - expected_subtotal) >= 0.005,
+        db.func.abs(Invoice.tax_total - expected_tax) >= 0.005,
+        db.func.abs(Invoice.grand_total - Invoice.subtotal - Invoice.tax_total) >= 0.005,
+        db.func.abs(Invoice.balance_due - Invoice.grand_total + Invoice.amount_paid) >= 0.005,
+        Invoice.line_count != expected_count,
+    )).all()
+    return [{
+        'invoice_id': invoice_id,
+        'invoice_number': number,
+        'stored': {'subtotal': str(stored_subtotal), 'tax_total': str(stored_tax), 'line_count': stored_count},
+        'lines': {'subtotal': str(round(Decimal(str(line_subtotal)), 2)), 'tax_total': str(round(Decimal(str(line_tax)), 2)),
+                  'line_count': line_count},
+    } for invoice_id, number, stored_subtotal, stored_tax, stored_count, line_subtotal, line_tax, line_count in rows]
+
+
+def backfill_invoice_totals(batch_size=10000):
+    """Recompute every invoice's totals, a committed id range at a time"""
+    last_id, updated = 0, 0
+    while True:
+        ids = [row.id for row in db.session.query(Invoice.id).filter(Invoice.id > last_id)
+               .order_by(Invoice.id).limit(batch_size)]
+        if not ids:
+            return updated
+        updated += refresh_invoice_totals(db.session.connection(), ids)
+        db.session.commit()
+        last_id = ids[-1]
+
+
+@app.cli.command('backfill-invoice-totals')
+def backfill_invoice_totals_command():
+    """Recompute stored invoice totals from invoice lines"""
+    print(f'Recomputed totals of {backfill_invoice_totals()} invoices')
+
+
+def backfill_columns(added):
+    """
+    Fill columns that scripts/migrate_indexes.py just added to an existing database.
+
+    ``added`` holds the (table, column) names it added. New total columns come
+    in at their server default of 0 and are recomputed from the lines and
+    payments; a new due_date is the invoice date plus INVOICE_PAYMENT_TERMS_DAYS,
+    as default_due_date() gives new invoices.
+    """
+    if ('invoices', 'due_date') in added:
+        invoices = Invoice.__table__
+        issued = db.func.coalesce(invoices.c.date, invoices.c.created_at)
+        terms = app.config['INVOICE_PAYMENT_TERMS_DAYS']
+        due = db.func.datetime(issued, f'+{terms} days') if db.engine.dialect.name == 'sqlite' \
+            else issued + timedelta(days=terms)
+        result = db.session.execute(db.update(invoices).where(invoices.c.due_date.is_(None))
+                                    .values(due_date=due))
+        db.session.commit()
+        print(f'Set the due date of {result.rowcount} invoices')
+    totals = {('invoices', field) for field in INVOICE_TOTAL_FIELDS}
+    if totals & added or ('invoice_invoice_items', 'tax_rate') in added:
+        print(f'Recomputed totals of {backfill_invoice_totals()} invoices')
+
+
+@app.cli.command('reconcile-invoice-totals')
+def reconcile_invoice_totals_command():
+    """Report invoices whose stored totals drifted from their lines"""
+    drift = reconcile_invoice_totals()
+    for row in drift:
+        print(f"{row['invoice_number']}: stored={row['stored']} lines={row['lines']}")
+    print(f'{len(drift)} invoices out of balance')
+
+
 # Invoice endpoints
+
+def parse_invoice_filter(values):
+    """Normalise from/to/customer_ids/min_total/max_total from query args or a JSON body; raises ValueError or ArithmeticError"""
+    filters = {}
+    if values.get('from'):
+        filters['from'] = datetime.fromisoformat(str(values['from'])).isoformat()
+    if values.get('to'):
+        to = str(values['to'])
+        before = datetime.fromisoformat(to)
+        if len(to) == 10:  # a bare date includes the whole day
+            before += timedelta(days=1)
+        filters['before'] = before.isoformat()
+    customer_ids = values.get('customer_ids')
+    if customer_ids:
+        if isinstance(customer_ids, str):
+            customer_ids = customer_ids.split(',')
+        filters['customer_ids'] = sorted({int(c) for c in customer_ids})
+    for bound in ('min_total', 'max_total'):
+        if values.get(bound) not in (None, ''):
+            filters[bound] = str(Decimal(str(values[bound])))
+    return filters
+
+
+def filtered_invoices(filters):
+    query = Invoice.query
+    if 'from' in filters:
+        query = query.filter(Invoice.date >= datetime.fromisoformat(filters['from']))
+    if 'before' in filters:
+        query = query.filter(Invoice.date < datetime.fromisoformat(filters['before']))
+    if 'customer_ids' in filters:
+        query = query.filter(Invoice.customer_id.in_(filters['customer_ids']))
+    if 'min_total' in filters:
+        query = query.filter(Invoice.grand_total >= Decimal(filters['min_total']))
+    if 'max_total' in filters:
+        query = query.filter(Invoice.grand_total <= Decimal(filters['max_total']))
+    return query
+
+
+INVOICE_SORTS = {
+    'created_at': Invoice.created_at,
+    'date': Invoice.date,
+    'invoice_number': Invoice.invoice_number,
+    'grand_total': Invoice.grand_total,
+}
+
+
 @app.route('/api/invoice/invoices', methods=['GET'])
 def list_invoices():
-    invoices = Invoice.query.order_by(Invoice.created_at.desc()).all()
-    return jsonify([inv.to_dict() for inv in invoices]), 200
+    """Invoices filtered by ?from=&to=&customer_ids=&min_total=&max_total=, sorted by ?sort=[-]field"""
+    try:
+        filters = parse_invoice_filter(request.args)
+    except (TypeError, ValueError, ArithmeticError):
+        return jsonify({'error': 'invalid filter'}), 400
+    sort = request.args.get('sort', '-created_at')
+    column = INVOICE_SORTS.get(sort.lstrip('-'))
+    if column is None:
+        return jsonify({'error': f"sort must be one of {', '.join(INVOICE_SORTS)}, optionally prefixed with -"}), 400
+    query = filtered_invoices(filters).order_by(column.desc() if sort.startswith('-') else column, Invoice.id)
+    include_items = 'items' in request.args.get('include', '').split(',')
+    if include_items:
+        query = query.options(db.selectinload(Invoice.items))
+    return jsonify([inv.to_dict(include_items=include_items) for inv in query]), 200
+
+
+@app.route('/api/invoice/invoices/summary', methods=['GET'])
+def invoice_summary():
+    """Count and amount sums of the invoices matching the list filters"""
+    try:
+        filters = parse_invoice_filter(request.args)
+    except (TypeError, ValueError, ArithmeticError):
+        return jsonify({'error': 'invalid filter'}), 400
+    count, subtotal, tax_total, grand_total = filtered_invoices(filters).with_entities(
+        db.func.count(Invoice.id), db.func.sum(Invoice.subtotal), db.func.sum(Invoice.tax_total),
+        db.func.sum(Invoice.grand_total)
+    ).one()
+    return jsonify({
+        'count': count,
+        'subtotal': str(round(Decimal(str(subtotal or 0)), 2)),
+        'tax_total': str(round(Decimal(str(tax_total or 0)), 2)),
+        'grand_total': str(round(Decimal(str(grand_total or 0)), 2)),
+    }), 200
 
 
 @app.route('/api/invoice/invoices/<int:invoice_id>', methods=['GET'])
@@ -433,11 +791,20 @@ def get_invoice(invoice_id):
 @app.route('/api/invoice/invoices', methods=['POST'])
 def create_invoice():
     data = request.get_json() or {}
-    if not data.get('invoice_number') or not data.get('customer_id'):
-        return jsonify({'error': 'invoice_number and customer_id required'}), 400
-    inv = Invoice(invoice_number=data['invoice_number'], customer_id=data['customer_id'], notes=data.get('notes'))
+    if not data.get('customer_id'):
+        return jsonify({'error': 'customer_id required'}), 400
+    try:
+        dates = {'due_date': datetime.fromisoformat(data['due_date'])} if data.get('due_date') else {}
+    except (TypeError, ValueError):
+        return jsonify({'error': 'due_date must be an ISO date'}), 400
+    invoice_number = data.get('invoice_number') or next_invoice_number()
+    inv = Invoice(invoice_number=invoice_number, customer_id=data['customer_id'], notes=data.get('notes'), **dates)
     db.session.add(inv)
-    db.session.flush()  # get id before adding items
+    try:
+        db.session.flush()  # get id before adding items
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': f'invoice number {invoice_number} already exists'}), 409
 
     items = data.get('items', [])
     for it in items:
@@ -445,87 +812,875 @@ def create_invoice():
             unit_price = Decimal(str(it.get('unit_price', '0')))
         except Exception:
             unit_price = Decimal('0')
+        try:
+            tax_rate = Decimal(str(it.get('tax_rate', '0')))
+        except Exception:
+            tax_rate = Decimal('0')
         qty = int(it.get('quantity', 1))
         desc = it.get('description') or it.get('name') or ''
-        ii = InvoiceItem(invoice_id=inv.id, item_id=it.get('item_id'), description=desc, quantity=qty, unit_price=unit_price)
+        ii = InvoiceItem(invoice_id=inv.id, item_id=it.get('item_id'), description=desc, quantity=qty,
+                         unit_price=unit_price, tax_rate=tax_rate)
         db.session.add(ii)
 
     db.session.commit()
+    if app.config['INVOICE_PDF_PRERENDER']:
+        try:
+            cached_invoice_pdf(inv)[1].close()
+        except Exception as exc:  # the invoice is saved; the first download just renders it
+            app.logger.warning('invoice PDF pre-render failed: %s', exc)
     return jsonify(inv.to_dict()), 201
 
 
-@app.route('/api/invoice/invoices/<int:invoice_id>/pdf', methods=['GET'])
-def invoice_pdf(invoice_id):
-    inv = Invoice.query.get_or_404(invoice_id)
-    # Build PDF in-memory
+# PDF rendering & render cache
+#
+# Rendered PDFs are stored on disk under the SHA-256 of everything the render
+# reads (the invoice, its lines, its customer and INVOICE_PDF_TEMPLATE), so an
+# edit always yields a new key and a stale PDF is never served. Committed edits
+# also delete the invoice's previous file straight away rather than leaving it
+# for eviction.
+
+INVOICE_PDF_TEMPLATE = '3'  # bump whenever render_invoice_pdf() output changes
+
+
+def invoice_pdf_data(inv):
+    """Plain, picklable snapshot of everything render_invoice_pdf() reads"""
+    customer = inv.customer
+    return {
+        'id': inv.id,
+        'invoice_number': inv.invoice_number,
+        'date': inv.date.isoformat() if inv.date else None,
+        'notes': inv.notes,
+        'subtotal': str(inv.subtotal),
+        'tax_total': str(inv.tax_total),
+        'grand_total': str(inv.grand_total),
+        'customer': {'name': customer.name, 'address': customer.address} if customer else None,
+        'items': [
+            {'quantity': ii.quantity, 'description': ii.description, 'unit_price': str(ii.unit_price)}
+            for ii in sorted(inv.items, key=lambda ii: ii.id)
+        ],
+    }
+
+
+def invoice_pdf_key(data):
+    """Content hash of an invoice_pdf_data() snapshot and the template version"""
+    payload = json.dumps([INVOICE_PDF_TEMPLATE, data], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def invoice_pdf_filename(invoice_number):
+    return f"invoice_{invoice_number}.pdf".replace('/', '_')
+
+
+def pdf_string(text):
+    """``text`` as the body of a PDF literal string in the standard fonts' WinAnsi encoding"""
+    if text.isascii() and text.isprintable():
+        return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return escapePDF(text.encode('cp1252', 'replace'))
+
+
+binary_streams_lock = threading.Lock()
+
+
+def save_pdf(p):
+    """
+    Save canvas ``p`` with binary Flate content streams rather than
+    ASCII85-armoured Flate: the files are a fifth smaller and skip a
+    pure-Python base85 pass over every page.
+
+    reportlab has no per-canvas switch for this. rl_config.useA85 is read only
+    while save() formats the document, so it is turned off for that call alone
+    and restored afterwards; the lock keeps concurrent saves from interleaving.
+    """
+    with binary_streams_lock:
+        use_a85 = rl_config.useA85
+        rl_config.useA85 = 0
+        try:
+            p.save()
+        finally:
+            rl_config.useA85 = use_a85
+
+
+class InvoiceLayout:
+    """
+    Page geometry and static furniture of one INVOICE_PDF_TEMPLATE version,
+    built once per process by invoice_layout().
+
+    Each document draws the furniture (column titles with their rule, the
+    footer rule) once into form XObjects and places them on every page, so
+    continuation pages repeat the table header. Line rows are written as one
+    preformatted text object per page instead of a drawString per cell, and
+    pages that continue carry the running subtotal forward.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.width, self.height = A4
+        self.margin = 20 * mm
+        self.leading = 14
+        self.columns = tuple(self.margin + offset * mm for offset in (0, 30, 110, 140))
+        self.row_x = tuple(f'{x:.2f}' for x in self.columns)
+        self.first_header_y = self.height - self.margin - 90  # column titles on the first page
+        self.next_header_y = self.height - self.margin - 30  # and on continuation pages
+        self.lowest_row_y = self.margin + 40  # above the carried-forward line and the footer
+        self.totals_height = 100  # subtotal, tax, total and notes on the last page
+
+    def first_row_y(self, page):
+        # Continuation pages start with a brought-forward line
+        return self.first_header_y - 18 if page == 1 else self.next_header_y - 32
+
+    def capacity(self, page, reserve=0):
+        return int((self.first_row_y(page) - self.lowest_row_y - reserve) // self.leading) + 1
+
+    def paginate(self, rows):
+        """[(start, stop)] row ranges per page; the last page keeps room for the totals and at least one row."""
+        pages, start, page = [], 0, 1
+        while rows - start > self.capacity(page, self.totals_height):
+            take = min(self.capacity(page), rows - start - 1)
+            pages.append((start, start + take))
+            start += take
+            page += 1
+        pages.append((start, rows))
+        return pages
+
+    def define_forms(self, p):
+        p.beginForm('invoice-columns', 0, -10, self.width, 20)
+        p.setFont('Helvetica-Bold', 10)
+        for x, title in zip(self.columns, ('Qty', 'Description', 'Unit', 'Total')):
+            p.drawString(x, 0, title)
+        p.setLineWidth(0.5)
+        p.line(self.margin, -4, self.width - self.margin, -4)
+        p.endForm()
+
+        p.beginForm('invoice-footer')
+        p.setLineWidth(0.5)
+        p.line(self.margin, self.margin + 14, self.width - self.margin, self.margin + 14)
+        p.endForm()
+
+    def start_page(self, p, data, page, pages, brought_forward):
+        p.doForm('invoice-footer')
+        p.setFont('Helvetica', 8)
+        p.drawRightString(self.width - self.margin, self.margin + 2, f'Page {page} of {pages}')
+        x, y = self.margin, self.height - self.margin
+        if page == 1:
+            p.setFont('Helvetica-Bold', 16)
+            p.drawString(x, y, f"Invoice: {data['invoice_number']}")
+            p.setFont('Helvetica', 10)
+            p.drawString(x, y - 18, f"Date: {(data['date'] or '')[:10]}")
+            customer = data['customer']
+            if customer:
+                p.drawString(x, y - 36, f"Bill To: {customer['name']}")
+                if customer['address']:
+                    p.drawString(x, y - 50, customer['address'][:100])
+            header_y = self.first_header_y
+        else:
+            p.setFont('Helvetica-Bold', 12)
+            p.drawString(x, y, f"Invoice: {data['invoice_number']} (continued)")
+            header_y = self.next_header_y
+        p.saveState()
+        p.translate(0, header_y)
+        p.doForm('invoice-columns')
+        p.restoreState()
+        if page > 1:
+            p.setFont('Helvetica-Oblique', 10)
+            p.drawString(self.columns[2], header_y - 18, 'Brought forward:')
+            p.drawString(self.columns[3], header_y - 18, str(brought_forward))
+
+    def rows_literal(self, rows, y):
+        """
+        One text object drawing ``rows`` of pre-escaped cells from baseline ``y``
+        down, in the font last set on the canvas: the font is graphics state, so
+        it carries into this text object.
+        """
+        code = ['BT']
+        for qty, description, unit, total in rows:
+            code.append(f'1 0 0 1 {self.row_x[0]} {y:.2f} Tm ({qty}) Tj 1 0 0 1 {self.row_x[1]} {y:.2f} Tm ({description}) Tj '
+                        f'1 0 0 1 {self.row_x[2]} {y:.2f} Tm ({unit}) Tj 1 0 0 1 {self.row_x[3]} {y:.2f} Tm ({total}) Tj')
+            y -= self.leading
+        code.append('ET')
+        return '\n'.join(code)
+
+    def carry_forward(self, p, subtotal):
+        p.setFont('Helvetica-Oblique', 10)
+        p.drawString(self.columns[2], self.margin + 24, 'Carried forward:')
+        p.drawString(self.columns[3], self.margin + 24, str(subtotal))
+
+    def draw_totals(self, p, data, y):
+        p.setFont('Helvetica-Bold', 11)
+        for offset, label, field in ((10, 'Subtotal:', 'subtotal'), (24, 'Tax:', 'tax_total'), (38, 'Total:', 'grand_total')):
+            p.drawString(self.columns[2], y - offset, label)
+            p.drawString(self.columns[3], y - offset, data[field])
+        if data['notes']:
+            p.setFont('Helvetica', 9)
+            p.drawString(self.margin, y - 60, 'Notes:')
+            p.drawString(self.margin, y - 74, data['notes'][:200])
+
+
+@lru_cache(maxsize=None)
+def invoice_layout(template):
+    return InvoiceLayout(template)
+
+
+def render_invoice_pdf(data):
+    """Render an invoice_pdf_data() snapshot with reportlab and return the PDF bytes"""
+    layout = invoice_layout(INVOICE_PDF_TEMPLATE)
     buffer = io.BytesIO()
     p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    margin = 20 * mm
-    x = margin
-    y = height - margin
-
-    # Header
-    p.setFont('Helvetica-Bold', 16)
-    p.drawString(x, y, f"Invoice: {inv.invoice_number}")
-    p.setFont('Helvetica', 10)
-    p.drawString(x, y - 18, f"Date: {inv.date.strftime('%Y-%m-%d') if inv.date else ''}")
-    if inv.customer:
-        p.drawString(x, y - 36, f"Bill To: {inv.customer.name}")
-        if inv.customer.address:
-            p.drawString(x, y - 50, inv.customer.address[:100])
-
-    # Items table header
-    table_y = y - 90
-    p.setFont('Helvetica-Bold', 10)
-    p.drawString(x, table_y, 'Qty')
-    p.drawString(x + 30 * mm, table_y, 'Description')
-    p.drawString(x + 110 * mm, table_y, 'Unit')
-    p.drawString(x + 140 * mm, table_y, 'Total')
-    p.setFont('Helvetica', 10)
-
-    cur_y = table_y - 18
-    subtotal = Decimal('0')
-    for ii in inv.items:
-        line_total = Decimal(ii.quantity) * Decimal(str(ii.unit_price))
-        subtotal += line_total
-        p.drawString(x, cur_y, str(ii.quantity))
-        p.drawString(x + 30 * mm, cur_y, (ii.description or '')[:60])
-        p.drawString(x + 110 * mm, cur_y, str(ii.unit_price))
-        p.drawString(x + 140 * mm, cur_y, str(line_total))
-        cur_y -= 14
-        if cur_y < margin + 40:
+    layout.define_forms(p)
+
+    line_totals, rows = [], []
+    for ii in data['items']:
+        line_total = Decimal(ii['quantity']) * Decimal(ii['unit_price'])
+        line_totals.append(line_total)
+        rows.append((str(ii['quantity']), pdf_string((ii['description'] or '')[:60]), ii['unit_price'], str(line_total)))
+
+    pages = layout.paginate(len(rows))
+    carried = Decimal('0')
+    for page, (start, stop) in enumerate(pages, 1):
+        if page > 1:
             p.showPage()
-            cur_y = height - margin
+        layout.start_page(p, data, page, len(pages), carried)
+        y = layout.first_row_y(page)
+        p.setFont('Helvetica', 10)
+        p.addLiteral(layout.rows_literal(rows[start:stop], y))
+        carried += sum(line_totals[start:stop], Decimal('0'))
+        if page < len(pages):
+            layout.carry_forward(p, carried)
+        else:
+            layout.draw_totals(p, data, y - (stop - start) * layout.leading)
 
-    # Totals
-    p.setFont('Helvetica-Bold', 11)
-    p.drawString(x + 110 * mm, cur_y - 10, 'Subtotal:')
-    p.drawString(x + 140 * mm, cur_y - 10, str(subtotal))
+    p.showPage()
+    save_pdf(p)
+    return buffer.getvalue()
 
-    if inv.notes:
-        p.setFont('Helvetica', 9)
-        p.drawString(x, cur_y - 40, 'Notes:')
-        p.drawString(x, cur_y - 54, (inv.notes or '')[:200])
 
-    p.showPage()
-    p.save()
-    buffer.seek(0)
+class PdfRenderCache:
+    """
+    Content-addressed PDF store, <root>/<key[:2]>/<key>.pdf, with
+    <root>/by-invoice/<id> naming the current file of each invoice.
+
+    Once the files exceed ``max_bytes`` the least recently used are removed
+    down to 90% of it. Recency is the file mtime, bumped on every hit, so all
+    workers sharing the directory share one LRU order.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.size = None  # bytes on disk at the last scan plus this worker's writes since
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], f'{key}.pdf')
+
+    def pointer(self, invoice_id):
+        return os.path.join(self.root, 'by-invoice', str(invoice_id))
+
+    def open(self, key):
+        """Open the cached PDF for ``key`` and mark it recently used, or None on a miss."""
+        path = self.path(key)
+        try:
+            pdf = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return pdf
+
+    def put(self, invoice_id, key, data):
+        self._write(self.path(key), data)
+        previous = self._read(self.pointer(invoice_id))
+        self._write(self.pointer(invoice_id), key.encode())
+        if previous and previous != key:
+            self._unlink(self.path(previous))
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self._entries())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def invalidate(self, invoice_ids):
+        """Remove the cached PDFs of ``invoice_ids``."""
+        for invoice_id in invoice_ids:
+            key = self._read(self.pointer(invoice_id))
+            if key:
+                self._unlink(self.path(key))
+                self._unlink(self.pointer(invoice_id))
+
+    def evict(self):
+        entries = sorted(self._entries())
+        self.size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+            self._unlink(path)
+            self.size -= size
+
+    def _entries(self):
+        """(mtime, size, path) of every cached PDF"""
+        if not os.path.isdir(self.root):
+            return
+        for shard in os.scandir(self.root):
+            if shard.is_dir() and shard.name != 'by-invoice':
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.pdf'):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        yield stat.st_mtime, stat.st_size, entry.path
+
+    @staticmethod
+    def _write(path, data):
+        # Write-then-rename so concurrent readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
 
-    return send_file(buffer, mimetype='application/pdf', as_attachment=True, download_name=f"invoice_{inv.invoice_number}.pdf")
+pdf_caches = {}
+
+
+def pdf_cache():
+    """The render cache of the configured INVOICE_PDF_CACHE_DIR"""
+    root = app.config['INVOICE_PDF_CACHE_DIR']
+    if root not in pdf_caches:
+        pdf_caches[root] = PdfRenderCache(root, app.config['INVOICE_PDF_CACHE_MAX_BYTES'])
+    return pdf_caches[root]
+
+
+def store_invoice_pdf(invoice_id, key, pdf):
+    try:
+        pdf_cache().put(invoice_id, key, pdf)
+    except OSError as exc:  # a full or read-only cache must not fail the download
+        app.logger.warning('invoice PDF cache write failed: %s', exc)
+
+
+def cached_invoice_pdf(inv):
+    """(key, open PDF file) for ``inv``, rendering and caching it on a miss"""
+    data = invoice_pdf_data(inv)
+    key = invoice_pdf_key(data)
+    pdf = pdf_cache().open(key)
+    if pdf is None:
+        rendered = render_invoice_pdf(data)
+        store_invoice_pdf(inv.id, key, rendered)
+        pdf = pdf_cache().open(key) or io.BytesIO(rendered)
+    return key, pdf
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_stale_invoice_pdfs(session, flush_context):
+    """Note the invoices whose PDF changed in this flush; their cached files go on commit."""
+    invoice_ids, customer_ids = set(), set()
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Invoice):
+            invoice_ids.add(obj.id)
+        elif isinstance(obj, Customer):
+            customer_ids.add(obj.id)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, InvoiceItem):
+            invoice_ids.add(obj.invoice_id)
+            invoice_ids.update(db.inspect(obj).attrs.invoice_id.history.deleted)
+    if customer_ids:
+        invoice_ids.update(session.connection().execute(
+            db.select(Invoice.id).where(Invoice.customer_id.in_(customer_ids))
+        ).scalars())
+    invoice_ids.discard(None)
+    if invoice_ids:
+        session.info.setdefault('stale_invoice_pdfs', set()).update(invoice_ids)
+
+
+@event.listens_for(db.session, 'after_commit')
+def drop_stale_invoice_pdfs(session):
+    stale = session.info.pop('stale_invoice_pdfs', None)
+    if stale:
+        pdf_cache().invalidate(stale)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_stale_invoice_pdfs(session):
+    session.info.pop('stale_invoice_pdfs', None)
+
+
+@app.route('/api/invoice/invoices/<int:invoice_id>/pdf', methods=['GET'])
+def invoice_pdf(invoice_id):
+    inv = Invoice.query.get_or_404(invoice_id)
+    key, pdf = cached_invoice_pdf(inv)
+    size = pdf.seek(0, os.SEEK_END)
+    pdf.seek(0)
+    response = send_file(pdf, mimetype='application/pdf', as_attachment=True,
+                         download_name=invoice_pdf_filename(inv.invoice_number), etag=key, conditional=False, max_age=0)
+    # send_file only honours Range when it is given a path; the content key is a strong ETag
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=size)
 
 
 @app.route('/api/invoice/invoices/<int:invoice_id>', methods=['DELETE'])
 def delete_invoice(invoice_id):
     inv = Invoice.query.get_or_404(invoice_id)
-    # delete items first
+    # delete items and payments first
     for ii in inv.items:
         db.session.delete(ii)
+    for payment in inv.payments:
+        db.session.delete(payment)
     db.session.delete(inv)
     db.session.commit()
     return jsonify({'message': 'invoice deleted'}), 200
 
 
+# Bulk PDF export
+#
+# Matching invoices are read in keyset pages. PDFs already in the render cache
+# are used as they are; the rest are rendered on a process pool and each PDF
+# goes into the ZIP as soon as it is ready. At most 4 x INVOICE_EXPORT_WORKERS
+# renders are in flight, so memory stays bounded however large the export.
+
+EXPORT_PAGE_SIZE = 200
+
+
+def iter_invoice_pdf_data(filters):
+    """invoice_pdf_data() of every matching invoice in id order, loading a page of invoices per round trip"""
+    last_id = 0
+    while True:
+        page = filtered_invoices(filters).options(db.selectinload(Invoice.items), db.joinedload(Invoice.customer)) \
+            .filter(Invoice.id > last_id).order_by(Invoice.id).limit(EXPORT_PAGE_SIZE).all()
+        if not page:
+            return
+        last_id = page[-1].id
+        yield from [invoice_pdf_data(inv) for inv in page]
+
+
+def rendered_invoice_pdfs(filters, workers):
+    """(filename, PDF bytes) for every matching invoice, in the order they become ready"""
+    cache = pdf_cache()
+
+    def from_cache(data):
+        cached = cache.open(invoice_pdf_key(data))
+        if cached is not None:
+            with cached:
+                return cached.read()
+
+    for data, pdf, rendered in parallel_map(render_invoice_pdf, iter_invoice_pdf_data(filters), workers, from_cache):
+        if rendered:
+            store_invoice_pdf(data['id'], invoice_pdf_key(data), pdf)
+        yield invoice_pdf_filename(data['invoice_number']), pdf
+
+
+class ZipChunks:
+    """Write-only sink for zipfile that holds what was written until drained"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def zip_stream(files):
+    """Yield a ZIP of (name, bytes) pairs one member at a time. PDFs are already compressed, so they are stored."""
+    sink = ZipChunks()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
+
+
+@app.route('/api/invoice/invoices/export', methods=['GET'])
+def export_invoice_pdfs():
+    """Stream a ZIP of the PDFs of invoices matching ?from=&to=&customer_ids="""
+    try:
+        filters = parse_invoice_filter(request.args)
+    except (TypeError, ValueError, ArithmeticError):
+        return jsonify({'error': 'invalid filter'}), 400
+    total = filtered_invoices(filters).count()
+    if total > app.config['INVOICE_EXPORT_SYNC_MAX']:
+        return jsonify({
+            'error': f"{total} invoices match; exports over {app.config['INVOICE_EXPORT_SYNC_MAX']} "
+                     f"must be created with POST /api/invoice/exports"
+        }), 413
+    files = rendered_invoice_pdfs(filters, app.config['INVOICE_EXPORT_WORKERS'])
+    return Response(stream_with_context(zip_stream(files)), mimetype='application/zip', headers={
+        'Content-Disposition': 'attachment; filename=invoices.zip',
+        'X-Invoice-Count': str(total),
+    })
+
+
+def run_invoice_export(job_id):
+    """Write export ``job_id`` to INVOICE_EXPORT_DIR, recording progress every 100 invoices"""
+    with app.app_context():
+        job = db.session.get(InvoiceExport, job_id)
+        job.status = 'running'
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+        os.makedirs(app.config['INVOICE_EXPORT_DIR'], exist_ok=True)
+        path = os.path.join(app.config['INVOICE_EXPORT_DIR'], f'invoices-{job_id}.zip')
+        try:
+            completed = 0
+            files = rendered_invoice_pdfs(json.loads(job.filters), app.config['INVOICE_EXPORT_WORKERS'])
+            with zipfile.ZipFile(path + '.part', 'w', zipfile.ZIP_STORED) as archive:
+                for name, pdf in files:
+                    archive.writestr(name, pdf)
+                    completed += 1
+                    if completed % 100 == 0:
+                        job.completed = completed
+                        job.heartbeat_at = datetime.utcnow()
+                        db.session.commit()
+            os.replace(path + '.part', path)
+            job.status = 'done'
+            job.completed = job.total = completed
+            job.path = path
+        except Exception as exc:
+            app.logger.exception('invoice export %s failed', job_id)
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(exc)
+            if os.path.exists(path + '.part'):
+                os.unlink(path + '.part')
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        db.session.remove()
+
+
+def fail_stale_exports(export_ids=None):
+    """
+    Mark queued or running exports failed once their thread has gone quiet.
+
+    Export threads die with their worker process, so a job whose last
+    heartbeat is older than INVOICE_EXPORT_STALE_SECONDS will never finish.
+    Returns how many jobs were failed.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['INVOICE_EXPORT_STALE_SECONDS'])
+    stale = db.update(InvoiceExport).where(
+        InvoiceExport.status.in_(('queued', 'running')),
+        db.func.coalesce(InvoiceExport.heartbeat_at, InvoiceExport.created_at) < cutoff
+    )
+    if export_ids is not None:
+        stale = stale.where(InvoiceExport.id.in_(export_ids))
+    result = db.session.execute(stale.values(
+        status='failed', error='export worker stopped before finishing, start a new export',
+        finished_at=datetime.utcnow()
+    ).execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+
+@app.cli.command('fail-stale-exports')
+def fail_stale_exports_command():
+    """Mark exports whose worker stopped reporting progress as failed"""
+    print(f'Failed {fail_stale_exports()} stale exports')
+
+
+@app.route('/api/invoice/exports', methods=['POST'])
+def create_invoice_export():
+    """Start a background export of the PDFs of invoices matching {from, to, customer_ids}"""
+    try:
+        filters = parse_invoice_filter(request.get_json() or {})
+    except (TypeError, ValueError, ArithmeticError):
+        return jsonify({'error': 'invalid filter'}), 400
+    job = InvoiceExport(filters=json.dumps(filters), total=filtered_invoices(filters).count())
+    db.session.add(job)
+    db.session.commit()
+    threading.Thread(target=run_invoice_export, args=(job.id,), daemon=True).start()
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/invoice/exports/<int:export_id>', methods=['GET'])
+def get_invoice_export(export_id):
+    fail_stale_exports([export_id])
+    job = InvoiceExport.query.get_or_404(export_id)
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/api/invoice/exports/<int:export_id>/download', methods=['GET'])
+def download_invoice_export(export_id):
+    job = InvoiceExport.query.get_or_404(export_id)
+    if job.status != 'done':
+        return jsonify({'error': f'export is {job.status}'}), 409
+    return send_file(job.path, mimetype='application/zip', as_attachment=True,
+                     download_name=f'invoices-{job.id}.zip', conditional=True)
+
+
+# Receivables
+#
+# Payments are recorded against invoices, and amount_paid/balance_due are kept
+# with the other totals. AR aging sums balance_due per customer and age bucket
+# in one grouped query over ix_invoices_open, a partial index holding only the
+# invoices that still have a balance, so it costs the open invoices rather
+# than the whole ledger. Statements are built a page of customers at a time
+# (four grouped queries per page) and rendered on the export process pool.
+
+AGING_BUCKETS = ('current', '1-30', '31-60', '61-90', '90+')
+STATEMENT_PAGE_SIZE = 500
+STATEMENT_ROWS_PER_PAGE = 40
+
+OPEN_INVOICE = Invoice.balance_due != db.literal_column('0')  # must match ix_invoices_open's WHERE
+
+
+def money(value):
+    """A database sum (a float on SQLite) as a 2dp Decimal"""
+    return round(Decimal(str(value or 0)), 2)
+
+
+def parse_as_of(value):
+    """Midnight of the ISO date ``value``, or of today when empty; raises ValueError"""
+    day = datetime.fromisoformat(value) if value else datetime.utcnow()
+    return day.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ar_aging_rows(as_of, customer_ids=None):
+    """(customer_id, name, current, 1-30, 31-60, 61-90, 90+) of customers with open invoices, aged by days past due on ``as_of``"""
+    due, balance = Invoice.due_date, Invoice.balance_due
+    day_30, day_60, day_90 = (as_of - timedelta(days=days) for days in (30, 60, 90))
+    # Summed as floats: a report over every customer would otherwise spend longer building Decimals than aggregating
+    buckets = (
+        db.func.sum(db.case((due >= as_of, balance), else_=0), type_=db.Float),  # not yet due
+        db.func.sum(db.case((db.and_(due < as_of, due >= day_30), balance), else_=0), type_=db.Float),
+        db.func.sum(db.case((db.and_(due < day_30, due >= day_60), balance), else_=0), type_=db.Float),
+        db.func.sum(db.case((db.and_(due < day_60, due >= day_90), balance), else_=0), type_=db.Float),
+        db.func.sum(db.case((due >= day_90, 0), else_=balance), type_=db.Float),  # and invoices without a due date
+    )
+    aged = db.select(Invoice.customer_id, *(bucket.label(f'b{n}') for n, bucket in enumerate(buckets))) \
+        .where(OPEN_INVOICE).group_by(Invoice.customer_id)
+    if customer_ids:
+        aged = aged.where(Invoice.customer_id.in_(customer_ids))
+    aged = aged.subquery()
+    return db.session.execute(
+        db.select(aged.c.customer_id, Customer.name, *(aged.c[f'b{n}'] for n in range(len(buckets))))
+        .outerjoin(Customer, Customer.id == aged.c.customer_id)
+    ).all()
+
+
+def aging_dict(*amounts):
+    """Bucket amounts, in AGING_BUCKETS order, as 2dp strings with their total"""
+    amounts = [amount or 0 for amount in amounts]
+    data = {bucket: f'{amount:.2f}' for bucket, amount in zip(AGING_BUCKETS, amounts)}
+    data['total'] = f'{sum(amounts):.2f}'
+    return data
+
+
+def statement_period(values):
+    """(from, before) datetimes of ?from=&to=, a bare to-date including the whole day; the last 30 days by default"""
+    filters = parse_invoice_filter({'from': values.get('from'), 'to': values.get('to')})
+    before = datetime.fromisoformat(filters['before']) if 'before' in filters \
+        else parse_as_of(None) + timedelta(days=1)
+    start = datetime.fromisoformat(filters['from']) if 'from' in filters else before - timedelta(days=30)
+    return start, before
+
+
+def customer_statements(customers, start, before):
+    """Plain, picklable statements of ``customers`` over [start, before), a few grouped queries for all of them"""
+    ids = [c.id for c in customers]
+    invoices, payments = Invoice.__table__, InvoicePayment.__table__
+    paid_by = db.select(invoices.c.customer_id, db.func.sum(payments.c.amount)) \
+        .join(invoices, invoices.c.id == payments.c.invoice_id).where(invoices.c.customer_id.in_(ids))
+    invoiced = dict(db.session.execute(
+        db.select(invoices.c.customer_id, db.func.sum(invoices.c.grand_total))
+        .where(invoices.c.customer_id.in_(ids), invoices.c.date < start).group_by(invoices.c.customer_id)
+    ).all())
+    paid = dict(db.session.execute(paid_by.where(payments.c.paid_at < start).group_by(invoices.c.customer_id)).all())
+
+    activity = {customer_id: [] for customer_id in ids}
+    for customer_id, when, number, amount in db.session.execute(
+        db.select(invoices.c.customer_id, invoices.c.date, invoices.c.invoice_number, invoices.c.grand_total)
+        .where(invoices.c.customer_id.in_(ids), invoices.c.date >= start, invoices.c.date < before)
+    ):
+        activity[customer_id].append((when, 0, f'Invoice {number}', money(amount)))
+    for customer_id, when, number, amount, reference in db.session.execute(
+        db.select(invoices.c.customer_id, payments.c.paid_at, invoices.c.invoice_number, payments.c.amount,
+                  payments.c.reference)
+        .join(invoices, invoices.c.id == payments.c.invoice_id)
+        .where(invoices.c.customer_id.in_(ids), payments.c.paid_at >= start, payments.c.paid_at < before)
+    ):
+        description = f'Payment, {number}' + (f' ({reference})' if reference else '')
+        activity[customer_id].append((when, 1, description, -money(amount)))
+    aging = {row[0]: aging_dict(*row[2:]) for row in ar_aging_rows(before - timedelta(days=1), ids)}
+
+    statements = []
+    for customer in customers:
+        opening = money(invoiced.get(customer.id)) - money(paid.get(customer.id))
+        balance, lines = opening, []
+        for when, _, description, amount in sorted(activity[customer.id], key=lambda entry: entry[:2]):
+            balance += amount
+            lines.append({'date': when.isoformat(), 'description': description,
+                          'debit': str(amount) if amount >= 0 else '', 'credit': str(-amount) if amount < 0 else '',
+                          'balance': str(balance)})
+        statements.append({
+            'customer': {'id': customer.id, 'name': customer.name, 'address': customer.address},
+            'from': start.date().isoformat(),
+            'to': (before - timedelta(days=1)).date().isoformat(),
+            'opening_balance': str(opening),
+            'lines': lines,
+            'closing_balance': str(balance),
+            'aging': aging.get(customer.id, aging_dict(*(0 for _ in AGING_BUCKETS))),
+        })
+    return statements
+
+
+def iter_customer_statements(customer_ids, start, before):
+    """Statements of ``customer_ids`` (every customer when empty) that have a balance or activity, a page per round trip"""
+    last_id = 0
+    while True:
+        query = Customer.query.filter(Customer.id > last_id)
+        if customer_ids:
+            query = query.filter(Customer.id.in_(customer_ids))
+        page = query.order_by(Customer.id).limit(STATEMENT_PAGE_SIZE).all()
+        if not page:
+            return
+        last_id = page[-1].id
+        for statement in customer_statements(page, start, before):
+            if statement['lines'] or Decimal(statement['closing_balance']) or Decimal(statement['opening_balance']):
+                yield statement
+
+
+def statement_filename(statement):
+    return f"statement_{statement['customer']['id']}_{statement['to']}.pdf"
+
+
+def render_customer_statement(data):
+    """Render a customer_statements() entry with reportlab and return the PDF bytes"""
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    lines = data['lines']
+    pages = max(1, -(-len(lines) // STATEMENT_ROWS_PER_PAGE))
+    columns = ((20 * mm, 'Date'), (45 * mm, 'Description'), (125 * mm, 'Debit'), (150 * mm, 'Credit'), (175 * mm, 'Balance'))
+
+    for page in range(pages):
+        if page:
+            p.showPage()
+        p.setFont('Helvetica-Bold', 16)
+        p.drawString(20 * mm, height - 20 * mm, 'Statement of account')
+        p.setFont('Helvetica', 10)
+        p.drawString(20 * mm, height - 28 * mm, data['customer']['name'] or '')
+        p.drawString(20 * mm, height - 34 * mm, f"{data['from']} to {data['to']}")
+        p.drawRightString(width - 20 * mm, height - 28 * mm, f'Page {page + 1} of {pages}')
+        y = height - 48 * mm
+        p.setFont('Helvetica-Bold', 10)
+        for x, title in columns:
+            p.drawString(x, y, title)
+        p.setFont('Helvetica', 10)
+        y -= 7 * mm
+        if page == 0:
+            p.drawString(45 * mm, y, 'Opening balance')
+            p.drawString(175 * mm, y, data['opening_balance'])
+            y -= 6 * mm
+        for line in lines[page * STATEMENT_ROWS_PER_PAGE:(page + 1) * STATEMENT_ROWS_PER_PAGE]:
+            for (x, _), value in zip(columns, (line['date'][:10], line['description'][:45], line['debit'],
+                                               line['credit'], line['balance'])):
+                p.drawString(x, y, value)
+            y -= 6 * mm
+
+    p.setFont('Helvetica-Bold', 10)
+    p.drawString(45 * mm, y - 2 * mm, 'Closing balance')
+    p.drawString(175 * mm, y - 2 * mm, data['closing_balance'])
+    p.setFont('Helvetica', 9)
+    aging = data['aging']
+    p.drawString(20 * mm, 20 * mm, 'Days past due  ' + '   '.join(f'{bucket}: {aging[bucket]}' for bucket in AGING_BUCKETS)
+                 + f"   Total due: {aging['total']}")
+    p.showPage()
+    save_pdf(p)
+    return buffer.getvalue()
+
+
+@app.route('/api/invoice/invoices/<int:invoice_id>/payments', methods=['GET'])
+def list_invoice_payments(invoice_id):
+    inv = Invoice.query.get_or_404(invoice_id)
+    return jsonify([payment.to_dict() for payment in sorted(inv.payments, key=lambda payment: payment.id)]), 200
+
+
+@app.route('/api/invoice/invoices/<int:invoice_id>/payments', methods=['POST'])
+def create_invoice_payment(invoice_id):
+    inv = Invoice.query.get_or_404(invoice_id)
+    data = request.get_json() or {}
+    try:
+        amount = Decimal(str(data['amount']))
+        dates = {'paid_at': datetime.fromisoformat(data['paid_at'])} if data.get('paid_at') else {}
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        return jsonify({'error': 'amount required; paid_at must be an ISO date'}), 400
+    if not amount.is_finite() or amount == 0:
+        return jsonify({'error': 'amount must be a non-zero number'}), 400
+    payment = InvoicePayment(invoice_id=inv.id, amount=amount, reference=data.get('reference'), **dates)
+    db.session.add(payment)
+    db.session.commit()
+    return jsonify({**payment.to_dict(), 'balance_due': str(inv.balance_due)}), 201
+
+
+@app.route('/api/invoice/ar-aging', methods=['GET'])
+def ar_aging():
+    """Open balances by customer, current/1-30/31-60/61-90/90+ days past due on ?as_of= (default today), largest first"""
+    try:
+        as_of = parse_as_of(request.args.get('as_of'))
+        customer_ids = parse_invoice_filter(request.args).get('customer_ids')
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except (TypeError, ValueError, ArithmeticError):
+        return jsonify({'error': 'invalid filter'}), 400
+    rows = ar_aging_rows(as_of, customer_ids)
+    totals = [sum(row[column] or 0 for row in rows) for column in range(2, 2 + len(AGING_BUCKETS))]
+    rows.sort(key=lambda row: (-sum(amount or 0 for amount in row[2:]), row[0] or 0))
+    return jsonify({
+        'as_of': as_of.date().isoformat(),
+        'buckets': list(AGING_BUCKETS),
+        'customer_count': len(rows),
+        'customers': [{'customer_id': row[0], 'name': row[1], **aging_dict(*row[2:])} for row in rows[:limit]],
+        'totals': aging_dict(*totals),
+    }), 200
+
+
+@app.route('/api/invoice/customers/<int:customer_id>/statement', methods=['GET'])
+def customer_statement(customer_id):
+    """Statement of account over ?from=&to= as JSON, or as a PDF with ?format=pdf"""
+    customer = Customer.query.get_or_404(customer_id)
+    try:
+        start, before = statement_period(request.args)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid period'}), 400
+    statement = customer_statements([customer], start, before)[0]
+    if request.args.get('format') == 'pdf':
+        return send_file(io.BytesIO(render_customer_statement(statement)), mimetype='application/pdf',
+                         as_attachment=True, download_name=statement_filename(statement))
+    return jsonify(statement), 200
+
+
+@app.route('/api/invoice/statements', methods=['GET'])
+def export_customer_statements():
+    """Stream a ZIP of statement PDFs over ?from=&to= for ?customer_ids= (default every customer with a balance or activity)"""
+    try:
+        start, before = statement_period(request.args)
+        customer_ids = parse_invoice_filter(request.args).get('customer_ids')
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid filter'}), 400
+    statements = iter_customer_statements(customer_ids, start, before)
+    files = ((statement_filename(statement), pdf) for statement, pdf, _ in
+             parallel_map(render_customer_statement, statements, app.config['INVOICE_EXPORT_WORKERS']))
+    return Response(stream_with_context(zip_stream(files)), mimetype='application/zip', headers={
+        'Content-Disposition': f"attachment; filename=statements-{(before - timedelta(days=1)).date().isoformat()}.zip",
+    })
+
+
 # ==================== Health & Error Handlers ====================
 
 @app.route('/api/health', methods=['GET'])
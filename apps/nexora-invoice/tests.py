@@ -1,5 +1,14 @@
+import io
+import re
+import time
+import zipfile
+import zlib
+from decimal import Decimal
+
 import pytest
-from app import app, db, User, Module
+import app as app_module
+from app import (app, db, User, Module, Invoice, InvoiceItem, reconcile_invoice_totals, backfill_invoice_totals,
+                 next_invoice_number, parse_as_of)
 
 @pytest.fixture
 def client():
@@ -38,3 +47,303 @@ def test_health_check(client):
     response = client.get('/api/health')
     assert response.status_code == 200
     assert response.json['status'] == 'healthy'
+
+def make_invoice(client, number='INV-1', lines=1):
+    customer = client.post('/api/invoice/customers', json={'name': 'Acme', 'address': '1 Road'}).json
+    return client.post('/api/invoice/invoices', json={
+        'invoice_number': number,
+        'customer_id': customer['id'],
+        'items': [{'description': f'line {n}', 'quantity': 2, 'unit_price': '10.00'} for n in range(lines)],
+    }).json
+
+def cached_pdfs(root):
+    return sorted(p.name for p in root.glob('*/*.pdf'))
+
+def test_invoice_pdf_is_cached_and_conditional(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'INVOICE_PDF_CACHE_DIR', str(tmp_path))
+    inv = make_invoice(client)
+    url = f"/api/invoice/invoices/{inv['id']}/pdf"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.data.startswith(b'%PDF')
+    assert len(cached_pdfs(tmp_path)) == 1
+
+    second = client.get(url)
+    assert second.data == first.data
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    part = client.get(url, headers={'Range': 'bytes=0-3'})
+    assert part.status_code == 206
+    assert part.data == b'%PDF'
+
+def test_invoice_pdf_cache_follows_edits(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'INVOICE_PDF_CACHE_DIR', str(tmp_path))
+    inv = make_invoice(client)
+    url = f"/api/invoice/invoices/{inv['id']}/pdf"
+    etag = client.get(url).headers['ETag']
+    assert len(cached_pdfs(tmp_path)) == 1
+
+    client.put(f"/api/invoice/customers/{inv['customer_id']}", json={'name': 'Acme Ltd'})
+    assert cached_pdfs(tmp_path) == []
+    assert client.get(url).headers['ETag'] != etag
+    assert len(cached_pdfs(tmp_path)) == 1
+
+def test_invoice_pdf_cache_evicts_least_recently_used(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'INVOICE_PDF_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(app_module, 'pdf_caches', {})
+    first, second, third = (make_invoice(client, f'INV-{n}') for n in range(3))
+    client.get(f"/api/invoice/invoices/{first['id']}/pdf")
+    size = sum(p.stat().st_size for p in tmp_path.glob('*/*.pdf'))
+    monkeypatch.setitem(app.config, 'INVOICE_PDF_CACHE_MAX_BYTES', int(size * 2.5))
+    monkeypatch.setattr(app_module, 'pdf_caches', {})
+    client.get(f"/api/invoice/invoices/{second['id']}/pdf")
+    time.sleep(0.01)
+    client.get(f"/api/invoice/invoices/{first['id']}/pdf")  # first is now the most recently used
+    time.sleep(0.01)
+    client.get(f"/api/invoice/invoices/{third['id']}/pdf")
+    remaining = {p.read_text() for p in (tmp_path / 'by-invoice').iterdir()}
+    assert len(cached_pdfs(tmp_path)) == 2
+    assert {p.stem for p in tmp_path.glob('*/*.pdf')} <= remaining
+
+def test_export_streams_zip_of_matching_invoices(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'INVOICE_PDF_CACHE_DIR', str(tmp_path))
+    monkeypatch.setitem(app.config, 'INVOICE_EXPORT_WORKERS', 2)
+    wanted = [make_invoice(client, f'INV-{n}', lines=3) for n in range(5)]
+    other = make_invoice(client, 'OTHER-1')
+    client.get(f"/api/invoice/invoices/{wanted[0]['id']}/pdf")  # one export member comes from the cache
+
+    ids = ','.join(str(inv['customer_id']) for inv in wanted)
+    response = client.get(f'/api/invoice/invoices/export?customer_ids={ids}')
+    assert response.status_code == 200
+    assert response.headers['X-Invoice-Count'] == '5'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert sorted(archive.namelist()) == [f'invoice_INV-{n}.pdf' for n in range(5)]
+    assert all(archive.read(name).startswith(b'%PDF') for name in archive.namelist())
+    assert f"invoice_{other['invoice_number']}.pdf" not in archive.namelist()
+
+    assert client.get('/api/invoice/invoices/export?from=yesterday').status_code == 400
+
+def test_export_job_reports_progress_and_serves_artifact(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'INVOICE_PDF_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setitem(app.config, 'INVOICE_EXPORT_DIR', str(tmp_path / 'exports'))
+    monkeypatch.setitem(app.config, 'INVOICE_EXPORT_WORKERS', 1)
+    for n in range(3):
+        make_invoice(client, f'INV-{n}')
+
+    job = client.post('/api/invoice/exports', json={'from': '2000-01-01'})
+    assert job.status_code == 202
+    assert job.json['total'] == 3
+    url = f"/api/invoice/exports/{job.json['id']}"
+    for _ in range(200):
+        status = client.get(url).json
+        if status['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.05)
+    assert status['status'] == 'done'
+    assert status['completed'] == 3
+    assert status['progress'] == 1.0
+
+    download = client.get(status['download_url'])
+    assert download.status_code == 200
+    assert len(zipfile.ZipFile(io.BytesIO(download.data)).namelist()) == 3
+
+def test_export_abandoned_by_its_worker_is_failed(client):
+    job = app_module.InvoiceExport(filters='{}', status='running', total=10,
+                                   heartbeat_at=app_module.datetime.utcnow() - app_module.timedelta(hours=1))
+    fresh = app_module.InvoiceExport(filters='{}', status='running', total=10,
+                                     heartbeat_at=app_module.datetime.utcnow())
+    db.session.add_all([job, fresh])
+    db.session.commit()
+
+    status = client.get(f'/api/invoice/exports/{job.id}').json
+    assert (status['status'], status['finished_at'] is not None) == ('failed', True)
+    assert client.get(f'/api/invoice/exports/{job.id}/download').status_code == 409
+    assert client.get(f'/api/invoice/exports/{fresh.id}').json['status'] == 'running'
+    assert app_module.fail_stale_exports() == 0
+
+def test_invoice_totals_are_maintained_on_line_changes(client):
+    customer = client.post('/api/invoice/customers', json={'name': 'Acme'}).json
+    inv = client.post('/api/invoice/invoices', json={
+        'invoice_number': 'INV-T', 'customer_id': customer['id'],
+        'items': [{'description': 'a', 'quantity': 3, 'unit_price': '10.00', 'tax_rate': '20'},
+                  {'description': 'b', 'quantity': 1, 'unit_price': '0.10'}],
+    }).json
+    assert (inv['subtotal'], inv['tax_total'], inv['grand_total'], inv['line_count']) == ('30.10', '6.00', '36.10', 2)
+
+    invoice = db.session.get(Invoice, inv['id'])
+    other = Invoice(invoice_number='INV-U', customer_id=customer['id'])
+    db.session.add(other)
+    line = InvoiceItem(invoice_id=invoice.id, description='c', quantity=2, unit_price=Decimal('5.00'))
+    db.session.add(line)
+    db.session.flush()
+    assert invoice.grand_total == Decimal('46.10')  # refreshed inside the same transaction
+    line.invoice_id = other.id  # moving a line updates both invoices
+    db.session.flush()
+    assert (invoice.grand_total, invoice.line_count) == (Decimal('36.10'), 2)
+    assert (other.grand_total, other.line_count) == (Decimal('10.00'), 1)
+    db.session.delete(invoice.items[0])
+    db.session.commit()
+    assert (invoice.subtotal, invoice.tax_total, invoice.line_count) == (Decimal('0.10'), Decimal('0.00'), 1)
+    assert reconcile_invoice_totals() == []
+
+def test_reconcile_and_backfill_invoice_totals(client):
+    first, second = make_invoice(client, 'INV-1', lines=2), make_invoice(client, 'INV-2')
+    db.session.execute(db.update(Invoice).where(Invoice.id == first['id']).values(subtotal=0, grand_total=0, line_count=0))
+    db.session.commit()
+    drift = reconcile_invoice_totals()
+    assert [row['invoice_id'] for row in drift] == [first['id']]
+    assert drift[0]['lines'] == {'subtotal': '40.00', 'tax_total': '0.00', 'line_count': 2}
+    assert backfill_invoice_totals(batch_size=1) == 2
+    assert reconcile_invoice_totals() == []
+
+def test_list_invoices_filters_and_sorts_by_stored_totals(client):
+    for n in range(1, 4):
+        make_invoice(client, f'INV-{n}', lines=n)  # grand totals 20, 40, 60
+    listed = client.get('/api/invoice/invoices?min_total=30&sort=-grand_total').json
+    assert [inv['invoice_number'] for inv in listed] == ['INV-3', 'INV-2']
+    assert 'items' not in listed[0]
+    assert len(client.get('/api/invoice/invoices?include=items').json[0]['items']) >= 1
+    assert client.get('/api/invoice/invoices?sort=nope').status_code == 400
+    assert client.get('/api/invoice/invoices?min_total=abc').status_code == 400
+
+    summary = client.get('/api/invoice/invoices/summary?max_total=40').json
+    assert summary == {'count': 2, 'subtotal': '60.00', 'tax_total': '0.00', 'grand_total': '60.00'}
+
+def pdf_page_streams(pdf):
+    raw_streams = re.findall(rb'(?<!end)stream\r?\n(.*?)endstream', pdf, re.S)
+    streams = [zlib.decompressobj().decompress(raw).decode('latin-1') for raw in raw_streams]
+    return [s for s in streams if 'Tm' in s and 'Invoice:' in s]
+
+def test_long_invoice_pdf_repeats_headers_and_carries_totals(client):
+    from app import render_invoice_pdf, invoice_layout, INVOICE_PDF_TEMPLATE
+    data = {
+        'id': 1, 'invoice_number': 'INV-LONG', 'date': '2030-01-31T00:00:00', 'notes': 'Net 30',
+        'subtotal': '400.00', 'tax_total': '0.00', 'grand_total': '400.00',
+        'customer': {'name': 'Acme', 'address': '1 Road'},
+        'items': [{'quantity': 1, 'description': f'Widget (size {n}) café', 'unit_price': '2.00'} for n in range(200)],
+    }
+    pages = invoice_layout(INVOICE_PDF_TEMPLATE).paginate(200)
+    assert pages[0][0] == 0 and pages[-1][1] == 200
+    assert all(a[1] == b[0] for a, b in zip(pages, pages[1:]))
+    assert pages[-1][1] > pages[-1][0]
+
+    use_a85 = app_module.rl_config.useA85
+    pdf = render_invoice_pdf(data)
+    assert app_module.rl_config.useA85 == use_a85  # binary streams for this document only
+    assert b'ASCII85Decode' not in pdf
+    assert pdf.count(b'/Subtype /Form') == 2  # column header and footer, drawn once per document
+    streams = pdf_page_streams(pdf)
+    assert len(streams) == len(pages) > 1
+    for page, stream in enumerate(streams):
+        assert stream.count(' Do') == 2  # both forms placed on every page
+        rows = pages[page][1] - pages[page][0]
+        assert stream.count('(Widget') == rows
+        if page:
+            assert '(Brought forward:)' in stream
+            assert f'({pages[page][0] * 2:.2f})' in stream  # brought forward: 2.00 per earlier row
+        if page < len(pages) - 1:
+            assert '(Carried forward:)' in stream
+    assert 'caf\\351' in streams[0] and '\\(size 0\\)' in streams[0]
+    assert '(Total:) Tj' in streams[-1] and '(400.00) Tj' in streams[-1]
+
+def test_invoices_without_a_number_are_numbered_gaplessly(client):
+    customer = client.post('/api/invoice/customers', json={'name': 'Acme'}).json
+    first = client.post('/api/invoice/invoices', json={'customer_id': customer['id']})
+    assert first.status_code == 201
+    assert first.json['invoice_number'] == 'INV-000001'
+
+    # A number taken by a transaction that rolls back is handed out again
+    assert next_invoice_number() == 'INV-000002'
+    db.session.rollback()
+    second = client.post('/api/invoice/invoices', json={'customer_id': customer['id']})
+    assert second.json['invoice_number'] == 'INV-000002'
+
+    supplied = client.post('/api/invoice/invoices', json={'customer_id': customer['id'], 'invoice_number': 'X-1'})
+    assert supplied.json['invoice_number'] == 'X-1'
+    assert client.post('/api/invoice/invoices', json={}).status_code == 400
+
+def test_invoice_numbers_continue_after_numbers_already_issued(client):
+    customer = client.post('/api/invoice/customers', json={'name': 'Acme'}).json
+    for number in ('INV-000001', 'INV-000007', 'INV-draft'):
+        supplied = client.post('/api/invoice/invoices', json={'customer_id': customer['id'], 'invoice_number': number})
+        assert supplied.status_code == 201
+    numbered = client.post('/api/invoice/invoices', json={'customer_id': customer['id']})
+    assert numbered.status_code == 201
+    assert numbered.json['invoice_number'] == 'INV-000008'
+
+    # Numbers a client took after the sequence started are skipped, and supplying a taken one is a conflict
+    taken = client.post('/api/invoice/invoices', json={'customer_id': customer['id'], 'invoice_number': 'INV-000009'})
+    assert taken.status_code == 201
+    assert client.post('/api/invoice/invoices', json={'customer_id': customer['id']}).json['invoice_number'] == 'INV-000010'
+    duplicate = client.post('/api/invoice/invoices', json={'customer_id': customer['id'], 'invoice_number': 'INV-000010'})
+    assert duplicate.status_code == 409
+
+def post_invoice(client, customer_id, amount, due_date):
+    return client.post('/api/invoice/invoices', json={
+        'customer_id': customer_id, 'due_date': due_date,
+        'items': [{'description': 'work', 'quantity': 1, 'unit_price': amount}],
+    }).json
+
+def test_ar_aging_buckets_open_balances_by_customer(client):
+    acme = client.post('/api/invoice/customers', json={'name': 'Acme'}).json['id']
+    globex = client.post('/api/invoice/customers', json={'name': 'Globex'}).json['id']
+    for due, amount in (('2030-06-20', '100.00'), ('2030-05-15', '50.00'), ('2030-04-20', '25.00'), ('2030-01-01', '10.00')):
+        post_invoice(client, acme, amount, due)
+    paid = post_invoice(client, globex, '80.00', '2030-06-01')
+    partly = post_invoice(client, globex, '60.00', '2030-03-01')
+    assert client.post(f"/api/invoice/invoices/{paid['id']}/payments", json={'amount': '80.00'}).status_code == 201
+    response = client.post(f"/api/invoice/invoices/{partly['id']}/payments", json={'amount': '15.50', 'reference': 'chq 7'})
+    assert response.json['balance_due'] == '44.50'
+    assert client.post(f"/api/invoice/invoices/{partly['id']}/payments", json={'amount': 'x'}).status_code == 400
+
+    aging = client.get('/api/invoice/ar-aging?as_of=2030-06-30').json
+    assert aging['customer_count'] == 2
+    first, second = aging['customers']
+    assert (first['name'], first['1-30'], first['31-60'], first['61-90'], first['90+'], first['total']) == \
+        ('Acme', '100.00', '50.00', '25.00', '10.00', '185.00')
+    # Invoices not yet due are current, not past due
+    acme_on_due_day = client.get(f'/api/invoice/ar-aging?as_of=2030-06-20&customer_ids={acme}').json['customers'][0]
+    assert (acme_on_due_day['current'], acme_on_due_day['1-30'], acme_on_due_day['31-60']) == ('100.00', '0.00', '50.00')
+    assert (second['name'], second['90+'], second['total']) == ('Globex', '44.50', '44.50')
+    assert aging['totals']['total'] == '229.50'
+    assert client.get(f'/api/invoice/ar-aging?as_of=2030-06-30&customer_ids={globex}').json['customer_count'] == 1
+    assert client.get('/api/invoice/ar-aging?as_of=soon').status_code == 400
+    assert reconcile_invoice_totals() == []
+
+    # The aggregate reads only the partial index of open invoices
+    query = db.select(Invoice.customer_id).where(app_module.OPEN_INVOICE)
+    plan = ' '.join(str(row[-1]) for row in db.session.execute(
+        db.text('EXPLAIN QUERY PLAN ' + str(query.compile(compile_kwargs={'literal_binds': True})))))
+    assert 'ix_invoices_open' in plan
+
+def test_customer_statement_runs_opening_to_closing_balance(client):
+    acme = client.post('/api/invoice/customers', json={'name': 'Acme'}).json['id']
+    old = post_invoice(client, acme, '100.00', '2030-01-31')
+    db.session.get(Invoice, old['id']).date = parse_as_of('2030-01-01')
+    new = post_invoice(client, acme, '40.00', '2030-03-31')
+    db.session.get(Invoice, new['id']).date = parse_as_of('2030-03-01')
+    db.session.commit()
+    client.post(f"/api/invoice/invoices/{old['id']}/payments", json={'amount': '30.00', 'paid_at': '2030-01-20'})
+    client.post(f"/api/invoice/invoices/{old['id']}/payments", json={'amount': '70.00', 'paid_at': '2030-03-05'})
+
+    statement = client.get(f'/api/invoice/customers/{acme}/statement?from=2030-02-01&to=2030-03-31').json
+    assert statement['opening_balance'] == '70.00'
+    assert [(line['debit'], line['credit'], line['balance']) for line in statement['lines']] == \
+        [('40.00', '', '110.00'), ('', '70.00', '40.00')]
+    assert statement['closing_balance'] == '40.00'
+    assert statement['aging']['current'] == '40.00'
+
+    pdf = client.get(f'/api/invoice/customers/{acme}/statement?from=2030-02-01&to=2030-03-31&format=pdf')
+    assert pdf.data.startswith(b'%PDF')
+
+def test_statement_export_zips_customers_with_activity(client):
+    acme = client.post('/api/invoice/customers', json={'name': 'Acme'}).json['id']
+    client.post('/api/invoice/customers', json={'name': 'Idle'})
+    post_invoice(client, acme, '10.00', '2030-01-31')
+    response = client.get('/api/invoice/statements')
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        names = archive.namelist()
+        assert len(names) == 1 and names[0].startswith(f'statement_{acme}_')
+        assert archive.read(names[0]).startswith(b'%PDF')
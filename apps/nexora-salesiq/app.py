@@ -289,6 +289,10 @@ class ChatMessage(db.Model):
 
     chat_session = db.relationship('ChatSession', backref=db.backref('messages', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_salesiq_messages_session', 'chat_session_id', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
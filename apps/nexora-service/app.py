@@ -51,6 +51,10 @@ class JobTicket(db.Model):
 
     technician = db.relationship('Technician', backref=db.backref('jobs', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_service_job_tickets_status_tech', 'status', 'technician_id', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
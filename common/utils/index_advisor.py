@@ -0,0 +1,260 @@
+"""
+Index Advisor
+Records the shape of the SELECT statements an app really issues and proposes
+composite indexes for them.
+
+A shape is the set of columns a statement filters on per table, split into
+equality predicates (=, IN, IS) and range predicates (<, >, BETWEEN, LIKE),
+plus its ORDER BY columns. The proposed index puts equality columns first,
+then the first range or ordering column, which is the layout a B-tree can
+serve with a single range scan.
+
+Usage as a pytest plugin (writes shapes and proposals to a JSON file):
+
+    NEXORA_INDEX_ADVISOR_OUT=shapes.json PYTHONPATH=common \\
+        pytest -p utils.index_advisor apps/nexora-desk
+
+scripts/index_advisor.py drives this across every app and can verify each
+proposal with before/after EXPLAIN plans and timings.
+"""
+
+import json
+import os
+import re
+import sys
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+EQUALITY_OPERATORS = {"=", "IN", "IS"}
+
+PREDICATE = re.compile(
+    r"(\w+)\.(\w+)\s*(>=|<=|!=|<>|=|>|<|\bNOT IN\b|\bIN\b|\bIS NOT\b|\bIS\b|\bLIKE\b|\bBETWEEN\b)\s*(\(?[\w.?%:'\"-]*)",
+    re.IGNORECASE,
+)
+ORDER_BY = re.compile(r"\bORDER BY\s+(.+?)(?:\bLIMIT\b|\bOFFSET\b|\bFOR UPDATE\b|\)|$)", re.IGNORECASE)
+COLUMN_REF = re.compile(r"^(\w+)\.(\w+)$")
+
+Shape = Tuple[str, Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]
+
+
+def extract_shapes(statement: str) -> List[Shape]:
+    """
+    Extract per-table filter shapes from a SELECT statement.
+
+    Args:
+        statement: SQL text as sent to the DBAPI
+
+    Returns:
+        list: (table, equality columns, range columns, order columns) tuples
+    """
+    sql = " ".join(statement.split())
+    if not sql.upper().startswith("SELECT"):
+        return []
+
+    equality: Dict[str, List[str]] = {}
+    ranges: Dict[str, List[str]] = {}
+    for table, column, operator, rhs in PREDICATE.findall(sql):
+        if COLUMN_REF.match(rhs):
+            continue  # join condition, not a filter
+        operator = operator.upper()
+        target = equality if operator in EQUALITY_OPERATORS else ranges
+        columns = target.setdefault(table, [])
+        if column not in columns:
+            columns.append(column)
+
+    ordering: Dict[str, List[str]] = {}
+    for clause in ORDER_BY.findall(sql):
+        for term in clause.split(","):
+            match = COLUMN_REF.match(term.strip().split(" ")[0])
+            if match:
+                ordering.setdefault(match.group(1), []).append(match.group(2))
+
+    shapes = []
+    for table in set(equality) | set(ranges):
+        # keyset paging compares the cursor column with both = and >, so it is a range
+        rng = tuple(ranges.get(table, []))
+        eq = tuple(sorted(c for c in equality.get(table, []) if c not in rng))
+        shapes.append((table, eq, rng, tuple(ordering.get(table, []))))
+    return shapes
+
+
+def index_columns(shape: Shape) -> Tuple[str, ...]:
+    """Columns of the index that serves a shape: equality first, then one range/order column."""
+    _, eq, rng, order = shape
+    ordered_range = [c for c in order if c in rng]
+    tail = [c for c in (ordered_range[:1] or rng[:1] or order[:1]) if c not in eq]
+    return tuple(eq) + tuple(tail)
+
+
+class QueryShapeRecorder:
+    """Counts query shapes seen by every SQLAlchemy engine in the process."""
+
+    def __init__(self):
+        self.shapes: Counter = Counter()
+        self.samples: Dict[Shape, Tuple[str, object]] = {}
+        self.endpoints: Dict[Shape, set] = {}
+
+    def install(self, target=Engine) -> None:
+        event.listen(target, "before_cursor_execute", self.record)
+
+    def uninstall(self, target=Engine) -> None:
+        event.remove(target, "before_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        shapes = extract_shapes(statement)
+        if not shapes:
+            return
+        endpoint = current_endpoint()
+        for shape in shapes:
+            self.shapes[shape] += 1
+            self.samples.setdefault(shape, (statement, parameters))
+            if endpoint:
+                self.endpoints.setdefault(shape, set()).add(endpoint)
+
+    def to_dict(self, metadata=None) -> dict:
+        return {
+            "shapes": [
+                {
+                    "table": shape[0],
+                    "equality": list(shape[1]),
+                    "range": list(shape[2]),
+                    "order_by": list(shape[3]),
+                    "count": count,
+                    "endpoints": sorted(self.endpoints.get(shape, ())),
+                    "sample_sql": self.samples[shape][0],
+                    "sample_params": _jsonable(self.samples[shape][1]),
+                }
+                for shape, count in self.shapes.most_common()
+            ],
+            "proposals": propose_indexes(self.shapes, metadata, self.endpoints),
+        }
+
+
+def current_endpoint() -> Optional[str]:
+    try:
+        from flask import has_request_context, request
+    except ImportError:
+        return None
+    if has_request_context():
+        return f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+    return None
+
+
+def existing_indexes(metadata, table: str) -> List[Tuple[str, Tuple[str, ...]]]:
+    """Names and column lists of the indexes (and PK/unique constraints) declared on a table."""
+    if metadata is None or table not in metadata.tables:
+        return []
+    t = metadata.tables[table]
+    found = [(ix.name, tuple(c.name for c in ix.columns)) for ix in t.indexes]
+    found.append(("primary key", tuple(c.name for c in t.primary_key.columns)))
+    for constraint in t.constraints:
+        columns = tuple(c.name for c in getattr(constraint, "columns", ()))
+        if columns and constraint.__class__.__name__ == "UniqueConstraint":
+            found.append((constraint.name or "unique", columns))
+    for column in t.columns:
+        if column.unique:
+            found.append((f"unique {column.name}", (column.name,)))
+    return found
+
+
+def covering_index(columns: Tuple[str, ...], equality: Tuple[str, ...], indexes) -> Optional[str]:
+    """Name of an index whose leading columns serve ``columns`` (equality part in any order)."""
+    for name, indexed in indexes:
+        head = indexed[: len(columns)]
+        if len(head) < len(columns):
+            continue
+        eq_len = len(equality)
+        if set(head[:eq_len]) == set(columns[:eq_len]) and head[eq_len:] == columns[eq_len:]:
+            return name
+    return None
+
+
+def propose_indexes(shapes, metadata=None, endpoints=None) -> List[dict]:
+    """
+    Turn recorded shapes into index proposals.
+
+    Shapes that look rows up by primary key are skipped, proposals that are a
+    prefix of a longer proposal on the same table are folded into it, and each
+    proposal names the existing index that already covers it, if any.
+
+    Args:
+        shapes: Counter of shapes to how often they ran
+        metadata: Optional SQLAlchemy MetaData used to find existing indexes
+        endpoints: Optional mapping of shape to the endpoints that issued it
+
+    Returns:
+        list: Proposal dicts, most frequently needed first
+    """
+    wanted: Dict[Tuple[str, Tuple[str, ...]], dict] = {}
+    for shape, count in shapes.items():
+        columns = index_columns(shape)
+        if not columns or columns == ("id",) or "id" in shape[1]:
+            continue  # primary key lookups need nothing more
+        proposal = wanted.setdefault((shape[0], columns), {
+            "table": shape[0],
+            "columns": list(columns),
+            "equality": list(shape[1]),
+            "queries": 0,
+            "endpoints": set(),
+        })
+        proposal["queries"] += count
+        proposal["endpoints"] |= (endpoints or {}).get(shape, set())
+
+    proposals = []
+    for (table, columns), proposal in wanted.items():
+        longer = [
+            other for (other_table, other), _ in wanted.items()
+            if other_table == table and len(other) > len(columns)
+            and set(other[: len(proposal["equality"])]) == set(columns[: len(proposal["equality"])])
+            and other[: len(columns)] == columns
+        ]
+        if longer:
+            continue
+        proposal["covered_by"] = covering_index(
+            columns, tuple(proposal["equality"]), existing_indexes(metadata, table)
+        )
+        proposal["endpoints"] = sorted(proposal["endpoints"])
+        proposals.append(proposal)
+
+    return sorted(proposals, key=lambda p: (-p["queries"], p["table"]))
+
+
+def _jsonable(parameters):
+    try:
+        json.dumps(parameters, default=str)
+        return json.loads(json.dumps(parameters, default=str))
+    except (TypeError, ValueError):
+        return None
+
+
+# ==================== pytest plugin ====================
+
+_recorder: Optional[QueryShapeRecorder] = None
+
+
+def pytest_configure(config) -> None:
+    global _recorder
+    if os.getenv("NEXORA_INDEX_ADVISOR_OUT"):
+        _recorder = QueryShapeRecorder()
+        _recorder.install()
+
+
+def pytest_unconfigure(config) -> None:
+    if _recorder is None:
+        return
+    app_module = sys.modules.get("app")
+    metadata = getattr(getattr(app_module, "db", None), "metadata", None)
+    with open(os.environ["NEXORA_INDEX_ADVISOR_OUT"], "w") as f:
+        json.dump(_recorder.to_dict(metadata), f, indent=2, default=str)
+
+
+__all__ = [
+    "QueryShapeRecorder",
+    "extract_shapes",
+    "index_columns",
+    "propose_indexes",
+    "existing_indexes",
+]
@@ -0,0 +1,57 @@
+"""
+Parallel Map
+Runs a function over a stream of items on a pool of worker processes while
+keeping only a bounded number of items in flight, so an export or batch job
+over millions of rows never holds them all in memory.
+
+Usage:
+
+    for item, result, computed in parallel_map(render, iter_rows(), workers=4):
+        ...
+
+``fn`` and the items must be picklable: a module-level function and plain
+data. Results arrive in completion order, not input order.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+
+def parallel_map(fn: Callable[[Any], Any], items: Iterable[Any], workers: int,
+                 ready: Optional[Callable[[Any], Any]] = None) -> Iterator[Tuple[Any, Any, bool]]:
+    """
+    (item, result, computed) for every item, in the order results become ready.
+
+    Args:
+        fn: the work, run as fn(item)
+        items: any iterable, consumed lazily
+        workers: processes to use; 1 or less runs fn inline
+        ready: ready(item) may supply a result without work (computed is then False)
+
+    Returns:
+        Iterator: at most 4 x workers items are submitted but not yet yielded
+    """
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = {}
+
+    def drain():
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result(), True
+
+    try:
+        for item in items:
+            result = ready(item) if ready is not None else None
+            if result is not None:
+                yield item, result, False
+            elif pool is None:
+                yield item, fn(item), True
+            else:
+                pending[pool.submit(fn, item)] = item
+                if len(pending) >= workers * 4:
+                    yield from drain()
+        while pending:
+            yield from drain()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,153 @@
+"""
+Sequence Allocator
+Hands out per-tenant, per-prefix document numbers (orders, invoices, ...)
+from a shared ``number_sequences`` table.
+
+Two modes:
+
+- block: each worker process reserves ``block_size`` numbers at a time in a
+  short transaction of its own and serves them from memory, so the hot path
+  needs no database round trip. Numbers are unique and increase within a
+  worker but interleave across workers, and whatever is left of a block when
+  the worker exits is never used.
+- gapless: the counter row is bumped inside the caller's transaction and
+  stays locked until it ends. A rollback hands the number back, so committed
+  numbers form an unbroken series. Writers of one sequence are serialised,
+  which is the price of a legally gapless series.
+
+Usage:
+
+    numbers = SequenceAllocator(lambda: db.engine, sequence_table(db.metadata))
+    order_number = format_number('ORD', numbers.allocate('ORD'))
+    invoice_number = format_number('INV', numbers.allocate_gapless(db.session.connection(), 'INV'))
+
+On SQLite, allocate block numbers before the caller's transaction writes:
+the reservation runs on another connection and would wait for its lock.
+"""
+
+import os
+import threading
+from typing import Callable, Dict, List, Tuple, Union
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection, Engine
+
+DEFAULT_TENANT = "default"
+
+
+def sequence_table(metadata: MetaData) -> Table:
+    """
+    Declare the ``number_sequences`` counter table on an app's metadata.
+
+    Args:
+        metadata: the app's MetaData, so create_all() creates the table
+
+    Returns:
+        Table: one row per (tenant, prefix) holding the next unissued number
+    """
+    if "number_sequences" in metadata.tables:
+        return metadata.tables["number_sequences"]
+    return Table(
+        "number_sequences",
+        metadata,
+        Column("tenant", String(64), primary_key=True),
+        Column("prefix", String(32), primary_key=True),
+        Column("next_value", Integer, nullable=False, default=1),
+        Column("updated_at", DateTime, default=func.now(), onupdate=func.now()),
+    )
+
+
+def format_number(prefix: str, value: int, width: int = 6) -> str:
+    """Render a sequence value as e.g. ``INV-000042``."""
+    return f"{prefix}-{value:0{width}d}"
+
+
+class SequenceAllocator:
+    """
+    Allocates numbers from a ``number_sequences`` table.
+
+    Args:
+        engine: an Engine, or a callable returning one (e.g. ``lambda: db.engine``)
+        table: the table returned by sequence_table()
+        block_size: numbers reserved per round trip in block mode
+        start: first number of a new sequence, or a callable ``(connection, tenant, prefix)``
+            returning it, e.g. to continue after numbers issued before the sequence existed
+    """
+
+    def __init__(self, engine: Union[Engine, Callable[[], Engine]], table: Table, block_size: int = 100,
+                 start: Union[int, Callable[[Connection, str, str], int]] = 1):
+        self._engine = engine
+        self.table = table
+        self.block_size = block_size
+        self.start = start
+        self._blocks: Dict[Tuple[str, str], List[int]] = {}  # (tenant, prefix) -> [next, end)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.reservations = 0
+
+    @property
+    def engine(self) -> Engine:
+        return self._engine if isinstance(self._engine, Engine) else self._engine()
+
+    def allocate(self, prefix: str, tenant: str = DEFAULT_TENANT) -> int:
+        """
+        Next number of (tenant, prefix) from this worker's block, reserving a
+        new block when it runs out.
+
+        Returns:
+            int: a number no other worker or call will receive
+        """
+        with self._lock:
+            if os.getpid() != self._pid:
+                # A forked child must not serve the blocks its parent is serving
+                self._blocks.clear()
+                self._pid = os.getpid()
+            block = self._blocks.get((tenant, prefix))
+            if block is None or block[0] >= block[1]:
+                first = self._reserve(tenant, prefix, self.block_size)
+                block = self._blocks[(tenant, prefix)] = [first, first + self.block_size]
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def allocate_gapless(self, connection: Connection, prefix: str, tenant: str = DEFAULT_TENANT) -> int:
+        """
+        Next number of (tenant, prefix), taken inside the transaction of
+        ``connection`` (e.g. ``db.session.connection()``).
+
+        The counter row stays locked until that transaction ends, and a
+        rollback returns the number.
+
+        Returns:
+            int: the number, which becomes permanent only when the caller commits
+        """
+        return self._bump(connection, tenant, prefix, 1)
+
+    def _reserve(self, tenant: str, prefix: str, count: int) -> int:
+        with self.engine.begin() as connection:
+            self.reservations += 1
+            return self._bump(connection, tenant, prefix, count)
+
+    def _bump(self, connection: Connection, tenant: str, prefix: str, count: int) -> int:
+        """Advance the counter by ``count`` and return the first number of the range taken."""
+        table = self.table
+        statement = update(table).where(table.c.tenant == tenant, table.c.prefix == prefix).values(
+            next_value=table.c.next_value + count
+        ).returning(table.c.next_value)
+        row = connection.execute(statement).first()
+        if row is None:
+            self._create(connection, tenant, prefix)
+            row = connection.execute(statement).first()
+        return row[0] - count
+
+    def _create(self, connection: Connection, tenant: str, prefix: str) -> None:
+        start = self.start(connection, tenant, prefix) if callable(self.start) else self.start
+        values = {"tenant": tenant, "prefix": prefix, "next_value": start}
+        dialect = connection.dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            dialect_insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+            connection.execute(dialect_insert(self.table).values(**values).on_conflict_do_nothing())
+        else:
+            connection.execute(insert(self.table).values(**values))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Benchmark AR aging and batch customer statements.
+
+Creates --invoices invoices over the last year for --customers customers,
+--open of them with an outstanding balance, then times
+/api/invoice/ar-aging (median of --runs) and streams
+/api/invoice/statements for the first --statements customers on
+--workers processes.
+
+    python scripts/bench_ar_aging.py --invoices 1000000 --open 0.15
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--invoices', type=int, default=1_000_000)
+parser.add_argument('--customers', type=int, default=20_000)
+parser.add_argument('--open', type=float, default=0.15, help='fraction of invoices with a balance')
+parser.add_argument('--runs', type=int, default=10)
+parser.add_argument('--statements', type=int, default=2000)
+parser.add_argument('--workers', type=int, default=os.cpu_count())
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/ar_aging_bench.db')
+os.environ.setdefault('INVOICE_EXPORT_WORKERS', str(args.workers))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-invoice'))
+
+from app import app, db, Customer, Invoice  # noqa: E402
+
+today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    t0 = time.perf_counter()
+    db.session.execute(db.insert(Customer), [
+        {'name': f'Customer {n}', 'address': f'{n} Main Street'} for n in range(args.customers)
+    ])
+    chunk = []
+    for n in range(args.invoices):
+        issued = today - timedelta(days=random.randrange(365), minutes=random.randrange(1440))
+        total = round(random.uniform(10, 2000), 2)
+        chunk.append({'invoice_number': f'INV-{n:07d}', 'customer_id': 1 + n % args.customers, 'date': issued,
+                      'due_date': issued + timedelta(days=30), 'subtotal': total, 'grand_total': total,
+                      'line_count': 1, 'balance_due': total if random.random() < args.open else 0,
+                      'amount_paid': 0})
+        if len(chunk) == 50_000:
+            db.session.execute(db.insert(Invoice), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(db.insert(Invoice), chunk)
+    db.session.execute(db.update(Invoice).where(Invoice.balance_due == 0).values(amount_paid=Invoice.grand_total))
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+    open_count = db.session.query(db.func.count()).select_from(Invoice).filter(Invoice.balance_due != 0).scalar()
+    print(f'Loaded {args.invoices:,} invoices ({open_count:,} open) for {args.customers:,} customers '
+          f'in {time.perf_counter() - t0:.1f}s')
+
+    client = app.test_client()
+    for label, url in (('ar-aging, every customer', '/api/invoice/ar-aging'),
+                       ('ar-aging, top 100', '/api/invoice/ar-aging?limit=100')):
+        timings = []
+        for _ in range(args.runs):
+            t = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - t) * 1000)
+        timings.sort()
+        body = response.json
+        print(f"{label}: p50={timings[len(timings) // 2]:.0f}ms max={timings[-1]:.0f}ms "
+              f"({body['customer_count']:,} customers, {body['totals']['total']} outstanding)")
+
+    ids = ','.join(str(n) for n in range(1, args.statements + 1))
+    t = time.perf_counter()
+    response = client.get(f'/api/invoice/statements?customer_ids={ids}')
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        count = len(archive.namelist())
+    elapsed = time.perf_counter() - t
+    print(f'statements: {count:,} PDFs in {elapsed:.1f}s ({count / elapsed:,.0f}/s) on {args.workers} worker(s)')
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Booking storm: many processes booking overlapping slots on a few calendars.
+
+Every process posts --requests half-hour bookings at random quarter-hour starts
+on --calendars calendars through the Flask test client, against a shared
+scratch SQLite database (or DATABASE_URL). Afterwards it counts overlapping
+live appointments per calendar, which must be zero, and reports throughput.
+
+    python scripts/bench_booking_storm.py --processes 8 --requests 500
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--processes', type=int, default=8)
+parser.add_argument('--requests', type=int, default=500)
+parser.add_argument('--calendars', type=int, default=4)
+parser.add_argument('--days', type=int, default=5)
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/booking_storm.db')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-bookings'))
+
+from app import app, db, Calendar, Appointment  # noqa: E402
+
+base = datetime(2030, 1, 7)
+
+
+def storm(calendar_ids, seed, results):
+    db.engine.dispose(close=False)
+    rng = random.Random(seed)
+    client = app.test_client()
+    booked = conflicts = errors = 0
+    for _ in range(args.requests):
+        start = base + timedelta(minutes=15 * rng.randrange(args.days * 24 * 4))
+        response = client.post('/api/bookings/appointments', json={
+            'calendar_id': rng.choice(calendar_ids), 'title': 'storm',
+            'start_time': start.isoformat(), 'end_time': (start + timedelta(minutes=30)).isoformat(),
+        })
+        if response.status_code == 201:
+            booked += 1
+        elif response.status_code == 409:
+            conflicts += 1
+        else:
+            errors += 1
+    results.put((booked, conflicts, errors))
+
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    calendars = [Calendar(name=f'storm-{n}') for n in range(args.calendars)]
+    db.session.add_all(calendars)
+    db.session.commit()
+    calendar_ids = [c.id for c in calendars]
+    db.session.remove()
+
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    workers = [ctx.Process(target=storm, args=(calendar_ids, n, results)) for n in range(args.processes)]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    totals = [results.get() for _ in workers]
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - t0
+
+    booked, conflicts, errors = (sum(t[i] for t in totals) for i in range(3))
+    overlaps = 0
+    for cal_id in calendar_ids:
+        rows = Appointment.query.filter(Appointment.calendar_id == cal_id, Appointment.status != 'cancelled') \
+            .order_by(Appointment.start_time).all()
+        overlaps += sum(a.end_time > b.start_time for a, b in zip(rows, rows[1:]))
+
+    print(f'{args.processes} processes x {args.requests} requests on {args.calendars} calendars in {elapsed:.1f}s')
+    print(f'booked={booked} conflicts={conflicts} errors={errors} double_bookings={overlaps}')
+    print(f'{args.processes * args.requests / elapsed:.0f} requests/sec, {booked / elapsed:.0f} bookings/sec')
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Benchmark the cart API.
+
+Creates --products products, then --carts buyers each create a cart, add
+--lines products one request at a time and check out. Runs once per cart
+store in --stores and once through the one-shot /api/checkout for
+reference. Reports p50/p99 latency per add and per checkout, and the SQL
+statements each sends to the app database (cart stores keep their own).
+
+    python scripts/bench_carts.py --carts 500 --lines 10 --stores memory sqlite
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--products', type=int, default=1000)
+parser.add_argument('--carts', type=int, default=500)
+parser.add_argument('--lines', type=int, default=10)
+parser.add_argument('--stores', nargs='+', default=['memory', 'sqlite'], help='memory, sqlite or a cart store URL')
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/carts_bench.db')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-commerce'))
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db, Product  # noqa: E402
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.execute(db.insert(Product), [
+        {'sku': f'SKU-{n}', 'name': f'Product {n}', 'price': round(random.uniform(1, 100), 2), 'quantity': 10 ** 6}
+        for n in range(args.products)
+    ])
+    db.session.commit()
+    product_ids = [row.id for row in db.session.query(Product.id)]
+    statements = []
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+client = app.test_client()
+buyer = {'customer_name': 'Bench', 'customer_email': 'bench@example.com'}
+
+
+def pick(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000
+
+
+def timed(call, timings, counts):
+    del statements[:]
+    t = time.perf_counter()
+    response = call()
+    timings.append(time.perf_counter() - t)
+    counts.append(len(statements))
+    assert response.status_code in (200, 201), response.json
+    return response
+
+
+def report(label, timings, counts):
+    print(f'  {label:<9} p50={pick(timings, 0.5):.2f}ms p99={pick(timings, 0.99):.2f}ms  '
+          f'{sum(counts) / len(counts):.1f} app DB statements')
+
+
+for store in args.stores:
+    url = {'memory': 'memory://', 'sqlite': f'sqlite:///{scratch}/carts.db'}.get(store, store)
+    app.config['CART_STORE_URL'] = url
+    adds, add_counts, checkouts, checkout_counts = [], [], [], []
+    for _ in range(args.carts):
+        cart_id = client.post('/api/carts').json['cart_id']
+        for pid in random.sample(product_ids, args.lines):
+            timed(lambda: client.post(f'/api/carts/{cart_id}/items', json={'product_id': pid, 'quantity': 1}),
+                  adds, add_counts)
+        timed(lambda: client.post(f'/api/carts/{cart_id}/checkout', json=buyer), checkouts, checkout_counts)
+    print(f'cart store {url.split(":")[0]}: {args.carts} carts of {args.lines} lines')
+    report('add', adds, add_counts)
+    report('checkout', checkouts, checkout_counts)
+
+checkouts, checkout_counts = [], []
+for _ in range(args.carts):
+    items = [{'product_id': pid, 'quantity': 1} for pid in random.sample(product_ids, args.lines)]
+    timed(lambda: client.post('/api/checkout', json={**buyer, 'items': items}), checkouts, checkout_counts)
+print('one-shot /api/checkout')
+report('checkout', checkouts, checkout_counts)
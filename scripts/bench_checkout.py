@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Benchmark commerce checkout under concurrent buyers.
+
+Creates --products products, then --threads buyers each post --carts carts
+of --lines distinct products to /api/checkout. Stock is sized so that about
+--sold-out of the carts run out. Reports carts/sec, SQL statements per
+successful checkout and the final stock, which must never go negative.
+
+    python scripts/bench_checkout.py --threads 8 --lines 50
+"""
+import argparse
+import collections
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--products', type=int, default=500)
+parser.add_argument('--threads', type=int, default=8)
+parser.add_argument('--carts', type=int, default=50, help='carts per buyer')
+parser.add_argument('--lines', type=int, default=50)
+parser.add_argument('--sold-out', type=float, default=0.2, help='rough fraction of carts that find stock gone')
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/checkout_bench.db')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-commerce'))
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db, Product, Order  # noqa: E402
+
+carts = args.threads * args.carts
+# Each product appears in carts * lines / products carts; stock covers (1 - sold_out) of them
+stock = max(1, int(carts * args.lines / args.products * (1 - args.sold_out)))
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.execute(db.insert(Product), [
+        {'sku': f'SKU-{n}', 'name': f'Product {n}', 'price': round(random.uniform(1, 100), 2), 'quantity': stock}
+        for n in range(args.products)
+    ])
+    db.session.commit()
+    product_ids = [row.id for row in db.session.query(Product.id)]
+
+    statements = collections.Counter()
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements[threading.get_ident()] += 1
+
+statuses = []
+
+
+def buyer():
+    client = app.test_client()
+    for _ in range(args.carts):
+        items = [{'product_id': pid, 'quantity': 1} for pid in random.sample(product_ids, args.lines)]
+        statuses.append(client.post('/api/checkout', json={
+            'customer_name': 'Bench', 'customer_email': 'bench@example.com', 'items': items,
+        }).status_code)
+
+
+threads = [threading.Thread(target=buyer) for _ in range(args.threads)]
+t0 = time.perf_counter()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+elapsed = time.perf_counter() - t0
+
+with app.app_context():
+    orders = Order.query.count()
+    lowest = db.session.query(db.func.min(Product.quantity)).scalar()
+    sold = db.session.query(db.func.sum(stock - Product.quantity)).scalar()
+
+outcomes = collections.Counter(statuses)
+print(f'{carts:,} carts of {args.lines} lines on {args.threads} threads in {elapsed:.1f}s '
+      f'({carts / elapsed:,.0f} carts/sec); outcomes {dict(outcomes)}')
+print(f'{sum(statements.values()) / carts:.1f} SQL statements per cart on average')
+print(f'{orders:,} orders, {sold:,} units sold (= {orders * args.lines:,} expected), lowest stock {lowest}')
+assert lowest >= 0 and sold == orders * args.lines
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Benchmark the CRM analytics endpoint.
+
+Creates --deals deals over 6 stages, 3 statuses, 50 owners and two years,
+and --leads leads and contacts. Then times /api/crm/analytics unfiltered,
+for one month, and for one owner:
+
+- computed (cache cleared before every request);
+- cached (every request a hit);
+- the six queries the endpoint used to run, for reference.
+
+Reports the mean latency and the SQL statements per request.
+
+    python scripts/bench_crm_analytics.py --deals 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--deals', type=int, default=1_000_000)
+parser.add_argument('--leads', type=int, default=300_000)
+parser.add_argument('--requests', type=int, default=20)
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/crm_analytics_bench.db')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-crm'))
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db, Contact, Deal, Lead, analytics_cache  # noqa: E402
+
+random.seed(7)
+epoch = datetime(2023, 1, 1)
+when = lambda: epoch + timedelta(seconds=random.randrange(2 * 365 * 86400))  # noqa: E731
+stages = ['prospect', 'qualified', 'proposal', 'negotiation', 'won', 'lost']
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    t0 = time.perf_counter()
+    connection = db.session.connection()
+    for start in range(0, args.deals, 50_000):
+        connection.execute(Deal.__table__.insert(), [
+            {'title': f'Deal {n}', 'amount': round(random.uniform(100, 50_000), 2), 'stage': random.choice(stages),
+             'status': random.choice(['open', 'open', 'closed', 'on_hold']), 'owner_id': random.randint(1, 50),
+             'created_at': when()} for n in range(start, min(start + 50_000, args.deals))])
+    for model in (Lead, Contact):
+        for start in range(0, args.leads, 50_000):
+            connection.execute(model.__table__.insert(), [
+                {'name': f'Person {n}', 'created_at': when()} for n in range(start, min(start + 50_000, args.leads))])
+    db.session.commit()
+    db.session.connection().exec_driver_sql('ANALYZE')
+    db.session.commit()
+    print(f'Loaded {args.deals:,} deals and {args.leads:,} leads and contacts in {time.perf_counter() - t0:.0f}s')
+
+    statements = []
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+
+def six_queries():
+    """What /api/crm/analytics used to run"""
+    with app.app_context():
+        Lead.query.count()
+        Contact.query.count()
+        Deal.query.count()
+        Deal.query.filter(Deal.status == 'open').count()
+        Deal.query.filter(Deal.status == 'closed').count()
+        db.session.query(Deal.stage, db.func.count(Deal.id)).group_by(Deal.stage).all()
+
+
+client = app.test_client()
+for label, query in (('unfiltered', ''), ('one month', '?from=2024-03-01&to=2024-03-31'), ('one owner', '?owner_id=7')):
+    for mode in ('computed', 'cached', 'six queries'):
+        if mode == 'six queries' and query:
+            continue
+        client.get(f'/api/crm/analytics{query}')
+        del statements[:]
+        t0 = time.perf_counter()
+        for _ in range(args.requests):
+            if mode == 'computed':
+                analytics_cache.clear()
+            if mode == 'six queries':
+                six_queries()
+            else:
+                assert client.get(f'/api/crm/analytics{query}').status_code == 200
+        elapsed = (time.perf_counter() - t0) / args.requests
+        print(f'{label:<11} {mode:<12} {elapsed * 1000:>8.2f}ms  {len(statements) / args.requests:.0f} SQL statements')
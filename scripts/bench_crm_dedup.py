@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Benchmark contact deduplication.
+
+Creates --records synthetic contacts. A --duplicates share of them re-enter
+an earlier person the way imports and web forms do: name reordered, retitled,
+recased or misspelt; email recased, +tagged, dotted or swapped for another;
+phone reformatted or missing. Runs a full pass with --workers processes,
+then adds --changes more records through the ORM (so they are queued) and
+runs an incremental pass. Reports time per phase, records/sec, and pairwise
+precision and recall of the resulting clusters against the known people.
+
+    python scripts/bench_crm_dedup.py --records 3000000 --workers 8
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', type=int, default=300_000)
+parser.add_argument('--duplicates', type=float, default=0.15)
+parser.add_argument('--changes', type=int, default=1000)
+parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/crm_dedup_bench.db')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-crm'))
+
+from app import app, db, Contact, DedupPair, UnionFind, dedup_full, dedup_incremental  # noqa: E402
+
+random.seed(7)
+syllables = ['an', 'bel', 'cor', 'da', 'el', 'fer', 'gar', 'hal', 'in', 'jo', 'ka', 'lin', 'mar', 'ne', 'ol', 'per',
+             'quin', 'ros', 'san', 'ter', 'ul', 'van', 'wil', 'xa', 'yor', 'zel']
+first_names = sorted({''.join(random.choices(syllables, k=random.randint(2, 3))).title() for _ in range(800)})
+last_names = sorted({''.join(random.choices(syllables, k=random.randint(2, 4))).title() for _ in range(20000)})
+zipf = lambda names: list(itertools.accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(names))))  # noqa: E731
+first_weights, last_weights = zipf(first_names), zipf(last_names)
+domains = ['gmail.com', 'yahoo.com', 'outlook.com', 'example.com', 'acme.io', 'initech.com']
+
+
+def person():
+    first = random.choices(first_names, cum_weights=first_weights)[0]
+    last = random.choices(last_names, cum_weights=last_weights)[0]
+    email = f'{first}.{last}{random.randint(1, 999)}@{random.choice(domains)}'.lower() if random.random() < 0.9 else None
+    phone = f'{random.randint(201, 989)}{random.randint(200, 999)}{random.randint(0, 9999):04d}' if random.random() < 0.7 else None
+    return first, last, email, phone
+
+
+def typo(word):
+    i = random.randrange(len(word))
+    return random.choice([word[:i] + word[i + 1:], word[:i] + random.choice('aeiourlnst') + word[i + 1:],
+                          word[:i] + word[i + 1:i + 2] + word[i:i + 1] + word[i + 2:]]) or word
+
+
+def reentry(first, last, email, phone):
+    """How the same person looks when they come in again"""
+    name = random.choice([f'{first} {last}', f'{last}, {first}', f'{first.upper()} {last.upper()}',
+                          f'Dr. {first} {last}', f'{typo(first)} {last}', f'{first} {typo(last)}'])
+    if email and random.random() < 0.8:
+        local, domain = email.split('@')
+        email = random.choice([email.upper(), f'{local}+crm@{domain}', email,
+                               f'{local.replace(".", "")}@{domain}' if domain == 'gmail.com' else email])
+    else:
+        email = person()[2] if random.random() < 0.5 else None
+    if phone and random.random() < 0.8:
+        phone = random.choice([f'({phone[:3]}) {phone[3:6]}-{phone[6:]}', f'+1 {phone[:3]} {phone[3:6]} {phone[6:]}',
+                               f'1-{phone[:3]}-{phone[3:6]}-{phone[6:]}', phone])
+    else:
+        phone = None
+    return name, email, phone
+
+
+people, truth = [], []
+
+
+def generate(count):
+    for _ in range(count):
+        if people and random.random() < args.duplicates:
+            pid = random.randrange(len(people))
+            name, email, phone = reentry(*people[pid])
+        else:
+            pid = len(people)
+            people.append(person())
+            first, last, email, phone = people[pid]
+            name = f'{first} {last}'
+        truth.append(pid)
+        yield {'name': name, 'email': email, 'phone': phone}
+
+
+with app.app_context():
+    app.config['CRM_DEDUP_WORKERS'] = args.workers
+    db.drop_all()
+    db.create_all()
+    t0 = time.perf_counter()
+    rows = generate(args.records)
+    while chunk := list(itertools.islice(rows, 50_000)):
+        db.session.connection().execute(Contact.__table__.insert(), chunk)
+    db.session.commit()
+    print(f'Loaded {args.records:,} contacts ({len(people):,} people) in {time.perf_counter() - t0:.0f}s')
+
+    t0 = time.perf_counter()
+    stats = dedup_full('contacts')
+    elapsed = time.perf_counter() - t0
+    print(f'full pass, {args.workers} workers: {elapsed:.1f}s ({args.records / elapsed:,.0f} records/sec) '
+          f'index={stats["index_seconds"]}s match={stats["match_seconds"]}s '
+          f'{stats["compared"]:,} pairs compared, {stats["pairs"]:,} matched')
+
+    db.session.add_all(Contact(**row) for row in generate(args.changes))
+    db.session.commit()
+    stats = dedup_incremental('contacts')
+    print(f'incremental pass: {stats["records"]:,} queued records in {stats["seconds"]}s, '
+          f'{stats["compared"]:,} pairs compared, {stats["pairs"]:,} matched')
+
+    sets = UnionFind()
+    for record_id, other_id in db.session.execute(db.select(DedupPair.record_id, DedupPair.other_id)):
+        sets.union(record_id, other_id)
+    found = correct = 0
+    for members in sets.groups().values():
+        found += len(members) * (len(members) - 1) // 2
+        correct += sum(n * (n - 1) // 2 for n in Counter(truth[i - 1] for i in members).values())
+    actual = sum(n * (n - 1) // 2 for n in Counter(truth).values())
+    print(f'clusters: precision={correct / max(found, 1):.3f} recall={correct / max(actual, 1):.3f} '
+          f'({found:,} clustered pairs, {actual:,} true duplicate pairs)')
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Benchmark the multi-calendar free-slot search.
+
+Creates --calendars calendars with weekday 08:00-18:00 templates in a mix of
+timezones and --per-day random appointments per calendar per day, then times
+/api/bookings/free-slots over a --days window: once cold (bitmaps built from
+the database) and --queries times warm (served from the per-worker cache).
+
+    python scripts/bench_free_slots.py --calendars 50 --days 30
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--calendars', type=int, default=50)
+parser.add_argument('--days', type=int, default=30)
+parser.add_argument('--per-day', type=int, default=2)
+parser.add_argument('--queries', type=int, default=200)
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/free_slots_bench.db')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-bookings'))
+
+from app import app, db, Calendar, TimeSlot, Appointment, availability_bitmaps  # noqa: E402
+
+zones = ['UTC', 'Europe/Berlin', 'Europe/London', 'America/New_York']
+start = datetime(2030, 1, 7)
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    calendars = [Calendar(name=f'tech-{n}', timezone=zones[n % len(zones)]) for n in range(args.calendars)]
+    db.session.add_all(calendars)
+    db.session.flush()
+    db.session.execute(db.insert(TimeSlot), [
+        {'calendar_id': cal.id, 'day_of_week': d, 'start_time': '08:00', 'end_time': '18:00', 'is_available': True}
+        for cal in calendars for d in range(5)
+    ])
+    rows = []
+    for cal in calendars:
+        for day in range(args.days):
+            for _ in range(args.per_day):
+                begin = start + timedelta(days=day, minutes=15 * random.randrange(24 * 4))
+                rows.append({'calendar_id': cal.id, 'title': 'job', 'appointment_id': f'{cal.id}-{len(rows)}',
+                             'start_time': begin, 'end_time': begin + timedelta(minutes=random.choice((15, 30, 60))),
+                             'status': 'confirmed'})
+    db.session.execute(db.insert(Appointment), rows)
+    db.session.commit()
+    print(f'{args.calendars} calendars, {len(rows):,} appointments over {args.days} days')
+
+    ids = ','.join(str(cal.id) for cal in calendars)
+    to = (start + timedelta(days=args.days - 1)).date().isoformat()
+    url = f'/api/bookings/free-slots?calendar_ids={ids}&from={start.date().isoformat()}&to={to}&duration=30&limit=5'
+    client = app.test_client()
+
+    availability_bitmaps.clear()
+    t = time.perf_counter()
+    response = client.get(url)
+    print(f'cold: {(time.perf_counter() - t) * 1000:.1f}ms, {len(response.json["slots"])} slots')
+
+    timings = []
+    for _ in range(args.queries):
+        t = time.perf_counter()
+        client.get(url)
+        timings.append((time.perf_counter() - t) * 1000)
+    timings.sort()
+    print(f'warm over {args.queries} queries: p50={timings[len(timings) // 2]:.2f}ms '
+          f'p95={timings[int(len(timings) * 0.95)]:.2f}ms')
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Benchmark the bulk invoice PDF export.
+
+Creates --invoices invoices of --lines lines each, then streams
+/api/invoice/invoices/export three times: rendering serially into an empty
+render cache, on a pool of --workers processes into another empty cache, and
+again from that now warm cache. Reports throughput for each.
+
+    python scripts/bench_invoice_export.py --invoices 2000 --workers 4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--invoices', type=int, default=2000)
+parser.add_argument('--lines', type=int, default=20)
+parser.add_argument('--workers', type=int, default=os.cpu_count())
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/invoice_export_bench.db')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-invoice'))
+
+from app import app, db, Customer, Invoice, InvoiceItem, pdf_caches  # noqa: E402
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    customers = [Customer(name=f'Customer {n}', address=f'{n} Main Street') for n in range(50)]
+    db.session.add_all(customers)
+    db.session.flush()
+    db.session.execute(db.insert(Invoice), [
+        {'invoice_number': f'INV-{n:06d}', 'customer_id': customers[n % len(customers)].id, 'notes': 'Net 30'}
+        for n in range(args.invoices)
+    ])
+    invoice_ids = [row.id for row in db.session.query(Invoice.id)]
+    db.session.execute(db.insert(InvoiceItem), [
+        {'invoice_id': invoice_id, 'description': f'Service line {line}', 'quantity': line + 1, 'unit_price': 12.5}
+        for invoice_id in invoice_ids for line in range(args.lines)
+    ])
+    db.session.commit()
+    print(f'{args.invoices:,} invoices x {args.lines} lines')
+
+    client = app.test_client()
+    for run, (workers, label) in enumerate([(1, 'serial'), (args.workers, 'pool'), (args.workers, 'cached')]):
+        app.config['INVOICE_EXPORT_WORKERS'] = workers
+        if label != 'cached':
+            app.config['INVOICE_PDF_CACHE_DIR'] = os.path.join(scratch, f'cache-{run}')
+            pdf_caches.clear()
+        t0 = time.perf_counter()
+        response = client.get('/api/invoice/invoices/export')
+        size = sum(len(chunk) for chunk in response.response)
+        elapsed = time.perf_counter() - t0
+        print(f'{label} (workers={workers}): {elapsed:.1f}s, {args.invoices / elapsed:,.0f} PDFs/s, '
+              f'{size / 1e6:.1f} MB zip')
+shutil.rmtree(scratch)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Benchmark invoice PDF rendering.
+
+Renders an invoice of --lines lines --runs times with render_invoice_pdf()
+and with the previous drawString-per-cell renderer (kept below as the
+baseline), and reports the median time of each.
+
+    python scripts/bench_invoice_render.py --lines 200
+"""
+import argparse
+import io
+import statistics
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--lines', type=int, default=200)
+parser.add_argument('--runs', type=int, default=50)
+args = parser.parse_args()
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-invoice'))
+
+from app import render_invoice_pdf  # noqa: E402
+
+
+def render_baseline(data):
+    """The renderer before page templates: every cell is its own drawString, streams ASCII85-encoded"""
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    margin = 20 * mm
+    x = margin
+    y = height - margin
+    p.setFont('Helvetica-Bold', 16)
+    p.drawString(x, y, f"Invoice: {data['invoice_number']}")
+    p.setFont('Helvetica', 10)
+    p.drawString(x, y - 18, f"Date: {(data['date'] or '')[:10]}")
+    p.drawString(x, y - 36, f"Bill To: {data['customer']['name']}")
+    p.drawString(x, y - 50, data['customer']['address'][:100])
+    table_y = y - 90
+    p.setFont('Helvetica-Bold', 10)
+    for offset, title in ((0, 'Qty'), (30, 'Description'), (110, 'Unit'), (140, 'Total')):
+        p.drawString(x + offset * mm, table_y, title)
+    p.setFont('Helvetica', 10)
+    cur_y = table_y - 18
+    for ii in data['items']:
+        line_total = Decimal(ii['quantity']) * Decimal(ii['unit_price'])
+        p.drawString(x, cur_y, str(ii['quantity']))
+        p.drawString(x + 30 * mm, cur_y, (ii['description'] or '')[:60])
+        p.drawString(x + 110 * mm, cur_y, ii['unit_price'])
+        p.drawString(x + 140 * mm, cur_y, str(line_total))
+        cur_y -= 14
+        if cur_y < margin + 40:
+            p.showPage()
+            cur_y = height - margin
+    p.setFont('Helvetica-Bold', 11)
+    p.drawString(x + 110 * mm, cur_y - 10, 'Subtotal:')
+    p.drawString(x + 140 * mm, cur_y - 10, data['subtotal'])
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
+
+
+data = {
+    'id': 1, 'invoice_number': 'INV-000001', 'date': '2030-01-31T00:00:00', 'notes': 'Payment due within 30 days',
+    'subtotal': '0.00', 'tax_total': '0.00', 'grand_total': '0.00',
+    'customer': {'name': 'Acme Corporation', 'address': '1 Main Street, Springfield'},
+    'items': [{'quantity': n % 5 + 1, 'description': f'Consulting services, work package {n}', 'unit_price': '125.00'}
+              for n in range(args.lines)],
+}
+
+results = {}
+for name, render in (('drawString per cell', render_baseline), ('page templates', render_invoice_pdf)):
+    render(data)
+    timings = []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        pdf = render(data)
+        timings.append((time.perf_counter() - t0) * 1000)
+    results[name] = statistics.median(timings)
+    print(f'{name}: median {results[name]:.2f}ms, {len(pdf) / 1024:.0f} KB')
+print(f"speedup: {results['drawString per cell'] / results['page templates']:.1f}x")
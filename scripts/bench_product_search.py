@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Benchmark catalog search.
+
+Creates --products products whose names (2-5 words) and descriptions
+(15 words) are drawn from a Zipf-distributed vocabulary of synthetic words,
+spread over 50 categories, and builds the search index. Then --queries
+queries are run through /api/products/search. Each query takes 1-3 words of a
+random product's name, with the last word cut short (typeahead) half the time.
+The query set runs twice: once with cold term statistics, then warm.
+
+    python scripts/bench_product_search.py --products 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--products', type=int, default=1_000_000)
+parser.add_argument('--vocabulary', type=int, default=8000)
+parser.add_argument('--queries', type=int, default=1000)
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/product_search_bench.db')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-commerce'))
+
+from app import app, db, Category, Product, product_search  # noqa: E402
+
+random.seed(7)
+syllables = ['ka', 'lo', 'mi', 'ter', 'van', 'dor', 'pel', 'zu', 'ri', 'son', 'bel', 'tra', 'quin', 'mox', 'fa',
+             'ge', 'hul', 'nir', 'os', 'pex']
+vocabulary = set()
+while len(vocabulary) < args.vocabulary:
+    vocabulary.add(''.join(random.choice(syllables) for _ in range(random.randint(2, 4))))
+vocabulary = sorted(vocabulary)
+random.shuffle(vocabulary)
+weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.execute(db.insert(Category), [{'name': f'Category {n}'} for n in range(50)])
+    t0 = time.perf_counter()
+    names, chunk = [], []
+    for n in range(1, args.products + 1):
+        name = ' '.join(random.choices(vocabulary, cum_weights=weights, k=random.randint(2, 5)))
+        if n % 100 == 0:
+            names.append(name)
+        chunk.append({'sku': f'SKU-{n:07d}', 'name': name, 'price': 10, 'quantity': 5,
+                      'description': ' '.join(random.choices(vocabulary, cum_weights=weights, k=15)),
+                      'category_id': random.randint(1, 50)})
+        if len(chunk) == 50_000:
+            db.session.connection().execute(Product.__table__.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.connection().execute(Product.__table__.insert(), chunk)
+    db.session.commit()
+    print(f'Loaded {args.products:,} products in {time.perf_counter() - t0:.0f}s')
+    t0 = time.perf_counter()
+    product_search().rebuild(db.session.connection())
+    db.session.commit()
+    print(f'Indexed them in {time.perf_counter() - t0:.0f}s')
+
+queries = []
+for _ in range(args.queries):
+    words = random.choice(names).split()
+    start = random.randrange(len(words))
+    words = words[start:start + random.randint(1, 3)]
+    if random.random() < 0.5:
+        words[-1] = words[-1][:random.randint(2, max(2, len(words[-1]) - 1))]
+        queries.append(' '.join(words))
+    else:
+        queries.append(' '.join(words) + ' ')
+
+client = app.test_client()
+for label in ('cold statistics', 'warm statistics'):
+    timings, estimated = [], 0
+    for q in queries:
+        t = time.perf_counter()
+        body = client.get(f'/api/products/search?q={quote(q)}').json
+        timings.append((time.perf_counter() - t) * 1000)
+        estimated += body['total_is_estimate']
+    timings.sort()
+    pick = lambda fraction: timings[min(len(timings) - 1, int(len(timings) * fraction))]  # noqa: E731
+    print(f'{label}: {len(timings)} queries p50={pick(0.5):.1f}ms p95={pick(0.95):.1f}ms p99={pick(0.99):.1f}ms '
+          f'max={timings[-1]:.1f}ms; {estimated} ranked a window of a larger match set')
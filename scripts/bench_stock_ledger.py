@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Benchmark point-in-time stock queries against a large stock ledger.
+
+Fills a scratch SQLite database (or DATABASE_URL) with --movements ledger rows
+spread over --items items and one snapshot per item every --snapshot-every
+movements, then times stock_at() for random items and instants.
+
+    python scripts/bench_stock_ledger.py --movements 10000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--movements', type=int, default=10_000_000)
+parser.add_argument('--items', type=int, default=10_000)
+parser.add_argument('--snapshot-every', type=int, default=500)
+parser.add_argument('--queries', type=int, default=2_000)
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/ledger_bench.db')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-inventory'))
+
+from app import app, db, Item, StockMovement, StockSnapshot, stock_at  # noqa: E402
+
+start = datetime(2024, 1, 1)
+step = timedelta(seconds=60)
+
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.execute(db.insert(Item), [
+        {'id': i, 'sku': f'SKU-{i}', 'name': f'Item {i}', 'unit_price': 1} for i in range(1, args.items + 1)
+    ])
+
+    t0 = time.perf_counter()
+    balances = [0] * (args.items + 1)
+    counts = [0] * (args.items + 1)
+    chunk, snapshots = [], []
+    for movement_id in range(1, args.movements + 1):
+        item_id = random.randint(1, args.items)
+        quantity = random.randint(-5, 10)
+        balances[item_id] += quantity
+        counts[item_id] += 1
+        created_at = start + step * movement_id
+        chunk.append({'id': movement_id, 'item_id': item_id, 'quantity': quantity,
+                      'movement_type': 'adjust', 'created_at': created_at})
+        if counts[item_id] % args.snapshot_every == 0:
+            snapshots.append({'item_id': item_id, 'quantity': balances[item_id],
+                              'last_movement_id': movement_id, 'taken_at': created_at})
+        if len(chunk) == 100_000:
+            db.session.execute(db.insert(StockMovement), chunk)
+            db.session.commit()
+            chunk = []
+    if chunk:
+        db.session.execute(db.insert(StockMovement), chunk)
+    if snapshots:
+        db.session.execute(db.insert(StockSnapshot), snapshots)
+    db.session.commit()
+    print(f'Loaded {args.movements:,} movements and {len(snapshots):,} snapshots '
+          f'in {time.perf_counter() - t0:.1f}s')
+
+    end = start + step * args.movements
+    timings = []
+    for _ in range(args.queries):
+        item_id = random.randint(1, args.items)
+        at = start + (end - start) * random.random()
+        t = time.perf_counter()
+        stock_at(item_id, at)
+        timings.append((time.perf_counter() - t) * 1000)
+    timings.sort()
+    print(f'stock_at over {args.queries:,} queries: '
+          f'p50={timings[len(timings) // 2]:.2f}ms p95={timings[int(len(timings) * 0.95)]:.2f}ms '
+          f'max={timings[-1]:.2f}ms')
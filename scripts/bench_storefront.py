@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Benchmark public storefront page views.
+
+Creates --storefronts templates of about --kb KB of HTML each, then requests
+--views random storefront pages through /store/<slug> in three rounds:
+
+- first views, rendered from the database into an empty page cache;
+- cached views;
+- revalidations with the ETag of the cached page (304).
+
+Reports views/sec, p50/p99 latency and SQL statements per view, plus the
+size of the pre-gzipped copy when --gzip is on.
+
+    python scripts/bench_storefront.py --storefronts 1000 --views 20000 --gzip
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--storefronts', type=int, default=1000)
+parser.add_argument('--kb', type=int, default=30, help='HTML size of a storefront')
+parser.add_argument('--views', type=int, default=20_000)
+parser.add_argument('--gzip', action='store_true')
+args = parser.parse_args()
+
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/storefront_bench.db')
+os.environ.setdefault('STOREFRONT_CACHE_DIR', f'{scratch}/storefront-cache')
+if args.gzip:
+    os.environ['STOREFRONT_GZIP'] = '1'
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'apps' / 'nexora-commerce'))
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db, StorefrontTemplate, storefront_cache  # noqa: E402
+
+random.seed(7)
+words = ['sale', 'new', 'summer', 'mug', 'kettle', 'garden', 'free', 'shipping', 'gift', 'card']
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+    for n in range(args.storefronts):
+        html = ''.join(f'<p>{" ".join(random.choices(words, k=12))}</p>' for _ in range(args.kb * 1024 // 80))
+        db.session.add(StorefrontTemplate(name=f'Store {n}', slug=f'store-{n}', html=html))
+    db.session.commit()
+    storefront_cache().clear()
+
+    statements = []
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+client = app.test_client()
+headers = {'Accept-Encoding': 'gzip'} if args.gzip else {}
+slugs = [f'store-{n}' for n in range(args.storefronts)]
+etags = {}
+
+
+def run(label, paths, conditional=False):
+    del statements[:]
+    timings, sent = [], 0
+    t0 = time.perf_counter()
+    for slug in paths:
+        extra = {'If-None-Match': etags[slug]} if conditional else {}
+        t = time.perf_counter()
+        response = client.get(f'/store/{slug}', headers={**headers, **extra})
+        timings.append(time.perf_counter() - t)
+        etags[slug] = response.headers['ETag']
+        sent += len(response.data)
+    elapsed = time.perf_counter() - t0
+    timings.sort()
+    pick = lambda fraction: timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000  # noqa: E731
+    print(f'{label:<14} {len(paths) / elapsed:>8,.0f} views/sec  p50={pick(0.5):.2f}ms p99={pick(0.99):.2f}ms  '
+          f'{len(statements) / len(paths):.2f} SQL statements/view  {sent / len(paths) / 1024:.1f} KB/view')
+
+
+run('first views', slugs)
+views = random.choices(slugs, k=args.views)
+run('cached views', views)
+run('revalidations', views, conditional=True)
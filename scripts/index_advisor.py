@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Record real query shapes per app and check the composite indexes that serve them.
+
+record: runs each app's test module with the utils.index_advisor pytest plugin,
+writes the recorded shapes to --out/<app>.json and prints index proposals,
+marking the ones an existing index already covers.
+
+    python scripts/index_advisor.py record
+    python scripts/index_advisor.py record --apps nexora-desk nexora-bookings
+
+verify: fills a scratch SQLite database (or DATABASE_URL) for one app with
+--rows synthetic rows per indexed table, then for every composite index the
+app declares prints the query plan and median latency with the index dropped
+and recreated. The query is the recorded sample when record has seen one for
+that index, otherwise one synthesised from the index columns.
+
+    python scripts/index_advisor.py verify --app nexora-desk --rows 200000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+APPS_DIR = ROOT / 'apps'
+COMMON_DIR = ROOT / 'common'
+
+VOCABULARY = ['open', 'pending', 'draft', 'active', 'assigned', 'in_progress', 'resolved', 'closed',
+              'confirmed', 'cancelled', 'completed', 'available', 'low_stock', 'expired', 'overstock',
+              'visitor', 'agent', 'note', 'system', 'event']
+
+
+def app_test_module(app_dir):
+    test_file = app_dir / f'test_{app_dir.name.replace("-", "_")}.py'
+    if test_file.exists():
+        return test_file
+    tests = sorted(app_dir.glob('test_*.py'))
+    return tests[0] if tests else None
+
+
+def record(args):
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    app_dirs = [APPS_DIR / name for name in args.apps] if args.apps else sorted(
+        p for p in APPS_DIR.iterdir() if p.is_dir() and p.name != 'nexora-home'
+    )
+    for app_dir in app_dirs:
+        test_file = app_test_module(app_dir)
+        if test_file is None:
+            continue
+        shapes_file = out / f'{app_dir.name}.json'
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(app_dir), str(COMMON_DIR), env.get('PYTHONPATH')]))
+        env['NEXORA_INDEX_ADVISOR_OUT'] = str(shapes_file)
+        proc = subprocess.run(
+            [sys.executable, '-m', 'pytest', test_file.name, '-q', '-p', 'utils.index_advisor', '-p', 'no:cacheprovider'],
+            cwd=app_dir, env=env, capture_output=True, text=True,
+        )
+        if not shapes_file.exists():
+            print(f'{app_dir.name}: no shapes recorded (pytest exit {proc.returncode})')
+            continue
+        report = json.loads(shapes_file.read_text())
+        print(f'{app_dir.name}: {len(report["shapes"])} shapes (pytest exit {proc.returncode})')
+        for p in report['proposals']:
+            status = f'covered by {p["covered_by"]}' if p['covered_by'] else 'MISSING'
+            endpoints = ', '.join(p['endpoints']) or '-'
+            print(f'  {p["table"]}({", ".join(p["columns"])}) x{p["queries"]} {status}  [{endpoints}]')
+
+
+def synthetic_value(column, i, rows):
+    from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric, String, Text
+
+    kind = column.type
+    if column.unique:
+        return i if isinstance(kind, Integer) else f'{column.name}-{i}'
+    if isinstance(kind, Boolean):
+        return random.random() < 0.2
+    if isinstance(kind, Integer):
+        return random.randint(1, max(1, rows // 200))
+    if isinstance(kind, (Numeric, Float)):
+        return round(random.uniform(1, 1000), 2)
+    if isinstance(kind, DateTime):
+        return datetime(2024, 1, 1) + timedelta(minutes=random.randint(0, 2 * 365 * 24 * 60))
+    if isinstance(kind, Date):
+        return (datetime(2024, 1, 1) + timedelta(days=random.randint(0, 730))).date()
+    if isinstance(kind, (String, Text)):
+        return random.choice(VOCABULARY)
+    return None
+
+
+def fill_table(db, table, rows):
+    batch = []
+    for i in range(1, rows + 1):
+        row = {c.name: synthetic_value(c, i, rows) for c in table.columns if not c.primary_key}
+        batch.append(row)
+        if len(batch) == 50_000:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def synthesised_query(db, table, index):
+    """SELECT with equality on every non-temporal index column and ORDER BY the temporal one."""
+    from sqlalchemy import Date, DateTime, select
+
+    sample = db.session.execute(select(table).order_by(table.c.id).limit(1).offset(table_rows(db, table) // 2)).mappings().first()
+    stmt = select(table)
+    for column in index.columns:
+        if isinstance(column.type, (DateTime, Date)):
+            stmt = stmt.order_by(column.desc())
+        else:
+            stmt = stmt.where(column == sample[column.name])
+    return stmt.limit(50)
+
+
+def table_rows(db, table):
+    from sqlalchemy import func, select
+    return db.session.execute(select(func.count()).select_from(table)).scalar()
+
+
+def query_plan(db, sql, params):
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.connection().exec_driver_sql(prefix + sql, params).fetchall()
+    return '; '.join(str(r[-1]) for r in rows)
+
+
+def median_ms(db, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        db.session.connection().exec_driver_sql(sql, params).fetchall()
+        timings.append((time.perf_counter() - t) * 1000)
+    return statistics.median(timings)
+
+
+def verify(args):
+    scratch = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{scratch}/index_advisor.db')
+    app_dir = APPS_DIR / args.app
+    sys.path.insert(0, str(COMMON_DIR))
+    sys.path.insert(0, str(app_dir))
+    os.chdir(app_dir)
+
+    from app import app, db  # noqa: E402
+
+    shapes_file = Path(args.out) / f'{args.app}.json'
+    samples = json.loads(shapes_file.read_text())['shapes'] if shapes_file.exists() else []
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        composite = [
+            (table, index) for table in db.metadata.sorted_tables
+            for index in sorted(table.indexes, key=lambda ix: ix.name) if len(index.columns) > 1 or args.all
+        ]
+        for table in {table for table, _ in composite}:
+            t0 = time.perf_counter()
+            fill_table(db, table, args.rows)
+            print(f'filled {table.name} with {args.rows:,} rows in {time.perf_counter() - t0:.1f}s')
+
+        print()
+        print('| index | endpoints | plan before | plan after | before ms | after ms |')
+        print('|---|---|---|---|---|---|')
+        for table, index in composite:
+            columns = [c.name for c in index.columns]
+            recorded = next((
+                s for s in samples
+                if s['table'] == table.name and s['equality'] and set(s['equality']) <= set(columns)
+                and s['sample_params'] is not None
+            ), None)
+            if recorded:
+                sql, params = recorded['sample_sql'], tuple(recorded['sample_params'])
+                endpoints = ', '.join(recorded['endpoints']) or '-'
+            else:
+                compiled = synthesised_query(db, table, index).compile(db.engine)
+                sql = str(compiled)
+                params = tuple(compiled.params[k] for k in compiled.positiontup) if compiled.positiontup else compiled.params
+                endpoints = '(synthesised)'
+
+            index.drop(db.engine, checkfirst=True)
+            db.session.commit()
+            before_plan, before_ms = query_plan(db, sql, params), median_ms(db, sql, params, args.repeat)
+            index.create(db.engine, checkfirst=True)
+            db.session.execute(db.text('ANALYZE'))
+            db.session.commit()
+            after_plan, after_ms = query_plan(db, sql, params), median_ms(db, sql, params, args.repeat)
+            print(f'| {index.name} | {endpoints} | {before_plan} | {after_plan} | {before_ms:.2f} | {after_ms:.2f} |')
+
+
+parser = argparse.ArgumentParser()
+sub = parser.add_subparsers(dest='command', required=True)
+record_parser = sub.add_parser('record')
+record_parser.add_argument('--apps', nargs='*')
+record_parser.add_argument('--out', default=str(ROOT / 'build' / 'index_shapes'))
+verify_parser = sub.add_parser('verify')
+verify_parser.add_argument('--app', required=True)
+verify_parser.add_argument('--rows', type=int, default=100_000)
+verify_parser.add_argument('--repeat', type=int, default=20)
+verify_parser.add_argument('--all', action='store_true', help='also time single-column indexes')
+verify_parser.add_argument('--out', default=str(ROOT / 'build' / 'index_shapes'))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    record(args) if args.command == 'record' else verify(args)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Bring databases that predate the current models up to date.
+
+db.create_all() only creates missing tables, so columns and indexes added to
+an existing model never reach a deployed database. This walks every app's
+metadata and, for tables that already exist:
+
+- issues ALTER TABLE ... ADD COLUMN for each declared column that is missing,
+  with its foreign key. A NOT NULL column must declare a server_default,
+  which fills existing rows;
+- calls the app's ``backfill_columns(added)`` hook, if it has one, with the
+  (table, column) pairs just added, so it can compute real values for them;
+- issues CREATE INDEX for each declared index that is not there yet, and
+  drops and recreates an index whose columns or uniqueness no longer match
+  its declaration.
+
+Each app runs in its own process against its own DATABASE_URL, exactly as it
+is deployed; --dry-run only lists what would be changed.
+
+    DATABASE_URL=postgresql://... python scripts/migrate_indexes.py --apps nexora-desk
+    python scripts/migrate_indexes.py --dry-run
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+APPS_DIR = ROOT / 'apps'
+
+
+def add_missing_columns(engine, inspector, table, dry_run):
+    """ALTER TABLE ADD COLUMN for the table's declared columns the database lacks; returns their names."""
+    from sqlalchemy.schema import CreateColumn
+
+    present = {column['name'] for column in inspector.get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in present:
+            continue
+        if not column.nullable and column.server_default is None:
+            sys.exit(f'{table.name}.{column.name} is NOT NULL without a server_default, '
+                     f'existing rows would have no value')
+        preparer = engine.dialect.identifier_preparer
+        ddl = str(CreateColumn(column).compile(dialect=engine.dialect))
+        for key in column.foreign_keys:  # CreateColumn leaves constraints out
+            ddl += f' REFERENCES {preparer.format_table(key.column.table)} ({preparer.quote(key.column.name)})'
+        print(f'{"would add" if dry_run else "add"} {table.name}.{ddl}')
+        if not dry_run:
+            with engine.begin() as connection:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'
+                )
+        added.append(column.name)
+    return added
+
+
+def index_changed(index, existing):
+    """True if the database's index of that name has other columns or uniqueness than the declared one."""
+    if len(index.expressions) != len(index.columns):
+        return False  # an expression index; the inspector cannot describe it well enough to compare
+    return ([column.name for column in index.columns] != list(existing['column_names'])
+            or bool(index.unique) != bool(existing['unique']))
+
+
+def migrate_app(dry_run):
+    from sqlalchemy import inspect
+
+    import app as module
+    from app import app, db
+
+    with app.app_context():
+        inspector = inspect(db.engine)
+        # create_all makes new tables with their columns and indexes
+        tables = [table for table in db.metadata.sorted_tables if inspector.has_table(table.name)]
+
+        added = set()
+        for table in tables:
+            added.update((table.name, name) for name in add_missing_columns(db.engine, inspector, table, dry_run))
+        backfill = getattr(module, 'backfill_columns', None)
+        if added and backfill:
+            print(f'{"would backfill" if dry_run else "backfill"} {len(added)} columns')
+            if not dry_run:
+                backfill(added)
+
+        for table in tables:
+            present = {ix['name']: ix for ix in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda ix: ix.name):
+                existing = present.get(index.name)
+                if existing is not None and not index_changed(index, existing):
+                    continue
+                action = 'recreate' if existing is not None else 'create'
+                print(f'{"would " if dry_run else ""}{action} {index.name} on '
+                      f'{table.name}({", ".join(c.name for c in index.columns)})')
+                if not dry_run:
+                    if existing is not None:
+                        index.drop(db.engine)
+                    index.create(db.engine)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--apps', nargs='*')
+parser.add_argument('--dry-run', action='store_true')
+parser.add_argument('--in-app', action='store_true', help=argparse.SUPPRESS)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.in_app:
+        sys.path.insert(0, os.getcwd())
+        migrate_app(args.dry_run)
+        sys.exit(0)
+
+    app_dirs = [APPS_DIR / name for name in args.apps] if args.apps else sorted(
+        p for p in APPS_DIR.iterdir() if (p / 'app.py').exists()
+    )
+    failed = []
+    for app_dir in app_dirs:
+        print(f'== {app_dir.name}')
+        cmd = [sys.executable, str(Path(__file__).resolve()), '--in-app'] + (['--dry-run'] if args.dry_run else [])
+        # Demo seeding at import would query the columns this run is about to add
+        if subprocess.run(cmd, cwd=app_dir, env=dict(os.environ, DEMO_MODE='0')).returncode != 0:
+            failed.append(app_dir.name)
+    if failed:
+        print(f'failed: {", ".join(failed)}')
+        sys.exit(1)